@@ -0,0 +1,166 @@
+# ==============================================================================
+# ARQUIVO: armazenamento.py
+# DESCRIÇÃO: Gravação de arquivos enviados (anexos) no disco.
+#   - Lê o upload em blocos de tamanho fixo (memória constante por upload)
+#   - Calcula o SHA-256 de forma incremental, bloco a bloco
+#   - Grava em arquivo temporário e só no fim faz o rename atômico para o destino
+#   - Limite de tamanho verificado durante a leitura
+#   - Escrita em disco feita em thread, sem travar o event loop
+#   - Armazenamento endereçado por conteúdo: o arquivo final é nomeado pelo
+#     SHA-256 (objetos/ab/cd/<hash>.<ext>), então bytes iguais ocupam o disco uma vez só
+# ==============================================================================
+
+import hashlib
+import os
+import tempfile
+from anyio import to_thread
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Tamanho de cada bloco lido do upload (padrão 1 MB)
+TAMANHO_BLOCO = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+# Tamanho máximo aceito por arquivo (padrão 50 MB)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+
+# Subpasta (dentro de uploads/) dos arquivos endereçados por hash e dos temporários
+PASTA_OBJETOS = "objetos"
+PASTA_TEMPORARIOS = "tmp"
+
+# Sufixo usado enquanto a exclusão de um objeto ainda não foi confirmada no banco
+SUFIXO_EXCLUSAO = ".excluido"
+
+
+class ArquivoMuitoGrande(Exception):
+    """O upload passou do limite UPLOAD_MAX_BYTES."""
+    pass
+
+
+def caminho_objeto(hash_arquivo: str, ext: str) -> str:
+    """
+    Caminho relativo (gravado em anexos.caminho_arquivo) do objeto com esse hash.
+    Os dois primeiros níveis de pasta vêm do próprio hash para não concentrar
+    milhares de arquivos em um só diretório.
+    """
+    return f"/{PASTA_OBJETOS}/{hash_arquivo[:2]}/{hash_arquivo[2:4]}/{hash_arquivo}.{ext.lower()}"
+
+
+def caminho_absoluto(upload_dir: str, caminho_relativo: str) -> str:
+    """Converte o caminho salvo no banco ('/a/b/c.pdf') para o caminho no disco."""
+    return os.path.join(upload_dir, *caminho_relativo.strip("/").split("/"))
+
+
+def calcular_hash_arquivo(caminho: str) -> str:
+    """SHA-256 de um arquivo já gravado, lido em blocos."""
+    sha256 = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b""):
+            sha256.update(bloco)
+    return sha256.hexdigest()
+
+
+def _abrir_temporario(pasta_temp):
+    os.makedirs(pasta_temp, exist_ok=True)
+    # O temporário fica no mesmo disco do destino para o rename ser atômico
+    return tempfile.NamedTemporaryFile(dir=pasta_temp, prefix=".upload_", suffix=".parcial", delete=False)
+
+
+def _gravar_bloco(arquivo_temp, sha256, bloco):
+    sha256.update(bloco)
+    arquivo_temp.write(bloco)
+
+
+def _fechar(arquivo_temp):
+    arquivo_temp.flush()
+    os.fsync(arquivo_temp.fileno())
+    arquivo_temp.close()
+
+
+def _descartar(caminho):
+    if caminho and os.path.exists(caminho):
+        os.remove(caminho)
+
+
+def _materializar(caminho_temp, caminho_final):
+    if os.path.exists(caminho_final):
+        # Conteúdo idêntico já está armazenado: só descarta a cópia recebida
+        os.remove(caminho_temp)
+        return False
+    os.makedirs(os.path.dirname(caminho_final), exist_ok=True)
+    os.replace(caminho_temp, caminho_final)
+    return True
+
+
+def _marcar_exclusao(caminho):
+    if not os.path.exists(caminho):
+        return None
+    marcado = caminho + SUFIXO_EXCLUSAO
+    os.replace(caminho, marcado)
+    return marcado
+
+
+def _restaurar_exclusao(marcado):
+    if marcado and os.path.exists(marcado):
+        os.replace(marcado, marcado[:-len(SUFIXO_EXCLUSAO)])
+
+
+async def receber_upload(arquivo, upload_dir: str, max_bytes: int = UPLOAD_MAX_BYTES):
+    """
+    Copia o UploadFile em blocos para um temporário em 'uploads/tmp'.
+    Retorna (caminho_temp, tamanho_bytes, hash_sha256).
+    Lança ArquivoMuitoGrande (e não deixa nada no disco) se passar de max_bytes.
+    """
+    arquivo_temp = await to_thread.run_sync(_abrir_temporario, os.path.join(upload_dir, PASTA_TEMPORARIOS))
+    sha256 = hashlib.sha256()
+    tamanho = 0
+
+    try:
+        while True:
+            bloco = await arquivo.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+
+            tamanho += len(bloco)
+            if tamanho > max_bytes:
+                raise ArquivoMuitoGrande(
+                    f"Arquivo maior que o limite de {max_bytes // (1024 * 1024)} MB"
+                )
+
+            await to_thread.run_sync(_gravar_bloco, arquivo_temp, sha256, bloco)
+
+        await to_thread.run_sync(_fechar, arquivo_temp)
+    except BaseException:
+        arquivo_temp.close()
+        await to_thread.run_sync(_descartar, arquivo_temp.name)
+        raise
+
+    return arquivo_temp.name, tamanho, sha256.hexdigest()
+
+
+async def materializar_objeto(caminho_temp: str, upload_dir: str, caminho_relativo: str) -> bool:
+    """
+    Move o temporário para o caminho do objeto (rename atômico).
+    Se o objeto já existir, o temporário é apagado. Retorna True se gravou um arquivo novo.
+    """
+    return await to_thread.run_sync(_materializar, caminho_temp, caminho_absoluto(upload_dir, caminho_relativo))
+
+
+async def descartar_temporario(caminho_temp: str):
+    await to_thread.run_sync(_descartar, caminho_temp)
+
+
+async def marcar_exclusao(upload_dir: str, caminho_relativo: str):
+    """
+    Renomeia o arquivo para '<nome>.excluido' antes do COMMIT da exclusão.
+    Se a transação falhar, use restaurar_exclusao(); se der certo, confirmar_exclusao().
+    """
+    return await to_thread.run_sync(_marcar_exclusao, caminho_absoluto(upload_dir, caminho_relativo))
+
+
+async def restaurar_exclusao(marcado):
+    await to_thread.run_sync(_restaurar_exclusao, marcado)
+
+
+async def confirmar_exclusao(marcado):
+    await to_thread.run_sync(_descartar, marcado)
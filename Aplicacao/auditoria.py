@@ -0,0 +1,161 @@
+# ==============================================================================
+# ARQUIVO: auditoria.py
+# DESCRIÇÃO: Log de auditoria gravado no momento em que cada ação acontece.
+#   - As rotas inserem o evento em eventos_auditoria na mesma transação da
+#     alteração (se a alteração sofrer ROLLBACK, o evento também some)
+#   - A página de Auditoria lê só esta tabela, pelo índice (empresa_id, data_hora),
+#     em vez de juntar cinco tabelas com UNION a cada acesso
+#   - Carga dos eventos antigos (backfill) a partir das tabelas de origem
+#   Tabela criada em Banco_fiscal/migracoes/003_eventos_auditoria.sql
+#
+# USO (a partir da pasta Aplicacao):
+#   python auditoria.py --backfill   -> cria os eventos que ainda faltam
+# ==============================================================================
+
+import argparse
+from decimal import Decimal
+from sqlalchemy import text
+
+# Ações registradas (mesmos nomes usados no filtro da página de Auditoria)
+DOCUMENTO_CRIADO = "DOCUMENTO_CRIADO"
+DOCUMENTO_EDITADO = "DOCUMENTO_EDITADO"
+DOCUMENTO_EXCLUIDO = "DOCUMENTO_EXCLUIDO"
+DOCUMENTO_CONFIRMADO = "DOCUMENTO_CONFIRMADO"
+DOCUMENTO_REVISADO = "DOCUMENTO_REVISADO"
+ANEXO_UPLOAD = "ANEXO_UPLOAD"
+PROV_CRIADO = "PROV_CRIADO"
+REMESSA_GERADA = "REMESSA_GERADA"
+RETORNO_PROCESSADO = "RETORNO_PROCESSADO"
+USUARIO_CRIADO = "USUARIO_CRIADO"
+LOGIN = "LOGIN"
+LOGOUT = "LOGOUT"
+
+# Tamanho da coluna descricao
+DESCRICAO_MAX = 500
+
+_INSERT_EVENTO = text("""
+    INSERT INTO eventos_auditoria (empresa_id, usuario_id, acao, descricao, referencia_id, ip_address)
+    VALUES (:empresa_id, :usuario_id, :acao, :descricao, :referencia_id, :ip_address)
+""")
+
+
+def formatar_valor(valor) -> str:
+    """Valor em reais no formato brasileiro (1.234,56), igual ao FORMAT(..., 'pt_BR') do MySQL."""
+    texto = f"{Decimal(str(valor or 0)):,.2f}"
+    return texto.replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def ip_cliente(request) -> str:
+    """IP de quem fez a requisição (o primeiro do X-Forwarded-For, se houver proxy)."""
+    if request is None:
+        return None
+    encaminhado = request.headers.get("x-forwarded-for")
+    if encaminhado:
+        return encaminhado.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+def evento(acao: str, descricao: str, empresa_id: int, usuario_id: int = None,
+           referencia_id: int = None, ip_address: str = None) -> dict:
+    """Monta os parâmetros de um evento para registrar_eventos()."""
+    return {
+        "empresa_id": empresa_id,
+        "usuario_id": usuario_id,
+        "acao": acao,
+        "descricao": descricao[:DESCRICAO_MAX],
+        "referencia_id": referencia_id,
+        "ip_address": ip_address
+    }
+
+
+def registrar_eventos(sessao, eventos: list):
+    """
+    Insere os eventos na transação atual (executar via db.run_sync, antes do COMMIT).
+    Vários eventos viram um único INSERT de várias linhas (executemany). Não faz COMMIT.
+    """
+    if eventos:
+        sessao.execute(_INSERT_EVENTO, eventos)
+
+
+# ------------------------------------------------------------------------------
+# Backfill: eventos das tabelas de origem que ainda não estão no log
+# (as mesmas cinco consultas do antigo UNION de /api/auditoria/log_atividades)
+# ------------------------------------------------------------------------------
+
+def _sql_backfill(acao: str, select: str) -> str:
+    return f"""
+        INSERT INTO eventos_auditoria (empresa_id, data_hora, usuario_id, acao, descricao, referencia_id)
+        SELECT * FROM ({select}) origem
+        WHERE NOT EXISTS (
+            SELECT 1 FROM eventos_auditoria e
+            WHERE e.acao = '{acao}' AND e.referencia_id = origem.referencia_id
+        )
+    """
+
+
+_BACKFILL = [
+    (DOCUMENTO_CRIADO, """
+        SELECT df.empresa_id, df.created_at, df.usuario_criacao_id, 'DOCUMENTO_CRIADO' AS acao,
+               CONCAT('Doc Fiscal Nº ', df.numero_documento, ' (R$ ', FORMAT(df.valor_total, 2, 'pt_BR'), ') foi criado.') AS descricao,
+               df.id AS referencia_id
+        FROM documentos_fiscais df
+    """),
+    (ANEXO_UPLOAD, """
+        SELECT u.empresa_id, a.created_at, a.uploaded_by, 'ANEXO_UPLOAD' AS acao,
+               CONCAT('Arquivo ', a.nome_original, ' (', a.tipo_arquivo, ') foi enviado.') AS descricao,
+               a.id AS referencia_id
+        FROM anexos a
+        JOIN usuarios u ON a.uploaded_by = u.id
+    """),
+    (PROV_CRIADO, """
+        SELECT p.empresa_id, p.created_at, p.usuario_criacao_id, 'PROV_CRIADO' AS acao,
+               CONCAT('Provisionamento (R$ ', FORMAT(p.valor_provisionado, 2, 'pt_BR'), ') criado para Doc ID ', p.documento_fiscal_id) AS descricao,
+               p.id AS referencia_id
+        FROM provisionamentos p
+    """),
+    (REMESSA_GERADA, """
+        SELECT r.empresa_id, r.data_geracao, r.usuario_geracao_id, 'REMESSA_GERADA' AS acao,
+               CONCAT('Remessa CNAB Nº ', r.numero_remessa, ' (R$ ', FORMAT(r.valor_total, 2, 'pt_BR'), ') foi gerada.') AS descricao,
+               r.id AS referencia_id
+        FROM remessas_cnab r
+    """),
+    (USUARIO_CRIADO, """
+        SELECT u.empresa_id, u.created_at, NULL AS usuario_id, 'USUARIO_CRIADO' AS acao,
+               CONCAT('Usuário ', u.nome, ' (', u.email, ') foi criado.') AS descricao,
+               u.id AS referencia_id
+        FROM usuarios u
+    """),
+]
+
+
+def executar_backfill(sessao) -> dict:
+    """
+    Cria os eventos que faltam para os registros já existentes. Pode ser rodado
+    mais de uma vez: registros que já têm evento (pela ação + referência) são pulados.
+    Retorna a quantidade de eventos criados por ação.
+    """
+    criados = {}
+    try:
+        for acao, select in _BACKFILL:
+            result = sessao.execute(text(_sql_backfill(acao, select)))
+            criados[acao] = result.rowcount
+        sessao.commit()
+    except Exception:
+        sessao.rollback()
+        raise
+    return criados
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Carrega em eventos_auditoria os eventos dos registros já existentes.")
+    parser.add_argument("--backfill", action="store_true", required=True, help="Cria os eventos que ainda faltam")
+    parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for acao, quantidade in executar_backfill(db).items():
+            print(f"{acao}: {quantidade} evento(s) criado(s)")
+    finally:
+        db.close()
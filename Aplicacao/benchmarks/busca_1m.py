@@ -0,0 +1,200 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/busca_1m.py
+# DESCRIÇÃO: Pesquisa livre de documentos (busca.py) em uma base de 1 milhão
+#   de documentos fiscais, comparada com o antigo LIKE '%termo%'.
+#   - --popular: gera fornecedores e documentos (INSERT de várias linhas, em blocos)
+#   - --medir: para cada termo de exemplo, roda a consulta da listagem
+#     (planejar_busca + consulta_documentos) e a antiga, mostrando o tempo
+#     (mediana de 5 execuções) e o plano (tabela, tipo de acesso, índice, linhas)
+#   - --sql: só imprime o SQL gerado para os termos (não precisa de banco)
+#   Use um banco separado: crie-o com Banco_fiscal/Sistema_fiscal.sql e as
+#   migrações e aponte DB_NAME para ele (ex: DB_NAME=sistema_fiscal_bench).
+#   Os documentos gerados não entram em resumo_documentos.
+#
+# USO (a partir da pasta Aplicacao):
+#   DB_NAME=sistema_fiscal_bench python benchmarks/busca_1m.py --popular 1000000
+#   DB_NAME=sistema_fiscal_bench python benchmarks/busca_1m.py --medir
+#   python benchmarks/busca_1m.py --sql
+# ==============================================================================
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from busca import planejar_busca
+from consultas import consulta_documentos
+
+# Termos de exemplo: cada um exercita um caminho do planejador
+TERMOS = [
+    "limpeza",           # FULLTEXT n-gram: razão social e descrição
+    "Transportes",       # FULLTEXT: só razão social
+    "manutenção",        # FULLTEXT: só descrição
+    "000123",            # prefixo de numero_documento / chave_acesso
+    "1.500,00",          # faixa de valor_total
+    "NF-e limpeza",      # tipo + texto (dois termos, AND)
+]
+
+CNPJ_EMPRESA_BENCH = "99000000000191"
+BLOCO = 5000
+
+_NOMES = ["Limpeza", "Transportes", "Tecnologia", "Consultoria", "Alimentos", "Engenharia",
+          "Segurança", "Manutenção", "Papelaria", "Logística", "Energia", "Telecom"]
+_SUFIXOS = ["Ltda", "S.A.", "ME", "EIRELI", "Serviços Ltda", "Comércio Ltda"]
+_DESCRICOES = ["Serviços de limpeza predial", "Manutenção preventiva de ar condicionado",
+               "Licenças de software", "Frete rodoviário", "Consultoria contábil",
+               "Material de escritório", "Fornecimento de refeições", "Vigilância patrimonial",
+               "Link de internet dedicado", "Energia elétrica", "Manutenção de elevadores"]
+_TIPOS = ["NF-e", "NFS-e", "CT-e", "BOLETO", "RECIBO"]
+_STATUS = ["PENDENTE", "PROCESSADO", "MANUAL"]
+
+
+def popular(sessao, total: int):
+    aleatorio = random.Random(42)
+    empresa_id = sessao.execute(
+        text("SELECT id FROM empresas WHERE cnpj = :cnpj"), {"cnpj": CNPJ_EMPRESA_BENCH}
+    ).scalar()
+    if empresa_id is None:
+        empresa_id = sessao.execute(text("""
+            INSERT INTO empresas (cnpj, razao_social) VALUES (:cnpj, 'Empresa Benchmark')
+        """), {"cnpj": CNPJ_EMPRESA_BENCH}).lastrowid
+
+    quantidade_fornecedores = max(1, total // 50)
+    inicio = time.perf_counter()
+    for base in range(0, quantidade_fornecedores, BLOCO):
+        linhas = [{
+            "cnpj": f"98{i:012d}",
+            "razao": f"{aleatorio.choice(_NOMES)} {aleatorio.choice(_NOMES)} {i} {aleatorio.choice(_SUFIXOS)}"
+        } for i in range(base, min(base + BLOCO, quantidade_fornecedores))]
+        sessao.execute(text("""
+            INSERT INTO fornecedores (cnpj_cpf, tipo_pessoa, razao_social) VALUES (:cnpj, 'PJ', :razao)
+        """), linhas)
+        sessao.commit()
+    # Os ids dos fornecedores gerados são sequenciais (um INSERT de várias linhas por bloco)
+    primeiro_fornecedor = sessao.execute(text("SELECT MIN(id) FROM fornecedores WHERE cnpj_cpf LIKE '98%'")).scalar()
+    print(f"{quantidade_fornecedores} fornecedores em {time.perf_counter() - inicio:.1f}s")
+
+    inicio = time.perf_counter()
+    hoje = date.today()
+    for base in range(0, total, BLOCO):
+        linhas = []
+        for i in range(base, min(base + BLOCO, total)):
+            linhas.append({
+                "empresa_id": empresa_id,
+                "fornecedor_id": primeiro_fornecedor + aleatorio.randrange(quantidade_fornecedores),
+                "tipo": aleatorio.choice(_TIPOS),
+                "numero": f"{i:09d}",
+                "chave": f"35{i:042d}",
+                "emissao": hoje - timedelta(days=aleatorio.randrange(1500)),
+                "valor": round(aleatorio.uniform(10, 50000), 2),
+                "descricao": f"{aleatorio.choice(_DESCRICOES)} - contrato {aleatorio.randrange(10000)}",
+                "status": aleatorio.choice(_STATUS),
+            })
+        sessao.execute(text("""
+            INSERT INTO documentos_fiscais (empresa_id, fornecedor_id, tipo_documento, numero_documento,
+                chave_acesso, data_emissao, valor_total, descricao_servico_produto, status_processamento)
+            VALUES (:empresa_id, :fornecedor_id, :tipo, :numero, :chave, :emissao, :valor, :descricao, :status)
+        """), linhas)
+        sessao.commit()
+        if (base // BLOCO) % 20 == 0:
+            print(f"  {base + len(linhas)} documentos ({time.perf_counter() - inicio:.0f}s)")
+    sessao.execute(text("ANALYZE TABLE fornecedores, documentos_fiscais"))
+    print(f"{total} documentos em {time.perf_counter() - inicio:.1f}s")
+
+
+def consulta_nova(termo: str):
+    condicoes, params = planejar_busca(termo)
+    consulta, _ = consulta_documentos(condicoes, params)
+    params["limite"] = 101
+    return consulta, params
+
+
+def consulta_antiga(termo: str):
+    # Filtro de pesquisa anterior ao busca.py
+    sql = text("""
+        SELECT df.id, df.data_emissao, df.numero_documento, f.razao_social, df.valor_total
+        FROM documentos_fiscais df
+        JOIN fornecedores f ON df.fornecedor_id = f.id
+        WHERE (df.numero_documento LIKE :search
+            OR f.razao_social LIKE :search
+            OR CAST(df.valor_total AS CHAR) LIKE :search
+            OR df.tipo_documento LIKE :search)
+        ORDER BY df.data_emissao DESC LIMIT 100
+    """)
+    return sql, {"search": f"%{termo}%"}
+
+
+def _sql_compilado(sessao, consulta, params):
+    compilada = consulta.compile(dialect=sessao.get_bind().dialect)
+    valores = compilada.construct_params(params)
+    if compilada.positional:
+        valores = tuple(valores[nome] for nome in compilada.positiontup)
+    return str(compilada), valores
+
+
+def _plano(sessao, consulta, params) -> str:
+    sql, valores = _sql_compilado(sessao, consulta, params)
+    linhas = sessao.connection().exec_driver_sql("EXPLAIN " + sql, valores).mappings().all()
+    return "; ".join(
+        f"{l['table']}:{l['type']}/{l['key'] or '-'}/{l['rows']}" for l in linhas
+    )
+
+
+def _tempo(sessao, consulta, params, repeticoes: int = 5):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        quantidade = len(sessao.execute(consulta, params).fetchall())
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos), quantidade
+
+
+def medir(sessao):
+    total = sessao.execute(text("SELECT COUNT(*) FROM documentos_fiscais")).scalar()
+    print(f"documentos_fiscais: {total} linhas\n")
+    for termo in TERMOS:
+        nova, params_nova = consulta_nova(termo)
+        antiga, params_antiga = consulta_antiga(termo)
+        tempo_nova, linhas_nova = _tempo(sessao, nova, params_nova)
+        tempo_antiga, linhas_antiga = _tempo(sessao, antiga, params_antiga, repeticoes=1)
+        print(f"'{termo}'")
+        print(f"  novo:   {tempo_nova * 1000:9.1f} ms  {linhas_nova:3d} linha(s)  plano: {_plano(sessao, nova, params_nova)}")
+        print(f"  antigo: {tempo_antiga * 1000:9.1f} ms  {linhas_antiga:3d} linha(s)  plano: {_plano(sessao, antiga, params_antiga)}")
+
+
+def imprimir_sql():
+    from sqlalchemy.dialects import mysql
+    for termo in TERMOS:
+        consulta, params = consulta_nova(termo)
+        print(f"-- '{termo}'  {params}")
+        print(str(consulta.compile(dialect=mysql.dialect())) + ";\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark da pesquisa de documentos em base grande.")
+    grupo = parser.add_mutually_exclusive_group(required=True)
+    grupo.add_argument("--popular", type=int, metavar="N", help="Gera N documentos (e N/50 fornecedores)")
+    grupo.add_argument("--medir", action="store_true", help="Mede os termos de exemplo")
+    grupo.add_argument("--sql", action="store_true", help="Só imprime o SQL gerado (sem banco)")
+    args = parser.parse_args()
+
+    if args.sql:
+        imprimir_sql()
+        sys.exit(0)
+
+    from database import SessionLocal
+    sessao = SessionLocal()
+    try:
+        if args.popular:
+            popular(sessao, args.popular)
+        else:
+            medir(sessao)
+    finally:
+        sessao.close()
@@ -0,0 +1,118 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/carga_dashboard.py
+# DESCRIÇÃO: Latência (p50/p99) de /api/dashboard/kpis enquanto outros clientes
+#   chamam /api/auditoria/log_atividades sem parar.
+#   - Com --url: mede um servidor rodando (uvicorn + MySQL de verdade)
+#   - Sem --url: roda o app no mesmo processo (httpx.ASGITransport) com um banco
+#     simulado cujas consultas BLOQUEIAM a thread (time.sleep), como o PyMySQL.
+#     Não precisa de MySQL. --sem-threads executa as consultas direto no event
+#     loop (como antes do SessaoAssincrona), para comparar.
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/carga_dashboard.py
+#   python benchmarks/carga_dashboard.py --sem-threads
+#   python benchmarks/carga_dashboard.py --url http://localhost:8000 --segundos 30
+# ==============================================================================
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _Resultado:
+    def fetchall(self):
+        return []
+
+
+class _SessaoLenta:
+    """Session falsa: cada execute segura a thread pelo tempo da consulta."""
+
+    def __init__(self, segundos_auditoria: float, segundos_outras: float):
+        self.segundos_auditoria = segundos_auditoria
+        self.segundos_outras = segundos_outras
+
+    def execute(self, query, params=None):
+        lenta = "eventos_auditoria" in str(query)
+        time.sleep(self.segundos_auditoria if lenta else self.segundos_outras)
+        return _Resultado()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def montar_cliente_local(args) -> httpx.AsyncClient:
+    import database
+    import main
+
+    if args.sem_threads:
+        async def _executar_no_loop(self, funcao, *a, **k):
+            return funcao(*a, **k)
+        database.SessaoAssincrona._executar = _executar_no_loop
+
+    # Sem cache do dashboard: toda chamada de kpis vai ao "banco"
+    main.cache_dashboard.ttl = 0
+
+    def banco_simulado():
+        yield database.SessaoAssincrona(_SessaoLenta(args.consulta_auditoria_ms / 1000, args.consulta_kpis_ms / 1000))
+
+    main.app.dependency_overrides[main.get_db_leitura] = banco_simulado
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://teste")
+
+
+async def _carga(cliente: httpx.AsyncClient, fim: float):
+    while time.perf_counter() < fim:
+        await cliente.get("/api/auditoria/log_atividades")
+
+
+async def _medir(cliente: httpx.AsyncClient, fim: float, latencias: list):
+    while time.perf_counter() < fim:
+        inicio = time.perf_counter()
+        resposta = await cliente.get("/api/dashboard/kpis")
+        latencias.append(time.perf_counter() - inicio)
+        resposta.raise_for_status()
+        await asyncio.sleep(0.01)
+
+
+async def executar(args):
+    if args.url:
+        cliente = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        cliente = montar_cliente_local(args)
+
+    latencias = []
+    async with cliente:
+        fim = time.perf_counter() + args.segundos
+        await asyncio.gather(
+            *(_carga(cliente, fim) for _ in range(args.clientes_auditoria)),
+            _medir(cliente, fim, latencias)
+        )
+
+    latencias.sort()
+    p99 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))]
+    print(f"kpis: {len(latencias)} chamadas com {args.clientes_auditoria} cliente(s) em log_atividades")
+    print(f"  p50 {statistics.median(latencias) * 1000:.1f} ms | p99 {p99 * 1000:.1f} ms | "
+          f"máx {latencias[-1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="p99 de /api/dashboard/kpis sob carga de log_atividades.")
+    parser.add_argument("--url", help="Servidor a medir (sem isto: app local com banco simulado)")
+    parser.add_argument("--segundos", type=float, default=5)
+    parser.add_argument("--clientes-auditoria", type=int, default=8)
+    parser.add_argument("--consulta-auditoria-ms", type=float, default=300, help="Banco simulado: duração da consulta de auditoria")
+    parser.add_argument("--consulta-kpis-ms", type=float, default=5, help="Banco simulado: duração da consulta do dashboard")
+    parser.add_argument("--sem-threads", action="store_true", help="Banco simulado: consultas no event loop (comportamento antigo)")
+    asyncio.run(executar(parser.parse_args()))
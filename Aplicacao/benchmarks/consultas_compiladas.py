@@ -0,0 +1,133 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/consultas_compiladas.py
+# DESCRIÇÃO: Custo por pedido, do lado da aplicação, da consulta da listagem
+#   de documentos (/api/documentos-fiscais): a montagem antiga (strings SQL
+#   concatenadas + text() a cada pedido) x a atual (consultas.py: select() do
+#   SQLAlchemy Core guardado por forma de filtro).
+#   - Mede o caminho que o SQLAlchemy faz antes de enviar ao MySQL: montar a
+#     consulta, gerar a chave do cache, achar o SQL compilado no cache do
+#     engine (query_cache_size) e montar os parâmetros
+#   - Mede também a compilação completa, paga uma vez por forma de filtro
+#     (cache do engine vazio)
+#   - Não precisa de MySQL: usa o dialeto do PyMySQL sem conexão. Os print()
+#     da montagem antiga (SQL e parâmetros a cada pedido) ficam de fora
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/consultas_compiladas.py
+#   python benchmarks/consultas_compiladas.py --repeticoes 20000
+# ==============================================================================
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.dialects.mysql.pymysql import MySQLDialect_pymysql
+from sqlalchemy.util import LRUCache
+
+from busca import planejar_busca
+from consultas import ORDENACAO_DOCUMENTOS, consulta_documentos
+from database import DB_QUERY_CACHE_SIZE
+from paginacao import aplicar_cursor, clausula_ordem, clausula_limite, codificar_cursor, parametros_cursor
+
+DIALETO = MySQLDialect_pymysql()
+LIMITE = 50
+
+# Formas de filtro medidas: (nome, parâmetros da rota)
+CENARIOS = [
+    ("sem filtros", {}),
+    ("pesquisa + período + status + cursor", {
+        "search": "distribuidora 1234", "data_inicial": "2024-01-01", "data_final": "2024-12-31",
+        "status": "PENDENTE", "cursor": codificar_cursor(["2024-06-30", 98765]),
+    }),
+]
+
+
+def antigo(search=None, tipo_data="emissao", data_inicial=None, data_final=None,
+           tipo_documento=None, status=None, fornecedor_id=None, cursor=None):
+    """Montagem anterior ao consultas.py (montar_filtros_documentos + text())."""
+    conditions = []
+    params = {}
+    if search and search.strip():
+        conditions_busca, params_busca = planejar_busca(search)
+        conditions.extend(conditions_busca)
+        params.update(params_busca)
+    if data_inicial and data_final:
+        conditions.append(f"df.data_{tipo_data} BETWEEN :data_inicial AND :data_final")
+        params["data_inicial"] = data_inicial
+        params["data_final"] = data_final
+    if tipo_documento:
+        conditions.append("df.tipo_documento = :tipo_documento")
+        params["tipo_documento"] = tipo_documento
+    if status:
+        conditions.append("df.status_processamento = :status")
+        params["status"] = status
+    if fornecedor_id:
+        conditions.append("df.fornecedor_id = :fornecedor_id")
+        params["fornecedor_id"] = fornecedor_id
+
+    ordenacao = [("df.data_emissao", "DESC"), ("df.id", "DESC")]
+    if cursor:
+        aplicar_cursor(conditions, params, ordenacao, cursor)
+
+    query_base = """
+        SELECT
+            df.id, df.data_emissao, df.data_recebimento, df.data_competencia, df.data_vencimento,
+            df.numero_documento, df.tipo_documento, f.razao_social as fornecedor,
+            df.valor_total, df.status_processamento
+        FROM documentos_fiscais df
+        JOIN fornecedores f ON df.fornecedor_id = f.id
+        WHERE 1=1
+    """
+    if conditions:
+        query_base += " AND " + " AND ".join(conditions)
+    query_base += clausula_ordem(ordenacao) + clausula_limite(LIMITE)
+    return text(query_base), params
+
+
+def atual(search=None, tipo_data="emissao", data_inicial=None, data_final=None,
+          tipo_documento=None, status=None, fornecedor_id=None, cursor=None):
+    """Montagem de listar_documentos com consultas.py."""
+    conditions_busca, params = planejar_busca(search) if search and search.strip() else ([], {})
+    if cursor:
+        params.update(parametros_cursor(cursor, len(ORDENACAO_DOCUMENTOS)))
+    consulta, _ = consulta_documentos(
+        conditions_busca, params, tipo_data, data_inicial, data_final,
+        tipo_documento, status, fornecedor_id, com_cursor=bool(cursor)
+    )
+    return consulta, {**params, "limite": LIMITE + 1}
+
+
+def preparar(montar, filtros, cache):
+    """O que o Connection.execute faz antes de enviar: chave, SQL compilado (cache) e parâmetros."""
+    consulta, params = montar(**filtros)
+    compilado, extraidos, _ = consulta._compile_w_cache(
+        DIALETO, compiled_cache=cache, column_keys=sorted(params)
+    )
+    compilado.construct_params(params, extracted_parameters=extraidos)
+    return compilado
+
+
+def por_pedido_us(montar, filtros, repeticoes: int, com_cache: bool) -> float:
+    cache = LRUCache(DB_QUERY_CACHE_SIZE)
+    preparar(montar, filtros, cache)  # 1º pedido da forma: compila e guarda
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        preparar(montar, filtros, cache if com_cache else None)
+    return (time.perf_counter() - inicio) / repeticoes * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Custo por pedido da consulta de documentos: text() x consultas.py.")
+    parser.add_argument("--repeticoes", type=int, default=5000)
+    args = parser.parse_args()
+
+    for nome, filtros in CENARIOS:
+        print(nome)
+        for rotulo, montar in (("antigo (text)", antigo), ("atual (Core)", atual)):
+            cache_quente = por_pedido_us(montar, filtros, args.repeticoes, com_cache=True)
+            sem_cache = por_pedido_us(montar, filtros, max(args.repeticoes // 10, 1), com_cache=False)
+            print(f"  {rotulo:<15}{cache_quente:>8.1f} µs/pedido   compilação completa {sem_cache:>7.1f} µs")
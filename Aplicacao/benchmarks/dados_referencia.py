@@ -0,0 +1,124 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/dados_referencia.py
+# DESCRIÇÃO: Custo de /api/fornecedores sem cache x com o cache de
+#   dados_referencia (JSON guardado serializado + ETag).
+#   - O banco é uma Session falsa com N fornecedores que conta as consultas.
+#     Não precisa de MySQL
+#   - Sem cache: consulta + montagem do dict + JSONResponse a cada pedido (como
+#     antes do cache)
+#   - Com cache: dados_referencia.resposta com a listagem já guardada, sem e
+#     com If-None-Match (200 com o corpo guardado / 304 sem corpo)
+#   - Confere pela rota (TestClient) que o 304 não consulta o banco e que
+#     invalidar("fornecedores") muda o ETag
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/dados_referencia.py
+#   python benchmarks/dados_referencia.py --fornecedores 20000
+# ==============================================================================
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import main
+
+CHAVE = ("fornecedores", "todas")
+
+
+class _Resultado:
+    def __init__(self, linhas):
+        self.linhas = linhas
+
+    def fetchall(self):
+        return self.linhas
+
+
+class SessaoContada:
+    """Session assíncrona falsa: devolve os fornecedores e conta as consultas."""
+
+    def __init__(self, fornecedores: int):
+        self.fornecedores = [(i, f"Fornecedor {i} Ltda ç", f"{i:014d}", "PJ") for i in range(fornecedores)]
+        self.consultas = 0
+
+    async def execute(self, query, params=None):
+        self.consultas += 1
+        return _Resultado(self.fornecedores if "FROM fornecedores" in str(query) else [])
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+def _pedido(if_none_match: str = None) -> Request:
+    cabecalhos = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "headers": cabecalhos})
+
+
+async def _por_pedido(funcao, repeticoes: int) -> float:
+    """Tempo médio (s) de 'await funcao()'."""
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        await funcao()
+    return (time.perf_counter() - inicio) / repeticoes
+
+
+async def medir(db: SessaoContada, repeticoes: int):
+    async def sem_cache():
+        return JSONResponse(await main.dados_fornecedores(db, None))
+
+    calcular = lambda: main.dados_fornecedores(db, None)
+    tempos = {"sem cache": await _por_pedido(sem_cache, max(repeticoes // 10, 1))}
+
+    # A 1ª resposta guarda a listagem; as seguintes não devem consultar o banco
+    resposta = await main.dados_referencia.resposta(_pedido(), CHAVE, calcular)
+    etag = resposta.headers["etag"]
+    consultas = db.consultas
+    tempos["cache, 200"] = await _por_pedido(lambda: main.dados_referencia.resposta(_pedido(), CHAVE, calcular), repeticoes)
+    tempos["cache, 304"] = await _por_pedido(lambda: main.dados_referencia.resposta(_pedido(etag), CHAVE, calcular), repeticoes)
+
+    for nome, segundos in tempos.items():
+        print(f"  {nome:<12}{segundos * 1_000_000:>10.1f} µs/pedido")
+    print(f"  corpo {len(resposta.body) / 1024:.0f} KB; consultas ao banco com o cache quente: {db.consultas - consultas}")
+
+
+def conferir_rota(db: SessaoContada):
+    main.app.dependency_overrides[main.get_db] = lambda: db
+    main.dados_referencia.invalidar("fornecedores")
+    try:
+        cliente = TestClient(main.app)
+        primeira = cliente.get("/api/fornecedores")
+        etag = primeira.headers["etag"]
+        consultas = db.consultas
+        condicional = cliente.get("/api/fornecedores", headers={"If-None-Match": etag})
+        assert condicional.status_code == 304 and not condicional.content
+        assert db.consultas == consultas, "304 consultou o banco"
+
+        main.dados_referencia.invalidar("fornecedores")
+        db.fornecedores.append((len(db.fornecedores), "Fornecedor Novo", "9", "PJ"))
+        depois = cliente.get("/api/fornecedores", headers={"If-None-Match": etag})
+        assert depois.status_code == 200 and depois.headers["etag"] != etag
+        print(f"  rota: 200 -> 304 sem consulta -> invalidar -> 200 com ETag novo ({depois.json()['total']} fornecedores)")
+    finally:
+        main.app.dependency_overrides.pop(main.get_db, None)
+        main.dados_referencia.invalidar("fornecedores")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/api/fornecedores sem cache x com cache e ETag.")
+    parser.add_argument("--fornecedores", type=int, default=2000)
+    parser.add_argument("--repeticoes", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{args.fornecedores} fornecedores")
+    asyncio.run(medir(SessaoContada(args.fornecedores), args.repeticoes))
+    conferir_rota(SessaoContada(args.fornecedores))
@@ -0,0 +1,110 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/detectar_encoding.py
+# DESCRIÇÃO: Tempo de leitor_xml.detect_encoding (BOM, declaração, UTF-8
+#   estrito, chardet sobre amostra de até 64 KB) comparado com a detecção
+#   antiga (só 'encoding="utf-8"'/'"iso-8859-1"' com aspas duplas no cabeçalho,
+#   senão chardet sobre o arquivo inteiro).
+#   - Gera XMLs de vários tamanhos nos casos comuns: UTF-8 e ISO-8859-1
+#     declarados, declaração com aspas simples, sem declaração (UTF-8 e
+#     latin-1) e com BOM; não precisa de banco nem de arquivos
+#   - Mostra o tempo (mediana) e se o encoding devolvido decodifica o arquivo
+#     com o texto original
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/detectar_encoding.py
+#   python benchmarks/detectar_encoding.py --tamanhos-kb 64 1024 20480
+# ==============================================================================
+
+import argparse
+import codecs
+import os
+import statistics
+import sys
+import time
+
+import chardet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from leitor_xml import detect_encoding
+
+_ITEM = "<det><xProd>Ação de manutenção preventiva nº {n} - São Paulo/SP</xProd><vProd>{n}.00</vProd></det>\n"
+
+
+def detect_encoding_antigo(content: bytes) -> str:
+    """Detecção anterior: cabeçalho com aspas duplas ou chardet no arquivo todo."""
+    try:
+        header = content[:100].decode('latin-1').lower()
+        if 'encoding="utf-8"' in header:
+            return 'utf-8'
+        if 'encoding="iso-8859-1"' in header:
+            return 'iso-8859-1'
+    except Exception:
+        pass
+    result = chardet.detect(content)
+    encoding = result.get('encoding') or 'utf-8'
+    if encoding.lower() not in ['utf-8', 'iso-8859-1', 'latin-1']:
+        return 'utf-8'
+    return encoding
+
+
+def gerar_texto(tamanho: int) -> str:
+    corpo = []
+    total = 0
+    n = 0
+    while total < tamanho:
+        item = _ITEM.format(n=n)
+        corpo.append(item)
+        total += len(item)
+        n += 1
+    return "<NFe>\n" + "".join(corpo) + "</NFe>"
+
+
+def casos(tamanho: int):
+    """(nome, bytes) de cada caso."""
+    texto = gerar_texto(tamanho)
+    declaracao = '<?xml version="1.0" encoding="{}"?>\n'
+    return [
+        ("UTF-8 declarado", (declaracao.format("UTF-8") + texto).encode("utf-8")),
+        ("ISO-8859-1 declarado", (declaracao.format("ISO-8859-1") + texto).encode("iso-8859-1")),
+        ("aspas simples", ("<?xml version='1.0' encoding='windows-1252'?>\n" + texto).encode("cp1252")),
+        ("sem declaração UTF-8", texto.encode("utf-8")),
+        ("sem declaração latin-1", texto.encode("iso-8859-1")),
+        ("UTF-8 com BOM", codecs.BOM_UTF8 + (declaracao.format("UTF-8") + texto).encode("utf-8")),
+    ]
+
+
+def decodifica(content: bytes, encoding: str) -> bool:
+    """O encoding devolvido reproduz o texto original (acentos incluídos)?"""
+    try:
+        return "manutenção" in content.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def tempo_ms(funcao, content, repeticoes: int) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(content)
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="detect_encoding atual x antigo (chardet no arquivo inteiro).")
+    parser.add_argument("--tamanhos-kb", type=int, nargs="+", default=[64, 1024, 5120])
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    for tamanho_kb in args.tamanhos_kb:
+        print(f"\n{tamanho_kb} KB")
+        print(f"  {'caso':<24}| {'atual ms':>9} {'encoding':<11}| {'antigo ms':>10} {'encoding':<11}")
+        for nome, content in casos(tamanho_kb * 1024):
+            atual, antigo = detect_encoding(content), detect_encoding_antigo(content)
+            # chardet no arquivo inteiro leva segundos: uma medição só nos arquivos grandes
+            repeticoes_antigo = args.repeticoes if tamanho_kb <= 1024 else 1
+            print(f"  {nome:<24}| {tempo_ms(detect_encoding, content, args.repeticoes):>9.2f} "
+                  f"{atual + ('' if decodifica(content, atual) else ' (ERRO)'):<11}| "
+                  f"{tempo_ms(detect_encoding_antigo, content, repeticoes_antigo):>10.2f} "
+                  f"{antigo + ('' if decodifica(content, antigo) else ' (ERRO)')}")
@@ -0,0 +1,190 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/importacao_lote.py
+# DESCRIÇÃO: Arquivos por segundo da importação em lote (ZIP -> pool de
+#   processos -> gravar_lote em uma transação) comparada com a importação um a
+#   um (extrair_dados_xml + gravar_documento por arquivo, como em
+#   /api/importar-xml).
+#   - Gera N NF-e com chaves diferentes e fornecedores repetidos
+#   - O banco é simulado: cada comando e cada COMMIT esperam --latencia-ms
+#     (ida e volta ao MySQL) + um custo por linha enviada, segurando a thread
+#     como o PyMySQL. Não precisa de MySQL
+#   - Mostra arquivos/s, comandos e COMMITs de cada forma, e roda uma segunda
+#     vez com as mesmas chaves (documentos já existentes: atualização)
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/importacao_lote.py
+#   python benchmarks/importacao_lote.py --arquivos 2000 --latencia-ms 1 --workers 4
+# ==============================================================================
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.leitura_xml import gerar_nfe
+
+CHAVE_MODELO = b"35240112345678000195550010000012341000012345"
+CNPJ_MODELO = b"<CNPJ>12345678000195</CNPJ>"
+
+
+def gerar_xmls(quantidade: int, fornecedores: int, itens: int):
+    """(nome, bytes) de 'quantidade' NF-e com chaves únicas."""
+    modelo = gerar_nfe(itens)
+    arquivos = []
+    for i in range(quantidade):
+        xml = modelo.replace(CHAVE_MODELO, f"35{i:042d}".encode())
+        xml = xml.replace(CNPJ_MODELO, f"<CNPJ>{i % fornecedores:014d}</CNPJ>".encode(), 1)
+        arquivos.append((f"nota_{i:06d}.xml", xml))
+    return arquivos
+
+
+def compactar_zip(arquivos) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_arquivo:
+        for nome, conteudo in arquivos:
+            zip_arquivo.writestr(nome, conteudo)
+    return buffer.getvalue()
+
+
+class _Resultado:
+    def __init__(self, linhas=(), lastrowid=None, rowcount=0):
+        self.linhas = linhas
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        return list(self.linhas)
+
+
+class BancoSimulado:
+    """
+    Session falsa com latência: guarda fornecedores e documentos em dicionários
+    e responde aos comandos de importacao_lote, resumo_documentos e auditoria.
+    """
+
+    def __init__(self, latencia: float, custo_linha: float):
+        self.latencia = latencia
+        self.custo_linha = custo_linha
+        self.fornecedores = {}  # cnpj -> id
+        self.documentos = {}    # chave -> [id, fornecedor_id, valor]
+        self.comandos = 0
+        self.commits = 0
+
+    def _ida_ao_banco(self, linhas: int = 1):
+        time.sleep(self.latencia + linhas * self.custo_linha)
+
+    def execute(self, query, params=None):
+        sql = " ".join(str(query).split())
+        linhas = params if isinstance(params, list) else [params or {}]
+        self.comandos += 1
+        self._ida_ao_banco(len(linhas))
+
+        if sql.startswith("INSERT INTO fornecedores"):
+            for p in linhas:
+                self.fornecedores.setdefault(p["cnpj"], len(self.fornecedores) + 1)
+            return _Resultado(lastrowid=self.fornecedores[linhas[-1]["cnpj"]], rowcount=len(linhas))
+
+        if sql.startswith("INSERT INTO documentos_fiscais"):
+            rowcount = 0
+            for p in linhas:
+                documento = self.documentos.get(p["chave"])
+                if documento:
+                    documento[2] = p["valor_total"]
+                    rowcount += 2
+                else:
+                    self.documentos[p["chave"]] = [len(self.documentos) + 1, p["fornecedor_id"], p["valor_total"]]
+                    rowcount += 1
+            return _Resultado(lastrowid=self.documentos[linhas[-1]["chave"]][0], rowcount=rowcount)
+
+        if sql.startswith("SELECT cnpj_cpf, id FROM fornecedores"):
+            return _Resultado([(c, self.fornecedores[c]) for c in params["cnpjs"] if c in self.fornecedores])
+
+        if sql.startswith("SELECT chave_acesso, id FROM documentos_fiscais"):
+            return _Resultado([(c, self.documentos[c][0]) for c in params["chaves"] if c in self.documentos])
+
+        if sql.startswith("SELECT id FROM documentos_fiscais WHERE chave_acesso"):
+            return _Resultado([(self.documentos[c][0],) for c in params["chaves"] if c in self.documentos])
+
+        if sql.startswith("SELECT empresa_id, fornecedor_id, status_processamento"):
+            ids = set(params["ids"])
+            return _Resultado([
+                (1, fornecedor_id, "PENDENTE", "2024-01-01", valor)
+                for id_documento, fornecedor_id, valor in self.documentos.values() if id_documento in ids
+            ])
+
+        # documentos_xml, resumo_documentos, eventos_auditoria
+        return _Resultado(rowcount=len(linhas))
+
+    def commit(self):
+        self.commits += 1
+        self._ida_ao_banco()
+
+    def rollback(self):
+        pass
+
+
+def um_a_um(banco, arquivos):
+    from importacao_lote import gravar_documento
+    from leitor_xml import extrair_dados_xml
+
+    for _, conteudo in arquivos:
+        gravar_documento(banco, extrair_dados_xml(conteudo), conteudo)
+
+
+def em_lote(banco, conteudo_zip):
+    from importacao_lote import expandir_arquivos, analisar_arquivos, gravar_lote, LOTE_MAX_BYTES
+
+    arquivos = expandir_arquivos("lote.zip", conteudo_zip, LOTE_MAX_BYTES)
+    itens = asyncio.run(analisar_arquivos(arquivos))
+    erros = [item["erro"] for item in itens if "erro" in item]
+    assert not erros, erros[:3]
+    gravar_lote(banco, itens)
+
+
+def medir(nome, funcao, banco, entrada, quantidade):
+    comandos, commits = banco.comandos, banco.commits
+    inicio = time.perf_counter()
+    # extrair_dados_xml registra o tipo de cada nota com print
+    with contextlib.redirect_stdout(io.StringIO()):
+        funcao(banco, entrada)
+    segundos = time.perf_counter() - inicio
+    print(f"  {nome:<10}{quantidade / segundos:>10.1f} arquivos/s {segundos:>8.2f}s "
+          f"{banco.comandos - comandos:>7d} comandos {banco.commits - commits:>6d} COMMIT(s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importação em lote x um a um (arquivos/s).")
+    parser.add_argument("--arquivos", type=int, default=1000)
+    parser.add_argument("--fornecedores", type=int, default=50, help="CNPJs diferentes entre os arquivos")
+    parser.add_argument("--itens", type=int, default=5, help="Itens (<det>) por NF-e")
+    parser.add_argument("--latencia-ms", type=float, default=0.5, help="Ida e volta ao banco por comando/COMMIT")
+    parser.add_argument("--custo-linha-us", type=float, default=5, help="Custo por linha enviada em um comando")
+    parser.add_argument("--workers", type=int, default=None, help="XML_WORKERS do pool de processos")
+    args = parser.parse_args()
+
+    import importacao_lote
+    if args.workers:
+        importacao_lote.XML_WORKERS = args.workers
+
+    arquivos = gerar_xmls(args.arquivos, args.fornecedores, args.itens)
+    conteudo_zip = compactar_zip(arquivos)
+    print(f"{args.arquivos} NF-e ({len(conteudo_zip) / 1024:.0f} KB em ZIP), {args.fornecedores} fornecedores, "
+          f"latência {args.latencia_ms} ms, {importacao_lote.XML_WORKERS} processo(s) de leitura")
+
+    # Sobe o pool de processos antes de medir (no servidor ele fica de pé entre os lotes)
+    with contextlib.redirect_stdout(io.StringIO()):
+        em_lote(BancoSimulado(0, 0), compactar_zip(arquivos[:1]))
+
+    # Cada forma tem o seu banco; a 2ª rodada reimporta as mesmas chaves nele
+    formas = [("um a um", um_a_um, arquivos), ("em lote", em_lote, conteudo_zip)]
+    bancos = {nome: BancoSimulado(args.latencia_ms / 1000, args.custo_linha_us / 1_000_000) for nome, _, _ in formas}
+    for rodada in ("documentos novos", "documentos existentes"):
+        print(rodada)
+        for nome, funcao, entrada in formas:
+            medir(nome, funcao, bancos[nome], entrada, args.arquivos)
@@ -0,0 +1,182 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/leitura_xml.py
+# DESCRIÇÃO: Extração dos campos de NF-e/NFS-e (leitor_xml.extrair_dados_xml:
+#   árvore montada direto dos bytes + caminhos exatos; iterparse acima de
+#   XML_ITERPARSE_MB) comparada com a leitura antiga (decode + replace do
+#   namespace + ET.fromstring da árvore inteira + buscas .//{*}).
+#   - Gera notas do tamanho das reais: NF-e com 1 a 5000 itens (<det>) e
+#     NFS-e padrão SP; não precisa de banco nem de arquivos
+#   - Mostra o tempo por arquivo (mediana) e o pico de memória (tracemalloc)
+#     da leitura atual com árvore, da atual forçando iterparse e da antiga, e
+#     confere se as três devolvem os mesmos campos
+#   Todas usam o mesmo detect_encoding: só a leitura do XML muda.
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/leitura_xml.py
+#   python benchmarks/leitura_xml.py --itens 1 20 200 2000 --repeticoes 20
+# ==============================================================================
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import leitor_xml
+from leitor_xml import detect_encoding, extrair_dados_xml
+
+_ITEM_NFE = """<det nItem="{n}"><prod><cProd>{n:06d}</cProd><cEAN>SEM GTIN</cEAN>\
+<xProd>Produto de teste número {n} - embalagem com 12 unidades</xProd><NCM>84713012</NCM>\
+<CFOP>5102</CFOP><uCom>UN</uCom><qCom>2.0000</qCom><vUnCom>150.0000000000</vUnCom>\
+<vProd>300.00</vProd><cEANTrib>SEM GTIN</cEANTrib><uTrib>UN</uTrib><qTrib>2.0000</qTrib>\
+<vUnTrib>150.0000000000</vUnTrib><indTot>1</indTot></prod><imposto><vTotTrib>45.30</vTotTrib>\
+<ICMS><ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC><vBC>300.00</vBC><pICMS>18.00</pICMS>\
+<vICMS>54.00</vICMS></ICMS00></ICMS><PIS><PISAliq><CST>01</CST><vBC>300.00</vBC><pPIS>1.65</pPIS>\
+<vPIS>4.95</vPIS></PISAliq></PIS><COFINS><COFINSAliq><CST>01</CST><vBC>300.00</vBC>\
+<pCOFINS>7.60</pCOFINS><vCOFINS>22.80</vCOFINS></COFINSAliq></COFINS></imposto></det>"""
+
+
+def gerar_nfe(itens: int) -> bytes:
+    """nfeProc com 'itens' produtos, no formato da SEFAZ (namespace + assinatura)."""
+    total = 300 * itens
+    return (f"""<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe><infNFe Id="NFe35240112345678000195550010000012341000012345" versao="4.00">\
+<ide><cUF>35</cUF><cNF>00001234</cNF><natOp>Venda de mercadoria</natOp><mod>55</mod><serie>1</serie>\
+<nNF>1234</nNF><dhEmi>2024-01-15T10:30:00-03:00</dhEmi><tpNF>1</tpNF></ide>\
+<emit><CNPJ>12345678000195</CNPJ><xNome>Distribuidora São João Ltda</xNome><enderEmit>\
+<xLgr>Rua das Flores</xLgr><nro>100</nro><xBairro>Centro</xBairro><xMun>São Paulo</xMun><UF>SP</UF>\
+</enderEmit><IE>123456789110</IE></emit><dest><CNPJ>98765432000110</CNPJ><xNome>Cliente Teste S.A.</xNome></dest>"""
+        + "".join(_ITEM_NFE.format(n=n) for n in range(1, itens + 1))
+        + f"""<total><ICMSTot><vBC>{total}.00</vBC><vICMS>{total * 0.18:.2f}</vICMS><vProd>{total}.00</vProd>\
+<vNF>{total}.00</vNF><vTotTrib>{45.3 * itens:.2f}</vTotTrib></ICMSTot></total></infNFe>\
+<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignatureValue>{"A" * 344}</SignatureValue></Signature>\
+</NFe><protNFe versao="4.00"><infProt><chNFe>35240112345678000195550010000012341000012345</chNFe>\
+<nProt>135240000012345</nProt></infProt></protNFe></nfeProc>""").encode("utf-8")
+
+
+def gerar_nfse_sp() -> bytes:
+    """Retorno de consulta de NFS-e da prefeitura de SP (ISO-8859-1, namespace padrão)."""
+    return """<?xml version="1.0" encoding="ISO-8859-1"?>
+<RetornoConsulta xmlns="http://www.prefeitura.sp.gov.br/nfe"><Cabecalho Versao="1"><Sucesso>true</Sucesso></Cabecalho>\
+<NFe><ChaveNFe><InscricaoPrestador>12345678</InscricaoPrestador><NumeroNFe>4567</NumeroNFe>\
+<CodigoVerificacao>AB12CD34</CodigoVerificacao></ChaveNFe><DataEmissaoNFe>2024-02-10T14:00:00</DataEmissaoNFe>\
+<CPFCNPJPrestador><CNPJ>11222333000181</CNPJ></CPFCNPJPrestador>\
+<RazaoSocialPrestador>Serviços Técnicos Paulistanos Ltda</RazaoSocialPrestador>\
+<ValorServicos>2500.00</ValorServicos><ValorISS>125.00</ValorISS>\
+<Discriminacao>Manutenção preventiva de equipamentos de informática conforme contrato</Discriminacao></NFe>\
+</RetornoConsulta>""".encode("iso-8859-1")
+
+
+def extrair_antigo(content: bytes) -> dict:
+    """Leitura anterior ao iterparse: árvore inteira em memória + buscas .//{*}."""
+    encoding = detect_encoding(content)
+    xml_string = content.decode(encoding)
+    xml_string = xml_string.replace('xmlns="http://www.prefeitura.sp.gov.br/nfe"', '', 1)
+    root = ET.fromstring(xml_string)
+
+    dados = {"numero": None, "serie": None, "chave_acesso": None, "data_emissao": None,
+             "valor_total": 0, "valor_impostos": 0, "cnpj_fornecedor": None, "razao_fornecedor": None}
+
+    def texto(pai, caminho):
+        elem = pai.find(caminho) if pai is not None else None
+        return elem.text if elem is not None else None
+
+    infNFe = root.find('.//{*}infNFe')
+    if infNFe is not None:
+        dados["tipo_documento"] = 'NF-e'
+        if infNFe.get('Id'):
+            dados["chave_acesso"] = infNFe.get('Id').replace('NFe', '')
+        ide, total, emit = infNFe.find('{*}ide'), infNFe.find('.//{*}ICMSTot'), infNFe.find('{*}emit')
+        dados["numero"], dados["serie"] = texto(ide, '{*}nNF'), texto(ide, '{*}serie')
+        dados["data_emissao"] = (texto(ide, '{*}dhEmi') or '')[:10] or None
+        dados["valor_total"] = float(texto(total, '{*}vNF') or 0)
+        dados["valor_impostos"] = float(texto(total, '{*}vTotTrib') or 0)
+        dados["cnpj_fornecedor"], dados["razao_fornecedor"] = texto(emit, '{*}CNPJ'), texto(emit, '{*}xNome')
+    else:
+        dados["tipo_documento"] = 'NFS-e'
+        nfe_sp = root.find('.//{*}NFe')
+        if nfe_sp is None:
+            nfe_sp = root
+        dados["numero"] = texto(nfe_sp, './/{*}NumeroNFe')
+        dados["chave_acesso"] = texto(nfe_sp, './/{*}CodigoVerificacao')
+        data = texto(nfe_sp, './/{*}DataEmissaoNFe') or texto(nfe_sp, './/{*}DataEmissao')
+        dados["data_emissao"] = data[:10] if data else None
+        dados["valor_total"] = float(texto(nfe_sp, './/{*}ValorServicos') or 0)
+        dados["valor_impostos"] = float(texto(nfe_sp, './/{*}ValorISS') or 0)
+        dados["razao_fornecedor"] = texto(nfe_sp, './/{*}RazaoSocialPrestador')
+        dados["cnpj_fornecedor"] = (texto(nfe_sp, './/{*}CPFCNPJPrestador/{*}CNPJ')
+                                    or texto(nfe_sp, './/{*}PrestadorServico/{*}Cnpj'))
+    dados["xml_string"] = xml_string
+    return dados
+
+
+def extrair_iterparse(content: bytes) -> dict:
+    """extrair_dados_xml como nos arquivos acima de XML_ITERPARSE_MB."""
+    limite = leitor_xml.XML_ITERPARSE_BYTES
+    leitor_xml.XML_ITERPARSE_BYTES = 0
+    try:
+        return extrair_dados_xml(content)
+    finally:
+        leitor_xml.XML_ITERPARSE_BYTES = limite
+
+
+def _sem_print(funcao, content):
+    # extrair_dados_xml registra o tipo detectado com print
+    with contextlib.redirect_stdout(io.StringIO()):
+        return funcao(content)
+
+
+def tempo_ms(funcao, content, repeticoes: int) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        _sem_print(funcao, content)
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos) * 1000
+
+
+def pico_mb(funcao, content) -> float:
+    tracemalloc.start()
+    _sem_print(funcao, content)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pico / (1024 * 1024)
+
+
+def mesmos_campos(content) -> bool:
+    antigo = _sem_print(extrair_antigo, content)
+    return all(
+        novo[campo] == antigo[campo]
+        for novo in (_sem_print(extrair_dados_xml, content), _sem_print(extrair_iterparse, content))
+        for campo in antigo if campo != "xml_string"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leitura atual (árvore / iterparse) x antiga na leitura de NF-e/NFS-e.")
+    parser.add_argument("--itens", type=int, nargs="+", default=[1, 50, 500, 5000], help="Itens (<det>) por NF-e gerada")
+    parser.add_argument("--repeticoes", type=int, default=10)
+    args = parser.parse_args()
+
+    corpus = [(f"NF-e {itens} itens", gerar_nfe(itens)) for itens in args.itens]
+    corpus.append(("NFS-e SP", gerar_nfse_sp()))
+
+    leituras = (extrair_dados_xml, extrair_iterparse, extrair_antigo)
+    print(f"limite do iterparse: {leitor_xml.XML_ITERPARSE_BYTES // (1024 * 1024)} MB")
+    print(f"{'arquivo':<18}{'tamanho':>10} | {'ms: atual':>9} {'iterparse':>9} {'antigo':>8} | "
+          f"{'MB: atual':>9} {'iterparse':>9} {'antigo':>8} | campos")
+    for nome, content in corpus:
+        # Arquivos grandes: menos repetições (o antigo leva segundos)
+        repeticoes = max(1, args.repeticoes // max(1, len(content) // (1024 * 1024)))
+        tempos = [tempo_ms(funcao, content, repeticoes) for funcao in leituras]
+        picos = [pico_mb(funcao, content) for funcao in leituras]
+        print(f"{nome:<18}{len(content) / 1024:>8.0f}KB | "
+              f"{tempos[0]:>9.2f} {tempos[1]:>9.2f} {tempos[2]:>8.2f} | "
+              f"{picos[0]:>9.2f} {picos[1]:>9.2f} {picos[2]:>8.2f} | "
+              f"{'iguais' if mesmos_campos(content) else 'DIFERENTES'}")
@@ -0,0 +1,155 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/remessa_cnab.py
+# DESCRIÇÃO: Geração de uma remessa CNAB 240 grande (cnab.escrever_remessa /
+#   cnab.gerar_remessa).
+#   - Gera N contas sintéticas (crédito em conta, TED e boleto, um lote cada)
+#   - Mede a escrita do arquivo (pagamentos/s) e, gravando em disco, o pico de
+#     memória (tracemalloc)
+#   - Roda gerar_remessa com uma Session falsa que conta os comandos (o
+#     gerar_remessa antigo fazia 3 + um UPDATE por conta)
+#   - Confere o arquivo: todas as linhas com 240 posições e, marcado como
+#     retorno com ocorrência 00, lido de volta por ler_retorno com o
+#     remessa_id/conta_id de cada pagamento
+#   Não precisa de MySQL; os arquivos vão para uma pasta temporária.
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/remessa_cnab.py
+#   python benchmarks/remessa_cnab.py --contas 200000
+# ==============================================================================
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cnab
+from cnab import (escrever_remessa, gerar_remessa, ler_retorno, ResumoArquivo,
+                  FORMA_BOLETO, FORMA_CREDITO_CONTA, FORMA_TED)
+
+NUMERO_REMESSA = 7
+REMESSA_ID = 42
+HOJE = date(2026, 10, 18)
+
+EMPRESA = {
+    "cnpj": "12345678000199", "razao_social": "Empresa Fiscal Ltda", "endereco_logradouro": "Av. Paulista",
+    "endereco_numero": "1000", "endereco_cidade": "São Paulo", "endereco_cep": "01310100", "endereco_uf": "SP"
+}
+LINHA_DIGITAVEL = "23790.12345 60000.000003 00000.000009 1 12340000010000"
+
+
+def gerar_contas(quantidade: int):
+    """Contas na ordem da consulta da remessa (por forma, depois por id)."""
+    for i in range(quantidade):
+        forma = (FORMA_CREDITO_CONTA, FORMA_TED, FORMA_BOLETO)[i * 3 // quantidade]
+        yield {
+            "id": i + 1, "valor_original": Decimal("1234.56") + i,
+            "data_vencimento": HOJE + timedelta(days=i % 400 - 30),
+            "codigo_barras": None, "linha_digitavel": LINHA_DIGITAVEL if forma == FORMA_BOLETO else None,
+            "cnpj_cpf": "99888777000122", "razao_social": "Fornecedor de TI Ação", "endereco_logradouro": "Rua das Flores",
+            "endereco_numero": "123", "endereco_complemento": None, "endereco_bairro": "Centro",
+            "endereco_cidade": "São Paulo", "endereco_cep": "01234567", "endereco_uf": "SP",
+            "banco": cnab.CNAB_BANCO if forma == FORMA_CREDITO_CONTA else "237",
+            "agencia": "1234-5", "conta": "567890-1", "forma": forma
+        }
+
+
+class _Resultado:
+    def __init__(self, linha=None, valor=None, linhas=(), lastrowid=None, rowcount=0):
+        self.linha = linha
+        self.valor = valor
+        self.linhas = linhas
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+    def mappings(self):
+        return self
+
+    def fetchone(self):
+        return self.linha
+
+    def scalar(self):
+        return self.valor
+
+    def __iter__(self):
+        return iter(self.linhas)
+
+    def close(self):
+        pass
+
+
+class SessaoContada:
+    """Session falsa: responde às consultas de gerar_remessa e conta os comandos."""
+
+    def __init__(self, quantidade: int):
+        self.quantidade = quantidade
+        self.comandos = []
+
+    def execute(self, query, params=None):
+        sql = " ".join(str(query).split())
+        self.comandos.append(sql)
+        if "FROM empresas" in sql:
+            return _Resultado(linha=EMPRESA)
+        if sql.startswith("SELECT ultimo_numero"):
+            return _Resultado(valor=NUMERO_REMESSA)
+        if sql.startswith("INSERT INTO remessas_cnab"):
+            return _Resultado(lastrowid=REMESSA_ID)
+        if sql.startswith("SELECT cp.id"):
+            return _Resultado(linhas=gerar_contas(self.quantidade))
+        if sql.startswith("UPDATE contas_pagar"):
+            return _Resultado(rowcount=self.quantidade)
+        return _Resultado(rowcount=1)
+
+
+def como_retorno(texto: str) -> bytes:
+    """A remessa vira um retorno: header com código 2 e ocorrência 00 (pago) em A/J."""
+    linhas = []
+    for linha in texto.split("\r\n"):
+        if linha[7:8] == "0":
+            linha = linha[:142] + "2" + linha[143:]
+        elif linha[7:8] == "3" and linha[13:14] in ("A", "J"):
+            linha = linha[:230] + "00".ljust(10)
+        linhas.append(linha)
+    return "\r\n".join(linhas).encode("latin-1")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Geração de remessa CNAB 240 em streaming.")
+    parser.add_argument("--contas", type=int, default=50000)
+    args = parser.parse_args()
+
+    buffer = io.StringIO()
+    inicio = time.perf_counter()
+    totais = escrever_remessa(buffer, EMPRESA, NUMERO_REMESSA, REMESSA_ID, gerar_contas(args.contas), hoje=HOJE)
+    segundos = time.perf_counter() - inicio
+    print(f"remessa CNAB 240: {totais['quantidade']} pagamentos, {totais['lotes']} lotes, {totais['linhas']} linhas")
+    print(f"  escrever_remessa: {segundos:.2f}s ({args.contas / segundos:,.0f} pagamentos/s)")
+
+    with tempfile.TemporaryDirectory() as pasta:
+        with open(os.path.join(pasta, "remessa.rem"), "w", encoding="ascii", newline="") as arquivo:
+            tracemalloc.start()
+            escrever_remessa(arquivo, EMPRESA, NUMERO_REMESSA, REMESSA_ID, gerar_contas(args.contas), hoje=HOJE)
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        print(f"  pico de memória gravando em disco: {pico / 1024:.0f} KiB")
+
+        sessao = SessaoContada(args.contas)
+        inicio = time.perf_counter()
+        gerar_remessa(sessao, list(range(1, args.contas + 1)), pasta)
+        segundos = time.perf_counter() - inicio
+        print(f"  gerar_remessa: {segundos:.2f}s sem banco, {len(sessao.comandos)} comandos "
+              f"(antes: 3 + 1 UPDATE por conta = {3 + args.contas})")
+
+    texto = buffer.getvalue()
+    assert all(len(linha) == 240 for linha in texto.split("\r\n")[:-1]), "linha fora de 240 posições"
+    resumo = ResumoArquivo()
+    registros = list(ler_retorno(io.BytesIO(como_retorno(texto)), resumo))
+    assert [r.conta_id for r in registros] == list(range(1, args.contas + 1))
+    assert all(r.remessa_id == REMESSA_ID for r in registros)
+    print(f"  lida de volta como retorno: {resumo.pagamentos} pagamentos, {dict(resumo.por_situacao)}")
@@ -0,0 +1,124 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/retorno_cnab.py
+# DESCRIÇÃO: Leitura e gravação de um arquivo de retorno CNAB 240 grande
+#   (cnab.ler_retorno / cnab.gravar_retorno).
+#   - Gera um retorno com N pagamentos (segmentos A e J, cada um com o seu Z,
+#     ocorrências 00/BD/AB alternadas) em um arquivo temporário
+#   - Mede a leitura em streaming (linhas/s) e, em outra passada, o pico de
+#     memória (tracemalloc)
+#   - Roda gravar_retorno com uma Session que só conta os comandos: mostra
+#     quantas idas ao banco o arquivo inteiro custa (INSERT em blocos de
+#     ITENS_POR_COMANDO + os UPDATE ... JOIN). Não precisa de MySQL
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/retorno_cnab.py
+#   python benchmarks/retorno_cnab.py --pagamentos 200000
+# ==============================================================================
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cnab import ler_retorno, gravar_retorno, seu_numero, ResumoArquivo, ITENS_POR_COMANDO
+
+REMESSA_ID = 7
+OCORRENCIAS = ("00", "BD", "AB")
+
+
+def _linha(**campos) -> str:
+    """Linha de 240 posições; campos como p74="..." (posição inicial, base 1)."""
+    linha = [" "] * 240
+    for nome, valor in campos.items():
+        inicio = int(nome[1:]) - 1
+        linha[inicio:inicio + len(valor)] = valor
+    return "".join(linha)
+
+
+def gerar_retorno(caminho: str, pagamentos: int) -> int:
+    """Escreve o retorno e devolve a quantidade de linhas."""
+    linhas = 0
+    with open(caminho, "w", encoding="latin-1", newline="\r\n") as arquivo:
+        def escrever(linha):
+            nonlocal linhas
+            linhas += 1
+            arquivo.write(linha + "\n")
+
+        escrever(_linha(p1="341", p4="0000", p8="0", p143="2"))
+        escrever(_linha(p1="341", p4="0001", p8="1"))
+        for i in range(pagamentos):
+            ocorrencia = OCORRENCIAS[i % 3].ljust(10)
+            referencia = seu_numero(REMESSA_ID, i + 1)
+            if i % 2 == 0:
+                escrever(_linha(p8="3", p14="A", p74=referencia, p135=f"N{i:019d}",
+                                p155="15102026", p163=f"{i * 100 + 123:015d}", p231=ocorrencia))
+            else:
+                escrever(_linha(p8="3", p14="J", p183=referencia, p203=f"N{i:019d}",
+                                p145="15102026", p153=f"{i * 100 + 123:015d}", p231=ocorrencia))
+            escrever(_linha(p8="3", p14="Z"))
+        escrever(_linha(p8="5"))
+        escrever(_linha(p8="9", p24=f"{linhas + 1:06d}"))
+    return linhas
+
+
+class _Resultado:
+    lastrowid = 1
+    rowcount = 0
+
+    def scalar(self):
+        return 0
+
+
+class SessaoContada:
+    """Session falsa: só conta os comandos e as linhas enviadas."""
+
+    def __init__(self):
+        self.comandos = 0
+        self.linhas = 0
+
+    def execute(self, query, params=None):
+        self.comandos += 1
+        self.linhas += len(params) if isinstance(params, list) else 1
+        return _Resultado()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leitura/gravação de retorno CNAB 240 em streaming.")
+    parser.add_argument("--pagamentos", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, "retorno.ret")
+        linhas = gerar_retorno(caminho, args.pagamentos)
+        print(f"retorno CNAB 240: {linhas} linhas, {args.pagamentos} pagamentos, "
+              f"{os.path.getsize(caminho) / (1024 * 1024):.1f} MB")
+
+        resumo = ResumoArquivo()
+        inicio = time.perf_counter()
+        with open(caminho, "rb") as arquivo:
+            for _ in ler_retorno(arquivo, resumo):
+                pass
+        segundos = time.perf_counter() - inicio
+
+        # Memória em uma segunda leitura (o tracemalloc deixa a leitura bem mais lenta)
+        tracemalloc.start()
+        with open(caminho, "rb") as arquivo:
+            for _ in ler_retorno(arquivo, ResumoArquivo()):
+                pass
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  ler_retorno:    {segundos:.2f}s ({resumo.linhas / segundos:,.0f} linhas/s), "
+              f"pico de memória {pico / 1024:.0f} KiB")
+        print(f"                  {dict(resumo.por_situacao)}, {resumo.autenticacoes} autenticações")
+
+        sessao = SessaoContada()
+        inicio = time.perf_counter()
+        with open(caminho, "rb") as arquivo:
+            gravar_retorno(sessao, arquivo, "retorno.ret", REMESSA_ID)
+        segundos = time.perf_counter() - inicio
+        print(f"  gravar_retorno: {segundos:.2f}s sem banco, {sessao.comandos} comandos "
+              f"(itens em blocos de {ITENS_POR_COMANDO}, {sessao.linhas} linhas enviadas)")
@@ -0,0 +1,84 @@
+# ==============================================================================
+# ARQUIVO: benchmarks/senhas_throughput.py
+# DESCRIÇÃO: Logins por segundo (verificação bcrypt) conforme o tamanho do pool
+#   de senhas.py (HASH_WORKERS). Não precisa de banco: mede só o trecho do
+#   login que usa CPU, com N verificações simultâneas.
+#   - "no event loop": pwd_context.verify direto na rota (como antes do pool)
+#   - "pool N": senhas.verificar_senha com N workers
+#   Também mostra o maior atraso do event loop durante a rajada (o tempo que
+#   as outras requisições do worker ficariam paradas).
+#
+# USO (a partir da pasta Aplicacao):
+#   python benchmarks/senhas_throughput.py
+#   python benchmarks/senhas_throughput.py --rounds 12 --logins 64 --workers 1 2 4 8
+# ==============================================================================
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def _no_event_loop(senhas, senha, senha_hash, quantidade):
+    async def login():
+        return senhas.pwd_context.verify(senha, senha_hash)
+    await asyncio.gather(*(login() for _ in range(quantidade)))
+
+
+async def _com_pool(senhas, senha, senha_hash, quantidade):
+    await asyncio.gather(*(senhas.verificar_senha(senha, senha_hash) for _ in range(quantidade)))
+
+
+async def _vigiar_loop(atrasos: list, intervalo: float = 0.005):
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        atrasos.append(time.perf_counter() - inicio - intervalo)
+
+
+async def _rodada(funcao, *args):
+    atrasos = []
+    vigia = asyncio.create_task(_vigiar_loop(atrasos))
+    await asyncio.sleep(0)
+    inicio = time.perf_counter()
+    await funcao(*args)
+    segundos = time.perf_counter() - inicio
+    # Deixa o vigia registrar o último atraso (um loop bloqueado só é visto quando ele volta)
+    await asyncio.sleep(0.02)
+    vigia.cancel()
+    return segundos, max(atrasos, default=0.0)
+
+
+def medir(funcao, *args):
+    """(segundos da rajada, maior atraso do event loop em segundos)"""
+    return asyncio.run(_rodada(funcao, *args))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput de login (bcrypt) por tamanho do pool.")
+    parser.add_argument("--rounds", type=int, default=10, help="Custo do bcrypt (produção: BCRYPT_ROUNDS, padrão 12)")
+    parser.add_argument("--logins", type=int, default=32, help="Verificações simultâneas por medição")
+    parser.add_argument("--workers", type=int, nargs="+", default=None)
+    args = parser.parse_args()
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    import senhas
+
+    senhas.HASH_FILA_MAX = args.logins
+    senha = "senha-de-teste"
+    senha_hash = senhas.pwd_context.hash(senha)
+    nucleos = os.cpu_count() or 1
+    workers = args.workers or sorted({1, 2, 4, nucleos})
+
+    print(f"bcrypt rounds={args.rounds}, {args.logins} logins simultâneos, {nucleos} núcleo(s)")
+    segundos, atraso = medir(_no_event_loop, senhas, senha, senha_hash, args.logins)
+    print(f"  no event loop: {args.logins / segundos:7.1f} logins/s | event loop parado até {atraso * 1000:7.1f} ms")
+    for quantidade in workers:
+        senhas._executor = ThreadPoolExecutor(max_workers=quantidade, thread_name_prefix="bcrypt")
+        segundos, atraso = medir(_com_pool, senhas, senha, senha_hash, args.logins)
+        senhas._executor.shutdown()
+        print(f"  pool {quantidade:2d}:      {args.logins / segundos:7.1f} logins/s | event loop parado até {atraso * 1000:7.1f} ms")
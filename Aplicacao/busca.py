@@ -0,0 +1,159 @@
+# ==============================================================================
+# ARQUIVO: busca.py
+# DESCRIÇÃO: Planejador da pesquisa livre de documentos fiscais.
+#   Cada termo digitado é classificado e recebe o caminho que usa índice:
+#   - Tipo de documento (NF-e, NFS-e...) -> igualdade em tipo_documento
+#   - Chave de acesso completa (44 dígitos) -> igualdade em chave_acesso
+#   - Números -> prefixo em numero_documento/chave_acesso (LIKE 'termo%')
+#   - Valores (1500, 1.500,00, R$ 99,90) -> intervalo em valor_total
+#   - Texto -> FULLTEXT n-gram em razão social do fornecedor e descrição
+#   Um termo que pode bater em mais de um caminho não vira um OR entre colunas
+#   de df e f (o MySQL não usa índice para OR que atravessa o JOIN): cada
+#   caminho é um SELECT de ids que usa um índice só, os SELECTs se juntam com
+#   UNION e o resultado entra como df.id IN (...) (o fornecedor pelo
+#   idx_fornecedor de documentos_fiscais).
+#   Os termos são combinados com AND (todos precisam bater).
+#   Índices criados em Banco_fiscal/migracoes/001_indices_busca.sql
+# ==============================================================================
+
+import re
+from decimal import Decimal, InvalidOperation
+
+TIPOS_DOCUMENTO = {
+    "nf-e": "NF-e", "nfe": "NF-e",
+    "nfs-e": "NFS-e", "nfse": "NFS-e",
+    "ct-e": "CT-e", "cte": "CT-e",
+    "nfc-e": "NFC-e", "nfce": "NFC-e",
+    "boleto": "BOLETO",
+    "contrato": "CONTRATO",
+    "recibo": "RECIBO",
+    "outros": "OUTROS",
+}
+
+# Tamanho mínimo de termo que o índice n-gram consegue achar (ngram_token_size padrão = 2)
+TAMANHO_MINIMO_FULLTEXT = 2
+
+# Quantidade máxima de termos considerados (evita queries gigantes)
+MAXIMO_TERMOS = 6
+
+TAMANHO_CHAVE_ACESSO = 44
+
+_RE_TERMOS = re.compile(r'"([^"]+)"|(\S+)')
+_RE_OPERADORES_FULLTEXT = re.compile(r'[+\-<>()~*"@]')
+_RE_VALOR = re.compile(r'^\d{1,3}(\.\d{3})+(,\d{1,2})?$|^\d+([.,]\d{1,2})?$')
+
+
+def separar_termos(search: str) -> list:
+    """Quebra a pesquisa em termos; trechos entre aspas viram um termo só."""
+    termos = []
+    for entre_aspas, simples in _RE_TERMOS.findall(search or ""):
+        termo = (entre_aspas or simples).strip()
+        if termo:
+            termos.append(termo)
+    return termos[:MAXIMO_TERMOS]
+
+
+def interpretar_valor(termo: str):
+    """
+    Converte '1500', '1.500,00', 'R$99,90' em uma faixa [minimo, maximo).
+    Sem casas decimais a faixa cobre o real inteiro (1500 -> 1500,00 a 1500,99).
+    Retorna None se o termo não for um valor.
+    """
+    texto = termo.strip().lower()
+    if texto.startswith("r$"):
+        texto = texto[2:].strip()
+
+    if not _RE_VALOR.match(texto):
+        return None
+
+    tem_centavos = "," in texto or re.search(r"\.\d{1,2}$", texto) is not None
+    if "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")
+    elif texto.count(".") >= 1 and not tem_centavos:
+        texto = texto.replace(".", "")  # separador de milhar
+
+    try:
+        valor = Decimal(texto)
+    except InvalidOperation:
+        return None
+
+    passo = Decimal("0.01") if tem_centavos else Decimal("1")
+    return valor, valor + passo
+
+
+def _condicao_termo(termo: str, indice: int, params: dict) -> str:
+    chave = f"busca_{indice}"
+
+    # 1. Tipo de documento
+    tipo = TIPOS_DOCUMENTO.get(termo.lower())
+    if tipo:
+        params[chave] = tipo
+        return f"df.tipo_documento = :{chave}"
+
+    # 2. Chave de acesso completa
+    if termo.isdigit() and len(termo) == TAMANHO_CHAVE_ACESSO:
+        params[chave] = termo
+        return f"df.chave_acesso = :{chave}"
+
+    # Cada caminho: SELECT dos ids de documentos_fiscais por um índice só
+    caminhos = []
+
+    # 3. Número do documento / início da chave de acesso (prefixo usa o índice)
+    if re.match(r"^[\w./-]+$", termo):
+        params[f"{chave}_prefixo"] = termo.replace("%", "").replace("_", r"\_") + "%"
+        caminhos.append(f"SELECT id FROM documentos_fiscais WHERE numero_documento LIKE :{chave}_prefixo")
+        if termo.isdigit():
+            caminhos.append(f"SELECT id FROM documentos_fiscais WHERE chave_acesso LIKE :{chave}_prefixo")
+
+    # 4. Valor
+    faixa = interpretar_valor(termo)
+    if faixa:
+        params[f"{chave}_min"], params[f"{chave}_max"] = faixa
+        caminhos.append(
+            f"SELECT id FROM documentos_fiscais WHERE valor_total >= :{chave}_min AND valor_total < :{chave}_max"
+        )
+
+    # 5. Texto livre: fornecedor e descrição
+    if not termo.isdigit() and faixa is None:
+        limpo = " ".join(_RE_OPERADORES_FULLTEXT.sub(" ", termo).split())
+        if len(limpo) >= TAMANHO_MINIMO_FULLTEXT:
+            # Entre aspas o n-gram procura a sequência exata de caracteres
+            params[f"{chave}_texto"] = f'"{limpo}"'
+            fornecedores = f"MATCH(fo.razao_social) AGAINST (:{chave}_texto IN BOOLEAN MODE)"
+            caminhos.append(
+                f"SELECT id FROM documentos_fiscais "
+                f"WHERE MATCH(descricao_servico_produto) AGAINST (:{chave}_texto IN BOOLEAN MODE)"
+            )
+        elif limpo:
+            params[f"{chave}_texto"] = limpo + "%"
+            fornecedores = f"fo.razao_social LIKE :{chave}_texto"
+        else:
+            fornecedores = None
+        if fornecedores:
+            # Fornecedores pelo índice de razao_social, depois os documentos pelo idx_fornecedor
+            caminhos.append(
+                f"SELECT d.id FROM fornecedores fo "
+                f"JOIN documentos_fiscais d ON d.fornecedor_id = fo.id WHERE {fornecedores}"
+            )
+
+    if not caminhos:
+        return None
+    # A tabela derivada é materializada uma vez; o IN sobre um SELECT simples
+    # vira semijoin, e cada id encontrado é lido pela chave primária
+    return f"df.id IN (SELECT id FROM ({' UNION '.join(caminhos)}) {chave})"
+
+
+def planejar_busca(search: str):
+    """
+    Monta as condições SQL da pesquisa livre.
+    Retorna (conditions, params) para serem somados aos demais filtros da listagem.
+    """
+    conditions = []
+    params = {}
+
+    for indice, termo in enumerate(separar_termos(search)):
+        condicao = _condicao_termo(termo, indice, params)
+        if condicao:
+            conditions.append(condicao)
+
+    return conditions, params
@@ -0,0 +1,80 @@
+# ==============================================================================
+# ARQUIVO: cache_memoria.py
+# DESCRIÇÃO: Cache em memória com tempo de validade (TTL).
+#   - Chaves em tupla, ex: ("dashboard", empresa_id)
+#   - Invalidação explícita de uma chave ou de todas com o mesmo prefixo
+#   - Pedidos simultâneos da mesma chave calculam o valor uma vez só
+#   - Limite opcional de itens: passando dele, sai o usado há mais tempo (LRU)
+#   O cache é por processo: com vários workers, cada um tem o seu e o TTL
+#   limita por quanto tempo um worker pode mostrar um valor antigo.
+# ==============================================================================
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class CacheTTL:
+    """Guarda valores por 'ttl' segundos; pensado para uso dentro do event loop."""
+
+    def __init__(self, ttl: float, max_itens: int = None):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        # Ordem de uso: o primeiro é o menos usado recentemente
+        self._valores = OrderedDict()
+        self._calculando = {}
+        # Muda a cada invalidação: um cálculo iniciado antes dela não é guardado
+        self._versao = 0
+
+    def obter(self, chave):
+        item = self._valores.get(chave)
+        if item is None:
+            return None
+        expira_em, valor = item
+        if time.monotonic() >= expira_em:
+            del self._valores[chave]
+            return None
+        self._valores.move_to_end(chave)
+        return valor
+
+    def guardar(self, chave, valor):
+        self._valores[chave] = (time.monotonic() + self.ttl, valor)
+        self._valores.move_to_end(chave)
+        if self.max_itens is not None and len(self._valores) > self.max_itens:
+            self._valores.popitem(last=False)
+
+    def __len__(self):
+        return len(self._valores)
+
+    def invalidar(self, *prefixo):
+        """
+        Remove as chaves que começam com 'prefixo'.
+        invalidar("dashboard") apaga todas; invalidar("dashboard", 3) só a da empresa 3.
+        """
+        self._versao += 1
+        for chave in [c for c in self._valores if c[:len(prefixo)] == prefixo]:
+            del self._valores[chave]
+
+    async def obter_ou_calcular(self, chave, calcular):
+        """
+        Retorna o valor em cache ou executa 'calcular()' (corrotina) e guarda o resultado.
+        Se outro pedido já estiver calculando a mesma chave, espera por ele.
+        """
+        valor = self.obter(chave)
+        if valor is not None:
+            return valor
+
+        tarefa = self._calculando.get(chave)
+        if tarefa is None:
+            versao = self._versao
+            tarefa = asyncio.ensure_future(calcular())
+            self._calculando[chave] = tarefa
+            try:
+                valor = await asyncio.shield(tarefa)
+            finally:
+                self._calculando.pop(chave, None)
+            if versao == self._versao:
+                self.guardar(chave, valor)
+            return valor
+
+        return await asyncio.shield(tarefa)
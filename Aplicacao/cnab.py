@@ -0,0 +1,704 @@
+# ==============================================================================
+# ARQUIVO: cnab.py
+# DESCRIÇÃO: Arquivos CNAB de pagamento a fornecedores.
+#   - Geração do arquivo de remessa CNAB 240 (segmentos A/B e J) em streaming,
+#     direto do resultado de uma única consulta contas + fornecedores
+#   - Numeração das remessas por empresa em sequencias_remessa, dentro da
+#     transação (não repete número em gerações simultâneas)
+#   - Leitura do arquivo de retorno (CNAB 240 FEBRABAN, segmentos A/J/Z, e
+#     CNAB 400) linha a linha, sem carregar o arquivo em memória
+#   - Cada pagamento vira um registro compacto (tupla) e é gravado em lotes
+#     em retornos_cnab_itens
+#   - As contas a pagar são atualizadas com poucos UPDATE ... JOIN sobre os
+#     itens (por remessa + "seu número"), tudo em uma transação
+#   Tabelas criadas em Banco_fiscal/migracoes/005_retornos_cnab_itens.sql
+#   e 006_sequencias_remessa.sql
+# ==============================================================================
+
+import os
+import unicodedata
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal
+from typing import NamedTuple, Optional
+from sqlalchemy import text, bindparam
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LAYOUT_240 = 240
+LAYOUT_400 = 400
+
+# Situação de cada pagamento no retorno
+SITUACAO_PAGO = "PAGO"
+SITUACAO_AGENDADO = "AGENDADO"
+SITUACAO_REJEITADO = "REJEITADO"
+
+# CNAB 240 (pagamentos): até 5 ocorrências de 2 posições por registro
+OCORRENCIAS_240_PAGO = {"00"}        # Crédito ou débito efetivado
+OCORRENCIAS_240_AGENDADO = {"BD", "BE"} # Inclusão/alteração efetuada (pagamento agendado)
+# Qualquer outra ocorrência é rejeição/exclusão: a conta volta a PENDENTE, fora da remessa
+
+# CNAB 400: uma ocorrência por registro; as não listadas são só informativas
+OCORRENCIAS_400 = {
+    "02": SITUACAO_AGENDADO,  # Entrada confirmada
+    "03": SITUACAO_REJEITADO, # Entrada rejeitada
+    "06": SITUACAO_PAGO,      # Liquidação normal
+    "15": SITUACAO_PAGO,      # Liquidação em cartório
+    "17": SITUACAO_PAGO,      # Liquidação após baixa
+}
+
+# "Seu número" (referência da empresa no pagamento): id da remessa (8) + id da conta (12)
+SEU_NUMERO_TAMANHO = 20
+
+# Linhas gravadas por executemany em retornos_cnab_itens
+ITENS_POR_COMANDO = 1000
+
+# Conta da empresa que paga (header do arquivo e dos lotes da remessa)
+CNAB_BANCO = os.getenv("CNAB_BANCO", "001")
+CNAB_AGENCIA = os.getenv("CNAB_AGENCIA", "")
+CNAB_CONTA = os.getenv("CNAB_CONTA", "")
+CNAB_CONVENIO = os.getenv("CNAB_CONVENIO", "")
+
+# Subpasta (dentro de uploads/) dos arquivos de remessa gerados
+PASTA_REMESSAS = "remessas"
+
+# Forma de lançamento de cada lote da remessa (um lote por forma)
+FORMA_CREDITO_CONTA = "01" # Favorecido no mesmo banco da empresa
+FORMA_TED = "41"           # TED para outro banco
+FORMA_BOLETO = "31"        # Pagamento de títulos (segmento J)
+
+
+class ErroCNAB(Exception):
+    """Arquivo de retorno inválido (erro do usuário, HTTP 400)."""
+    pass
+
+
+class RegistroPagamento(NamedTuple):
+    """Um pagamento do arquivo de retorno (segmento A/J do 240 ou detalhe do 400)."""
+    linha: int
+    segmento: str
+    remessa_id: Optional[int]
+    conta_id: Optional[int]
+    nosso_numero: str
+    ocorrencias: str
+    situacao: Optional[str]
+    valor_pago: Decimal
+    data_pagamento: Optional[date]
+
+
+class ResumoArquivo:
+    """Contadores preenchidos durante a leitura (memória constante)."""
+    __slots__ = ("layout", "linhas", "lotes", "pagamentos", "por_situacao", "sem_referencia", "autenticacoes")
+
+    def __init__(self):
+        self.layout = None
+        self.linhas = 0
+        self.lotes = 0
+        self.pagamentos = 0
+        self.por_situacao = Counter()
+        self.sem_referencia = 0
+        self.autenticacoes = 0
+
+
+def seu_numero(remessa_id: int, conta_id: int) -> str:
+    """Referência gravada pela empresa no pagamento e devolvida pelo banco no retorno."""
+    return f"{remessa_id:08d}{conta_id:012d}"
+
+
+def ler_seu_numero(campo: str):
+    """(remessa_id, conta_id) do "seu número", ou (None, None) se não for desta aplicação."""
+    campo = campo.strip()
+    if len(campo) != SEU_NUMERO_TAMANHO or not campo.isdigit():
+        return None, None
+    return int(campo[:8]), int(campo[8:])
+
+
+def _valor(campo: str) -> Decimal:
+    # Valores numéricos com 2 casas decimais implícitas
+    campo = campo.strip()
+    return Decimal(int(campo)).scaleb(-2) if campo.isdigit() else Decimal("0.00")
+
+
+def _data(campo: str) -> Optional[date]:
+    # DDMMAAAA (240) ou DDMMAA (400); zeros ou brancos = sem data
+    campo = campo.strip()
+    if not campo.isdigit() or not int(campo):
+        return None
+    try:
+        if len(campo) == 8:
+            return date(int(campo[4:8]), int(campo[2:4]), int(campo[0:2]))
+        return date(2000 + int(campo[4:6]), int(campo[2:4]), int(campo[0:2]))
+    except ValueError:
+        return None
+
+
+def _situacao_240(ocorrencias: str) -> str:
+    codigos = {ocorrencias[i:i + 2] for i in range(0, len(ocorrencias.rstrip()), 2)}
+    if codigos & OCORRENCIAS_240_PAGO:
+        return SITUACAO_PAGO
+    if codigos & OCORRENCIAS_240_AGENDADO:
+        return SITUACAO_AGENDADO
+    return SITUACAO_REJEITADO
+
+
+# Posições abaixo são as do layout (1 a N); no Python: linha[inicio - 1:fim]
+
+def _registro_240(numero: int, linha: str, resumo: ResumoArquivo):
+    tipo = linha[7]
+    if tipo == "1":
+        resumo.lotes += 1
+        return None
+    if tipo != "3":
+        return None
+
+    segmento = linha[13]
+    if segmento == "A":
+        seu, nosso = linha[73:93], linha[134:154]
+        data_pagamento = _data(linha[154:162]) or _data(linha[93:101])
+        valor = _valor(linha[162:177]) or _valor(linha[119:134])
+    elif segmento == "J":
+        seu, nosso = linha[182:202], linha[202:222]
+        data_pagamento = _data(linha[144:152])
+        valor = _valor(linha[152:167])
+    else:
+        # Z (autenticação) e outros segmentos complementares não mudam a situação
+        if segmento == "Z":
+            resumo.autenticacoes += 1
+        return None
+
+    ocorrencias = linha[230:240]
+    remessa_id, conta_id = ler_seu_numero(seu)
+    return RegistroPagamento(
+        numero, segmento, remessa_id, conta_id, nosso.strip(), ocorrencias.strip(),
+        _situacao_240(ocorrencias), valor, data_pagamento
+    )
+
+
+def _registro_400(numero: int, linha: str, resumo: ResumoArquivo):
+    if linha[0] != "1":
+        return None
+    ocorrencia = linha[108:110]
+    remessa_id, conta_id = ler_seu_numero(linha[37:62])
+    return RegistroPagamento(
+        numero, "1", remessa_id, conta_id, linha[70:82].strip(), ocorrencia,
+        OCORRENCIAS_400.get(ocorrencia), _valor(linha[253:266]),
+        _data(linha[295:301]) or _data(linha[110:116])
+    )
+
+
+def _validar_header(linha: str, layout: int):
+    if layout == LAYOUT_240:
+        if linha[7] != "0":
+            raise ErroCNAB("A primeira linha não é o header do arquivo (registro tipo 0)")
+        if linha[142] != "2":
+            raise ErroCNAB("O arquivo é uma remessa, não um retorno (código 1 no header)")
+    elif linha[0:2] != "02":
+        raise ErroCNAB("A primeira linha não é o header de um arquivo de retorno CNAB 400")
+
+
+def ler_retorno(arquivo, resumo: ResumoArquivo):
+    """
+    Lê o arquivo de retorno (binário, aberto) linha a linha e gera um
+    RegistroPagamento por pagamento. Detecta o layout pelo tamanho da 1ª linha,
+    confere o header e a quantidade de linhas do trailer. 'resumo' é preenchido
+    durante a leitura. Lança ErroCNAB se o arquivo estiver fora do layout.
+    """
+    trailer = None
+    for numero, linha_bytes in enumerate(arquivo, start=1):
+        linha = linha_bytes.decode("latin-1").rstrip("\r\n")
+        if not linha.strip():
+            continue
+
+        if resumo.layout is None:
+            if len(linha) not in (LAYOUT_240, LAYOUT_400):
+                raise ErroCNAB(f"Linha 1 tem {len(linha)} posições; esperado CNAB 240 ou 400")
+            resumo.layout = len(linha)
+            _validar_header(linha, resumo.layout)
+        elif len(linha) != resumo.layout:
+            raise ErroCNAB(f"Linha {numero} tem {len(linha)} posições; esperado {resumo.layout}")
+
+        resumo.linhas += 1
+        if trailer is not None:
+            raise ErroCNAB(f"Linha {numero} depois do trailer do arquivo")
+
+        if resumo.layout == LAYOUT_240:
+            if linha[7] == "9":
+                trailer = linha
+                continue
+            registro = _registro_240(numero, linha, resumo)
+        else:
+            if linha[0] == "9":
+                trailer = linha
+                continue
+            registro = _registro_400(numero, linha, resumo)
+
+        if registro is None:
+            continue
+        resumo.pagamentos += 1
+        if registro.conta_id is None:
+            resumo.sem_referencia += 1
+        if registro.situacao:
+            resumo.por_situacao[registro.situacao] += 1
+        yield registro
+
+    if resumo.layout is None:
+        raise ErroCNAB("Arquivo de retorno vazio")
+    if trailer is None:
+        raise ErroCNAB("Arquivo incompleto: trailer do arquivo (registro 9) não encontrado")
+    if resumo.layout == LAYOUT_240:
+        # Quantidade de registros do arquivo (posições 24-29), incluindo header e trailer
+        informado = trailer[23:29]
+        if informado.isdigit() and int(informado) != resumo.linhas:
+            raise ErroCNAB(f"Trailer informa {int(informado)} registros, mas o arquivo tem {resumo.linhas}")
+
+
+def primeira_remessa(arquivo):
+    """
+    Id da remessa do primeiro pagamento desta aplicação no arquivo (ou None se
+    não houver). Lê só até achá-lo e volta ao início do arquivo.
+    """
+    try:
+        for registro in ler_retorno(arquivo, ResumoArquivo()):
+            if registro.remessa_id is not None:
+                return registro.remessa_id
+    finally:
+        arquivo.seek(0)
+    return None
+
+
+# ------------------------------------------------------------------------------
+# Gravação: itens em lote + atualização das contas por conjunto (UPDATE ... JOIN)
+# ------------------------------------------------------------------------------
+
+_INSERT_ITEM = text("""
+    INSERT INTO retornos_cnab_itens
+    (retorno_id, linha, segmento, remessa_id, conta_id, nosso_numero, ocorrencias, situacao, valor_pago, data_pagamento)
+    VALUES (:retorno_id, :linha, :segmento, :remessa_id, :conta_id, :nosso_numero, :ocorrencias, :situacao, :valor_pago, :data_pagamento)
+""")
+
+# Último registro de cada conta no arquivo (um pagamento pode vir agendado e depois pago)
+_ULTIMOS_ITENS = """
+    SELECT i.* FROM retornos_cnab_itens i
+    JOIN (
+        SELECT conta_id, MAX(linha) AS linha
+        FROM retornos_cnab_itens
+        WHERE retorno_id = :retorno_id AND conta_id IS NOT NULL AND situacao IS NOT NULL
+        GROUP BY conta_id
+    ) u ON u.conta_id = i.conta_id AND u.linha = i.linha
+    WHERE i.retorno_id = :retorno_id
+"""
+
+_UPDATE_CONTAS = text(f"""
+    UPDATE contas_pagar cp
+    JOIN ({_ULTIMOS_ITENS}) i ON i.conta_id = cp.id AND i.remessa_id = cp.remessa_id
+    SET cp.valor_pago = IF(i.situacao = 'PAGO', i.valor_pago, cp.valor_pago),
+        cp.data_pagamento = IF(i.situacao = 'PAGO', COALESCE(i.data_pagamento, NOW()), cp.data_pagamento),
+        cp.numero_documento_banco = COALESCE(NULLIF(i.nosso_numero, ''), cp.numero_documento_banco),
+        cp.status = CASE i.situacao WHEN 'PAGO' THEN 'PAGO' WHEN 'AGENDADO' THEN 'AGENDADO' ELSE 'PENDENTE' END,
+        -- Rejeitada: sai da remessa para poder entrar em uma nova
+        cp.remessa_id = IF(i.situacao = 'REJEITADO', NULL, cp.remessa_id)
+    WHERE cp.status = 'AGENDADO' AND cp.empresa_id = :empresa_id
+""")
+
+_UPDATE_PROVISIONAMENTOS = text(f"""
+    UPDATE provisionamentos p
+    JOIN contas_pagar cp ON cp.provisionamento_id = p.id
+    JOIN ({_ULTIMOS_ITENS}) i ON i.conta_id = cp.id AND i.remessa_id = cp.remessa_id
+    SET p.status = 'PAGO'
+    WHERE i.situacao = 'PAGO' AND cp.status = 'PAGO' AND p.status <> 'PAGO' AND cp.empresa_id = :empresa_id
+""")
+
+# Pagamentos do arquivo sem conta correspondente (outra remessa ou empresa, já baixados ou de outro sistema)
+_SQL_SEM_CONTA = text(f"""
+    SELECT COUNT(*) FROM ({_ULTIMOS_ITENS}) i
+    LEFT JOIN contas_pagar cp ON cp.id = i.conta_id AND cp.remessa_id = i.remessa_id AND cp.empresa_id = :empresa_id
+    WHERE cp.id IS NULL
+""")
+
+# Remessa processada quando nenhuma conta dela continua aguardando retorno
+_UPDATE_REMESSAS = text("""
+    UPDATE remessas_cnab r
+    SET r.status_remessa = 'PROCESSADA'
+    WHERE r.empresa_id = :empresa_id
+      AND r.id IN (SELECT DISTINCT remessa_id FROM retornos_cnab_itens WHERE retorno_id = :retorno_id AND remessa_id IS NOT NULL)
+      AND NOT EXISTS (SELECT 1 FROM contas_pagar cp WHERE cp.remessa_id = r.id AND cp.status = 'AGENDADO')
+""")
+
+
+def gravar_retorno(sessao, arquivo, nome_arquivo: str, remessa_id: int, empresa_id: int = 1, usuario_id: int = 1) -> dict:
+    """
+    Processa o arquivo de retorno em uma transação (executar via db.run_sync):
+    1. cria o registro em retornos_cnab;
+    2. lê o arquivo em streaming e grava os pagamentos em retornos_cnab_itens
+       (executemany de ITENS_POR_COMANDO linhas: memória constante);
+    3. atualiza contas, provisionamentos e remessas com UPDATE ... JOIN nos itens.
+    Só contas e remessas de 'empresa_id' são alteradas: o "seu número" de um
+    pagamento de outra empresa conta como sem conta.
+    Não faz COMMIT. Retorna os contadores do processamento.
+    """
+    retorno_id = sessao.execute(text("""
+        INSERT INTO retornos_cnab
+        (remessa_id, nome_arquivo_retorno, caminho_arquivo, processado, data_processamento, usuario_processamento_id, quantidade_registros)
+        VALUES (:remessa_id, :nome, :caminho, FALSE, NULL, :usuario_id, 0)
+    """), {
+        "remessa_id": remessa_id,
+        "nome": nome_arquivo,
+        "caminho": f"/uploads/retornos/{nome_arquivo}",
+        "usuario_id": usuario_id
+    }).lastrowid
+
+    resumo = ResumoArquivo()
+    bloco = []
+    for registro in ler_retorno(arquivo, resumo):
+        bloco.append({"retorno_id": retorno_id, **registro._asdict()})
+        if len(bloco) >= ITENS_POR_COMANDO:
+            sessao.execute(_INSERT_ITEM, bloco)
+            bloco = []
+    if bloco:
+        sessao.execute(_INSERT_ITEM, bloco)
+
+    parametros = {"retorno_id": retorno_id, "empresa_id": empresa_id}
+    sem_conta = sessao.execute(_SQL_SEM_CONTA, parametros).scalar()
+    contas_atualizadas = sessao.execute(_UPDATE_CONTAS, parametros).rowcount
+    sessao.execute(_UPDATE_PROVISIONAMENTOS, parametros)
+    remessas_processadas = sessao.execute(_UPDATE_REMESSAS, parametros).rowcount
+
+    sessao.execute(text("""
+        UPDATE retornos_cnab
+        SET processado = TRUE, data_processamento = NOW(), quantidade_registros = :quantidade
+        WHERE id = :retorno_id
+    """), {"retorno_id": retorno_id, "quantidade": resumo.pagamentos})
+
+    return {
+        "retorno_id": retorno_id,
+        "layout": resumo.layout,
+        "linhas": resumo.linhas,
+        "lotes": resumo.lotes,
+        "pagamentos": resumo.pagamentos,
+        "por_situacao": dict(resumo.por_situacao),
+        "autenticacoes": resumo.autenticacoes,
+        "sem_referencia": resumo.sem_referencia,
+        "sem_conta": int(sem_conta or 0),
+        "contas_atualizadas": contas_atualizadas,
+        "remessas_processadas": remessas_processadas
+    }
+
+
+# ------------------------------------------------------------------------------
+# Remessa: numeração por empresa + arquivo CNAB 240 gerado em streaming
+# ------------------------------------------------------------------------------
+
+def proximo_numero_remessa(sessao, empresa_id: int) -> int:
+    """
+    Reserva o próximo numero_remessa da empresa na transação atual. A linha de
+    sequencias_remessa fica travada até o COMMIT/ROLLBACK: gerações simultâneas
+    da mesma empresa esperam, e um ROLLBACK devolve o número.
+    """
+    sessao.execute(text("""
+        INSERT INTO sequencias_remessa (empresa_id, ultimo_numero) VALUES (:empresa_id, 1)
+        ON DUPLICATE KEY UPDATE ultimo_numero = ultimo_numero + 1
+    """), {"empresa_id": empresa_id})
+    return sessao.execute(
+        text("SELECT ultimo_numero FROM sequencias_remessa WHERE empresa_id = :empresa_id"),
+        {"empresa_id": empresa_id}
+    ).scalar()
+
+
+def _alfa(valor, tamanho: int) -> str:
+    # Campo alfanumérico: maiúsculo, sem acentos, alinhado à esquerda com brancos
+    texto = unicodedata.normalize("NFKD", str(valor or "")).encode("ascii", "ignore").decode("ascii")
+    return texto.upper()[:tamanho].ljust(tamanho)
+
+
+def _num(valor, tamanho: int) -> str:
+    # Campo numérico: só dígitos, alinhado à direita com zeros
+    digitos = "".join(c for c in str(valor or "") if c.isdigit())
+    return digitos[-tamanho:].rjust(tamanho, "0")
+
+
+def _dinheiro(valor, tamanho: int) -> str:
+    # Valor com 2 casas decimais implícitas
+    return f"{int((Decimal(valor or 0) * 100).to_integral_value()):0{tamanho}d}"
+
+
+def _ddmmaaaa(dia: date) -> str:
+    return dia.strftime("%d%m%Y")
+
+
+def _conta_dv(conta) -> tuple:
+    """('12345', '6') de '12345-6'; sem hífen, a conta fica sem dígito."""
+    numero, _, dv = str(conta or "").partition("-")
+    return numero, dv
+
+
+def _codigo_barras(codigo: str, linha_digitavel: str) -> str:
+    """Código de barras (44 dígitos) do boleto, montado da linha digitável se preciso."""
+    codigo = "".join(c for c in codigo or "" if c.isdigit())
+    if len(codigo) == 44:
+        return codigo
+    linha = "".join(c for c in linha_digitavel or codigo if c.isdigit())
+    if len(linha) == 47:
+        # Banco+moeda, DV geral, fator+valor e os três campos livres sem seus DVs
+        return linha[0:4] + linha[32] + linha[33:47] + linha[4:9] + linha[10:20] + linha[21:31]
+    return None
+
+
+def _registro(*campos) -> str:
+    linha = "".join(campos)
+    if len(linha) != LAYOUT_240:
+        raise ValueError(f"Registro CNAB com {len(linha)} posições")
+    return linha + "\r\n"
+
+
+def _inscricao(documento: str) -> str:
+    # Tipo de inscrição: 1 = CPF, 2 = CNPJ
+    return "1" if len("".join(c for c in documento or "" if c.isdigit())) == 11 else "2"
+
+
+def _conta_empresa(empresa) -> str:
+    # Posições 18-72 do header do arquivo e do lote: inscrição, convênio, agência e conta da empresa
+    agencia, dv_agencia = _conta_dv(CNAB_AGENCIA)
+    conta, dv_conta = _conta_dv(CNAB_CONTA)
+    return (
+        _inscricao(empresa["cnpj"]) + _num(empresa["cnpj"], 14) + _alfa(CNAB_CONVENIO, 20)
+        + _num(agencia, 5) + _alfa(dv_agencia, 1) + _num(conta, 12) + _alfa(dv_conta, 1) + " "
+    )
+
+
+class _Lote:
+    """Contadores do lote aberto (o trailer do lote precisa deles)."""
+    __slots__ = ("numero", "forma", "registros", "valor")
+
+    def __init__(self, numero: int, forma: str):
+        self.numero = numero
+        self.forma = forma
+        self.registros = 1 # header do lote
+        self.valor = Decimal("0")
+
+
+def _header_arquivo(empresa, numero_remessa: int, gerado_em: datetime) -> str:
+    return _registro(
+        _num(CNAB_BANCO, 3), "0000", "0", " " * 9, _conta_empresa(empresa),
+        _alfa(empresa["razao_social"], 30), _alfa("", 30), " " * 10,
+        "1", # 1 = remessa (o retorno vem com 2)
+        _ddmmaaaa(gerado_em), gerado_em.strftime("%H%M%S"), _num(numero_remessa, 6),
+        "089", "01600", " " * 20, " " * 20, " " * 29
+    )
+
+
+def _header_lote(empresa, lote: _Lote) -> str:
+    return _registro(
+        _num(CNAB_BANCO, 3), _num(lote.numero, 4), "1", "C", "20", lote.forma, "045", " ",
+        _conta_empresa(empresa), _alfa(empresa["razao_social"], 30), " " * 40,
+        _alfa(empresa["endereco_logradouro"], 30), _num(empresa["endereco_numero"], 5), _alfa("", 15),
+        _alfa(empresa["endereco_cidade"], 20), _num(empresa["endereco_cep"], 8), _alfa(empresa["endereco_uf"], 2),
+        "01", " " * 6, " " * 10
+    )
+
+
+def _trailer_lote(lote: _Lote) -> str:
+    lote.registros += 1
+    return _registro(
+        _num(CNAB_BANCO, 3), _num(lote.numero, 4), "5", " " * 9, _num(lote.registros, 6),
+        _dinheiro(lote.valor, 18), "0" * 18, "0" * 6, " " * 165, " " * 10
+    )
+
+
+def _segmentos_credito(lote: _Lote, conta, referencia: str, pagamento: date) -> str:
+    # Segmento A (crédito/TED) + segmento B (inscrição e endereço do favorecido)
+    agencia, dv_agencia = _conta_dv(conta["agencia"])
+    numero_conta, dv_conta = _conta_dv(conta["conta"])
+    camara = "000" if lote.forma == FORMA_CREDITO_CONTA else "018"
+    segmento_a = _registro(
+        _num(CNAB_BANCO, 3), _num(lote.numero, 4), "3", _num(lote.registros, 5), "A", "0", "00",
+        camara, _num(conta["banco"], 3), _num(agencia, 5), _alfa(dv_agencia, 1), _num(numero_conta, 12),
+        _alfa(dv_conta, 1), " ", _alfa(conta["razao_social"], 30), referencia, _ddmmaaaa(pagamento),
+        "BRL", "0" * 15, _dinheiro(conta["valor_original"], 15), " " * 20, "0" * 8, "0" * 15,
+        " " * 40, "  ", "     ", "  ", "   ", "0", " " * 10
+    )
+    segmento_b = _registro(
+        _num(CNAB_BANCO, 3), _num(lote.numero, 4), "3", _num(lote.registros + 1, 5), "B", "   ",
+        _inscricao(conta["cnpj_cpf"]), _num(conta["cnpj_cpf"], 14), _alfa(conta["endereco_logradouro"], 30),
+        _num(conta["endereco_numero"], 5), _alfa(conta["endereco_complemento"], 15),
+        _alfa(conta["endereco_bairro"], 15), _alfa(conta["endereco_cidade"], 20),
+        _num(conta["endereco_cep"], 8), _alfa(conta["endereco_uf"], 2), " " * 113
+    )
+    lote.registros += 2
+    return segmento_a + segmento_b
+
+
+def _segmento_boleto(lote: _Lote, conta, referencia: str, pagamento: date) -> str:
+    codigo = _codigo_barras(conta["codigo_barras"], conta["linha_digitavel"])
+    if codigo is None:
+        raise ErroCNAB(f"Conta {conta['id']}: código de barras do boleto inválido")
+    segmento_j = _registro(
+        _num(CNAB_BANCO, 3), _num(lote.numero, 4), "3", _num(lote.registros, 5), "J", "0", "00",
+        codigo, _alfa(conta["razao_social"], 30), _ddmmaaaa(conta["data_vencimento"]),
+        _dinheiro(conta["valor_original"], 15), "0" * 15, "0" * 15, _ddmmaaaa(pagamento),
+        _dinheiro(conta["valor_original"], 15), "0" * 15, referencia, " " * 20, "09", " " * 6, " " * 10
+    )
+    lote.registros += 1
+    return segmento_j
+
+
+def escrever_remessa(arquivo, empresa, numero_remessa: int, remessa_id: int, contas, hoje: date = None) -> dict:
+    """
+    Escreve o arquivo de remessa CNAB 240 (texto, aberto) a partir das contas,
+    uma por vez: nada além do lote aberto fica em memória. As contas devem vir
+    ordenadas por 'forma' (um lote por forma de lançamento). O "seu número" de
+    cada pagamento é seu_numero(remessa_id, conta_id), lido de volta no retorno.
+    Retorna quantidade de pagamentos, valor total e quantidade de lotes.
+    """
+    gerado_em = datetime.now()
+    hoje = hoje or gerado_em.date()
+    arquivo.write(_header_arquivo(empresa, numero_remessa, gerado_em))
+    linhas = 1
+    lotes = 0
+    quantidade = 0
+    valor_total = Decimal("0")
+    lote = None
+
+    for conta in contas:
+        if lote is None or conta["forma"] != lote.forma:
+            if lote is not None:
+                arquivo.write(_trailer_lote(lote))
+                linhas += lote.registros
+            lotes += 1
+            lote = _Lote(lotes, conta["forma"])
+            arquivo.write(_header_lote(empresa, lote))
+
+        # Conta vencida é paga na data da remessa
+        pagamento = max(conta["data_vencimento"], hoje)
+        referencia = seu_numero(remessa_id, conta["id"])
+        if lote.forma == FORMA_BOLETO:
+            arquivo.write(_segmento_boleto(lote, conta, referencia, pagamento))
+        else:
+            if not conta["banco"] or not conta["conta"]:
+                raise ErroCNAB(f"Conta {conta['id']}: fornecedor sem dados bancários nem boleto")
+            arquivo.write(_segmentos_credito(lote, conta, referencia, pagamento))
+
+        lote.valor += conta["valor_original"]
+        quantidade += 1
+        valor_total += conta["valor_original"]
+
+    if lote is not None:
+        arquivo.write(_trailer_lote(lote))
+        linhas += lote.registros
+    linhas += 1
+    arquivo.write(_registro(
+        _num(CNAB_BANCO, 3), "9999", "9", " " * 9, _num(lotes, 6), _num(linhas, 6), "0" * 6, " " * 205
+    ))
+    return {"quantidade": quantidade, "valor_total": valor_total, "lotes": lotes, "linhas": linhas}
+
+
+# Dados bancários da conta (têm prioridade) ou do fornecedor
+_DADOS_BANCARIOS = "COALESCE(cp.dados_bancarios, f.dados_bancarios)"
+
+# Contas da remessa com os dados do favorecido, já na ordem dos lotes.
+# FOR UPDATE OF cp: a mesma conta não entra em duas remessas geradas ao mesmo tempo.
+_SQL_CONTAS_REMESSA = text(f"""
+    SELECT cp.id, cp.valor_original, cp.data_vencimento, cp.codigo_barras, cp.linha_digitavel,
+           f.cnpj_cpf, f.razao_social, f.endereco_logradouro, f.endereco_numero, f.endereco_complemento,
+           f.endereco_bairro, f.endereco_cidade, f.endereco_cep, f.endereco_uf,
+           JSON_UNQUOTE(JSON_EXTRACT({_DADOS_BANCARIOS}, '$.banco')) AS banco,
+           JSON_UNQUOTE(JSON_EXTRACT({_DADOS_BANCARIOS}, '$.agencia')) AS agencia,
+           JSON_UNQUOTE(JSON_EXTRACT({_DADOS_BANCARIOS}, '$.conta')) AS conta,
+           CASE
+               WHEN CONCAT(COALESCE(cp.codigo_barras, ''), COALESCE(cp.linha_digitavel, '')) <> '' THEN :forma_boleto
+               WHEN JSON_UNQUOTE(JSON_EXTRACT({_DADOS_BANCARIOS}, '$.banco')) = :banco THEN :forma_credito
+               ELSE :forma_ted
+           END AS forma
+    FROM contas_pagar cp
+    JOIN fornecedores f ON f.id = cp.fornecedor_id
+    WHERE cp.id IN :conta_ids AND cp.empresa_id = :empresa_id AND cp.status = 'PENDENTE'
+    ORDER BY forma, cp.id
+    FOR UPDATE OF cp
+""").bindparams(bindparam("conta_ids", expanding=True))
+
+# As mesmas contas travadas pela consulta acima, em um único UPDATE
+_UPDATE_CONTAS_REMESSA = text("""
+    UPDATE contas_pagar
+    SET remessa_id = :remessa_id, status = 'AGENDADO'
+    WHERE id IN :conta_ids AND empresa_id = :empresa_id AND status = 'PENDENTE'
+""").bindparams(bindparam("conta_ids", expanding=True))
+
+
+def gerar_remessa(sessao, conta_ids: list, upload_dir: str, empresa_id: int = 1, usuario_id: int = 1) -> dict:
+    """
+    Gera a remessa na transação atual (executar via db.run_sync):
+    1. reserva o número em sequencias_remessa e cria a linha em remessas_cnab;
+    2. lê as contas (uma consulta com os dados do fornecedor) e escreve o arquivo
+       em uploads/remessas/<empresa>/ enquanto as linhas chegam;
+    3. agenda as contas com um único UPDATE ... WHERE id IN (...).
+    Não faz COMMIT. Se a transação não for confirmada, o número volta para a
+    sequência e o arquivo é sobrescrito pela próxima remessa com esse número.
+    Lança ErroCNAB se nenhuma conta puder entrar na remessa.
+    """
+    conta_ids = sorted(set(conta_ids))
+    if not conta_ids:
+        raise ErroCNAB("Nenhuma conta válida selecionada")
+
+    empresa = sessao.execute(text("""
+        SELECT cnpj, razao_social, endereco_logradouro, endereco_numero, endereco_cidade, endereco_cep, endereco_uf
+        FROM empresas WHERE id = :empresa_id
+    """), {"empresa_id": empresa_id}).mappings().fetchone()
+    if empresa is None:
+        raise ErroCNAB(f"Empresa {empresa_id} não encontrada")
+
+    numero_remessa = proximo_numero_remessa(sessao, empresa_id)
+    nome_arquivo = f"remessa_{numero_remessa:06d}.rem"
+    remessa_id = sessao.execute(text("""
+        INSERT INTO remessas_cnab
+        (empresa_id, nome_arquivo, caminho_arquivo, numero_remessa, quantidade_registros, valor_total, usuario_geracao_id)
+        VALUES (:empresa_id, :nome, :caminho, :numero, 0, 0, :usuario_id)
+    """), {
+        "empresa_id": empresa_id,
+        "nome": nome_arquivo,
+        "caminho": f"/uploads/{PASTA_REMESSAS}/{empresa_id}/{nome_arquivo}",
+        "numero": numero_remessa,
+        "usuario_id": usuario_id
+    }).lastrowid
+
+    pasta = os.path.join(upload_dir, PASTA_REMESSAS, str(empresa_id))
+    os.makedirs(pasta, exist_ok=True)
+    caminho_final = os.path.join(pasta, nome_arquivo)
+    caminho_temp = caminho_final + ".parcial"
+    try:
+        # stream_results: as linhas chegam do MySQL aos poucos (cursor sem buffer)
+        contas = sessao.execute(_SQL_CONTAS_REMESSA.execution_options(stream_results=True), {
+            "conta_ids": conta_ids,
+            "empresa_id": empresa_id,
+            "banco": CNAB_BANCO,
+            "forma_boleto": FORMA_BOLETO,
+            "forma_credito": FORMA_CREDITO_CONTA,
+            "forma_ted": FORMA_TED
+        }).mappings()
+        try:
+            with open(caminho_temp, "w", encoding="ascii", newline="") as arquivo:
+                totais = escrever_remessa(arquivo, empresa, numero_remessa, remessa_id, contas)
+        finally:
+            contas.close() # Descarta o resto do cursor se a escrita parou no meio
+        if not totais["quantidade"]:
+            raise ErroCNAB("Nenhuma conta válida selecionada")
+
+        agendadas = sessao.execute(_UPDATE_CONTAS_REMESSA, {
+            "remessa_id": remessa_id, "conta_ids": conta_ids, "empresa_id": empresa_id
+        }).rowcount
+        if agendadas != totais["quantidade"]:
+            raise RuntimeError(f"{agendadas} conta(s) agendada(s), mas o arquivo tem {totais['quantidade']}")
+
+        sessao.execute(text("""
+            UPDATE remessas_cnab SET quantidade_registros = :quantidade, valor_total = :valor WHERE id = :remessa_id
+        """), {"quantidade": totais["quantidade"], "valor": totais["valor_total"], "remessa_id": remessa_id})
+        os.replace(caminho_temp, caminho_final)
+    finally:
+        if os.path.exists(caminho_temp):
+            os.remove(caminho_temp)
+
+    return {
+        "remessa_id": remessa_id,
+        "numero_remessa": numero_remessa,
+        "nome_arquivo": nome_arquivo,
+        **totais
+    }
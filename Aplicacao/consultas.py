@@ -0,0 +1,342 @@
+# ==============================================================================
+# ARQUIVO: consultas.py
+# DESCRIÇÃO: Consultas das listagens (documentos, provisionamentos, remessas)
+#   montadas com SQLAlchemy Core em vez de concatenar strings SQL.
+#   - Cada combinação de filtros presentes ("forma" da consulta) gera o
+#     select() uma única vez (lru_cache); os valores entram só como parâmetros
+#   - Como a consulta é sempre o mesmo objeto para a mesma forma, o SQLAlchemy
+#     acha o SQL já compilado no cache do engine (query_cache_size) e o MySQL
+#     recebe sempre o mesmo texto para a mesma forma
+#   - Prepared statements no servidor: o PyMySQL não tem suporte (envia o SQL
+#     já com os valores); o ganho aqui é do lado da aplicação
+#   - Documentos: projeção de campos (parâmetro fields=) na listagem e no
+#     detalhe; colunas pesadas (xml_content) só quando pedidas explicitamente
+# ==============================================================================
+
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from sqlalchemy import select, table, column, text, bindparam, func, literal_column, exists, or_, Integer
+
+from paginacao import filtro_cursor
+
+# Máximo de formas de consulta guardadas por listagem
+CONSULTAS_CACHE_MAX = 256
+
+
+class CampoInvalido(ValueError):
+    """Parâmetro fields= pediu um campo que não existe no endpoint."""
+    pass
+
+# Tabelas usadas nas listagens (só as colunas necessárias; as condições de
+# texto do busca.py usam o apelido df)
+df = table(
+    "documentos_fiscais",
+    column("id"), column("empresa_id"), column("fornecedor_id"), column("data_emissao"),
+    column("data_recebimento"), column("data_competencia"), column("data_vencimento"),
+    column("numero_documento"), column("tipo_documento"), column("valor_total"),
+    column("status_processamento"), column("serie"), column("chave_acesso"), column("valor_impostos"),
+    column("valor_liquido"), column("descricao_servico_produto"), column("observacoes"),
+    column("uf_origem"), column("uf_destino"), column("municipio_prestacao"), column("xml_content")
+).alias("df")
+
+f = table("fornecedores", column("id"), column("razao_social")).alias("f")
+
+e = table("empresas", column("id"), column("razao_social")).alias("e")
+
+dx = table("documentos_xml", column("documento_fiscal_id")).alias("dx")
+
+p = table(
+    "provisionamentos",
+    column("id"), column("documento_fiscal_id"), column("fornecedor_id"), column("data_competencia"),
+    column("valor_provisionado"), column("valor_liquido"), column("status"), column("created_at")
+).alias("p")
+
+r = table(
+    "remessas_cnab",
+    column("id"), column("numero_remessa"), column("data_geracao"), column("quantidade_registros"),
+    column("valor_total"), column("status_remessa")
+).alias("r")
+
+retornos = table("retornos_cnab", column("remessa_id"))
+
+# Colunas aceitas no filtro de período dos documentos (parâmetro tipo_data)
+CAMPOS_DATA_DOCUMENTO = {
+    "emissao": df.c.data_emissao,
+    "recebimento": df.c.data_recebimento,
+    "competencia": df.c.data_competencia,
+    "vencimento": df.c.data_vencimento,
+}
+
+# Campos aceitos em fields= (na ordem em que aparecem na resposta)
+CAMPOS_LISTA_DOCUMENTO = {
+    "id": df.c.id,
+    "data_emissao": df.c.data_emissao,
+    "data_recebimento": df.c.data_recebimento,
+    "data_competencia": df.c.data_competencia,
+    "data_vencimento": df.c.data_vencimento,
+    "numero_documento": df.c.numero_documento,
+    "tipo_documento": df.c.tipo_documento,
+    "fornecedor": f.c.razao_social,
+    "valor_total": df.c.valor_total,
+    "status_processamento": df.c.status_processamento,
+}
+
+CAMPOS_DETALHE_DOCUMENTO = {
+    "id": df.c.id,
+    "empresa_id": df.c.empresa_id,
+    "empresa_nome": e.c.razao_social,
+    "fornecedor_id": df.c.fornecedor_id,
+    "fornecedor_nome": f.c.razao_social,
+    "tipo_documento": df.c.tipo_documento,
+    "numero_documento": df.c.numero_documento,
+    "serie": df.c.serie,
+    "chave_acesso": df.c.chave_acesso,
+    "data_emissao": df.c.data_emissao,
+    "data_recebimento": df.c.data_recebimento,
+    "data_vencimento": df.c.data_vencimento,
+    "data_competencia": df.c.data_competencia,
+    "valor_total": df.c.valor_total,
+    "valor_impostos": df.c.valor_impostos,
+    "valor_liquido": df.c.valor_liquido,
+    "descricao_servico_produto": df.c.descricao_servico_produto,
+    "observacoes": df.c.observacoes,
+    "uf_origem": df.c.uf_origem,
+    "uf_destino": df.c.uf_destino,
+    "municipio_prestacao": df.c.municipio_prestacao,
+    "status_processamento": df.c.status_processamento,
+    # Só testa se há XML (compactado em documentos_xml ou ainda não migrado), sem lê-lo
+    "tem_xml": or_(
+        df.c.xml_content.isnot(None),
+        exists().where(dx.c.documento_fiscal_id == df.c.id)
+    ),
+}
+
+# Campos grandes: fora da resposta padrão, só com fields= explícito.
+# Montados fora da consulta (o XML é descompactado por xml_compactado.ler_xml)
+CAMPOS_PESADOS_DOCUMENTO = ("xml_content",)
+
+# Campos de valor: NULL vira 0 na resposta (como nas demais rotas)
+CAMPOS_VALOR = {"valor_total", "valor_impostos", "valor_liquido", "valor_provisionado"}
+
+ORDENACAO_DOCUMENTOS = [(df.c.data_emissao, "DESC"), (df.c.id, "DESC")]
+ORDENACAO_PROVISIONAMENTOS = [(p.c.data_competencia, "DESC"), (p.c.id, "DESC")]
+ORDENACAO_REMESSAS = [(r.c.data_geracao, "DESC"), (r.c.id, "DESC")]
+
+
+def _ordem(ordenacao: list) -> list:
+    return [coluna.desc() if direcao == "DESC" else coluna.asc() for coluna, direcao in ordenacao]
+
+
+def _montar(colunas: list, origem, filtros: list, ordenacao: list, com_cursor: bool):
+    """Devolve (consulta da página, consulta da contagem) para a lista de filtros."""
+    contagem = select(func.count()).select_from(origem).where(*filtros)
+
+    if com_cursor:
+        filtros = filtros + [filtro_cursor(ordenacao)]
+
+    # 'limite' já chega somado de 1 (linha extra que indica se há próxima página)
+    pagina = (
+        select(*colunas).select_from(origem).where(*filtros)
+        .order_by(*_ordem(ordenacao))
+        .limit(bindparam("limite", type_=Integer))
+    )
+    return pagina, contagem
+
+
+# ------------------------------------------------------------------------------
+# Projeção de campos (fields=)
+# ------------------------------------------------------------------------------
+
+def campos_solicitados(fields: str, disponiveis: dict, extras: tuple = ()) -> tuple:
+    """
+    Converte 'fields=id,numero_documento,...' na tupla de campos da resposta.
+    Sem fields= devolve todos os campos de 'disponiveis' mais os 'extras' padrão.
+    Campos desconhecidos geram CampoInvalido (HTTP 400).
+    """
+    if not fields or not fields.strip():
+        return tuple(disponiveis) + tuple(extras)
+
+    campos = []
+    for campo in fields.split(","):
+        campo = campo.strip()
+        if campo and campo not in campos:
+            campos.append(campo)
+    return tuple(campos)
+
+
+def validar_campos(campos: tuple, *aceitos):
+    validos = set().union(*aceitos)
+    invalidos = [campo for campo in campos if campo not in validos]
+    if invalidos:
+        raise CampoInvalido(
+            f"Campo(s) inválido(s) em fields: {', '.join(invalidos)}. "
+            f"Disponíveis: {', '.join(sorted(validos))}"
+        )
+
+
+def formatar_campo(campo: str, valor):
+    """Converte o valor lido do banco para o formato JSON usado pela API."""
+    if isinstance(valor, (date, datetime)):
+        return str(valor)
+    if campo in CAMPOS_VALOR:
+        return float(valor) if valor else 0
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if campo.startswith("tem_"):
+        return bool(valor)
+    return valor
+
+
+def linha_para_dict(linha, campos: tuple) -> dict:
+    mapa = linha._mapping
+    return {campo: formatar_campo(campo, mapa[campo]) for campo in campos if campo in mapa}
+
+
+# ------------------------------------------------------------------------------
+# Documentos fiscais
+# ------------------------------------------------------------------------------
+
+@lru_cache(maxsize=CONSULTAS_CACHE_MAX)
+def _consulta_documentos(condicoes_busca: tuple, campo_data: str, tipo_documento: bool,
+                         status: bool, fornecedor: bool, com_cursor: bool, campos: tuple):
+    # As condições da pesquisa livre (busca.py) já vêm em SQL com :parâmetros
+    filtros = [text(condicao) for condicao in condicoes_busca]
+
+    if campo_data:
+        filtros.append(CAMPOS_DATA_DOCUMENTO[campo_data].between(bindparam("data_inicial"), bindparam("data_final")))
+    if tipo_documento:
+        filtros.append(df.c.tipo_documento == bindparam("tipo_documento"))
+    if status:
+        filtros.append(df.c.status_processamento == bindparam("status"))
+    if fornecedor:
+        filtros.append(df.c.fornecedor_id == bindparam("fornecedor_id"))
+
+    # id e data_emissao sempre vêm primeiro (posições 0 e 1): são a chave do cursor
+    colunas = [df.c.id.label("id"), df.c.data_emissao.label("data_emissao")] + [
+        CAMPOS_LISTA_DOCUMENTO[campo].label(campo) for campo in campos if campo not in ("id", "data_emissao")
+    ]
+    origem = df.join(f, df.c.fornecedor_id == f.c.id)
+    return _montar(colunas, origem, filtros, ORDENACAO_DOCUMENTOS, com_cursor)
+
+
+def consulta_documentos(condicoes_busca: list, params: dict, tipo_data: str = "emissao",
+                        data_inicial: str = None, data_final: str = None, tipo_documento: str = None,
+                        status: str = None, fornecedor_id: int = None, com_cursor: bool = False,
+                        campos: tuple = tuple(CAMPOS_LISTA_DOCUMENTO)):
+    """
+    Devolve (consulta da página, consulta da contagem) dos documentos fiscais
+    e completa 'params' com os valores dos filtros informados.
+    'condicoes_busca'/'params' vêm de busca.planejar_busca(); 'campos' vem de campos_solicitados().
+    """
+    validar_campos(campos, CAMPOS_LISTA_DOCUMENTO)
+    campo_data = None
+    if data_inicial and data_final:
+        # Valor desconhecido em tipo_data cai no padrão (emissão)
+        campo_data = tipo_data if tipo_data in CAMPOS_DATA_DOCUMENTO else "emissao"
+        params["data_inicial"] = data_inicial
+        params["data_final"] = data_final
+    if tipo_documento:
+        params["tipo_documento"] = tipo_documento
+    if status:
+        params["status"] = status
+    if fornecedor_id:
+        params["fornecedor_id"] = fornecedor_id
+
+    return _consulta_documentos(
+        tuple(condicoes_busca), campo_data, bool(tipo_documento), bool(status), bool(fornecedor_id), com_cursor, campos
+    )
+
+
+@lru_cache(maxsize=CONSULTAS_CACHE_MAX)
+def _consulta_detalhe_documento(colunas_banco: tuple):
+    colunas = [
+        CAMPOS_DETALHE_DOCUMENTO[campo].label(campo) for campo in colunas_banco
+    ]
+    origem = df.join(f, df.c.fornecedor_id == f.c.id).join(e, df.c.empresa_id == e.c.id)
+    return select(*colunas).select_from(origem).where(df.c.id == bindparam("doc_id"))
+
+
+def consulta_detalhe_documento(campos: tuple, extras: tuple = ()):
+    """
+    Consulta do detalhe de um documento (parâmetro :doc_id) só com os 'campos' pedidos.
+    'extras' são campos montados fora desta consulta (ex: anexos), assim como
+    os de CAMPOS_PESADOS_DOCUMENTO.
+    """
+    extras = tuple(extras) + CAMPOS_PESADOS_DOCUMENTO
+    validar_campos(campos, CAMPOS_DETALHE_DOCUMENTO, extras)
+    # O id sempre é lido: sem ele não há como saber se o documento existe
+    colunas_banco = ("id",) + tuple(campo for campo in campos if campo not in extras and campo != "id")
+    return _consulta_detalhe_documento(colunas_banco)
+
+
+# ------------------------------------------------------------------------------
+# Provisionamentos
+# ------------------------------------------------------------------------------
+
+@lru_cache(maxsize=CONSULTAS_CACHE_MAX)
+def _consulta_provisionamentos(status: bool, periodo: bool, fornecedor: bool, com_cursor: bool):
+    filtros = []
+    if status:
+        filtros.append(p.c.status == bindparam("status"))
+    if periodo:
+        filtros.append(p.c.data_competencia.between(bindparam("data_inicial"), bindparam("data_final")))
+    if fornecedor:
+        filtros.append(p.c.fornecedor_id == bindparam("fornecedor_id"))
+
+    colunas = [
+        p.c.id, p.c.data_competencia, f.c.razao_social.label("fornecedor"), df.c.numero_documento,
+        p.c.valor_provisionado, p.c.valor_liquido, p.c.status, p.c.created_at
+    ]
+    origem = p.join(f, p.c.fornecedor_id == f.c.id).join(df, p.c.documento_fiscal_id == df.c.id)
+    return _montar(colunas, origem, filtros, ORDENACAO_PROVISIONAMENTOS, com_cursor)
+
+
+def consulta_provisionamentos(params: dict, status: str = None, data_inicial: str = None,
+                              data_final: str = None, fornecedor_id: int = None, com_cursor: bool = False):
+    """Devolve (consulta da página, consulta da contagem) e completa 'params'."""
+    periodo = bool(data_inicial and data_final)
+    if status:
+        params["status"] = status
+    if periodo:
+        params["data_inicial"] = data_inicial
+        params["data_final"] = data_final
+    if fornecedor_id:
+        params["fornecedor_id"] = fornecedor_id
+
+    return _consulta_provisionamentos(bool(status), periodo, bool(fornecedor_id), com_cursor)
+
+
+# ------------------------------------------------------------------------------
+# Remessas CNAB
+# ------------------------------------------------------------------------------
+
+@lru_cache(maxsize=CONSULTAS_CACHE_MAX)
+def _consulta_remessas(status: bool, periodo: bool, com_cursor: bool):
+    filtros = []
+    if status:
+        filtros.append(r.c.status_remessa == bindparam("status"))
+    if periodo:
+        # Faixa direto na coluna (usa idx_data_geracao); equivale a DATE(data_geracao) BETWEEN
+        filtros.append(r.c.data_geracao >= bindparam("data_inicial"))
+        filtros.append(r.c.data_geracao < func.date_add(bindparam("data_final"), literal_column("INTERVAL 1 DAY")))
+
+    tem_retorno = select(literal_column("1")).where(retornos.c.remessa_id == r.c.id).exists().label("tem_retorno")
+    colunas = [
+        r.c.id, r.c.numero_remessa, r.c.data_geracao, r.c.quantidade_registros,
+        r.c.valor_total, r.c.status_remessa, tem_retorno
+    ]
+    return _montar(colunas, r, filtros, ORDENACAO_REMESSAS, com_cursor)
+
+
+def consulta_remessas(params: dict, status: str = None, data_inicial: str = None,
+                      data_final: str = None, com_cursor: bool = False):
+    """Devolve (consulta da página, consulta da contagem) e completa 'params'."""
+    periodo = bool(data_inicial and data_final)
+    if status:
+        params["status"] = status
+    if periodo:
+        params["data_inicial"] = data_inicial
+        params["data_final"] = data_final
+
+    return _consulta_remessas(bool(status), periodo, com_cursor)
@@ -0,0 +1,85 @@
+# ==============================================================================
+# ARQUIVO: dados_referencia.py
+# DESCRIÇÃO: Cache das listagens de cadastro (fornecedores, empresas, roles)
+#   com GET condicional.
+#   - O JSON de cada listagem é montado uma vez e guardado já serializado
+#     (bytes), junto com o ETag (hash do conteúdo)
+#   - Pedido com If-None-Match igual ao ETag recebe 304 sem corpo: não consulta
+#     o banco nem serializa de novo
+#   - As rotas de criar/alterar/excluir chamam invalidar(nome) depois do COMMIT;
+#     a versão do cache muda e um cálculo que começou antes não é guardado
+#   - Cache-Control "private, no-cache": o navegador guarda a resposta, mas
+#     confirma o ETag a cada uso (um cadastro novo aparece na hora)
+#   O cache é por processo e guarda até REFERENCIA_CACHE_MAX listagens (a
+#   chave vem do empresa_id da query string; passando do limite, sai a usada
+#   há mais tempo). Com vários workers, uma alteração leva até
+#   REFERENCIA_CACHE_TTL segundos para aparecer nos outros. Como o ETag vem do
+#   conteúdo, workers com os mesmos dados respondem o mesmo ETag.
+# ==============================================================================
+
+import hashlib
+import json
+import os
+from fastapi import Request
+from fastapi.responses import Response
+from dotenv import load_dotenv
+
+from cache_memoria import CacheTTL
+
+load_dotenv()
+
+# Validade (s) e quantidade máxima por processo das listagens em cache
+REFERENCIA_CACHE_TTL = float(os.getenv("REFERENCIA_CACHE_TTL", "300"))
+REFERENCIA_CACHE_MAX = int(os.getenv("REFERENCIA_CACHE_MAX", "1000"))
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag_confere(request: Request, etag: str) -> bool:
+    """True se o If-None-Match do pedido tiver o ETag (aceita '*' e W/)."""
+    cabecalho = request.headers.get("if-none-match")
+    if not cabecalho:
+        return False
+    for valor in cabecalho.split(","):
+        valor = valor.strip()
+        if valor == "*" or valor.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def _serializar(calcular):
+    # Mesmo formato do JSONResponse do FastAPI
+    corpo = json.dumps(
+        await calcular(), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+    return f'"{hashlib.sha1(corpo).hexdigest()[:20]}"', corpo
+
+
+class CacheReferencia:
+    """Listagens serializadas por chave, ex: ("fornecedores", empresa_id)."""
+
+    def __init__(self):
+        self.cache = CacheTTL(REFERENCIA_CACHE_TTL, max_itens=REFERENCIA_CACHE_MAX)
+
+    async def resposta(self, request: Request, chave: tuple, calcular) -> Response:
+        """
+        Resposta da listagem: 304 se o navegador já tem esta versão, senão o
+        JSON guardado. 'calcular()' (corrotina que devolve o dict) só roda
+        quando a chave não está no cache.
+        """
+        etag, corpo = await self.cache.obter_ou_calcular(
+            ("referencia",) + chave, lambda: _serializar(calcular)
+        )
+        cabecalhos = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if etag_confere(request, etag):
+            return Response(status_code=304, headers=cabecalhos)
+        return Response(content=corpo, media_type="application/json", headers=cabecalhos)
+
+    def invalidar(self, *nomes):
+        """Descarta as listagens (todas as empresas) de cada nome, ex: invalidar("empresas")."""
+        for nome in nomes:
+            self.cache.invalidar("referencia", nome)
+
+
+# Instância global
+dados_referencia = CacheReferencia()
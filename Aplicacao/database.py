@@ -1,13 +1,20 @@
 import pymysql
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 import os
+import functools
+import threading
+import time
+import anyio
+from anyio import to_thread
 from dotenv import load_dotenv # Importar o leitor de .env
 
 # Carrega as variáveis do arquivo .env
 load_dotenv()
 
-# PEGA AS INFORMAÇÕES DO .ENV 
+# PEGA AS INFORMAÇÕES DO .ENV
 
 MYSQL_USER = os.getenv("DB_USER", "root")
 MYSQL_PASSWORD = os.getenv("DB_PASSWORD", "")
@@ -15,15 +22,350 @@ MYSQL_HOST = os.getenv("DB_HOST", "localhost")
 MYSQL_PORT = os.getenv("DB_PORT", "3306")
 MYSQL_DATABASE = os.getenv("DB_NAME", "sistema_fiscal")
 
+# POOL DE CONEXÕES
+# Conexões mantidas abertas e conexões extras permitidas em picos
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Segundos de espera por uma conexão livre antes de dar erro
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Recria conexões com mais de N segundos (deve ficar abaixo do wait_timeout do MySQL,
+# senão o servidor fecha a conexão parada e a próxima requisição falha)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Testa a conexão (ping) antes de entregá-la; uma conexão morta é trocada sem erro
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "sim")
+
+# Segundos para abrir uma conexão nova com o MySQL
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+
+# Quantidade de SQLs compilados guardados pelo SQLAlchemy (uma entrada por forma de consulta)
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "500"))
+
+# Quantidade máxima de chamadas ao banco executando ao mesmo tempo fora do event loop
+# (padrão = total de conexões do pool, assim nenhuma thread fica esperando conexão)
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
+class MetricasPool:
+    """
+    Contadores do pool de conexões, alimentados pelos eventos do SQLAlchemy
+    e pelo PoolMedido (tempo de espera por conexão). Lidos em /api/metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.conexoes_abertas = 0
+        self.conexoes_invalidadas = 0
+        self.timeouts = 0
+        self.pedidos = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+
+    def registrar_espera(self, segundos: float, timeout: bool = False):
+        with self._lock:
+            self.pedidos += 1
+            self.espera_total += segundos
+            self.espera_maxima = max(self.espera_maxima, segundos)
+            if timeout:
+                self.timeouts += 1
+
+    def incrementar(self, contador: str):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+    def resumo(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "conexoes_abertas": self.conexoes_abertas,
+                "conexoes_invalidadas": self.conexoes_invalidadas,
+                "timeouts": self.timeouts,
+                "espera_total_segundos": round(self.espera_total, 4),
+                "espera_media_ms": round(self.espera_total / self.pedidos * 1000, 3) if self.pedidos else 0,
+                "espera_maxima_ms": round(self.espera_maxima * 1000, 3)
+            }
+
+metricas_pool = MetricasPool()
+
+class PoolMedido(QueuePool):
+    """QueuePool que mede quanto tempo cada pedido esperou por uma conexão livre."""
+
+    metricas = metricas_pool
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexao = super()._do_get()
+        except PoolTimeoutError:
+            self.metricas.registrar_espera(time.perf_counter() - inicio, timeout=True)
+            raise
+        self.metricas.registrar_espera(time.perf_counter() - inicio)
+        return conexao
+
+def _criar_engine(url: str, poolclass):
+    """Cria o engine com a configuração de pool do .env e liga os contadores de métricas."""
+    novo_engine = create_engine(
+        url,
+        poolclass=poolclass,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+        connect_args={"connect_timeout": DB_CONNECT_TIMEOUT}
+    )
+    metricas = poolclass.metricas
+
+    @event.listens_for(novo_engine, "connect")
+    def _ao_conectar(conexao_dbapi, registro):
+        metricas.incrementar("conexoes_abertas")
+
+    @event.listens_for(novo_engine, "checkout")
+    def _ao_retirar(conexao_dbapi, registro, proxy):
+        metricas.incrementar("checkouts")
+
+    @event.listens_for(novo_engine, "invalidate")
+    def _ao_invalidar(conexao_dbapi, registro, excecao):
+        # Inclui conexões mortas detectadas pelo pre-ping
+        metricas.incrementar("conexoes_invalidadas")
+
+    return novo_engine
+
 # CRIA CONEXÃO COM O BANCO DE DADOS
 DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}"
 
-engine = create_engine(DATABASE_URL)
+engine = _criar_engine(DATABASE_URL, PoolMedido)
 SessionLocal = sessionmaker(bind=engine)
 
-def get_db():
-    db = SessionLocal()
+# RÉPLICA DE LEITURA (opcional)
+# Com DB_REPLICA_HOST definido, as rotas só de leitura (listagens, dashboard,
+# auditoria) usam a réplica; sem ele, tudo continua no banco principal.
+REPLICA_HOST = os.getenv("DB_REPLICA_HOST", "")
+REPLICA_PORT = os.getenv("DB_REPLICA_PORT", MYSQL_PORT)
+REPLICA_USER = os.getenv("DB_REPLICA_USER", MYSQL_USER)
+REPLICA_PASSWORD = os.getenv("DB_REPLICA_PASSWORD", MYSQL_PASSWORD)
+
+# Atraso máximo (s) aceito na réplica; acima disso (ou com a replicação parada) as leituras voltam ao principal
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+
+# Intervalo (s) entre as consultas ao atraso da réplica
+DB_REPLICA_INTERVALO_CHECAGEM = float(os.getenv("DB_REPLICA_INTERVALO_CHECAGEM", "5"))
+
+metricas_replica = MetricasPool()
+
+class PoolMedidoReplica(PoolMedido):
+    metricas = metricas_replica
+
+engine_replica = None
+SessionReplica = None
+if REPLICA_HOST:
+    engine_replica = _criar_engine(
+        f"mysql+pymysql://{REPLICA_USER}:{REPLICA_PASSWORD}@{REPLICA_HOST}:{REPLICA_PORT}/{MYSQL_DATABASE}",
+        PoolMedidoReplica
+    )
+    SessionReplica = sessionmaker(bind=engine_replica)
+
+class EstadoReplica:
+    """
+    Guarda o último atraso medido na réplica. A medição roda no máximo uma vez
+    por DB_REPLICA_INTERVALO_CHECAGEM; os pedidos nesse intervalo usam o valor guardado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.atraso = None
+        self.disponivel = False
+        self.erro = None
+        self.checado_em = 0.0
+        self.leituras_replica = 0
+        self.leituras_principal = 0
+
+    def _medir_atraso(self):
+        with engine_replica.connect() as conexao:
+            try:
+                status = conexao.exec_driver_sql("SHOW REPLICA STATUS").mappings().first()
+                campo = "Seconds_Behind_Source"
+            except Exception:
+                # MySQL anterior ao 8.0.22
+                status = conexao.exec_driver_sql("SHOW SLAVE STATUS").mappings().first()
+                campo = "Seconds_Behind_Master"
+        if status is None:
+            raise RuntimeError("servidor não está configurado como réplica")
+        if status[campo] is None:
+            # NULL = thread de replicação parada
+            raise RuntimeError("replicação parada")
+        return float(status[campo])
+
+    def usar_replica(self) -> bool:
+        """Chamado em thread: decide se a leitura pode ir para a réplica."""
+        if engine_replica is None:
+            return False
+
+        with self._lock:
+            checar = time.monotonic() - self.checado_em >= DB_REPLICA_INTERVALO_CHECAGEM
+            if checar:
+                # Marca antes de medir: pedidos simultâneos usam o estado anterior
+                self.checado_em = time.monotonic()
+
+        if checar:
+            try:
+                atraso = self._medir_atraso()
+                disponivel, erro = atraso <= DB_REPLICA_MAX_LAG, None
+            except Exception as e:
+                atraso, disponivel, erro = None, False, str(e)
+            with self._lock:
+                if disponivel != self.disponivel:
+                    print(f"[v0] Réplica de leitura {'disponível' if disponivel else 'fora de uso'} "
+                          f"(atraso: {atraso}, erro: {erro})")
+                self.atraso, self.disponivel, self.erro = atraso, disponivel, erro
+
+        with self._lock:
+            if self.disponivel:
+                self.leituras_replica += 1
+            else:
+                self.leituras_principal += 1
+            return self.disponivel
+
+    def resumo(self) -> dict:
+        with self._lock:
+            return {
+                "em_uso": self.disponivel,
+                "atraso_segundos": self.atraso,
+                "atraso_maximo_segundos": DB_REPLICA_MAX_LAG,
+                "erro": self.erro,
+                "leituras_replica": self.leituras_replica,
+                "leituras_principal": self.leituras_principal
+            }
+
+estado_replica = EstadoReplica()
+
+# Os limitadores são criados sob demanda, pois precisam do event loop em execução.
+# A réplica tem o seu: relatórios pesados não ocupam as threads das escritas.
+_limitador_db = None
+_limitador_replica = None
+
+def _obter_limitador():
+    global _limitador_db
+    if _limitador_db is None:
+        _limitador_db = anyio.CapacityLimiter(DB_THREADPOOL_SIZE)
+    return _limitador_db
+
+def _obter_limitador_replica():
+    global _limitador_replica
+    if _limitador_replica is None:
+        _limitador_replica = anyio.CapacityLimiter(DB_THREADPOOL_SIZE)
+    return _limitador_replica
+
+async def executar_em_thread(funcao, *args, **kwargs):
+    """
+    Executa uma chamada bloqueante (driver PyMySQL) no pool de threads do banco,
+    liberando o event loop para atender outras requisições enquanto a query roda.
+    """
+    return await to_thread.run_sync(
+        functools.partial(funcao, *args, **kwargs),
+        limiter=_obter_limitador()
+    )
+
+class SessaoAssincrona:
+    """
+    Envolve a Session síncrona do SQLAlchemy e executa cada ida ao banco
+    no pool de threads limitado. Segue a interface do AsyncSession
+    (await db.execute / db.commit / db.rollback), então os endpoints não
+    mudam caso o driver seja trocado por um assíncrono (aiomysql/asyncmy).
+    """
+
+    def __init__(self, sessao, limitador=None):
+        self.sessao = sessao
+        # None = limitador do banco principal
+        self._limitador = limitador
+
+    async def _executar(self, funcao, *args, **kwargs):
+        return await to_thread.run_sync(
+            functools.partial(funcao, *args, **kwargs),
+            limiter=self._limitador or _obter_limitador()
+        )
+
+    async def execute(self, *args, **kwargs):
+        return await self._executar(self.sessao.execute, *args, **kwargs)
+
+    async def commit(self):
+        return await self._executar(self.sessao.commit)
+
+    async def rollback(self):
+        return await self._executar(self.sessao.rollback)
+
+    async def close(self):
+        return await self._executar(self.sessao.close)
+
+    async def run_sync(self, funcao, *args, **kwargs):
+        """Executa um bloco síncrono inteiro (várias queries) recebendo a Session."""
+        return await self._executar(funcao, self.sessao, *args, **kwargs)
+
+def _estado_engine(engine_atual, metricas: MetricasPool, limitador) -> dict:
+    pool = engine_atual.pool
+    estado = {
+        "pool": {
+            "em_uso": pool.checkedout(),
+            "livres": pool.checkedin(),
+            # overflow() fica negativo enquanto o pool ainda não abriu pool_size conexões
+            "overflow": max(pool.overflow(), 0),
+            **metricas.resumo()
+        },
+        "threadpool": None
+    }
+    if limitador is not None:
+        estatisticas = limitador.statistics()
+        estado["threadpool"] = {
+            "em_uso": estatisticas.borrowed_tokens,
+            "esperando": estatisticas.tasks_waiting
+        }
+    return estado
+
+def estado_pool() -> dict:
+    """Configuração, ocupação atual e contadores do pool e do limitador de threads."""
+    estado = {
+        "configuracao": {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+            "threadpool_size": DB_THREADPOOL_SIZE
+        },
+        **_estado_engine(engine, metricas_pool, _limitador_db),
+        "replica": None
+    }
+    if engine_replica is not None:
+        estado["replica"] = {
+            **estado_replica.resumo(),
+            **_estado_engine(engine_replica, metricas_replica, _limitador_replica)
+        }
+    return estado
+
+async def get_db():
+    db = SessaoAssincrona(SessionLocal())
+    try:
+        yield db
+    finally:
+        await db.close()
+
+async def get_db_leitura():
+    """
+    Sessão para rotas que só leem (listagens, dashboard, auditoria).
+    Usa a réplica quando configurada e com atraso até DB_REPLICA_MAX_LAG;
+    caso contrário (ou se a réplica cair), usa o banco principal.
+    Não use em rotas que gravam nem em leituras logo após uma gravação do mesmo usuário.
+    """
+    if engine_replica is not None and await to_thread.run_sync(
+        estado_replica.usar_replica, limiter=_obter_limitador_replica()
+    ):
+        db = SessaoAssincrona(SessionReplica(), _obter_limitador_replica())
+    else:
+        db = SessaoAssincrona(SessionLocal())
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
@@ -0,0 +1,115 @@
+# ==============================================================================
+# ARQUIVO: deduplicar_uploads.py
+# DESCRIÇÃO: Migração única da pasta uploads/ para o armazenamento por hash.
+#   - Agrupa os anexos pelo SHA-256 (anexos.hash_arquivo)
+#   - Move um arquivo de cada grupo para uploads/objetos/ab/cd/<hash>.<ext>
+#   - Aponta todos os anexos do grupo para esse arquivo
+#   - Apaga as cópias antigas que ficaram sem referência
+#
+# USO (a partir da pasta Aplicacao):
+#   python deduplicar_uploads.py             -> só mostra o que seria feito
+#   python deduplicar_uploads.py --executar  -> aplica as mudanças
+# ==============================================================================
+
+import argparse
+import os
+from collections import OrderedDict
+from sqlalchemy import text
+
+from database import SessionLocal
+from armazenamento import caminho_objeto, caminho_absoluto, calcular_hash_arquivo
+
+UPLOAD_DIR = "uploads"
+
+
+def deduplicar(executar: bool):
+    db = SessionLocal()
+    bytes_liberados = 0
+    arquivos_removidos = 0
+    anexos_atualizados = 0
+
+    try:
+        rows = db.execute(text("""
+            SELECT id, caminho_arquivo, hash_arquivo, tipo_arquivo
+            FROM anexos
+            ORDER BY id
+        """)).fetchall()
+
+        # Agrupa pelo caminho de destino (hash + extensão)
+        grupos = OrderedDict()
+        for row in rows:
+            grupos.setdefault(caminho_objeto(row[2], row[3]), []).append(row)
+
+        for destino, anexos in grupos.items():
+            destino_abs = caminho_absoluto(UPLOAD_DIR, destino)
+            antigos = list(OrderedDict.fromkeys(a[1] for a in anexos if a[1] != destino))
+            if not antigos:
+                continue
+
+            # 1. Garante o objeto no destino, usando a primeira cópia íntegra encontrada
+            origem = None
+            if not os.path.exists(destino_abs):
+                for caminho in antigos:
+                    caminho_abs = caminho_absoluto(UPLOAD_DIR, caminho)
+                    if os.path.exists(caminho_abs) and calcular_hash_arquivo(caminho_abs) == anexos[0][2]:
+                        origem = caminho
+                        break
+
+                if not origem:
+                    print(f"[AVISO] Nenhuma cópia íntegra encontrada para {destino} (anexos {[a[0] for a in anexos]})")
+                    continue
+
+                print(f"[MOVER] {origem} -> {destino}")
+                if executar:
+                    os.makedirs(os.path.dirname(destino_abs), exist_ok=True)
+                    os.replace(caminho_absoluto(UPLOAD_DIR, origem), destino_abs)
+
+            # 2. Aponta todos os anexos do grupo para o objeto
+            for anexo in anexos:
+                if anexo[1] != destino:
+                    anexos_atualizados += 1
+                    if executar:
+                        db.execute(text("""
+                            UPDATE anexos SET caminho_arquivo = :destino, nome_arquivo = :nome
+                            WHERE id = :id
+                        """), {"destino": destino, "nome": destino.rsplit("/", 1)[-1], "id": anexo[0]})
+            if executar:
+                db.commit()
+
+            # 3. Remove as cópias antigas que não são mais referenciadas
+            for caminho in antigos:
+                caminho_abs = caminho_absoluto(UPLOAD_DIR, caminho)
+                if caminho == origem or not os.path.exists(caminho_abs):
+                    continue
+                referencias = db.execute(
+                    text("SELECT COUNT(*) FROM anexos WHERE caminho_arquivo = :caminho"),
+                    {"caminho": caminho}
+                ).scalar()
+                if executar and referencias:
+                    continue
+
+                tamanho = os.path.getsize(caminho_abs)
+                print(f"[REMOVER] {caminho} ({tamanho} bytes)")
+                bytes_liberados += tamanho
+                arquivos_removidos += 1
+                if executar:
+                    os.remove(caminho_abs)
+
+        modo = "APLICADO" if executar else "SIMULAÇÃO (use --executar para aplicar)"
+        print(f"\n{modo}")
+        print(f"Anexos apontados para o armazenamento por hash: {anexos_atualizados}")
+        print(f"Arquivos antigos removidos: {arquivos_removidos}")
+        print(f"Espaço liberado: {bytes_liberados / (1024 * 1024):.2f} MB")
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplica a pasta uploads/ usando o hash SHA-256 dos anexos.")
+    parser.add_argument("--executar", action="store_true", help="Aplica as mudanças (sem isso, só simula)")
+    args = parser.parse_args()
+    deduplicar(args.executar)
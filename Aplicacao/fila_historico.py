@@ -0,0 +1,199 @@
+# ==============================================================================
+# ARQUIVO: fila_historico.py
+# DESCRIÇÃO: Gravação assíncrona e em lote do histórico de ações.
+#   - As rotas só colocam o registro em uma fila em memória e respondem
+#   - Uma tarefa em segundo plano esvazia a fila e grava em lotes
+#     (no Firebase, um único update multi-caminho por lote)
+#   - Falhas são repetidas com espera crescente; se o backend continuar fora,
+#     os registros vão para um arquivo em disco e são reenviados depois
+#   - Cada registro tem uma chave própria, então reenviar não duplica
+# ==============================================================================
+
+import asyncio
+import json
+import os
+import threading
+from anyio import to_thread
+from dotenv import load_dotenv
+
+from firebase_historico import historico_db, gerar_chave
+
+load_dotenv()
+
+# Máximo de registros gravados por vez
+HISTORICO_LOTE_MAX = int(os.getenv("HISTORICO_LOTE_MAX", "200"))
+
+# Tempo (s) esperando mais registros para completar o lote
+HISTORICO_LOTE_ESPERA = float(os.getenv("HISTORICO_LOTE_ESPERA", "0.2"))
+
+# Tamanho da fila em memória; acima disso os registros vão direto para o disco
+HISTORICO_FILA_MAX = int(os.getenv("HISTORICO_FILA_MAX", "10000"))
+
+# Tentativas antes de mandar o lote para o disco, e espera inicial entre elas (s)
+HISTORICO_TENTATIVAS = int(os.getenv("HISTORICO_TENTATIVAS", "3"))
+HISTORICO_ESPERA_RETRY = float(os.getenv("HISTORICO_ESPERA_RETRY", "0.5"))
+
+# Arquivo (JSONL) com os registros que ainda não chegaram ao backend
+HISTORICO_PENDENTES = os.getenv("HISTORICO_PENDENTES", "historico_pendente.jsonl")
+
+# Intervalo (s) entre as tentativas de reenviar o arquivo de pendentes
+INTERVALO_REENVIO = 30
+
+
+class FilaHistorico:
+    """Fila em memória + tarefa de gravação em lote para um HistoricoFirebase."""
+
+    def __init__(self, historico, arquivo_pendentes: str = HISTORICO_PENDENTES):
+        self.historico = historico
+        self.arquivo_pendentes = arquivo_pendentes
+        self._fila = None
+        self._tarefa = None
+        self._lock_pendentes = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Produção (rotas)
+    # ------------------------------------------------------------------
+
+    def registrar_acao(self, documento_id, acao, usuario_id, comentarios, novo_status):
+        """Enfileira a ação e retorna na hora (não espera o Firebase)."""
+        registro = self.historico.montar_registro(documento_id, acao, usuario_id, comentarios, novo_status)
+        registro["chave"] = gerar_chave()
+
+        if self._fila is None:
+            # Fila não iniciada (ex: script fora do servidor): grava direto
+            return self.historico.registrar_lote([registro])
+
+        try:
+            self._fila.put_nowait(registro)
+        except asyncio.QueueFull:
+            print("[v0] Fila de histórico cheia, gravando registro no disco")
+            self._guardar_pendentes([registro])
+        return True
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida (chamado no startup/shutdown do app)
+    # ------------------------------------------------------------------
+
+    async def iniciar(self):
+        self._fila = asyncio.Queue(maxsize=HISTORICO_FILA_MAX)
+        self._tarefa = asyncio.create_task(self._executar())
+
+    async def encerrar(self):
+        """Grava o que ainda está na fila antes de o servidor parar."""
+        if self._tarefa is None:
+            return
+        self._tarefa.cancel()
+        try:
+            await self._tarefa
+        except asyncio.CancelledError:
+            pass
+
+        restantes = []
+        while not self._fila.empty():
+            restantes.append(self._fila.get_nowait())
+        if restantes and not await self._gravar_com_retry(restantes):
+            await to_thread.run_sync(self._guardar_pendentes, restantes)
+
+        self._fila = None
+        self._tarefa = None
+
+    # ------------------------------------------------------------------
+    # Consumo (tarefa em segundo plano)
+    # ------------------------------------------------------------------
+
+    async def _executar(self):
+        await self._reenviar_pendentes()
+        ultimo_reenvio = asyncio.get_running_loop().time()
+
+        while True:
+            lote = []
+            try:
+                lote.append(await asyncio.wait_for(self._fila.get(), timeout=INTERVALO_REENVIO))
+                await self._completar_lote(lote)
+                if not await self._gravar_com_retry(lote):
+                    await to_thread.run_sync(self._guardar_pendentes, lote)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # Servidor parando no meio de um lote: não perde o que já saiu da fila
+                if lote:
+                    self._guardar_pendentes(lote)
+                raise
+
+            agora = asyncio.get_running_loop().time()
+            if agora - ultimo_reenvio >= INTERVALO_REENVIO:
+                ultimo_reenvio = agora
+                await self._reenviar_pendentes()
+
+    async def _completar_lote(self, lote: list):
+        # Junta o que chegar em até HISTORICO_LOTE_ESPERA segundos
+        limite = asyncio.get_running_loop().time() + HISTORICO_LOTE_ESPERA
+        while len(lote) < HISTORICO_LOTE_MAX:
+            restante = limite - asyncio.get_running_loop().time()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._fila.get(), timeout=restante))
+            except asyncio.TimeoutError:
+                break
+
+    async def _gravar_com_retry(self, lote: list) -> bool:
+        espera = HISTORICO_ESPERA_RETRY
+        for tentativa in range(1, HISTORICO_TENTATIVAS + 1):
+            if await to_thread.run_sync(self.historico.registrar_lote, lote):
+                return True
+            if tentativa < HISTORICO_TENTATIVAS:
+                print(f"[v0] Falha ao gravar histórico (tentativa {tentativa}), nova tentativa em {espera}s")
+                await asyncio.sleep(espera)
+                espera *= 2
+        return False
+
+    # ------------------------------------------------------------------
+    # Arquivo de pendentes (disco)
+    # ------------------------------------------------------------------
+
+    def _guardar_pendentes(self, registros: list):
+        with self._lock_pendentes:
+            with open(self.arquivo_pendentes, 'a', encoding='utf-8') as f:
+                for registro in registros:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        print(f"[v0] {len(registros)} registro(s) de histórico guardados em {self.arquivo_pendentes}")
+
+    def _ler_pendentes(self):
+        # Renomeia antes de ler: o que chegar enquanto reenvia vai para um arquivo novo
+        em_envio = self.arquivo_pendentes + ".enviando"
+        with self._lock_pendentes:
+            if not os.path.exists(em_envio):
+                os.replace(self.arquivo_pendentes, em_envio)
+
+        registros = []
+        with open(em_envio, 'r', encoding='utf-8') as f:
+            for linha in f:
+                linha = linha.strip()
+                if linha:
+                    try:
+                        registros.append(json.loads(linha))
+                    except json.JSONDecodeError:
+                        pass # Linha cortada por uma queda durante a escrita
+        return em_envio, registros
+
+    async def _reenviar_pendentes(self):
+        # Um '.enviando' que sobrou de uma execução anterior é reenviado primeiro
+        if not os.path.exists(self.arquivo_pendentes) and not os.path.exists(self.arquivo_pendentes + ".enviando"):
+            return
+
+        em_envio, registros = await to_thread.run_sync(self._ler_pendentes)
+        for i in range(0, len(registros), HISTORICO_LOTE_MAX):
+            if not await to_thread.run_sync(self.historico.registrar_lote, registros[i:i + HISTORICO_LOTE_MAX]):
+                # Backend ainda fora: mantém o arquivo para a próxima rodada
+                # (os lotes já enviados não duplicam, pois a chave de cada registro é fixa)
+                return
+
+        os.remove(em_envio)
+        print(f"[v0] {len(registros)} registro(s) de histórico pendentes reenviados")
+
+
+# Instância global (iniciada no startup do app)
+fila_historico = FilaHistorico(historico_db)
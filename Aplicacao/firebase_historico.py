@@ -1,65 +1,94 @@
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import db
-import json
 import os
+import uuid
 from datetime import datetime
+from dotenv import load_dotenv
+from historico_local import HistoricoLocal
+
+load_dotenv()
+
+# URL do Realtime Database. Para testes, defina FIREBASE_DATABASE_EMULATOR_HOST
+# (ex: localhost:9000) e o SDK passa a usar o emulador local do Firebase
+FIREBASE_DATABASE_URL = os.getenv("FIREBASE_DATABASE_URL", "https://seu-projeto.firebaseio.com")
+FIREBASE_EMULADOR = os.getenv("FIREBASE_DATABASE_EMULATOR_HOST")
+
+def gerar_chave() -> str:
+    """
+    Chave do registro no histórico. Começa pelo instante em milissegundos,
+    então a ordem alfabética das chaves é a ordem cronológica (como o push do Firebase).
+    """
+    return f"{int(datetime.now().timestamp() * 1000):013d}-{uuid.uuid4().hex[:12]}"
 
 class HistoricoFirebase:
     """Gerencia histórico de ações em Firebase sem alterar o banco MySQL"""
     
     def __init__(self):
         self.usar_firebase = False
-        self.historico_local = []
+        self.historico_local = None
         
         # Tentar conectar ao Firebase
         try:
             if os.path.exists("credentials.json"):
                 cred = credentials.Certificate("credentials.json")
                 firebase_admin.initialize_app(cred, {
-                    'databaseURL': 'https://seu-projeto.firebaseio.com'
+                    'databaseURL': FIREBASE_DATABASE_URL
                 })
                 self.usar_firebase = True
                 print("[v0] SUCESSO: Conectado ao Firebase!")
+            elif FIREBASE_EMULADOR:
+                # O emulador não exige credenciais de serviço
+                firebase_admin.initialize_app(options={'databaseURL': FIREBASE_DATABASE_URL})
+                self.usar_firebase = True
+                print(f"[v0] Usando emulador do Firebase em {FIREBASE_EMULADOR}")
         except Exception as e:
             print(f"[v0] Firebase não configurado, usando armazenamento local: {str(e)}")
+
+        if not self.usar_firebase:
+            # Log local append-only (SQLite), indexado por documento
+            self.historico_local = HistoricoLocal()
     
-    def registrar_acao(self, documento_id, acao, usuario_id, comentarios, novo_status):
-        """Registra ação de confirmar/revisar em Firebase ou local fallback"""
-        
-        registro = {
+    def montar_registro(self, documento_id, acao, usuario_id, comentarios, novo_status):
+        """Monta o registro de histórico com a data/hora atual"""
+        agora = datetime.now()
+        return {
             "documento_id": documento_id,
             "acao": acao,
             "usuario_id": usuario_id,
             "comentarios": comentarios,
             "novo_status": novo_status,
-            "data_hora": datetime.now().isoformat(),
-            "timestamp": int(datetime.now().timestamp())
+            "data_hora": agora.isoformat(),
+            "timestamp": int(agora.timestamp())
         }
-        
+
+    def registrar_acao(self, documento_id, acao, usuario_id, comentarios, novo_status):
+        """Registra ação de confirmar/revisar em Firebase ou local fallback (síncrono)"""
+        registro = self.montar_registro(documento_id, acao, usuario_id, comentarios, novo_status)
+        registro["chave"] = gerar_chave()
+        return self.registrar_lote([registro])
+
+    def registrar_lote(self, registros):
+        """
+        Grava vários registros de uma vez. Cada registro precisa ter 'chave'.
+        No Firebase é um único update multi-caminho (uma ida à rede por lote).
+        Retorna False em caso de erro, para quem chamou tentar de novo.
+        """
         try:
             if self.usar_firebase:
-                # Salvar no Firebase
-                ref = db.reference(f"documentos/{documento_id}/historico")
-                ref.push(registro)
+                caminhos = {
+                    f"documentos/{r['documento_id']}/historico/{r['chave']}": r
+                    for r in registros
+                }
+                db.reference().update(caminhos)
             else:
-                # Salvar localmente em JSON
-                arquivo_historico = f"historico_local_{documento_id}.json"
-                
-                if os.path.exists(arquivo_historico):
-                    with open(arquivo_historico, 'r', encoding='utf-8') as f:
-                        historico = json.load(f)
-                else:
-                    historico = []
-                
-                historico.append(registro)
-                
-                with open(arquivo_historico, 'w', encoding='utf-8') as f:
-                    json.dump(historico, f, ensure_ascii=False, indent=2)
-            
-            print(f"[v0] Ação registrada: {acao} no documento {documento_id}")
+                # Salvar localmente (acrescenta ao log, sem reescrever o histórico)
+                self.historico_local.registrar_varios(registros)
+
+            for r in registros:
+                print(f"[v0] Ação registrada: {r['acao']} no documento {r['documento_id']}")
             return True
-            
+
         except Exception as e:
             print(f"[v0] Erro ao registrar ação: {str(e)}")
             return False
@@ -70,16 +99,11 @@ class HistoricoFirebase:
         try:
             if self.usar_firebase:
                 ref = db.reference(f"documentos/{documento_id}/historico")
-                historico = ref.get()
-                return historico if historico else []
+                historico = ref.order_by_key().get()
+                # O Firebase devolve {chave: registro}; as chaves já estão em ordem cronológica
+                return list(historico.values()) if historico else []
             else:
-                arquivo_historico = f"historico_local_{documento_id}.json"
-                
-                if os.path.exists(arquivo_historico):
-                    with open(arquivo_historico, 'r', encoding='utf-8') as f:
-                        return json.load(f)
-                else:
-                    return []
+                return self.historico_local.listar(documento_id)
                     
         except Exception as e:
             print(f"[v0] Erro ao obter histórico: {str(e)}")
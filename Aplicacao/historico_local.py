@@ -0,0 +1,114 @@
+# ==============================================================================
+# ARQUIVO: historico_local.py
+# DESCRIÇÃO: Armazenamento local do histórico de ações (usado quando o
+#   Firebase não está configurado).
+#   - Um único arquivo SQLite em modo WAL (append-only, sem reescrever o histórico)
+#   - Índice por documento_id: a leitura não depende do tamanho total do log
+#   - Escritas serializadas (lock na aplicação + lock do próprio SQLite entre processos)
+#   - Registros com chave única: reenviar o mesmo registro não duplica
+#   - Importa os antigos historico_local_{id}.json na primeira execução
+# ==============================================================================
+
+import glob
+import json
+import os
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Arquivo do banco local de histórico
+HISTORICO_LOCAL_DB = os.getenv("HISTORICO_LOCAL_DB", "historico_local.db")
+
+# Tempo (ms) esperando outro processo liberar a escrita antes de falhar
+ESPERA_LOCK_MS = 5000
+
+# Padrão dos arquivos JSON gravados pela versão anterior (um por documento)
+PADRAO_JSON_ANTIGO = "historico_local_*.json"
+SUFIXO_IMPORTADO = ".importado"
+
+
+class HistoricoLocal:
+    """Log de histórico append-only em SQLite, indexado por documento."""
+
+    def __init__(self, caminho: str = HISTORICO_LOCAL_DB):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=ESPERA_LOCK_MS / 1000, check_same_thread=False)
+
+        with self._lock:
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            # Em WAL, NORMAL é seguro contra corrupção e evita um fsync por registro
+            self._conexao.execute("PRAGMA synchronous=NORMAL")
+            self._conexao.execute(f"PRAGMA busy_timeout={ESPERA_LOCK_MS}")
+            self._conexao.execute("""
+                CREATE TABLE IF NOT EXISTS historico (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    documento_id INTEGER NOT NULL,
+                    registro TEXT NOT NULL
+                )
+            """)
+            self._conexao.execute(
+                "CREATE INDEX IF NOT EXISTS idx_historico_documento ON historico (documento_id, id)"
+            )
+            self._conexao.execute("CREATE TABLE IF NOT EXISTS json_importados (arquivo TEXT PRIMARY KEY)")
+
+            # Chave do registro (firebase_historico.gerar_chave): reenviar o mesmo registro não duplica
+            colunas = [linha[1] for linha in self._conexao.execute("PRAGMA table_info(historico)")]
+            if "chave" not in colunas:
+                self._conexao.execute("ALTER TABLE historico ADD COLUMN chave TEXT")
+            self._conexao.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_historico_chave ON historico (chave)")
+            self._conexao.commit()
+
+        self._importar_json_antigos()
+
+    def registrar(self, registro: dict):
+        """Acrescenta um registro ao final do log (não lê nem reescreve os anteriores)."""
+        self.registrar_varios([registro])
+
+    def registrar_varios(self, registros: list):
+        """
+        Acrescenta vários registros em uma única transação.
+        Registros com 'chave' já gravada são ignorados (reenvio após falha).
+        """
+        linhas = [(r["documento_id"], r.get("chave"), json.dumps(r, ensure_ascii=False)) for r in registros]
+        with self._lock:
+            with self._conexao:
+                self._conexao.executemany(
+                    "INSERT OR IGNORE INTO historico (documento_id, chave, registro) VALUES (?, ?, ?)", linhas
+                )
+
+    def listar(self, documento_id) -> list:
+        """Registros do documento, na ordem em que foram gravados."""
+        with self._lock:
+            linhas = self._conexao.execute(
+                "SELECT registro FROM historico WHERE documento_id = ? ORDER BY id",
+                (documento_id,)
+            ).fetchall()
+        return [json.loads(linha[0]) for linha in linhas]
+
+    def _importar_json_antigos(self):
+        # O nome do arquivo é gravado na mesma transação dos registros,
+        # então uma importação interrompida não duplica o histórico
+        for arquivo in sorted(glob.glob(PADRAO_JSON_ANTIGO)):
+            try:
+                with open(arquivo, 'r', encoding='utf-8') as f:
+                    registros = json.load(f)
+
+                with self._lock:
+                    with self._conexao:
+                        ja_importado = self._conexao.execute(
+                            "SELECT 1 FROM json_importados WHERE arquivo = ?", (arquivo,)
+                        ).fetchone()
+                        if not ja_importado:
+                            self._conexao.executemany(
+                                "INSERT INTO historico (documento_id, registro) VALUES (?, ?)",
+                                [(r["documento_id"], json.dumps(r, ensure_ascii=False)) for r in registros]
+                            )
+                            self._conexao.execute("INSERT INTO json_importados (arquivo) VALUES (?)", (arquivo,))
+
+                os.replace(arquivo, arquivo + SUFIXO_IMPORTADO)
+                print(f"[v0] Histórico antigo importado: {arquivo} ({len(registros)} registros)")
+            except Exception as e:
+                print(f"[v0] Erro ao importar histórico antigo {arquivo}: {str(e)}")
@@ -0,0 +1,415 @@
+# ==============================================================================
+# ARQUIVO: importacao_lote.py
+# DESCRIÇÃO: Importação de muitos XMLs (NF-e/NFS-e) em uma única requisição.
+#   - Aceita vários .xml e/ou arquivos .zip com XMLs dentro
+#   - Leitura dos XMLs em um pool de processos (parse usa CPU e não libera o GIL)
+#   - Fornecedores resolvidos com um único SELECT ... IN e os que faltam
+#     criados com INSERT de várias linhas
+#   - Documentos gravados com executemany (upsert pela chave de acesso)
+#   - XMLs compactados nos próprios processos de leitura e gravados em
+#     documentos_xml (xml_compactado.py)
+#   - Tudo em uma transação (inclusive os eventos de auditoria); devolve o
+#     resultado de cada arquivo
+#   - Importação de um XML só (gravar_documento): fornecedor e documento com
+#     upsert + LAST_INSERT_ID(id), sem SELECT depois do INSERT, em uma transação
+# ==============================================================================
+
+import asyncio
+import io
+import os
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import text, bindparam
+from dotenv import load_dotenv
+
+from leitor_xml import extrair_dados_xml, ErroLeituraXML
+from resumo_documentos import estado_documentos, aplicar_alteracao
+from xml_compactado import preparar_xml, gravar_xmls, gravar_xml
+import auditoria
+
+load_dotenv()
+
+# Processos usados para ler os XMLs (padrão: um por núcleo)
+XML_WORKERS = int(os.getenv("XML_WORKERS", str(os.cpu_count() or 2)))
+
+# Limites por requisição (protege contra ZIPs gigantes ou "zip bombs")
+LOTE_MAX_ARQUIVOS = int(os.getenv("LOTE_MAX_ARQUIVOS", "5000"))
+LOTE_MAX_BYTES = int(os.getenv("LOTE_MAX_MB", "200")) * 1024 * 1024
+
+# Bloco lido de cada arquivo do ZIP (o limite de tamanho é conferido a cada bloco)
+BLOCO_DESCOMPACTACAO = 1024 * 1024
+
+# Quantidade de XMLs enviada de uma vez para cada processo (reduz o custo de IPC)
+XMLS_POR_TAREFA = 50
+
+# Tamanho máximo das listas em IN (...) e dos executemany
+LINHAS_POR_COMANDO = 1000
+
+ACAO_INSERIDO = "inserido"
+ACAO_ATUALIZADO = "atualizado"
+ACAO_IGNORADO = "ignorado"
+
+_pool = None
+
+
+class LoteInvalido(Exception):
+    """O lote passou dos limites de quantidade/tamanho ou o ZIP está corrompido."""
+    pass
+
+
+def _obter_pool():
+    # Criado sob demanda: só sobe os processos na primeira importação em lote
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=XML_WORKERS)
+    return _pool
+
+
+def _em_blocos(lista, tamanho=LINHAS_POR_COMANDO):
+    for i in range(0, len(lista), tamanho):
+        yield lista[i:i + tamanho]
+
+
+def _ler_entrada(zip_arquivo, info, nome: str, bytes_restantes: int) -> bytes:
+    # Lê em blocos contando os bytes realmente descompactados: o tamanho
+    # declarado no cabeçalho do ZIP (file_size) pode ser falso
+    partes = []
+    with zip_arquivo.open(info) as entrada:
+        while True:
+            bloco = entrada.read(BLOCO_DESCOMPACTACAO)
+            if not bloco:
+                break
+            bytes_restantes -= len(bloco)
+            if bytes_restantes < 0:
+                raise LoteInvalido(f"O conteúdo descompactado de {nome} passa do limite de {LOTE_MAX_BYTES // (1024 * 1024)} MB")
+            partes.append(bloco)
+    return b"".join(partes)
+
+
+def expandir_arquivos(nome: str, conteudo: bytes, bytes_restantes: int):
+    """
+    Transforma um arquivo recebido em uma lista de (nome, bytes).
+    Um .zip vira os XMLs que ele contém; um .xml vira ele mesmo.
+    Arquivos de outro tipo voltam com conteúdo None (viram erro no relatório).
+    ZIP corrompido (inclusive um arquivo interno com CRC errado ou cortado)
+    ou acima do limite de tamanho lança LoteInvalido.
+    """
+    if not nome.lower().endswith('.zip'):
+        return [(nome, conteudo if nome.lower().endswith('.xml') else None)]
+
+    try:
+        zip_arquivo = zipfile.ZipFile(io.BytesIO(conteudo))
+    except zipfile.BadZipFile:
+        raise LoteInvalido(f"Arquivo ZIP inválido ou corrompido: {nome}")
+
+    with zip_arquivo:
+        entradas = [
+            info for info in zip_arquivo.infolist()
+            if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+        ]
+        if len(entradas) > LOTE_MAX_ARQUIVOS:
+            raise LoteInvalido(f"O ZIP {nome} tem mais de {LOTE_MAX_ARQUIVOS} arquivos")
+        if sum(info.file_size for info in entradas) > bytes_restantes:
+            raise LoteInvalido(f"O conteúdo descompactado de {nome} passa do limite de {LOTE_MAX_BYTES // (1024 * 1024)} MB")
+
+        arquivos = []
+        for info in entradas:
+            nome_interno = f"{nome}/{info.filename}"
+            if not info.filename.lower().endswith('.xml'):
+                arquivos.append((nome_interno, None))
+                continue
+            try:
+                xml = _ler_entrada(zip_arquivo, info, nome, bytes_restantes)
+            except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                raise LoteInvalido(f"Arquivo ZIP inválido ou corrompido: {nome_interno} ({e})")
+            except (RuntimeError, NotImplementedError) as e:
+                # Arquivo com senha ou método de compressão não suportado
+                raise LoteInvalido(f"Não foi possível ler {nome_interno} do ZIP: {e}")
+            bytes_restantes -= len(xml)
+            arquivos.append((nome_interno, xml))
+        return arquivos
+
+
+def _analisar_bloco(arquivos):
+    """Roda dentro do processo filho: lê e compacta cada XML e devolve os dados ou o erro."""
+    resultados = []
+    for nome, conteudo in arquivos:
+        if conteudo is None:
+            resultados.append({"arquivo": nome, "erro": "Apenas arquivos .xml são permitidos"})
+            continue
+        try:
+            dados = extrair_dados_xml(conteudo)
+            # Só os bytes compactados voltam ao processo principal (menos dados no IPC)
+            dados["xml"] = preparar_xml(conteudo, dados.pop("encoding"))
+            del dados["xml_string"]
+            resultados.append({"arquivo": nome, "dados": dados})
+        except ErroLeituraXML as e:
+            resultados.append({"arquivo": nome, "erro": str(e)})
+        except Exception as e:
+            resultados.append({"arquivo": nome, "erro": f"Erro ao ler o XML: {e}"})
+    return resultados
+
+
+async def analisar_arquivos(arquivos: list) -> list:
+    """Lê todos os XMLs no pool de processos, mantendo a ordem de entrada."""
+    loop = asyncio.get_running_loop()
+    pool = _obter_pool()
+    tarefas = [
+        loop.run_in_executor(pool, _analisar_bloco, bloco)
+        for bloco in _em_blocos(arquivos, XMLS_POR_TAREFA)
+    ]
+    resultados = []
+    for parcial in await asyncio.gather(*tarefas):
+        resultados.extend(parcial)
+    return resultados
+
+
+def _buscar_fornecedores(sessao, cnpjs: list) -> dict:
+    query = text("SELECT cnpj_cpf, id FROM fornecedores WHERE cnpj_cpf IN :cnpjs").bindparams(
+        bindparam("cnpjs", expanding=True)
+    )
+    encontrados = {}
+    for bloco in _em_blocos(cnpjs):
+        for cnpj, fornecedor_id in sessao.execute(query, {"cnpjs": bloco}).fetchall():
+            encontrados[cnpj] = fornecedor_id
+    return encontrados
+
+
+def _buscar_documentos(sessao, chaves: list) -> dict:
+    query = text("SELECT chave_acesso, id FROM documentos_fiscais WHERE chave_acesso IN :chaves").bindparams(
+        bindparam("chaves", expanding=True)
+    )
+    encontrados = {}
+    for bloco in _em_blocos(chaves):
+        for chave, doc_id in sessao.execute(query, {"chaves": bloco}).fetchall():
+            encontrados[chave] = doc_id
+    return encontrados
+
+
+# LAST_INSERT_ID(id): quando a chave já existe, o lastrowid traz o id do documento
+# atualizado (em vez de 0), então não é preciso um SELECT depois do upsert
+QUERY_UPSERT_DOCUMENTO = text("""
+    INSERT INTO documentos_fiscais
+    (empresa_id, fornecedor_id, tipo_documento, numero_documento, serie, chave_acesso,
+     data_emissao, valor_total, valor_impostos, status_processamento, usuario_criacao_id)
+    VALUES
+    (:empresa_id, :fornecedor_id, :tipo_documento, :numero, :serie, :chave, :data_emissao,
+     :valor_total, :valor_impostos, 'PENDENTE', :usuario_id)
+    ON DUPLICATE KEY UPDATE
+     id = LAST_INSERT_ID(id),
+     valor_total = VALUES(valor_total),
+     status_processamento = 'PENDENTE',
+     xml_content = NULL,
+     updated_at = CURRENT_TIMESTAMP
+""")
+
+# Cria o fornecedor ou, se o CNPJ já existir, só devolve o id dele no lastrowid
+QUERY_UPSERT_FORNECEDOR = text("""
+    INSERT INTO fornecedores (empresa_id, cnpj_cpf, tipo_pessoa, razao_social, ativo)
+    VALUES (:empresa_id, :cnpj, 'PJ', :razao, 1)
+    ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+""")
+
+
+def _parametros_documento(dados: dict, fornecedor_id: int, empresa_id: int, usuario_id: int) -> dict:
+    return {
+        "empresa_id": empresa_id,
+        "usuario_id": usuario_id,
+        "fornecedor_id": fornecedor_id,
+        "tipo_documento": dados["tipo_documento"],
+        "numero": dados["numero"],
+        "serie": dados["serie"],
+        "chave": dados["chave_acesso"],
+        "data_emissao": dados["data_emissao"],
+        "valor_total": dados["valor_total"],
+        "valor_impostos": dados["valor_impostos"]
+    }
+
+
+def _evento_documento(dados: dict, documento_id: int, criado: bool, origem: str, ip_address: str,
+                      empresa_id: int, usuario_id: int) -> dict:
+    return auditoria.evento(
+        auditoria.DOCUMENTO_CRIADO if criado else auditoria.DOCUMENTO_EDITADO,
+        f"Doc Fiscal Nº {dados['numero']} (R$ {auditoria.formatar_valor(dados['valor_total'])}) "
+        f"foi {'criado' if criado else 'atualizado'} pela {origem}.",
+        empresa_id=empresa_id, usuario_id=usuario_id, referencia_id=documento_id, ip_address=ip_address
+    )
+
+
+def gravar_documento(sessao, dados: dict, conteudo: bytes, ip_address: str = None,
+                     empresa_id: int = 1, usuario_id: int = 1) -> dict:
+    """
+    Grava um XML lido por extrair_dados_xml() em uma única transação (executar
+    via db.run_sync): fornecedor, documento, XML compactado, resumo do dashboard
+    e evento de auditoria. 'empresa_id'/'usuario_id' vêm da sessão de quem importou.
+    Retorna {"documento_id", "fornecedor_id", "acao"}, com acao 'inserido' ou 'atualizado'.
+    """
+    try:
+        # 1. Fornecedor: cria ou acha pelo CNPJ em um só comando
+        result = sessao.execute(QUERY_UPSERT_FORNECEDOR, {
+            "empresa_id": empresa_id,
+            "cnpj": dados["cnpj_fornecedor"],
+            "razao": dados["razao_fornecedor"]
+        })
+        fornecedor_id = result.lastrowid
+
+        # 2. Estado anterior (resumo do dashboard); vazio se a chave ainda não existe
+        chave = dados["chave_acesso"]
+        antes = estado_documentos(sessao, chaves=[chave]) if chave else []
+
+        # 3. Documento: o id vem no lastrowid tanto na inserção quanto na atualização
+        result = sessao.execute(QUERY_UPSERT_DOCUMENTO, _parametros_documento(dados, fornecedor_id, empresa_id, usuario_id))
+        documento_id = result.lastrowid
+        # Com CLIENT_FOUND_ROWS (padrão do SQLAlchemy) o rowcount é 1 na inserção e
+        # 2 na atualização (1 também se nada mudou, caso coberto por 'antes')
+        criado = not antes and result.rowcount == 1
+
+        # 4. XML compactado, resumo e auditoria na mesma transação
+        gravar_xml(sessao, documento_id, conteudo, dados["encoding"])
+        aplicar_alteracao(sessao, antes, [documento_id])
+        auditoria.registrar_eventos(sessao, [
+            _evento_documento(dados, documento_id, criado, "importação de XML", ip_address, empresa_id, usuario_id)
+        ])
+
+        sessao.commit()
+    except Exception:
+        sessao.rollback()
+        raise
+
+    return {
+        "documento_id": documento_id,
+        "fornecedor_id": fornecedor_id,
+        "acao": ACAO_INSERIDO if criado else ACAO_ATUALIZADO
+    }
+
+
+def gravar_lote(sessao, itens: list, ip_address: str = None, empresa_id: int = 1, usuario_id: int = 1) -> None:
+    """
+    Grava os documentos lidos em uma única transação (executar via db.run_sync).
+    'itens' é a lista devolvida por analisar_arquivos(); os itens sem erro
+    recebem 'documento_id' e 'acao' (inserido, atualizado ou ignorado).
+    'ip_address' vai para os eventos de auditoria; 'empresa_id'/'usuario_id' vêm
+    da sessão de quem importou.
+    """
+    validos = [item for item in itens if "dados" in item]
+    if not validos:
+        return
+
+    try:
+        # 1. Fornecedores: um SELECT para todos os CNPJs do lote
+        razoes = {}
+        for item in validos:
+            razoes.setdefault(item["dados"]["cnpj_fornecedor"], item["dados"]["razao_fornecedor"])
+
+        fornecedores = _buscar_fornecedores(sessao, list(razoes))
+        faltando = [
+            {"empresa_id": empresa_id, "cnpj": cnpj, "razao": razao}
+            for cnpj, razao in razoes.items() if cnpj not in fornecedores
+        ]
+
+        if faltando:
+            # O PyMySQL transforma o executemany em INSERT ... VALUES (...), (...), ...
+            # 'id = id' ignora CNPJs criados por outra importação ao mesmo tempo
+            insert_fornecedor = text("""
+                INSERT INTO fornecedores (empresa_id, cnpj_cpf, tipo_pessoa, razao_social, ativo)
+                VALUES (:empresa_id, :cnpj, 'PJ', :razao, 1)
+                ON DUPLICATE KEY UPDATE id = id
+            """)
+            for bloco in _em_blocos(faltando):
+                sessao.execute(insert_fornecedor, bloco)
+            fornecedores.update(_buscar_fornecedores(sessao, [f["cnpj"] for f in faltando]))
+
+        # 2. Documentos com chave de acesso: upsert em lote
+        # Se a mesma chave vier repetida no lote, vale a última ocorrência
+        por_chave = {}
+        sem_chave = []
+        for item in validos:
+            chave = item["dados"]["chave_acesso"]
+            if chave:
+                anterior = por_chave.get(chave)
+                if anterior:
+                    anterior["acao"] = ACAO_IGNORADO
+                    anterior["mensagem"] = f"Chave de acesso repetida no lote (substituída por {item['arquivo']})"
+                por_chave[chave] = item
+            else:
+                sem_chave.append(item)
+
+        existentes = _buscar_documentos(sessao, list(por_chave))
+        # Estado anterior dos documentos que serão atualizados (resumo do dashboard)
+        antes = estado_documentos(sessao, ids=list(existentes.values()))
+
+        def parametros(dados):
+            return _parametros_documento(dados, fornecedores[dados["cnpj_fornecedor"]], empresa_id, usuario_id)
+
+        linhas = [parametros(item["dados"]) for item in por_chave.values()]
+        for bloco in _em_blocos(linhas):
+            sessao.execute(QUERY_UPSERT_DOCUMENTO, bloco)
+
+        ids = _buscar_documentos(sessao, list(por_chave))
+        for chave, item in por_chave.items():
+            item["documento_id"] = ids.get(chave)
+            item["acao"] = ACAO_ATUALIZADO if chave in existentes else ACAO_INSERIDO
+
+        for item in validos:
+            if item.get("acao") == ACAO_IGNORADO:
+                item["documento_id"] = ids.get(item["dados"]["chave_acesso"])
+
+        # 3. Documentos sem chave: não há como fazer upsert, insere um a um para obter o id
+        for item in sem_chave:
+            result = sessao.execute(QUERY_UPSERT_DOCUMENTO, parametros(item["dados"]))
+            item["documento_id"] = result.lastrowid
+            item["acao"] = ACAO_INSERIDO
+
+        # 4. XMLs compactados (já vêm prontos dos processos de leitura)
+        xmls = [
+            {**item["dados"]["xml"], "documento_fiscal_id": item["documento_id"]}
+            for item in validos if item.get("acao") != ACAO_IGNORADO and item.get("documento_id")
+        ]
+        for bloco in _em_blocos(xmls):
+            gravar_xmls(sessao, bloco)
+
+        # 5. Resumo do dashboard: aplica a diferença de todos os documentos gravados
+        gravados = {item["documento_id"] for item in validos if item.get("documento_id")}
+        aplicar_alteracao(sessao, antes, list(gravados))
+
+        # 6. Auditoria: um evento por documento gravado (INSERT de várias linhas)
+        eventos = []
+        for item in validos:
+            if item.get("acao") == ACAO_IGNORADO:
+                continue
+            eventos.append(_evento_documento(
+                item["dados"], item["documento_id"], item["acao"] == ACAO_INSERIDO,
+                "importação de XML em lote", ip_address, empresa_id, usuario_id
+            ))
+        for bloco in _em_blocos(eventos):
+            auditoria.registrar_eventos(sessao, bloco)
+
+        sessao.commit()
+    except Exception:
+        sessao.rollback()
+        raise
+
+
+def montar_relatorio(itens: list) -> list:
+    """Resultado por arquivo, no formato devolvido pela API."""
+    relatorio = []
+    for item in itens:
+        if "erro" in item:
+            relatorio.append({"arquivo": item["arquivo"], "success": False, "erro": item["erro"]})
+            continue
+
+        dados = item["dados"]
+        linha = {
+            "arquivo": item["arquivo"],
+            "success": True,
+            "documento_id": item.get("documento_id"),
+            "acao": item.get("acao"),
+            "tipo_documento": dados["tipo_documento"],
+            "numero": dados["numero"],
+            "chave_acesso": dados["chave_acesso"]
+        }
+        if item.get("mensagem"):
+            linha["mensagem"] = item["mensagem"]
+        relatorio.append(linha)
+    return relatorio
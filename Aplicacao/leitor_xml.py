@@ -0,0 +1,370 @@
+# ==============================================================================
+# ARQUIVO: leitor_xml.py
+# DESCRIÇÃO: Leitura de XMLs de notas fiscais (NF-e e NFS-e).
+#   - Detecção de encoding (BOM, declaração XML, UTF-8 estrito, amostra p/ chardet)
+#   - Encoding declarado de um XML já gravado (download do XML original)
+#   - Identificação do formato (NF-e Federal ou NFS-e padrão SP)
+#   - Extração dos campos usados no cadastro do documento fiscal direto dos
+#     bytes (sem decode + replace antes do parse): árvore montada pelo parser
+#     em C e campos da NF-e buscados pelo caminho exato. Acima de
+#     XML_ITERPARSE_MB, uma única passada com iterparse, liberando cada
+#     elemento lido e pulando as partes sem campos (itens, assinatura)
+#   Não depende do banco nem do FastAPI, então pode rodar em processos
+#   separados (importação em lote).
+# ==============================================================================
+
+import codecs
+import io
+import os
+import re
+import xml.etree.ElementTree as ET
+import chardet
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class ErroLeituraXML(Exception):
+    """Arquivo recebido não pôde ser lido como nota fiscal (erro do usuário, HTTP 400)."""
+    pass
+
+
+# Marcas de ordem de bytes (BOM) -> codec do Python
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Codecs aceitos para XMLs sem declaração que não são UTF-8 válido
+ENCODINGS_ACEITOS = ('iso8859-1', 'cp1252', 'latin-1')
+
+# Quantidade máxima de bytes analisados pelo chardet (o custo dele cresce com o tamanho)
+AMOSTRA_CHARDET = 64 * 1024
+
+# Acima deste tamanho o XML é lido com iterparse: mais lento que montar a
+# árvore, mas a memória não cresce com o arquivo
+XML_ITERPARSE_BYTES = int(os.getenv("XML_ITERPARSE_MB", "8")) * 1024 * 1024
+
+# <?xml version="1.0" encoding="ISO-8859-1"?>, com aspas simples ou duplas e qualquer caixa
+_RE_DECLARACAO = re.compile(
+    rb'^\s*<\?xml\s[^>]*?\bencoding\s*=\s*(["\'])([A-Za-z][A-Za-z0-9._-]*)\1'
+)
+_RE_BYTE_NAO_ASCII = re.compile(rb'[\x80-\xff]')
+
+
+def _codec(nome):
+    """Nome canônico do codec no Python ('ISO-8859-1' -> 'iso8859-1'), ou None se não existir."""
+    try:
+        return codecs.lookup(nome).name
+    except LookupError:
+        return None
+
+
+def detect_encoding(content: bytes) -> str:
+    """
+    Detecta o encoding de um arquivo XML, pois muitos vêm como 'iso-8859-1'.
+    Ordem: BOM, declaração <?xml encoding=...?>, UTF-8 estrito e, só então,
+    chardet sobre uma amostra limitada a partir do primeiro byte não ASCII.
+    """
+    # 1. BOM
+    for bom, encoding in BOMS:
+        if content.startswith(bom):
+            return encoding
+
+    # 2. Declaração XML (ex: <?xml version="1.0" encoding='windows-1252'?>)
+    declaracao = _RE_DECLARACAO.match(content[:200])
+    if declaracao:
+        encoding = _codec(declaracao.group(2).decode('ascii'))
+        if encoding:
+            return encoding
+
+    # 3. Sem declaração: UTF-8 é o padrão do XML; a validação estrita é rápida
+    try:
+        content.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    # 4. Adivinha com chardet, olhando só o trecho que tem acentos
+    inicio = _RE_BYTE_NAO_ASCII.search(content)
+    amostra = content[inicio.start():inicio.start() + AMOSTRA_CHARDET] if inicio else content[:AMOSTRA_CHARDET]
+    encoding = _codec(chardet.detect(amostra).get('encoding') or '')
+
+    # Garante um fallback seguro (latin-1 decodifica qualquer sequência de bytes)
+    if encoding not in ENCODINGS_ACEITOS:
+        return 'iso8859-1'
+
+    return encoding
+
+
+def encoding_declarado(texto: str) -> str:
+    """
+    Codec da declaração <?xml encoding=...?> de um XML já decodificado (como
+    gravado em xml_content), para devolvê-lo nos mesmos bytes do original.
+    Sem declaração (ou com codec desconhecido) o padrão do XML é UTF-8.
+    """
+    declaracao = _RE_DECLARACAO.match(texto[:200].encode('ascii', 'replace'))
+    if declaracao:
+        encoding = _codec(declaracao.group(2).decode('ascii'))
+        if encoding:
+            return encoding
+    return 'utf-8'
+
+
+def _encoding_parser(encoding: str) -> str:
+    # O expat reconhece o BOM sozinho; 'utf-8-sig' não é um nome que ele aceite
+    return 'utf-8' if encoding == 'utf-8-sig' else encoding
+
+
+# Campos da NF-e: (elemento pai, elemento) -> campo. Buscados dentro do primeiro <infNFe>
+# (ide e emit são filhos de <infNFe>; ICMSTot fica em <total>)
+CAMPOS_NFE = {
+    ("ide", "nNF"): "numero",
+    ("ide", "serie"): "serie",
+    ("ide", "dhEmi"): "data_emissao",
+    ("ICMSTot", "vNF"): "valor_total",
+    ("ICMSTot", "vTotTrib"): "valor_impostos",
+    ("emit", "CNPJ"): "cnpj_fornecedor",
+    ("emit", "xNome"): "razao_fornecedor",
+}
+
+# Campos da NFS-e (padrão SP): elemento -> campo (vale a primeira ocorrência)
+CAMPOS_NFSE = {
+    "NumeroNFe": "numero",
+    "CodigoVerificacao": "chave_acesso",
+    "DataEmissaoNFe": "data_emissao",
+    "DataEmissao": "data_emissao_alternativa",
+    "ValorServicos": "valor_total",
+    "ValorISS": "valor_impostos",
+    "RazaoSocialPrestador": "razao_fornecedor",
+}
+
+# CNPJ do prestador na NFS-e: (elemento pai, elemento) -> campo
+CAMPOS_NFSE_CNPJ = {
+    ("CPFCNPJPrestador", "CNPJ"): "cnpj_fornecedor",
+    ("PrestadorServico", "Cnpj"): "cnpj_fornecedor_alternativo",
+}
+
+# Filhos de <infNFe> que têm campos; os outros (det, dest, transp, pag...) são pulados
+FILHOS_INFNFE_LIDOS = frozenset(("ide", "emit", "total"))
+
+
+def _nome_local(tag: str) -> str:
+    # '{http://www.portalfiscal.inf.br/nfe}infNFe' -> 'infNFe'
+    return tag.rsplit("}", 1)[-1] if tag[:1] == "{" else tag
+
+
+# Caminho de cada campo da NF-e a partir do filho de <infNFe> que o contém
+_CAMINHOS_NFE = {
+    campo: ("total", "{*}ICMSTot/{*}" + nome) if pai == "ICMSTot" else (pai, "{*}" + nome)
+    for (pai, nome), campo in CAMPOS_NFE.items()
+}
+
+
+def _achar_infnfe(raiz):
+    """Primeiro <infNFe>: nos caminhos usuais (nfeProc/NFe/infNFe, NFe/infNFe) e, senão, em qualquer nível."""
+    nome = _nome_local(raiz.tag)
+    if nome == "infNFe":
+        return raiz
+    if nome == "NFe":
+        infnfe = raiz.find("{*}infNFe")
+    else:
+        infnfe = raiz.find("{*}NFe/{*}infNFe")
+    return infnfe if infnfe is not None else raiz.find(".//{*}infNFe")
+
+
+def _ler_campos_arvore(content: bytes, encoding: str):
+    """
+    Monta a árvore com o parser em C, direto sobre os bytes, e lê os campos:
+    na NF-e pelo caminho exato a partir do <infNFe>; na NFS-e em uma passada
+    pelo primeiro <NFe> (ou pelo documento todo, se não houver <NFe>).
+    Retorna (achou_infNFe, infNFe_id ou None, campos NF-e, campos NFS-e).
+    """
+    raiz = ET.fromstring(content, parser=ET.XMLParser(encoding=_encoding_parser(encoding)))
+
+    infnfe = _achar_infnfe(raiz)
+    if infnfe is not None:
+        # ide/emit/total em uma passada pelos filhos (os <det> podem ser milhares)
+        filhos = {}
+        for filho in infnfe:
+            nome = _nome_local(filho.tag)
+            if nome in FILHOS_INFNFE_LIDOS:
+                filhos.setdefault(nome, filho)
+        campos_nfe = {}
+        for campo, (filho, caminho) in _CAMINHOS_NFE.items():
+            elem = filhos[filho].find(caminho) if filho in filhos else None
+            if elem is not None:
+                campos_nfe[campo] = elem.text
+        return True, infnfe.get("Id"), campos_nfe, {}
+
+    nfe = raiz if _nome_local(raiz.tag) == "NFe" else raiz.find(".//{*}NFe")
+    if nfe is None:
+        nfe = raiz
+    campos_nfse = {}
+    for pai in nfe.iter():
+        nome_pai = _nome_local(pai.tag)
+        for elem in pai:
+            nome = _nome_local(elem.tag)
+            campo = CAMPOS_NFSE.get(nome) or CAMPOS_NFSE_CNPJ.get((nome_pai, nome))
+            if campo:
+                campos_nfse.setdefault(campo, elem.text)
+    return False, None, {}, campos_nfse
+
+
+def _ler_campos_iterparse(content: bytes, encoding: str):
+    """
+    Percorre o XML uma única vez (iterparse), direto sobre os bytes, guardando
+    só os campos usados. Cada elemento é liberado assim que termina de ser lido.
+    Retorna (achou_infNFe, infNFe_id ou None, campos NF-e, campos NFS-e).
+    """
+    parser = ET.XMLParser(encoding=_encoding_parser(encoding))
+    caminho = []
+    nomes = {}  # tag com namespace -> nome local (as tags se repetem muito)
+
+    # Profundidade dentro de uma subárvore sem campos (ex: os <det> da NF-e).
+    # Nela cada evento só conta o nível e libera o elemento: é a maior parte
+    # de uma NF-e grande
+    pular = 0
+
+    # 0 = ainda não achou <infNFe>, 1 = dentro do primeiro, 2 = já saiu dele
+    estado_nfe = 0
+    infnfe_id = None
+    campos_nfe = {}
+
+    # A NFS-e é lida dentro do primeiro <NFe>; se não houver <NFe>, no documento todo
+    estado_tag_nfe = 0
+    campos_nfse_tag = {}
+    campos_nfse_documento = {}
+
+    for evento, elem in ET.iterparse(io.BytesIO(content), events=("start", "end"), parser=parser):
+        if pular:
+            if evento == "start":
+                pular += 1
+            else:
+                pular -= 1
+                elem.clear()
+            continue
+
+        nome = nomes.get(elem.tag)
+        if nome is None:
+            nome = nomes[elem.tag] = _nome_local(elem.tag)
+
+        if evento == "start":
+            # Depois do primeiro <infNFe> o documento é NF-e: os campos de
+            # NFS-e e o resto do arquivo (assinatura, protocolo) não são usados
+            if estado_nfe == 2 or (estado_nfe == 1 and caminho[-1] == "infNFe"
+                                   and nome not in FILHOS_INFNFE_LIDOS):
+                pular = 1
+                continue
+            caminho.append(nome)
+            if nome == "infNFe" and estado_nfe == 0:
+                estado_nfe = 1
+                infnfe_id = elem.get("Id")
+            elif nome == "NFe" and estado_tag_nfe == 0:
+                estado_tag_nfe = 1
+            continue
+
+        caminho.pop()
+        pai = caminho[-1] if caminho else None
+
+        if estado_nfe == 1:
+            if nome == "infNFe":
+                estado_nfe = 2
+            else:
+                campo = CAMPOS_NFE.get((pai, nome))
+                # ICMSTot pode estar em qualquer nível de <total>; ide/emit são filhos diretos
+                if campo and campo not in campos_nfe and (pai == "ICMSTot" or caminho[-2:-1] == ["infNFe"]):
+                    campos_nfe[campo] = elem.text
+
+        campo = CAMPOS_NFSE.get(nome) or CAMPOS_NFSE_CNPJ.get((pai, nome))
+        if campo:
+            campos_nfse_documento.setdefault(campo, elem.text)
+            if estado_tag_nfe == 1:
+                campos_nfse_tag.setdefault(campo, elem.text)
+
+        if nome == "NFe" and estado_tag_nfe == 1:
+            estado_tag_nfe = 2
+
+        # Libera o conteúdo já lido (memória não cresce com o tamanho do XML)
+        elem.clear()
+
+    campos_nfse = campos_nfse_tag if estado_tag_nfe else campos_nfse_documento
+    return estado_nfe > 0, infnfe_id, campos_nfe, campos_nfse
+
+
+def _ler_campos(content: bytes, encoding: str):
+    """Campos do XML: árvore inteira (mais rápida) ou, nos arquivos grandes, iterparse."""
+    if len(content) > XML_ITERPARSE_BYTES:
+        return _ler_campos_iterparse(content, encoding)
+    return _ler_campos_arvore(content, encoding)
+
+
+def extrair_dados_xml(content: bytes) -> dict:
+    """
+    Lê o conteúdo de um XML de NF-e ou NFS-e e devolve os dados do documento:
+    tipo_documento, numero, serie, chave_acesso, data_emissao, valor_total,
+    valor_impostos, cnpj_fornecedor, razao_fornecedor, xml_string e encoding
+    (codec usado na decodificação, gravado junto com o XML compactado).
+    Lança ErroLeituraXML com a mensagem para o usuário se o arquivo for inválido.
+    """
+    if content.startswith(b'%PDF-'):
+        print("[v0 Backend] Erro: O arquivo é um PDF, não um XML.")
+        raise ErroLeituraXML("Arquivo inválido. O conteúdo é de um PDF, apesar da extensão .xml")
+
+    try:
+        encoding = detect_encoding(content)
+        # A decodificação valida o encoding detectado; o parse é feito sobre os bytes
+        xml_string = content.decode(encoding)
+    except UnicodeDecodeError as e:
+        print(f"[v0 Backend] Erro de decodificação: {e}")
+        raise ErroLeituraXML(f"Erro de decodificação. O arquivo pode estar corrompido: {e}")
+
+    try:
+        achou_nfe, infnfe_id, campos_nfe, campos_nfse = _ler_campos(content, encoding)
+    except ET.ParseError as e:
+        print(f"[v0 Backend] Erro de Parse XML: {e}")
+        raise ErroLeituraXML(f"Não foi possível ler o XML. O arquivo está mal formatado: {e}")
+
+    # --- TENTATIVA 1: NF-e (Padrão Federal) ---
+    if achou_nfe:
+        print("[v0 Backend] Detectado XML de NF-e (Federal)")
+        tipo_documento = 'NF-e'
+        chave_acesso = infnfe_id.replace('NFe', '') if infnfe_id else None
+        campos = campos_nfe
+        cnpj_fornecedor = campos.get("cnpj_fornecedor")
+
+    # --- TENTATIVA 2: NFS-e (Nota de Serviço, ex: SP) ---
+    else:
+        print("[v0 Backend] Detectado XML de NFS-e (Nota de Serviço)")
+        tipo_documento = 'NFS-e'
+        campos = campos_nfse
+        chave_acesso = campos.get("chave_acesso")
+        if "data_emissao" not in campos and "data_emissao_alternativa" in campos:
+            campos["data_emissao"] = campos["data_emissao_alternativa"]
+        if "cnpj_fornecedor" in campos:
+            cnpj_fornecedor = campos["cnpj_fornecedor"]
+        else:
+            cnpj_fornecedor = campos.get("cnpj_fornecedor_alternativo")
+
+    razao_fornecedor = campos.get("razao_fornecedor")
+    data_emissao = campos.get("data_emissao")
+
+    # --- Validação dos dados extraídos ---
+    if not cnpj_fornecedor or not razao_fornecedor:
+        print(f"[v0 Backend] Erro: Não foi possível extrair CNPJ ({cnpj_fornecedor}) ou RazaoSocial ({razao_fornecedor}).")
+        raise ErroLeituraXML("Não foi possível extrair o CNPJ ou a Razão Social do XML. Formato não suportado.")
+
+    return {
+        "tipo_documento": tipo_documento,
+        "numero": campos.get("numero"),
+        "serie": campos.get("serie"),
+        "chave_acesso": chave_acesso,
+        "data_emissao": data_emissao[:10] if data_emissao else None,
+        "valor_total": float(campos["valor_total"]) if "valor_total" in campos else 0,
+        "valor_impostos": float(campos["valor_impostos"]) if "valor_impostos" in campos else 0,
+        "cnpj_fornecedor": cnpj_fornecedor,
+        "razao_fornecedor": razao_fornecedor,
+        "xml_string": xml_string,
+        "encoding": encoding
+    }
@@ -8,33 +8,85 @@
 # ==============================================================================
 
 from fastapi import FastAPI, Request, Depends, File, UploadFile, Form, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 from sqlalchemy import text
+import codecs
+import csv
+import io
 import json
 import os
-import hashlib
-import uuid
-from datetime import datetime
-from typing import Optional
-import xml.etree.ElementTree as ET
-import chardet
+from typing import Optional, List
+from contextlib import asynccontextmanager
+import time
+from anyio import to_thread
 import traceback
 import pymysql # Adicionado para tratar erros de duplicidade (IntegrityError)
 
 # --- IMPORTS LOCAIS ---
-from database import get_db, engine
+from database import get_db, get_db_leitura, engine, SessaoAssincrona, estado_pool # get_db_leitura: réplica para rotas só de leitura
 from firebase_historico import historico_db # Módulo de logs no Firebase
+from fila_historico import fila_historico # Gravação do histórico em segundo plano, em lote
+from senhas import verificar_senha, gerar_hash, FilaSenhasCheia # Bcrypt fora do event loop
+from paginacao import (
+    PAGINA_PADRAO, PAGINA_MAXIMA, CONTAGEM_NENHUMA, CursorInvalido, ContagemInvalida, normalizar_limite, aplicar_cursor,
+    clausula_ordem, clausula_limite, fatiar_pagina, contar_registros, parametros_cursor, contar_consulta
+) # Paginação por cursor (keyset)
+from consultas import (
+    ORDENACAO_DOCUMENTOS, ORDENACAO_PROVISIONAMENTOS, ORDENACAO_REMESSAS,
+    CAMPOS_LISTA_DOCUMENTO, CAMPOS_DETALHE_DOCUMENTO, CampoInvalido, campos_solicitados, linha_para_dict,
+    consulta_documentos, consulta_provisionamentos, consulta_remessas, consulta_detalhe_documento
+) # Consultas das listagens em SQLAlchemy Core, reaproveitadas por forma de filtro; projeção fields=
+from busca import planejar_busca # Pesquisa livre com índices (FULLTEXT/prefixo/faixa)
+from armazenamento import (
+    ArquivoMuitoGrande, UPLOAD_MAX_BYTES, receber_upload, materializar_objeto, descartar_temporario,
+    caminho_objeto, caminho_absoluto, marcar_exclusao, restaurar_exclusao, confirmar_exclusao
+) # Upload em blocos e armazenamento por hash (sem duplicatas)
+from cache_memoria import CacheTTL # Cache em memória com validade (dashboard)
+from dados_referencia import dados_referencia # Listagens de cadastro em cache + ETag/304
+from resumo_documentos import estado_documentos, atualizar_resumo, aplicar_alteracao # Resumo incremental do dashboard
+from leitor_xml import extrair_dados_xml, encoding_declarado, ErroLeituraXML # Leitura de NF-e/NFS-e
+from importacao_lote import (
+    LOTE_MAX_ARQUIVOS, LOTE_MAX_BYTES, ACAO_INSERIDO, ACAO_ATUALIZADO, LoteInvalido,
+    expandir_arquivos, analisar_arquivos, gravar_lote, gravar_documento, montar_relatorio
+) # Importação de vários XMLs/ZIP em uma requisição
+import auditoria # Log de auditoria gravado junto com cada ação
+from xml_compactado import ler_xml, texto_xml, descompactar_em_blocos # XMLs compactados (documentos_xml)
+from cnab import ErroCNAB, primeira_remessa, gravar_retorno, gerar_remessa as gerar_remessa_cnab # Remessa e retorno CNAB
+from auditoria import evento, registrar_eventos, formatar_valor, ip_cliente
+from sessoes import ( # Sessões de login com cache em memória
+    SessaoInvalida, SessaoUsuario, gerenciador_sessoes, usuario_atual,
+    criar_sessao, encerrar_sessao, encerrar_sessoes_usuario
+)
+from permissoes import PermissaoNegada, NIVEL_ADMIN, perfis, exigir_permissao, ler_permissoes # Perfis compilados em memória
 
 # ==============================================================================
 # CONFIGURAÇÃO INICIAL DO APP
 # ==============================================================================
 
-app = FastAPI()
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Inicia a gravação do histórico em segundo plano e, ao parar, grava o que ficou na fila
+    await fila_historico.iniciar()
+    # Gravação em lote do último acesso das sessões e expiração das inativas
+    await gerenciador_sessoes.iniciar()
+    yield
+    await gerenciador_sessoes.encerrar()
+    await fila_historico.encerrar()
+
+app = FastAPI(lifespan=ciclo_de_vida)
+
+@app.exception_handler(SessaoInvalida)
+async def sessao_invalida(request: Request, exc: SessaoInvalida):
+    # Rotas com Depends(usuario_atual) chamadas sem login válido
+    return JSONResponse(status_code=401, content={"erro": str(exc)})
+
+@app.exception_handler(PermissaoNegada)
+async def permissao_negada(request: Request, exc: PermissaoNegada):
+    # Rotas com Depends(exigir_permissao(...)) fora do perfil do usuário
+    return JSONResponse(status_code=403, content={"erro": str(exc)})
 
 # Configuração de arquivos estáticos (CSS, JS)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -48,8 +100,13 @@ app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 # Configuração de Templates (Jinja2)
 templates = Jinja2Templates(directory="templates")
 
-# Configuração de Hash de Senhas (Bcrypt)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cache do dashboard: validade em segundos, quantidade máxima de empresas por
+# processo (o empresa_id vem da query string; passando do limite, sai a usada
+# há mais tempo) e tamanho do ranking de fornecedores
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+DASHBOARD_CACHE_MAX = int(os.getenv("DASHBOARD_CACHE_MAX", "1000"))
+DASHBOARD_TOP_FORNECEDORES = 10
+cache_dashboard = CacheTTL(DASHBOARD_CACHE_TTL, max_itens=DASHBOARD_CACHE_MAX)
 
 # Modelo de dados para Login
 class LoginRequest(BaseModel):
@@ -80,10 +137,10 @@ async def projeto_page(request: Request):
 # ==============================================================================
 
 @app.get("/api/test-db")
-async def test_database(db: Session = Depends(get_db)):
+async def test_database(db: SessaoAssincrona = Depends(get_db)):
     """Testa a conexão com o banco de dados MySQL."""
     try:
-        result = db.execute(text("SELECT DATABASE() as db_name, VERSION() as version"))
+        result = await db.execute(text("SELECT DATABASE() as db_name, VERSION() as version"))
         row = result.fetchone()
         
         return {
@@ -97,8 +154,19 @@ async def test_database(db: Session = Depends(get_db)):
             "erro": str(e)
         }
 
+@app.get("/api/metrics")
+async def obter_metricas(usuario: SessaoUsuario = Depends(exigir_permissao(nivel_minimo=NIVEL_ADMIN))):
+    """
+    Métricas do pool de conexões deste worker: conexões em uso/livres/overflow,
+    tempo de espera por conexão, timeouts, conexões trocadas pelo pre-ping e
+    ocupação do pool de threads do banco. Use para dimensionar DB_POOL_SIZE e
+    DB_MAX_OVERFLOW (o total entre todos os workers não pode passar do max_connections do MySQL).
+    Só para administradores (mostra a configuração e os erros do banco).
+    """
+    return estado_pool()
+
 @app.post("/api/login")
-async def fazer_login(dados: LoginRequest, db: Session = Depends(get_db)):
+async def fazer_login(dados: LoginRequest, request: Request, db: SessaoAssincrona = Depends(get_db)):
     """
     Processa o login do usuário.
     Verifica credenciais, hash da senha e retorna o token + permissões.
@@ -107,15 +175,15 @@ async def fazer_login(dados: LoginRequest, db: Session = Depends(get_db)):
         query = text("""
             SELECT 
                 u.id, u.nome, u.email, u.senha_hash, u.departamento,
-                r.nome as role, r.permissoes_base, r.nivel_acesso,
-                e.razao_social as empresa
+                r.nome as role, r.nivel_acesso,
+                e.razao_social as empresa, u.empresa_id, u.role_id
             FROM usuarios u
             JOIN roles r ON u.role_id = r.id
             JOIN empresas e ON u.empresa_id = e.id
             WHERE u.email = :email AND u.ativo = 1
         """)
 
-        result = db.execute(query, {"email": dados.email})
+        result = await db.execute(query, {"email": dados.email})
         usuario = result.fetchone()
         
         if not usuario:
@@ -128,7 +196,7 @@ async def fazer_login(dados: LoginRequest, db: Session = Depends(get_db)):
         
         # Verifica a senha (compatibilidade com versões antigas e novas de hash)
         if senha_hash and (senha_hash.startswith('$2b$') or senha_hash.startswith('$2a$')):
-            if not pwd_context.verify(dados.senha, senha_hash):
+            if not await verificar_senha(dados.senha, senha_hash):
                 return JSONResponse(
                     status_code=401,
                     content={"success": False, "message": "Senha incorreta"}
@@ -140,37 +208,76 @@ async def fazer_login(dados: LoginRequest, db: Session = Depends(get_db)):
                     content={"success": False, "message": "Senha incorreta"}
                 )
         
-        # Processa as permissões do usuário (JSON)
-        permissoes = usuario[6]
-        if permissoes and isinstance(permissoes, str):
-            try:
-                permissoes = json.loads(permissoes)
-            except:
-                permissoes = {"menus": ["dashboard"]}
-        elif not permissoes:
-            permissoes = {"menus": ["dashboard"]}
+        # Permissões do perfil (JSON já lido no cache de perfis)
+        perfil = await perfis.perfil(usuario[9], db)
+        permissoes = perfil.permissoes if perfil else ler_permissoes(None)
+        
+        # Sessão em user_sessions; o token assinado vai no cabeçalho Authorization
+        sessao_usuario, token = await db.run_sync(
+            criar_sessao, usuario[0], usuario[8], usuario[9],
+            ip_cliente(request), request.headers.get("user-agent")
+        )
+        await db.commit()
+        gerenciador_sessoes.guardar(sessao_usuario)
+        
+        # Auditoria do login: uma falha aqui não impede o usuário de entrar
+        try:
+            await db.run_sync(registrar_eventos, [evento(
+                auditoria.LOGIN, f"Usuário {usuario[1]} ({usuario[2]}) entrou no sistema.",
+                empresa_id=usuario[8], usuario_id=usuario[0], ip_address=ip_cliente(request)
+            )])
+            await db.commit()
+        except Exception as e_audit:
+            await db.rollback()
+            print(f"[v0 Backend] Erro ao registrar login na auditoria: {str(e_audit)}")
         
         return {
             "success": True,
-            "token": f"token-{usuario[0]}",
+            "token": token,
             "user": {
                 "id": usuario[0],
                 "nome": usuario[1],
                 "email": usuario[2],
                 "role": usuario[5],
-                "nivel_acesso": usuario[7],
-                "empresa": usuario[8],
+                "nivel_acesso": usuario[6],
+                "empresa": usuario[7],
                 "departamento": usuario[4],
                 "permissoes": permissoes
             }
         }
         
+    except FilaSenhasCheia as e:
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": "1"},
+            content={"success": False, "message": str(e)}
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"success": False, "message": f"Erro no servidor: {str(e)}"}
         )
 
+@app.post("/api/logout")
+async def fazer_logout(
+    request: Request,
+    usuario: SessaoUsuario = Depends(usuario_atual),
+    db: SessaoAssincrona = Depends(get_db)
+):
+    """Encerra a sessão do token (logout_type = MANUAL) e registra o LOGOUT na auditoria."""
+    try:
+        await db.run_sync(encerrar_sessao, usuario.session_id)
+        await db.run_sync(registrar_eventos, [evento(
+            auditoria.LOGOUT, "Usuário saiu do sistema.",
+            empresa_id=usuario.empresa_id, usuario_id=usuario.usuario_id, ip_address=ip_cliente(request)
+        )])
+        await db.commit()
+        gerenciador_sessoes.esquecer(usuario)
+        return {"success": True}
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
 # ==============================================================================
 # API: DOCUMENTOS FISCAIS (Listagem e Detalhes)
 # ==============================================================================
@@ -184,95 +291,54 @@ async def listar_documentos(
     tipo_documento: str = None,
     status: str = None,
     fornecedor_id: int = None,
-    db: Session = Depends(get_db)
+    limite: int = PAGINA_PADRAO,
+    cursor: str = None,
+    contagem: str = CONTAGEM_NENHUMA,
+    fields: str = None,
+    db: SessaoAssincrona = Depends(get_db_leitura)
 ):
     """
     Lista documentos fiscais com suporte a múltiplos filtros dinâmicos.
-    Constrói a query SQL baseada nos parâmetros opcionais fornecidos.
+    A consulta (SQLAlchemy Core) é montada uma vez por combinação de filtros
+    e reaproveitada (consultas.py); os valores entram só como parâmetros.
+    Paginação por cursor em (data_emissao, id): envie o 'next_cursor' da
+    resposta no parâmetro 'cursor' para buscar a próxima página.
+    'fields' (ex: fields=id,numero_documento,valor_total) limita as colunas lidas e devolvidas.
     """
     try:
         print(f"[v0 Backend] Parâmetros recebidos: search={search}, tipo_data={tipo_data}, data_inicial={data_inicial}, data_final={data_final}")
         
-        query_base = """
-            SELECT 
-                df.id,
-                df.data_emissao,
-                df.data_recebimento,
-                df.data_competencia,
-                df.data_vencimento,
-                df.numero_documento,
-                df.tipo_documento,
-                f.razao_social as fornecedor,
-                df.valor_total,
-                df.status_processamento
-            FROM documentos_fiscais df
-            JOIN fornecedores f ON df.fornecedor_id = f.id
-            WHERE 1=1
-        """
-        
-        conditions = []
-        params = {}
-        
-        if search and search.strip():
-            conditions.append("""
-                (df.numero_documento LIKE :search 
-                OR f.razao_social LIKE :search 
-                OR CAST(df.valor_total AS CHAR) LIKE :search
-                OR df.tipo_documento LIKE :search)
-            """)
-            params["search"] = f"%{search.strip()}%"
-            print(f"[v0 Backend] Adicionando filtro de pesquisa: {search}")
-        
-        if data_inicial and data_final:
-            campo_data = f"df.data_{tipo_data}"
-            conditions.append(f"{campo_data} BETWEEN :data_inicial AND :data_final")
-            params["data_inicial"] = data_inicial
-            params["data_final"] = data_final
-            print(f"[v0 Backend] Filtro de data: {campo_data} entre {data_inicial} e {data_final}")
-        
-        if tipo_documento:
-            conditions.append("df.tipo_documento = :tipo_documento")
-            params["tipo_documento"] = tipo_documento
-        
-        if status:
-            conditions.append("df.status_processamento = :status")
-            params["status"] = status
+        # Cada termo da pesquisa vira uma condição que usa índice (FULLTEXT, prefixo ou faixa de valor)
+        conditions_busca, params = planejar_busca(search) if search and search.strip() else ([], {})
         
-        if fornecedor_id:
-            conditions.append("df.fornecedor_id = :fornecedor_id")
-            params["fornecedor_id"] = fornecedor_id
+        limite = normalizar_limite(limite)
+        if cursor:
+            params.update(parametros_cursor(cursor, len(ORDENACAO_DOCUMENTOS)))
         
-        if conditions:
-            query_base += " AND " + " AND ".join(conditions)
-        
-        query_base += " ORDER BY df.data_emissao DESC LIMIT 100"
+        campos = campos_solicitados(fields, CAMPOS_LISTA_DOCUMENTO)
+        consulta, consulta_contagem = consulta_documentos(
+            conditions_busca, params, tipo_data, data_inicial, data_final,
+            tipo_documento, status, fornecedor_id, com_cursor=bool(cursor), campos=campos
+        )
         
-        print(f"[v0 Backend] Query final: {query_base}")
-        print(f"[v0 Backend] Parâmetros: {params}")
+        # Contagem total (opcional) usa os mesmos filtros, sem a condição do cursor
+        total_registros, total_aproximado = await contar_consulta(db, consulta_contagem, params, contagem)
         
-        result = db.execute(text(query_base), params)
-        documentos = result.fetchall()
+        result = await db.execute(consulta, {**params, "limite": limite + 1})
+        documentos, next_cursor = fatiar_pagina(result.fetchall(), limite, [1, 0])
         
         print(f"[v0 Backend] Documentos encontrados: {len(documentos)}")
         
         return {
             "total": len(documentos),
-            "documentos": [
-                {
-                    "id": row[0],
-                    "data_emissao": str(row[1]) if row[1] else None,
-                    "data_recebimento": str(row[2]) if row[2] else None,
-                    "data_competencia": str(row[3]) if row[3] else None,
-                    "data_vencimento": str(row[4]) if row[4] else None,
-                    "numero_documento": row[5],
-                    "tipo_documento": row[6],
-                    "fornecedor": row[7],
-                    "valor_total": float(row[8]) if row[8] else 0,
-                    "status_processamento": row[9]
-                }
-                for row in documentos
-            ]
+            "total_registros": total_registros,
+            "total_aproximado": total_aproximado,
+            "limite": limite,
+            "next_cursor": next_cursor,
+            "documentos": [linha_para_dict(row, campos) for row in documentos]
         }
+    except (CursorInvalido, ContagemInvalida, CampoInvalido) as e:
+        return JSONResponse(status_code=400, content={"erro": str(e)})
     except Exception as e:
         print(f"[v0 Backend] ERRO: {str(e)}")
         return JSONResponse(
@@ -281,71 +347,44 @@ async def listar_documentos(
         )
 
 @app.get("/api/documentos-fiscais/{doc_id}")
-async def buscar_documento(doc_id: int, db: Session = Depends(get_db)):
+async def buscar_documento(doc_id: int, fields: str = None, db: SessaoAssincrona = Depends(get_db)):
     """
-    Busca os detalhes completos de um documento, incluindo:
+    Busca os detalhes de um documento, incluindo:
     - Dados cadastrais
     - Empresa e Fornecedor
     - Lista de Anexos vinculados
+    O XML original não vem na resposta (só 'tem_xml' e 'xml_url'): baixe-o em
+    /api/documentos-fiscais/{id}/xml. 'fields' (ex: fields=id,valor_total,anexos)
+    limita as colunas lidas; 'xml_content' só é devolvido se pedido em 'fields'.
     """
     try:
-        query = text("""
-            SELECT 
-                df.id, df.empresa_id, df.fornecedor_id, df.tipo_documento,
-                df.numero_documento, df.serie, df.chave_acesso,
-                df.data_emissao, df.data_recebimento, df.data_vencimento, df.data_competencia,
-                df.valor_total, df.valor_impostos, df.valor_liquido,
-                df.descricao_servico_produto, df.observacoes,
-                df.uf_origem, df.uf_destino, df.municipio_prestacao,
-                df.xml_content, df.arquivo_anexo, df.status_processamento,
-                f.razao_social as fornecedor_nome,
-                e.razao_social as empresa_nome
-            FROM documentos_fiscais df
-            JOIN fornecedores f ON df.fornecedor_id = f.id
-            JOIN empresas e ON df.empresa_id = e.id
-            WHERE df.id = :doc_id
-        """)
+        campos = campos_solicitados(fields, CAMPOS_DETALHE_DOCUMENTO, extras=("anexos",))
+        query = consulta_detalhe_documento(campos, extras=("anexos",)) # xml_content também é montado à parte
         
-        result = db.execute(query, {"doc_id": doc_id})
+        result = await db.execute(query, {"doc_id": doc_id})
         row = result.fetchone()
         
         if not row:
             return JSONResponse(status_code=404, content={"erro": "Documento não encontrado"})
         
-        # Buscar anexos
-        anexos_query = text("""
-            SELECT a.id, a.nome_original, a.tipo_arquivo, a.tamanho_bytes, a.caminho_arquivo
-            FROM anexos a
-            JOIN documento_anexos da ON a.id = da.anexo_id
-            WHERE da.documento_fiscal_id = :doc_id
-        """)
-        anexos_result = db.execute(anexos_query, {"doc_id": doc_id})
-        anexos = anexos_result.fetchall()
-        
-        return {
-            "id": row[0],
-            "empresa_id": row[1],
-            "empresa_nome": row[23],
-            "fornecedor_id": row[2],
-            "fornecedor_nome": row[22],
-            "tipo_documento": row[3],
-            "numero_documento": row[4],
-            "serie": row[5],
-            "chave_acesso": row[6],
-            "data_emissao": str(row[7]) if row[7] else None,
-            "data_recebimento": str(row[8]) if row[8] else None,
-            "data_vencimento": str(row[9]) if row[9] else None,
-            "data_competencia": str(row[10]) if row[10] else None,
-            "valor_total": float(row[11]) if row[11] else 0,
-            "valor_impostos": float(row[12]) if row[12] else 0,
-            "valor_liquido": float(row[13]) if row[13] else 0,
-            "descricao_servico_produto": row[14],
-            "observacoes": row[15],
-            "uf_origem": row[16],
-            "uf_destino": row[17],
-            "municipio_prestacao": row[18],
-            "status_processamento": row[21],
-            "anexos": [
+        documento = linha_para_dict(row, campos)
+        if "xml_content" in campos:
+            # Só com fields=xml_content explícito: lê e descompacta o XML
+            xml = await db.run_sync(ler_xml, doc_id)
+            documento["xml_content"] = texto_xml(*xml) if xml else None
+        if "tem_xml" in documento:
+            documento["xml_url"] = f"/api/documentos-fiscais/{doc_id}/xml" if documento["tem_xml"] else None
+        
+        # Buscar anexos (só quando fazem parte da resposta)
+        if "anexos" in campos:
+            anexos_query = text("""
+                SELECT a.id, a.nome_original, a.tipo_arquivo, a.tamanho_bytes, a.caminho_arquivo
+                FROM anexos a
+                JOIN documento_anexos da ON a.id = da.anexo_id
+                WHERE da.documento_fiscal_id = :doc_id
+            """)
+            anexos_result = await db.execute(anexos_query, {"doc_id": doc_id})
+            documento["anexos"] = [
                 {
                     "id": a[0],
                     "nome_original": a[1],
@@ -353,31 +392,115 @@ async def buscar_documento(doc_id: int, db: Session = Depends(get_db)):
                     "tamanho_bytes": a[3],
                     "caminho_arquivo": a[4]
                 }
-                for a in anexos
+                for a in anexos_result.fetchall()
             ]
-        }
+        
+        return documento
+    except CampoInvalido as e:
+        return JSONResponse(status_code=400, content={"erro": str(e)})
     except Exception as e:
         print(f"[v0 Backend] Erro ao buscar documento: {str(e)}")
         import traceback
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
+# Tamanho (em caracteres) de cada trecho do XML não migrado (xml_content) lido no download
+XML_TRECHO_CARACTERES = 256 * 1024
+
+_SQL_TRECHO_XML = text("""
+    SELECT SUBSTRING(xml_content, :inicio, :tamanho)
+    FROM documentos_fiscais
+    WHERE id = :doc_id
+""")
+
+@app.get("/api/documentos-fiscais/{doc_id}/xml")
+async def baixar_xml_documento(doc_id: int, download: bool = False, db: SessaoAssincrona = Depends(get_db)):
+    """
+    Devolve o XML original do documento em streaming.
+    - XML compactado (documentos_xml): os bytes originais do arquivo, descompactados
+      em blocos enquanto são enviados
+    - XML ainda não migrado (xml_content): lido do banco em trechos de
+      XML_TRECHO_CARACTERES (SUBSTRING) e codificado no encoding declarado no XML
+    - download=true envia como anexo (Content-Disposition), com o nome da chave de acesso
+    """
+    try:
+        # 1ª leitura: XML compactado ou, se não houver, tamanho + primeiro trecho do xml_content
+        result = await db.execute(text("""
+            SELECT df.chave_acesso, df.numero_documento,
+                   dx.algoritmo, dx.encoding, dx.conteudo, dx.tamanho_original,
+                   CHAR_LENGTH(df.xml_content), SUBSTRING(df.xml_content, 1, :tamanho)
+            FROM documentos_fiscais df
+            LEFT JOIN documentos_xml dx ON dx.documento_fiscal_id = df.id
+            WHERE df.id = :doc_id
+        """), {"doc_id": doc_id, "tamanho": XML_TRECHO_CARACTERES})
+        row = result.fetchone()
+        
+        if not row:
+            return JSONResponse(status_code=404, content={"erro": "Documento não encontrado"})
+        if row[4] is None and row[6] is None:
+            return JSONResponse(status_code=404, content={"erro": "Documento não possui XML armazenado"})
+        
+        headers = {}
+        if download:
+            nome = "".join(c for c in (row[0] or row[1] or "") if c.isalnum() or c in "-_") or str(doc_id)
+            headers["Content-Disposition"] = f'attachment; filename="{nome}.xml"'
+        
+        if row[4] is not None:
+            algoritmo, encoding, conteudo = row[2], row[3], row[4]
+            headers["Content-Length"] = str(row[5])
+            charset = "utf-8" if encoding == "utf-8-sig" else encoding
+            return StreamingResponse(
+                descompactar_em_blocos(algoritmo, conteudo),
+                media_type=f"application/xml; charset={charset}", headers=headers
+            )
+        
+        total_caracteres, primeiro_trecho = row[6], row[7]
+        encoding = encoding_declarado(primeiro_trecho)
+        
+        async def gerar_xml():
+            # Caracteres que não existem no encoding declarado viram referência (&#...;)
+            codificador = codecs.getincrementalencoder(encoding)(errors="xmlcharrefreplace")
+            yield codificador.encode(primeiro_trecho)
+            
+            # A sessão (get_db) só é fechada depois do envio da resposta; a transação
+            # aberta (REPEATABLE READ) garante que todos os trechos são da mesma versão
+            inicio = len(primeiro_trecho) + 1
+            while inicio <= total_caracteres:
+                trecho = (await db.execute(_SQL_TRECHO_XML, {
+                    "doc_id": doc_id, "inicio": inicio, "tamanho": XML_TRECHO_CARACTERES
+                })).scalar()
+                if not trecho:
+                    break
+                yield codificador.encode(trecho)
+                inicio += len(trecho)
+            yield codificador.encode("", final=True)
+        
+        return StreamingResponse(gerar_xml(), media_type=f"application/xml; charset={encoding}", headers=headers)
+    except Exception as e:
+        print(f"[v0 Backend] Erro ao baixar XML do documento: {str(e)}")
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
 # ==============================================================================
 # API: UPLOAD E IMPORTAÇÃO (Arquivos e XML)
 # ==============================================================================
 
 @app.post("/api/upload-arquivo")
 async def upload_arquivo(
+    request: Request,
     file: UploadFile = File(...),
     documento_id: Optional[int] = Form(None),
     tipo_relacao: str = Form("COMPLEMENTAR"),
-    db: Session = Depends(get_db)
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="documentos_fiscais")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
     """
-    Recebe um arquivo, salva no disco (organizado por Empresa/Ano/Mês) e
-    cria o registro na tabela 'anexos'. Se 'documento_id' for passado,
-    cria o vínculo na tabela 'documento_anexos'.
+    Recebe um arquivo, salva no disco e cria o registro na tabela 'anexos'.
+    Se 'documento_id' for passado, cria o vínculo na tabela 'documento_anexos'.
+    O arquivo é copiado em blocos (memória constante) e o hash é calculado durante a cópia.
+    O disco é endereçado pelo hash: se o mesmo conteúdo já foi enviado antes,
+    o novo anexo aponta para o arquivo existente e nada é gravado de novo.
     """
+    caminho_temp = None
     try:
         # Validar tipo de arquivo
         ext = file.filename.split(".")[-1].upper()
@@ -389,34 +512,25 @@ async def upload_arquivo(
                 content={"erro": f"Tipo de arquivo não permitido. Use: {', '.join(tipos_validos)}"}
             )
         
-        # Ler conteúdo do arquivo
-        content = await file.read()
-        
-        # Gerar hash para integridade
-        hash_arquivo = hashlib.sha256(content).hexdigest()
-        
-        # Gerar nome único para o arquivo
-        nome_unico = f"{uuid.uuid4().hex[:8]}.{ext.lower()}"
-        
-        empresa_id = 1  # TODO: Obter da sessão do usuário
-        
-        ano = datetime.now().year
-        mes = datetime.now().month
-        
-        pasta_destino = os.path.join(UPLOAD_DIR, f"empresa_{empresa_id}", str(ano), f"{mes:02d}")
-        os.makedirs(pasta_destino, exist_ok=True)
+        # Recusa logo pelo cabeçalho, antes de copiar, se o tamanho declarado já passa do limite
+        tamanho_declarado = request.headers.get("content-length")
+        if tamanho_declarado and tamanho_declarado.isdigit() and int(tamanho_declarado) > UPLOAD_MAX_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"erro": f"Arquivo maior que o limite de {UPLOAD_MAX_BYTES // (1024 * 1024)} MB"}
+            )
         
-        # Salvar arquivo
-        caminho_completo = os.path.join(pasta_destino, nome_unico)
-        with open(caminho_completo, "wb") as f:
-            f.write(content)
+        # Receber arquivo (em blocos, com hash SHA-256 incremental para integridade)
+        caminho_temp, tamanho, hash_arquivo = await receber_upload(file, UPLOAD_DIR)
         
-        # Caminho relativo para armazenar no banco
-        caminho_relativo = f"/empresa_{empresa_id}/{ano}/{mes:02d}/{nome_unico}"
+        # Caminho relativo para armazenar no banco (derivado do hash)
+        caminho_relativo = caminho_objeto(hash_arquivo, ext)
         
         # Salvar no banco
-        user_id = 1  # TODO: Ajustar conforme sessão do usuário
+        user_id = usuario.usuario_id
         
+        # Se uma exclusão do mesmo hash estiver em andamento, este INSERT espera
+        # o COMMIT dela (lock no idx_hash) antes de conferir se o arquivo existe
         query_anexo = text("""
             INSERT INTO anexos 
             (nome_arquivo, nome_original, tipo_arquivo, tamanho_bytes, caminho_arquivo, hash_arquivo, uploaded_by)
@@ -424,18 +538,17 @@ async def upload_arquivo(
             (:nome_arquivo, :nome_original, :tipo_arquivo, :tamanho, :caminho, :hash, :user_id)
         """)
         
-        result = db.execute(query_anexo, {
-            "nome_arquivo": nome_unico,
+        result = await db.execute(query_anexo, {
+            "nome_arquivo": caminho_relativo.rsplit("/", 1)[-1],
             "nome_original": file.filename,
             "tipo_arquivo": ext,
-            "tamanho": len(content),
+            "tamanho": tamanho,
             "caminho": caminho_relativo,
             "hash": hash_arquivo,
             "user_id": user_id
         })
         
         anexo_id = result.lastrowid
-        db.commit()
         
         # Se houver documento_id, vincular anexo ao documento
         if documento_id:
@@ -444,55 +557,71 @@ async def upload_arquivo(
                 VALUES (:doc_id, :anexo_id, :tipo_relacao)
             """)
             
-            db.execute(query_vinculo, {
+            await db.execute(query_vinculo, {
                 "doc_id": documento_id,
                 "anexo_id": anexo_id,
                 "tipo_relacao": tipo_relacao
             })
-            db.commit()
+        
+        await db.run_sync(registrar_eventos, [evento(
+            auditoria.ANEXO_UPLOAD, f"Arquivo {file.filename} ({ext}) foi enviado.",
+            empresa_id=usuario.empresa_id, usuario_id=user_id, referencia_id=anexo_id, ip_address=ip_cliente(request)
+        )])
+        
+        # Grava o arquivo só se o conteúdo ainda não existir no disco
+        arquivo_novo = await materializar_objeto(caminho_temp, UPLOAD_DIR, caminho_relativo)
+        caminho_temp = None
+        
+        await db.commit()
+        
+        if not arquivo_novo:
+            print(f"[v0 Backend] Conteúdo duplicado ({hash_arquivo[:12]}...), reaproveitando arquivo existente")
         
         return {
             "success": True,
             "anexo_id": anexo_id,
             "caminho_arquivo": caminho_relativo,
-            "hash_arquivo": hash_arquivo
+            "hash_arquivo": hash_arquivo,
+            "duplicado": not arquivo_novo
         }
         
+    except ArquivoMuitoGrande as e:
+        return JSONResponse(status_code=413, content={"erro": str(e)})
     except Exception as e:
         print(f"[v0 Backend] Erro no upload: {str(e)}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
+    finally:
+        if caminho_temp:
+            await descartar_temporario(caminho_temp)
 
-# Função Helper para XML
-def detect_encoding(content: bytes) -> str:
+@app.get("/api/download-arquivo/{anexo_id}")
+async def download_arquivo(anexo_id: int, db: SessaoAssincrona = Depends(get_db)):
     """
-    Detecta o encoding de um arquivo XML, pois muitos vêm como 'iso-8859-1'.
-    Tenta ler o cabeçalho XML ou usa chardet como fallback.
+    Baixa um anexo com o nome original (no disco ele é salvo pelo hash do conteúdo).
     """
     try:
-        # Tenta ler o cabeçalho XML (ex: <?xml version="1.0" encoding="UTF-8"?>)
-        header = content[:100].decode('latin-1').lower()
-        if 'encoding="utf-8"' in header:
-            return 'utf-8'
-        if 'encoding="iso-8859-1"' in header:
-            return 'iso-8859-1'
-    except Exception:
-        pass # Ignora erros se não conseguir ler o cabeçalho
-    
-    # Se não encontrar, tenta adivinhar com chardet
-    result = chardet.detect(content)
-    encoding = result.get('encoding', 'utf-8')
-    
-    # Garante um fallback seguro
-    if encoding.lower() not in ['utf-8', 'iso-8859-1', 'latin-1']:
-        return 'utf-8'
+        query = text("SELECT nome_original, caminho_arquivo FROM anexos WHERE id = :anexo_id")
+        anexo = (await db.execute(query, {"anexo_id": anexo_id})).fetchone()
+        
+        if not anexo:
+            return JSONResponse(status_code=404, content={"erro": "Anexo não encontrado"})
         
-    return encoding
+        caminho_completo = caminho_absoluto(UPLOAD_DIR, anexo[1])
+        if not os.path.exists(caminho_completo):
+            return JSONResponse(status_code=404, content={"erro": "Arquivo físico não encontrado"})
+        
+        return FileResponse(caminho_completo, filename=anexo[0])
+    except Exception as e:
+        print(f"[v0 Backend] Erro ao baixar anexo: {str(e)}")
+        return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.post("/api/importar-xml")
 async def importar_xml(
+    request: Request,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="documentos_fiscais")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
     """
     Processa a importação de XMLs (NF-e e NFS-e).
@@ -501,6 +630,8 @@ async def importar_xml(
     3. Extrai dados: Número, Valor, Datas, CNPJ Fornecedor.
     4. Cria o Fornecedor se não existir.
     5. Faz 'Upsert' do Documento Fiscal (Insere ou Atualiza se a chave já existir).
+    Os passos 4 e 5 rodam em uma única transação (importacao_lote.gravar_documento)
+    e a resposta informa se o documento foi inserido ou atualizado.
     """
     try:
         if not file.filename.lower().endswith('.xml'):
@@ -508,222 +639,99 @@ async def importar_xml(
         
         content = await file.read()
 
-        if content.startswith(b'%PDF-'):
-            print("[v0 Backend] Erro: O arquivo é um PDF, não um XML.")
-            return JSONResponse(
-                status_code=400, 
-                content={"success": False, "erro": "Arquivo inválido. O conteúdo é de um PDF, apesar da extensão .xml"}
-            )
-
         try:
-            encoding = detect_encoding(content)
-            xml_string = content.decode(encoding)
-        except UnicodeDecodeError as e:
-            print(f"[v0 Backend] Erro de decodificação: {e}")
-            return JSONResponse(
-                status_code=400, 
-                content={"success": False, "erro": f"Erro de decodificação. O arquivo pode estar corrompido: {e}"}
-            )
-
-        try:
-            # Remove o namespace padrão (xmlns) se existir, pois ele atrapalha o find()
-            xml_string = xml_string.replace('xmlns="http://www.prefeitura.sp.gov.br/nfe"', '', 1)
-            root = ET.fromstring(xml_string)
-        except ET.ParseError as e:
-            print(f"[v0 Backend] Erro de Parse XML: {e}")
-            return JSONResponse(
-                status_code=400, 
-                content={"success": False, "erro": f"Não foi possível ler o XML. O arquivo está mal formatado: {e}"}
-            )
-        
-        # --- LÓGICA DE EXTRAÇÃO MULTI-FORMATO ---
-        # A sintaxe .//*:[tag] ignora namespaces (como 'nfe:' ou 'sp:')
-        
-        numero = None
-        serie = None
-        chave_acesso = None
-        data_emissao = None
-        valor_total = 0
-        valor_impostos = 0
-        cnpj_fornecedor = None
-        razao_fornecedor = None
-        tipo_documento = 'OUTROS'
-
-        # --- TENTATIVA 1: NF-e (Padrão Federal) ---
-        infNFe = root.find('.//{*}infNFe')
-        
-        if infNFe is not None:
-            print("[v0 Backend] Detectado XML de NF-e (Federal)")
-            tipo_documento = 'NF-e'
-            chave_acesso_el = infNFe.get('Id')
-            if chave_acesso_el:
-                chave_acesso = chave_acesso_el.replace('NFe', '')
-            
-            ide = infNFe.find('{*}ide')
-            if ide is not None:
-                numero_el = ide.find('{*}nNF')
-                if numero_el is not None: numero = numero_el.text
-                
-                serie_el = ide.find('{*}serie')
-                if serie_el is not None: serie = serie_el.text
-
-                data_emissao_el = ide.find('{*}dhEmi')
-                if data_emissao_el is not None: data_emissao = data_emissao_el.text[:10]
-
-            total = infNFe.find('.//{*}ICMSTot')
-            if total is not None:
-                valor_total_el = total.find('{*}vNF')
-                if valor_total_el is not None: valor_total = float(valor_total_el.text)
-                
-                valor_impostos_el = total.find('{*}vTotTrib')
-                if valor_impostos_el is not None: valor_impostos = float(valor_impostos_el.text)
-
-            emit = infNFe.find('{*}emit')
-            if emit is not None:
-                cnpj_el = emit.find('{*}CNPJ')
-                if cnpj_el is not None: cnpj_fornecedor = cnpj_el.text
-                
-                razao_el = emit.find('{*}xNome')
-                if razao_el is not None: razao_fornecedor = razao_el.text
-
-        # --- TENTATIVA 2: NFS-e (Nota de Serviço, ex: SP) ---
-        else:
-            # Procura por tags comuns de NFS-e, ignorando namespaces
-            nfe_sp = root.find('.//{*}NFe') # A tag <NFe>
-            if nfe_sp is None:
-                nfe_sp = root # Se não achar <NFe>, assume que o root é o documento
-
-            print("[v0 Backend] Detectado XML de NFS-e (Nota de Serviço)")
-            tipo_documento = 'NFS-e'
-
-            # Tenta achar o número da nota
-            numero_el = nfe_sp.find('.//{*}NumeroNFe')
-            if numero_el is not None: numero = numero_el.text
-
-            # Tenta achar o código de verificação
-            chave_el = nfe_sp.find('.//{*}CodigoVerificacao')
-            if chave_el is not None: chave_acesso = chave_el.text
-            
-            # Tenta achar a data de emissão
-            data_emissao_el = nfe_sp.find('.//{*}DataEmissaoNFe')
-            if data_emissao_el is None:
-                data_emissao_el = nfe_sp.find('.//{*}DataEmissao') # Fallback
-            if data_emissao_el is not None: data_emissao = data_emissao_el.text[:10]
-
-            # Tenta achar o valor
-            valor_el = nfe_sp.find('.//{*}ValorServicos')
-            if valor_el is not None: valor_total = float(valor_el.text)
-            
-            # Tenta achar impostos
-            imposto_el = nfe_sp.find('.//{*}ValorISS')
-            if imposto_el is not None: valor_impostos = float(imposto_el.text)
-
-            # --- ACHAR FORNECEDOR (PRESTADOR) ---
-            # Tenta achar a Razão Social primeiro
-            razao_el = nfe_sp.find('.//{*}RazaoSocialPrestador')
-            if razao_el is not None: razao_fornecedor = razao_el.text
-            
-            # Tenta achar o CNPJ
-            # Procura por <CNPJ> dentro de <CPFCNPJPrestador>
-            prestador_cnpj_el = nfe_sp.find('.//{*}CPFCNPJPrestador/{*}CNPJ')
-            if prestador_cnpj_el is not None:
-                cnpj_fornecedor = prestador_cnpj_el.text
-            else:
-                # Fallback: Procura por <Cnpj> dentro de <PrestadorServico>
-                prestador_cnpj_el_alt = nfe_sp.find('.//{*}PrestadorServico/{*}Cnpj')
-                if prestador_cnpj_el_alt is not None:
-                    cnpj_fornecedor = prestador_cnpj_el_alt.text
-
-        # --- Validação dos dados extraídos ---
-        if not cnpj_fornecedor or not razao_fornecedor:
-            print(f"[v0 Backend] Erro: Não foi possível extrair CNPJ ({cnpj_fornecedor}) ou RazaoSocial ({razao_fornecedor}).")
-            traceback.print_exc()
-            return JSONResponse(
-                status_code=400, 
-                content={"success": False, "erro": "Não foi possível extrair o CNPJ ou a Razão Social do XML. Formato não suportado."}
-            )
-
-        # --- O resto da lógica (Banco de Dados) é a mesma ---
-        
-        # Buscar ou criar fornecedor
-        query_fornecedor = text("SELECT id FROM fornecedores WHERE cnpj_cpf = :cnpj LIMIT 1")
-        result = db.execute(query_fornecedor, {"cnpj": cnpj_fornecedor})
-        fornecedor = result.fetchone()
-        
-        fornecedor_id = None
-        if not fornecedor:
-            try:
-                insert_fornecedor = text("""
-                    INSERT INTO fornecedores (empresa_id, cnpj_cpf, tipo_pessoa, razao_social, ativo)
-                    VALUES (1, :cnpj, 'PJ', :razao, 1)
-                """)
-                result = db.execute(insert_fornecedor, {
-                    "cnpj": cnpj_fornecedor,
-                    "razao": razao_fornecedor
-                })
-                fornecedor_id = result.lastrowid
-                db.commit() 
-            except Exception as e_forn:
-                 db.rollback()
-                 print(f"[v0 Backend] Erro ao criar fornecedor: {str(e_forn)}")
-                 return JSONResponse(status_code=500, content={"success": False, "erro": f"Erro ao criar fornecedor: {str(e_forn)}"})
-        else:
-            fornecedor_id = fornecedor[0]
-        
-        # Inserir documento fiscal
-        query_doc = text("""
-            INSERT INTO documentos_fiscais 
-            (empresa_id, fornecedor_id, tipo_documento, numero_documento, serie, chave_acesso,
-             data_emissao, valor_total, valor_impostos, xml_content, status_processamento, usuario_criacao_id)
-            VALUES 
-            (1, :fornecedor_id, :tipo_documento, :numero, :serie, :chave, :data_emissao, 
-             :valor_total, :valor_impostos, :xml_content, 'PENDENTE', 1)
-            ON DUPLICATE KEY UPDATE 
-             valor_total = :valor_total,
-             status_processamento = 'PENDENTE',
-             xml_content = :xml_content,
-             updated_at = CURRENT_TIMESTAMP
-        """)
-        
-        result = db.execute(query_doc, {
-            "fornecedor_id": fornecedor_id,
-            "tipo_documento": tipo_documento,
-            "numero": numero,
-            "serie": serie,
-            "chave": chave_acesso,
-            "data_emissao": data_emissao,
-            "valor_total": valor_total,
-            "valor_impostos": valor_impostos,
-            "xml_content": xml_string
-        })
-        
-        doc_id = result.lastrowid
-        if not doc_id:
-             # Se foi ON DUPLICATE KEY UPDATE, precisamos pegar o ID
-            query_get_id = text("SELECT id FROM documentos_fiscais WHERE chave_acesso = :chave LIMIT 1")
-            result_id = db.execute(query_get_id, {"chave": chave_acesso})
-            doc_id = result_id.scalar()
-
-        db.commit() 
+            # Detecção do encoding + iterparse do arquivo inteiro: fora do event loop
+            dados = await to_thread.run_sync(extrair_dados_xml, content)
+        except ErroLeituraXML as e:
+            return JSONResponse(status_code=400, content={"success": False, "erro": str(e)})
+
+        # Fornecedor, documento, XML compactado, resumo e auditoria em uma transação
+        # (upserts com LAST_INSERT_ID(id): sem SELECT antes/depois de cada INSERT)
+        gravado = await db.run_sync(
+            gravar_documento, dados, content, ip_cliente(request), usuario.empresa_id, usuario.usuario_id
+        )
+        invalidar_dashboard()
+        dados_referencia.invalidar("fornecedores") # O fornecedor do XML pode ser novo
         
         return {
             "success": True,
-            "documento_id": doc_id,
+            "documento_id": gravado["documento_id"],
+            "acao": gravado["acao"], # inserido | atualizado
             "message": "XML importado com sucesso"
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"[v0 Backend] Erro fatal ao importar XML: {str(e)}")
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"success": False, "erro": str(e)})
 
+@app.post("/api/importar-xml/lote")
+async def importar_xml_lote(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="documentos_fiscais")),
+    db: SessaoAssincrona = Depends(get_db)
+):
+    """
+    Importa vários XMLs (NF-e e NFS-e) de uma vez: aceita vários .xml e/ou .zip.
+    1. Descompacta os ZIPs (com limite de arquivos e de tamanho).
+    2. Lê os XMLs em paralelo no pool de processos.
+    3. Resolve/cria os fornecedores e grava os documentos em lote, em uma transação.
+    4. Devolve o resultado de cada arquivo (inserido, atualizado ou erro).
+    """
+    inicio = time.perf_counter()
+    try:
+        arquivos = []
+        bytes_restantes = LOTE_MAX_BYTES
+        for file in files:
+            content = await file.read()
+            expandidos = await to_thread.run_sync(expandir_arquivos, file.filename, content, bytes_restantes)
+            arquivos.extend(expandidos)
+            bytes_restantes -= sum(len(c) for _, c in expandidos if c)
+
+            if len(arquivos) > LOTE_MAX_ARQUIVOS:
+                raise LoteInvalido(f"O lote passa do limite de {LOTE_MAX_ARQUIVOS} arquivos")
+            if bytes_restantes < 0:
+                raise LoteInvalido(f"O lote passa do limite de {LOTE_MAX_BYTES // (1024 * 1024)} MB")
+
+        if not arquivos:
+            return JSONResponse(status_code=400, content={"success": False, "erro": "Nenhum arquivo enviado"})
+
+        itens = await analisar_arquivos(arquivos)
+        await db.run_sync(gravar_lote, itens, ip_cliente(request), usuario.empresa_id, usuario.usuario_id)
+        invalidar_dashboard()
+        dados_referencia.invalidar("fornecedores") # O fornecedor do XML pode ser novo
+
+        resultados = montar_relatorio(itens)
+        tempo = time.perf_counter() - inicio
+        print(f"[v0 Backend] Lote de {len(resultados)} XMLs importado em {tempo:.2f}s")
+
+        return {
+            "success": True,
+            "total_arquivos": len(resultados),
+            "inseridos": sum(1 for r in resultados if r.get("acao") == ACAO_INSERIDO),
+            "atualizados": sum(1 for r in resultados if r.get("acao") == ACAO_ATUALIZADO),
+            "erros": sum(1 for r in resultados if not r["success"]),
+            "tempo_segundos": round(tempo, 3),
+            "arquivos_por_segundo": round(len(resultados) / tempo, 1) if tempo else None,
+            "resultados": resultados
+        }
+
+    except LoteInvalido as e:
+        return JSONResponse(status_code=400, content={"success": False, "erro": str(e)})
+    except Exception as e:
+        print(f"[v0 Backend] Erro fatal ao importar lote de XMLs: {str(e)}")
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"success": False, "erro": str(e)})
+
 # ==============================================================================
 # API: CRUD DE DOCUMENTOS (Manual e Edição)
 # ==============================================================================
 
 @app.post("/api/documentos-fiscais")
 async def cadastrar_documento(
+    request: Request,
     empresa_id: int = Form(...),
     fornecedor_id: int = Form(...),
     tipo_documento: str = Form(...),
@@ -741,7 +749,8 @@ async def cadastrar_documento(
     uf_origem: Optional[str] = Form(None),
     uf_destino: Optional[str] = Form(None),
     municipio_prestacao: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="documentos_fiscais")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
         query = text("""
@@ -754,10 +763,10 @@ async def cadastrar_documento(
             (:empresa_id, :fornecedor_id, :tipo_documento, :numero_documento, :serie, :chave_acesso,
              :data_emissao, :data_recebimento, :data_vencimento, :data_competencia,
              :valor_total, :valor_impostos, :descricao, :observacoes,
-             :uf_origem, :uf_destino, :municipio, 'PENDENTE', 1)
+             :uf_origem, :uf_destino, :municipio, 'PENDENTE', :usuario_id)
         """)
         
-        result = db.execute(query, {
+        result = await db.execute(query, {
             "empresa_id": empresa_id,
             "fornecedor_id": fornecedor_id,
             "tipo_documento": tipo_documento,
@@ -774,11 +783,19 @@ async def cadastrar_documento(
             "observacoes": observacoes,
             "uf_origem": uf_origem,
             "uf_destino": uf_destino,
-            "municipio": municipio_prestacao
+            "municipio": municipio_prestacao,
+            "usuario_id": usuario.usuario_id
         })
         
         doc_id = result.lastrowid
-        db.commit()
+        await db.run_sync(aplicar_alteracao, [], [doc_id])
+        await db.run_sync(registrar_eventos, [evento(
+            auditoria.DOCUMENTO_CRIADO,
+            f"Doc Fiscal Nº {numero_documento} (R$ {formatar_valor(valor_total)}) foi criado.",
+            empresa_id=empresa_id, usuario_id=usuario.usuario_id, referencia_id=doc_id, ip_address=ip_cliente(request)
+        )])
+        await db.commit()
+        invalidar_dashboard()
         
         return {
             "success": True,
@@ -788,11 +805,12 @@ async def cadastrar_documento(
         
     except Exception as e:
         print(f"[v0 Backend] Erro ao cadastrar documento: {str(e)}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.put("/api/documentos-fiscais/{doc_id}")
 async def atualizar_documento(
+    request: Request,
     doc_id: int,
     fornecedor_id: int = Form(...),
     tipo_documento: str = Form(...),
@@ -810,9 +828,12 @@ async def atualizar_documento(
     uf_origem: Optional[str] = Form(None),
     uf_destino: Optional[str] = Form(None),
     municipio_prestacao: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="documentos_fiscais")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
+        antes = await db.run_sync(estado_documentos, [doc_id])
+
         query = text("""
             UPDATE documentos_fiscais 
             SET fornecedor_id = :fornecedor_id,
@@ -835,7 +856,7 @@ async def atualizar_documento(
             WHERE id = :doc_id
         """)
         
-        db.execute(query, {
+        await db.execute(query, {
             "doc_id": doc_id,
             "fornecedor_id": fornecedor_id,
             "tipo_documento": tipo_documento,
@@ -855,7 +876,15 @@ async def atualizar_documento(
             "municipio": municipio_prestacao
         })
         
-        db.commit()
+        await db.run_sync(aplicar_alteracao, antes, [doc_id])
+        if antes:
+            await db.run_sync(registrar_eventos, [evento(
+                auditoria.DOCUMENTO_EDITADO,
+                f"Doc Fiscal Nº {numero_documento} (R$ {formatar_valor(valor_total)}) foi editado.",
+                empresa_id=antes[0][0], usuario_id=usuario.usuario_id, referencia_id=doc_id, ip_address=ip_cliente(request)
+            )])
+        await db.commit()
+        invalidar_dashboard()
         
         return {
             "success": True,
@@ -864,15 +893,29 @@ async def atualizar_documento(
         
     except Exception as e:
         print(f"[v0 Backend] Erro ao atualizar documento: {str(e)}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.delete("/api/documentos-fiscais/{doc_id}")
-async def excluir_documento(doc_id: int, db: Session = Depends(get_db)):
+async def excluir_documento(
+    doc_id: int,
+    request: Request,
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="documentos_fiscais")),
+    db: SessaoAssincrona = Depends(get_db)
+):
     try:
+        antes = await db.run_sync(estado_documentos, [doc_id])
         query = text("DELETE FROM documentos_fiscais WHERE id = :doc_id")
-        db.execute(query, {"doc_id": doc_id})
-        db.commit()
+        await db.execute(query, {"doc_id": doc_id})
+        await db.run_sync(atualizar_resumo, antes, [])
+        if antes:
+            await db.run_sync(registrar_eventos, [evento(
+                auditoria.DOCUMENTO_EXCLUIDO,
+                f"Doc Fiscal ID {doc_id} (R$ {formatar_valor(antes[0][4])}) foi excluído.",
+                empresa_id=antes[0][0], usuario_id=usuario.usuario_id, referencia_id=doc_id, ip_address=ip_cliente(request)
+            )])
+        await db.commit()
+        invalidar_dashboard()
         
         return {
             "success": True,
@@ -881,44 +924,59 @@ async def excluir_documento(doc_id: int, db: Session = Depends(get_db)):
         
     except Exception as e:
         print(f"[v0 Backend] Erro ao excluir documento: {str(e)}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.delete("/api/anexos/{anexo_id}")
-async def excluir_anexo(anexo_id: int, db: Session = Depends(get_db)):
+@app.delete("/api/anexos/{anexo_id}", dependencies=[Depends(exigir_permissao(menu="documentos_fiscais"))])
+async def excluir_anexo(anexo_id: int, db: SessaoAssincrona = Depends(get_db)):
     """
     Exclui um anexo específico (registro no banco e arquivo físico).
+    Como arquivos com o mesmo conteúdo são compartilhados, o arquivo físico
+    só é apagado quando nenhum outro anexo aponta mais para ele.
     """
+    marcado = None
     try:
-        # 1. Encontrar o anexo para pegar o caminho do arquivo
-        query_find = text("SELECT caminho_arquivo FROM anexos WHERE id = :anexo_id")
-        result = db.execute(query_find, {"anexo_id": anexo_id})
+        # 1. Encontrar o anexo para pegar o caminho e o hash do arquivo
+        query_find = text("SELECT caminho_arquivo, hash_arquivo FROM anexos WHERE id = :anexo_id")
+        result = await db.execute(query_find, {"anexo_id": anexo_id})
         anexo = result.fetchone()
         
+        referencias = 0
         if anexo:
-            caminho_relativo = anexo[0]
-            # Constrói o caminho completo baseado no UPLOAD_DIR
-            # (Assume que UPLOAD_DIR está definido como "uploads")
-            caminho_completo = os.path.join(UPLOAD_DIR, *caminho_relativo.strip('/').split('/'))
-            
-            # 2. Deletar o arquivo físico (se existir)
-            if os.path.exists(caminho_completo):
-                os.remove(caminho_completo)
-                print(f"[v0 Backend] Arquivo físico deletado: {caminho_completo}")
-            else:
-                print(f"[v0 Backend] Aviso: Arquivo físico não encontrado: {caminho_completo}")
+            # 2. Contar quantos anexos usam o mesmo arquivo (FOR UPDATE trava o hash
+            #    até o COMMIT, então um upload do mesmo conteúdo espera esta exclusão)
+            query_refs = text("""
+                SELECT COUNT(*) FROM anexos
+                WHERE hash_arquivo = :hash AND caminho_arquivo = :caminho
+                FOR UPDATE
+            """)
+            referencias = (await db.execute(query_refs, {"hash": anexo[1], "caminho": anexo[0]})).scalar()
         
         # 3. Deletar o registro da tabela 'anexos'
         # Graças ao "ON DELETE CASCADE" no seu SQL, 
         # o vínculo em 'documento_anexos' será removido automaticamente.
         query_delete = text("DELETE FROM anexos WHERE id = :anexo_id")
-        db.execute(query_delete, {"anexo_id": anexo_id})
-        db.commit()
+        await db.execute(query_delete, {"anexo_id": anexo_id})
+        
+        # 4. Última referência: tira o arquivo físico de cena antes do COMMIT
+        if anexo and referencias <= 1:
+            marcado = await marcar_exclusao(UPLOAD_DIR, anexo[0])
+            if not marcado:
+                print(f"[v0 Backend] Aviso: Arquivo físico não encontrado: {anexo[0]}")
+        elif anexo:
+            print(f"[v0 Backend] Arquivo mantido, ainda usado por {referencias - 1} anexo(s): {anexo[0]}")
+        
+        await db.commit()
+        
+        if marcado:
+            await confirmar_exclusao(marcado)
+            print(f"[v0 Backend] Arquivo físico deletado: {anexo[0]}")
         
         return {"success": True, "message": "Anexo excluído com sucesso"}
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        await restaurar_exclusao(marcado)
         print(f"[v0 Backend] Erro ao excluir anexo: {str(e)}")
         if "foreign key constraint" in str(e).lower():
              return JSONResponse(status_code=400, content={"erro": "Não é possível excluir o anexo, pois está em uso."})
@@ -928,31 +986,44 @@ async def excluir_anexo(anexo_id: int, db: Session = Depends(get_db)):
 # API: CADASTROS BASE (Fornecedores, Empresas, Usuários)
 # ==============================================================================
 
+async def dados_fornecedores(db: SessaoAssincrona, empresa_id: Optional[int]):
+    """Fornecedores ativos (de uma empresa ou de todas), para o cache de dados_referencia."""
+    filtro = "AND empresa_id = :empresa_id" if empresa_id else ""
+    query = text(f"""
+        SELECT id, razao_social, cnpj_cpf, tipo_pessoa
+        FROM fornecedores
+        WHERE ativo = 1 {filtro}
+        ORDER BY razao_social
+    """)
+    
+    result = await db.execute(query, {"empresa_id": empresa_id})
+    fornecedores = result.fetchall()
+    
+    return {
+        "total": len(fornecedores),
+        "fornecedores": [
+            {
+                "id": row[0],
+                "razao_social": row[1],
+                "cnpj_cpf": row[2],
+                "tipo_pessoa": row[3]
+            }
+            for row in fornecedores
+        ]
+    }
+
 @app.get("/api/fornecedores")
-async def listar_fornecedores(db: Session = Depends(get_db)):
+async def listar_fornecedores(
+    request: Request,
+    empresa_id: Optional[int] = None,
+    db: SessaoAssincrona = Depends(get_db)
+):
+    """Lista os fornecedores ativos. Resposta em cache com ETag (304 se não mudou)."""
     try:
-        query = text("""
-            SELECT id, razao_social, cnpj_cpf, tipo_pessoa
-            FROM fornecedores
-            WHERE ativo = 1
-            ORDER BY razao_social
-        """)
-        
-        result = db.execute(query)
-        fornecedores = result.fetchall()
-        
-        return {
-            "total": len(fornecedores),
-            "fornecedores": [
-                {
-                    "id": row[0],
-                    "razao_social": row[1],
-                    "cnpj_cpf": row[2],
-                    "tipo_pessoa": row[3]
-                }
-                for row in fornecedores
-            ]
-        }
+        return await dados_referencia.resposta(
+            request, ("fornecedores", empresa_id or "todas"),
+            lambda: dados_fornecedores(db, empresa_id)
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -960,7 +1031,7 @@ async def listar_fornecedores(db: Session = Depends(get_db)):
         )
 
 @app.get("/api/usuarios")
-async def listar_usuarios(db: Session = Depends(get_db)):
+async def listar_usuarios(db: SessaoAssincrona = Depends(get_db)):
     try:
         query = text("""
             SELECT 
@@ -975,7 +1046,7 @@ async def listar_usuarios(db: Session = Depends(get_db)):
             LEFT JOIN empresas e ON u.empresa_id = e.id
         """)
         
-        result = db.execute(query)
+        result = await db.execute(query)
         usuarios = result.fetchall()
         
         return {
@@ -1000,49 +1071,54 @@ async def listar_usuarios(db: Session = Depends(get_db)):
         }
 
 
+async def dados_empresas(db: SessaoAssincrona):
+    """Todas as empresas, para o cache de dados_referencia."""
+    query = text("""
+        SELECT id, cnpj, razao_social, nome_fantasia, inscricao_estadual, inscricao_municipal,
+               endereco_logradouro, endereco_numero, endereco_complemento, endereco_bairro,
+               endereco_cidade, endereco_uf, endereco_cep, email_principal, telefone_principal, ativa
+        FROM empresas
+        ORDER BY razao_social
+    """)
+    
+    result = await db.execute(query)
+    empresas = result.fetchall()
+    
+    return {
+        "total": len(empresas),
+        "empresas": [
+            {
+                "id": row[0],
+                "cnpj": row[1],
+                "razao_social": row[2],
+                "nome_fantasia": row[3],
+                "inscricao_estadual": row[4],
+                "inscricao_municipal": row[5],
+                "endereco_logradouro": row[6],
+                "endereco_numero": row[7],
+                "endereco_complemento": row[8],
+                "endereco_bairro": row[9],
+                "endereco_cidade": row[10],
+                "endereco_uf": row[11],
+                "endereco_cep": row[12],
+                "email_principal": row[13],
+                "telefone_principal": row[14],
+                "ativa": bool(row[15])
+            }
+            for row in empresas
+        ]
+    }
+
 @app.get("/api/empresas")
-async def listar_empresas(db: Session = Depends(get_db)):
+async def listar_empresas(request: Request, db: SessaoAssincrona = Depends(get_db)):
+    """Lista as empresas. Resposta em cache com ETag (304 se não mudou)."""
     try:
-        query = text("""
-            SELECT id, cnpj, razao_social, nome_fantasia, inscricao_estadual, inscricao_municipal,
-                   endereco_logradouro, endereco_numero, endereco_complemento, endereco_bairro,
-                   endereco_cidade, endereco_uf, endereco_cep, email_principal, telefone_principal, ativa
-            FROM empresas
-            ORDER BY razao_social
-        """)
-        
-        result = db.execute(query)
-        empresas = result.fetchall()
-        
-        return {
-            "total": len(empresas),
-            "empresas": [
-                {
-                    "id": row[0],
-                    "cnpj": row[1],
-                    "razao_social": row[2],
-                    "nome_fantasia": row[3],
-                    "inscricao_estadual": row[4],
-                    "inscricao_municipal": row[5],
-                    "endereco_logradouro": row[6],
-                    "endereco_numero": row[7],
-                    "endereco_complemento": row[8],
-                    "endereco_bairro": row[9],
-                    "endereco_cidade": row[10],
-                    "endereco_uf": row[11],
-                    "endereco_cep": row[12],
-                    "email_principal": row[13],
-                    "telefone_principal": row[14],
-                    "ativa": bool(row[15])
-                }
-                for row in empresas
-            ]
-        }
+        return await dados_referencia.resposta(request, ("empresas",), lambda: dados_empresas(db))
     except Exception as e:
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.get("/api/empresas/{empresa_id}")
-async def buscar_empresa(empresa_id: int, db: Session = Depends(get_db)):
+async def buscar_empresa(empresa_id: int, db: SessaoAssincrona = Depends(get_db)):
     try:
         query = text("""
             SELECT id, cnpj, razao_social, nome_fantasia, inscricao_estadual, inscricao_municipal,
@@ -1052,7 +1128,7 @@ async def buscar_empresa(empresa_id: int, db: Session = Depends(get_db)):
             WHERE id = :id
         """)
         
-        result = db.execute(query, {"id": empresa_id})
+        result = await db.execute(query, {"id": empresa_id})
         row = result.fetchone()
         
         if not row:
@@ -1079,7 +1155,7 @@ async def buscar_empresa(empresa_id: int, db: Session = Depends(get_db)):
     except Exception as e:
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.post("/api/empresas")
+@app.post("/api/empresas", dependencies=[Depends(exigir_permissao(menu="cadastros_base"))])
 async def criar_empresa(
     cnpj: str = Form(...),
     razao_social: str = Form(...),
@@ -1096,7 +1172,7 @@ async def criar_empresa(
     email_principal: Optional[str] = Form(None),
     telefone_principal: Optional[str] = Form(None),
     ativa: bool = Form(True),
-    db: Session = Depends(get_db)
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
         query = text("""
@@ -1108,7 +1184,7 @@ async def criar_empresa(
                     :endereco_cidade, :endereco_uf, :endereco_cep, :email_principal, :telefone_principal, :ativa)
         """)
         
-        result = db.execute(query, {
+        result = await db.execute(query, {
             "cnpj": cnpj,
             "razao_social": razao_social,
             "nome_fantasia": nome_fantasia,
@@ -1127,14 +1203,15 @@ async def criar_empresa(
         })
         
         empresa_id = result.lastrowid
-        db.commit()
+        await db.commit()
+        dados_referencia.invalidar("empresas")
         
         return {"success": True, "empresa_id": empresa_id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.put("/api/empresas/{empresa_id}")
+@app.put("/api/empresas/{empresa_id}", dependencies=[Depends(exigir_permissao(menu="cadastros_base"))])
 async def atualizar_empresa(
     empresa_id: int,
     cnpj: str = Form(...),
@@ -1152,7 +1229,7 @@ async def atualizar_empresa(
     email_principal: Optional[str] = Form(None),
     telefone_principal: Optional[str] = Form(None),
     ativa: bool = Form(True),
-    db: Session = Depends(get_db)
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
         query = text("""
@@ -1166,7 +1243,7 @@ async def atualizar_empresa(
             WHERE id = :id
         """)
         
-        db.execute(query, {
+        await db.execute(query, {
             "id": empresa_id,
             "cnpj": cnpj,
             "razao_social": razao_social,
@@ -1185,25 +1262,27 @@ async def atualizar_empresa(
             "ativa": ativa
         })
         
-        db.commit()
+        await db.commit()
+        dados_referencia.invalidar("empresas")
         return {"success": True}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.delete("/api/empresas/{empresa_id}")
-async def excluir_empresa(empresa_id: int, db: Session = Depends(get_db)):
+@app.delete("/api/empresas/{empresa_id}", dependencies=[Depends(exigir_permissao(menu="cadastros_base"))])
+async def excluir_empresa(empresa_id: int, db: SessaoAssincrona = Depends(get_db)):
     try:
         query = text("DELETE FROM empresas WHERE id = :id")
-        db.execute(query, {"id": empresa_id})
-        db.commit()
+        await db.execute(query, {"id": empresa_id})
+        await db.commit()
+        dados_referencia.invalidar("empresas")
         return {"success": True}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.get("/api/fornecedores/{fornecedor_id}")
-async def buscar_fornecedor(fornecedor_id: int, db: Session = Depends(get_db)):
+async def buscar_fornecedor(fornecedor_id: int, db: SessaoAssincrona = Depends(get_db)):
     try:
         query = text("""
             SELECT id, empresa_id, cnpj_cpf, tipo_pessoa, razao_social, nome_fantasia,
@@ -1213,7 +1292,7 @@ async def buscar_fornecedor(fornecedor_id: int, db: Session = Depends(get_db)):
             WHERE id = :id
         """)
         
-        result = db.execute(query, {"id": fornecedor_id})
+        result = await db.execute(query, {"id": fornecedor_id})
         row = result.fetchone()
         
         if not row:
@@ -1240,7 +1319,7 @@ async def buscar_fornecedor(fornecedor_id: int, db: Session = Depends(get_db)):
     except Exception as e:
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.post("/api/fornecedores")
+@app.post("/api/fornecedores", dependencies=[Depends(exigir_permissao(menu="cadastros_base"))])
 async def criar_fornecedor(
     empresa_id: int = Form(...),
     cnpj_cpf: str = Form(...),
@@ -1257,7 +1336,7 @@ async def criar_fornecedor(
     email: Optional[str] = Form(None),
     telefone: Optional[str] = Form(None),
     ativo: int = Form(...),
-    db: Session = Depends(get_db)
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
         query = text("""
@@ -1269,7 +1348,7 @@ async def criar_fornecedor(
                     :endereco_cidade, :endereco_uf, :endereco_cep, :email, :telefone, :ativo)
         """)
         
-        result = db.execute(query, {
+        result = await db.execute(query, {
             "empresa_id": empresa_id,
             "cnpj_cpf": cnpj_cpf,
             "tipo_pessoa": tipo_pessoa,
@@ -1288,11 +1367,12 @@ async def criar_fornecedor(
         })
         
         fornecedor_id = result.lastrowid
-        db.commit()
+        await db.commit()
+        dados_referencia.invalidar("fornecedores")
         
         return {"success": True, "fornecedor_id": fornecedor_id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         
         # ========================================
         # TRATAMENTO DE ERRO DE DUPLICIDADE
@@ -1312,7 +1392,7 @@ async def criar_fornecedor(
         print(f"[v0 Backend] Erro ao cadastrar fornecedor: {str(e)}")
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.put("/api/fornecedores/{fornecedor_id}")
+@app.put("/api/fornecedores/{fornecedor_id}", dependencies=[Depends(exigir_permissao(menu="cadastros_base"))])
 async def atualizar_fornecedor(
     fornecedor_id: int,
     empresa_id: int = Form(...),
@@ -1330,7 +1410,7 @@ async def atualizar_fornecedor(
     email: Optional[str] = Form(None),
     telefone: Optional[str] = Form(None),
     ativo: int = Form(...),
-    db: Session = Depends(get_db)
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
         query = text("""
@@ -1344,7 +1424,7 @@ async def atualizar_fornecedor(
             WHERE id = :id
         """)
         
-        db.execute(query, {
+        await db.execute(query, {
             "id": fornecedor_id,
             "empresa_id": empresa_id,
             "cnpj_cpf": cnpj_cpf,
@@ -1363,25 +1443,27 @@ async def atualizar_fornecedor(
             "ativo": ativo
         })
         
-        db.commit()
+        await db.commit()
+        dados_referencia.invalidar("fornecedores")
         return {"success": True}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.delete("/api/fornecedores/{fornecedor_id}")
-async def excluir_fornecedor(fornecedor_id: int, db: Session = Depends(get_db)):
+@app.delete("/api/fornecedores/{fornecedor_id}", dependencies=[Depends(exigir_permissao(menu="cadastros_base"))])
+async def excluir_fornecedor(fornecedor_id: int, db: SessaoAssincrona = Depends(get_db)):
     try:
         query = text("DELETE FROM fornecedores WHERE id = :id")
-        db.execute(query, {"id": fornecedor_id})
-        db.commit()
+        await db.execute(query, {"id": fornecedor_id})
+        await db.commit()
+        dados_referencia.invalidar("fornecedores")
         return {"success": True}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.get("/api/usuarios-detalhado")
-async def listar_usuarios_detalhado(db: Session = Depends(get_db)):
+async def listar_usuarios_detalhado(db: SessaoAssincrona = Depends(get_db)):
     try:
         query = text("""
             SELECT 
@@ -1395,7 +1477,7 @@ async def listar_usuarios_detalhado(db: Session = Depends(get_db)):
             ORDER BY u.nome
         """)
         
-        result = db.execute(query)
+        result = await db.execute(query)
         usuarios = result.fetchall()
         
         return {
@@ -1421,7 +1503,7 @@ async def listar_usuarios_detalhado(db: Session = Depends(get_db)):
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.get("/api/usuarios/{usuario_id}")
-async def buscar_usuario(usuario_id: int, db: Session = Depends(get_db)):
+async def buscar_usuario(usuario_id: int, db: SessaoAssincrona = Depends(get_db)):
     try:
         query = text("""
             SELECT 
@@ -1431,7 +1513,7 @@ async def buscar_usuario(usuario_id: int, db: Session = Depends(get_db)):
             WHERE u.id = :id
         """)
         
-        result = db.execute(query, {"id": usuario_id})
+        result = await db.execute(query, {"id": usuario_id})
         row = result.fetchone()
         
         if not row:
@@ -1451,8 +1533,9 @@ async def buscar_usuario(usuario_id: int, db: Session = Depends(get_db)):
     except Exception as e:
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.post("/api/usuarios")
+@app.post("/api/usuarios", dependencies=[Depends(exigir_permissao(menu="usuarios"))])
 async def criar_usuario(
+    request: Request,
     nome: str = Form(...),
     email: str = Form(...),
     cpf: Optional[str] = Form(None),
@@ -1462,17 +1545,17 @@ async def criar_usuario(
     role_id: int = Form(...),
     senha: str = Form(...),
     ativo: bool = Form(True),
-    db: Session = Depends(get_db)
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
-        senha_hash = pwd_context.hash(senha)
+        senha_hash = await gerar_hash(senha)
         
         query = text("""
             INSERT INTO usuarios (nome, email, cpf, telefone, departamento, empresa_id, role_id, senha_hash, ativo)
             VALUES (:nome, :email, :cpf, :telefone, :departamento, :empresa_id, :role_id, :senha_hash, :ativo)
         """)
         
-        result = db.execute(query, {
+        result = await db.execute(query, {
             "nome": nome,
             "email": email,
             "cpf": cpf,
@@ -1485,14 +1568,20 @@ async def criar_usuario(
         })
         
         usuario_id = result.lastrowid
-        db.commit()
+        await db.run_sync(registrar_eventos, [evento(
+            auditoria.USUARIO_CRIADO, f"Usuário {nome} ({email}) foi criado.",
+            empresa_id=empresa_id, referencia_id=usuario_id, ip_address=ip_cliente(request)
+        )])
+        await db.commit()
         
         return {"success": True, "usuario_id": usuario_id}
+    except FilaSenhasCheia as e:
+        return JSONResponse(status_code=503, headers={"Retry-After": "1"}, content={"erro": str(e)})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.put("/api/usuarios/{usuario_id}")
+@app.put("/api/usuarios/{usuario_id}", dependencies=[Depends(exigir_permissao(menu="usuarios"))])
 async def atualizar_usuario(
     usuario_id: int,
     nome: str = Form(...),
@@ -1503,7 +1592,7 @@ async def atualizar_usuario(
     empresa_id: int = Form(...),
     role_id: int = Form(...),
     ativo: bool = Form(True),
-    db: Session = Depends(get_db)
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
         query = text("""
@@ -1513,7 +1602,7 @@ async def atualizar_usuario(
             WHERE id = :id
         """)
         
-        db.execute(query, {
+        await db.execute(query, {
             "id": usuario_id,
             "nome": nome,
             "email": email,
@@ -1524,68 +1613,134 @@ async def atualizar_usuario(
             "role_id": role_id,
             "ativo": ativo
         })
+        if not ativo:
+            await db.run_sync(encerrar_sessoes_usuario, usuario_id)
         
-        db.commit()
+        await db.commit()
+        # Empresa/perfil podem ter mudado: as sessões dele são relidas do banco
+        gerenciador_sessoes.esquecer_usuario(usuario_id)
         return {"success": True}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.put("/api/usuarios/{usuario_id}/senha")
 async def alterar_senha_usuario(
     usuario_id: int,
     senha: str = Form(...),
-    db: Session = Depends(get_db)
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="usuarios")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
-        senha_hash = pwd_context.hash(senha)
+        senha_hash = await gerar_hash(senha)
         
         query = text("UPDATE usuarios SET senha_hash = :senha_hash WHERE id = :id")
-        db.execute(query, {"id": usuario_id, "senha_hash": senha_hash})
-        db.commit()
+        await db.execute(query, {"id": usuario_id, "senha_hash": senha_hash})
+        # Senha trocada: os logins abertos com a senha antiga deixam de valer (menos o de quem trocou)
+        await db.run_sync(encerrar_sessoes_usuario, usuario_id, exceto=usuario.session_id)
+        await db.commit()
+        gerenciador_sessoes.esquecer_usuario(usuario_id)
         
         return {"success": True}
+    except FilaSenhasCheia as e:
+        return JSONResponse(status_code=503, headers={"Retry-After": "1"}, content={"erro": str(e)})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.delete("/api/usuarios/{usuario_id}")
-async def excluir_usuario(usuario_id: int, db: Session = Depends(get_db)):
+@app.delete("/api/usuarios/{usuario_id}", dependencies=[Depends(exigir_permissao(menu="usuarios"))])
+async def excluir_usuario(usuario_id: int, db: SessaoAssincrona = Depends(get_db)):
     try:
         query = text("DELETE FROM usuarios WHERE id = :id")
-        db.execute(query, {"id": usuario_id})
-        db.commit()
+        await db.execute(query, {"id": usuario_id})
+        await db.commit()
+        gerenciador_sessoes.esquecer_usuario(usuario_id) # As sessões saem junto (ON DELETE CASCADE)
         return {"success": True}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
+async def dados_roles(db: SessaoAssincrona):
+    """Perfis ativos, para o cache de dados_referencia."""
+    query = text("""
+        SELECT id, nome, descricao, nivel_acesso
+        FROM roles
+        WHERE ativo = 1
+        ORDER BY nivel_acesso
+    """)
+    
+    result = await db.execute(query)
+    roles = result.fetchall()
+    
+    return {
+        "total": len(roles),
+        "roles": [
+            {
+                "id": row[0],
+                "nome": row[1],
+                "descricao": row[2],
+                "nivel_acesso": row[3]
+            }
+            for row in roles
+        ]
+    }
+
 @app.get("/api/roles")
-async def listar_roles(db: Session = Depends(get_db)):
+async def listar_roles(request: Request, db: SessaoAssincrona = Depends(get_db)):
+    """Lista os perfis ativos. Resposta em cache com ETag (304 se não mudou)."""
+    try:
+        return await dados_referencia.resposta(request, ("roles",), lambda: dados_roles(db))
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
+@app.put("/api/roles/{role_id}")
+async def atualizar_role(
+    role_id: int,
+    descricao: Optional[str] = Form(None),
+    nivel_acesso: int = Form(...),
+    permissoes_base: str = Form(...),
+    ativo: bool = Form(True),
+    usuario: SessaoUsuario = Depends(exigir_permissao(nivel_minimo=NIVEL_ADMIN)),
+    db: SessaoAssincrona = Depends(get_db)
+):
+    """
+    Altera um perfil de acesso. permissoes_base é o JSON do perfil,
+    ex: {"menus": ["dashboard", "documentos_fiscais"]}.
+    """
     try:
+        try:
+            permissoes = json.loads(permissoes_base)
+        except ValueError:
+            permissoes = None
+        if not isinstance(permissoes, dict) or not isinstance(permissoes.get("menus", []), list):
+            return JSONResponse(status_code=400, content={"erro": "permissoes_base deve ser um JSON com a lista 'menus'"})
+        if not 1 <= nivel_acesso <= 5:
+            return JSONResponse(status_code=400, content={"erro": "nivel_acesso deve estar entre 1 e 5"})
+        
         query = text("""
-            SELECT id, nome, descricao, nivel_acesso
-            FROM roles
-            WHERE ativo = 1
-            ORDER BY nivel_acesso
+            UPDATE roles
+            SET descricao = :descricao, nivel_acesso = :nivel_acesso,
+                permissoes_base = :permissoes_base, ativo = :ativo
+            WHERE id = :id
         """)
-        
-        result = db.execute(query)
-        roles = result.fetchall()
-        
-        return {
-            "total": len(roles),
-            "roles": [
-                {
-                    "id": row[0],
-                    "nome": row[1],
-                    "descricao": row[2],
-                    "nivel_acesso": row[3]
-                }
-                for row in roles
-            ]
-        }
+        result = await db.execute(query, {
+            "id": role_id,
+            "descricao": descricao,
+            "nivel_acesso": nivel_acesso,
+            "permissoes_base": json.dumps(permissoes, ensure_ascii=False),
+            "ativo": ativo
+        })
+        if result.rowcount == 0:
+            await db.rollback()
+            return JSONResponse(status_code=404, content={"erro": "Perfil não encontrado"})
+        
+        await db.commit()
+        # As próximas checagens (e logins) usam o perfil novo
+        perfis.invalidar()
+        dados_referencia.invalidar("roles")
+        return {"success": True}
     except Exception as e:
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 # ==============================================================================
@@ -1598,51 +1753,32 @@ async def listar_provisionamentos(
     data_inicial: str = None,
     data_final: str = None,
     fornecedor_id: int = None,
-    db: Session = Depends(get_db)
+    limite: int = PAGINA_PADRAO,
+    cursor: str = None,
+    contagem: str = CONTAGEM_NENHUMA,
+    db: SessaoAssincrona = Depends(get_db_leitura)
 ):
     try:
-        query_base = """
-            SELECT 
-                p.id,
-                p.data_competencia,
-                f.razao_social as fornecedor,
-                df.numero_documento,
-                p.valor_provisionado,
-                p.valor_liquido,
-                p.status,
-                p.created_at
-            FROM provisionamentos p
-            JOIN fornecedores f ON p.fornecedor_id = f.id
-            JOIN documentos_fiscais df ON p.documento_fiscal_id = df.id
-            WHERE 1=1
-        """
-        
-        conditions = []
         params = {}
+        limite = normalizar_limite(limite)
+        if cursor:
+            params.update(parametros_cursor(cursor, len(ORDENACAO_PROVISIONAMENTOS)))
         
-        if status:
-            conditions.append("p.status = :status")
-            params["status"] = status
-        
-        if data_inicial and data_final:
-            conditions.append("p.data_competencia BETWEEN :data_inicial AND :data_final")
-            params["data_inicial"] = data_inicial
-            params["data_final"] = data_final
-        
-        if fornecedor_id:
-            conditions.append("p.fornecedor_id = :fornecedor_id")
-            params["fornecedor_id"] = fornecedor_id
-        
-        if conditions:
-            query_base += " AND " + " AND ".join(conditions)
+        consulta, consulta_contagem = consulta_provisionamentos(
+            params, status, data_inicial, data_final, fornecedor_id, com_cursor=bool(cursor)
+        )
         
-        query_base += " ORDER BY p.data_competencia DESC LIMIT 100"
+        total_registros, total_aproximado = await contar_consulta(db, consulta_contagem, params, contagem)
         
-        result = db.execute(text(query_base), params)
-        provisionamentos = result.fetchall()
+        result = await db.execute(consulta, {**params, "limite": limite + 1})
+        provisionamentos, next_cursor = fatiar_pagina(result.fetchall(), limite, [1, 0])
         
         return {
             "total": len(provisionamentos),
+            "total_registros": total_registros,
+            "total_aproximado": total_aproximado,
+            "limite": limite,
+            "next_cursor": next_cursor,
             "provisionamentos": [
                 {
                     "id": row[0],
@@ -1657,14 +1793,20 @@ async def listar_provisionamentos(
                 for row in provisionamentos
             ]
         }
+    except (CursorInvalido, ContagemInvalida) as e:
+        return JSONResponse(status_code=400, content={"erro": str(e)})
     except Exception as e:
         print(f"[v0 Backend] Erro ao listar provisionamentos: {str(e)}")
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.post("/api/provisionamentos/{prov_id}/aprovar")
-async def aprovar_provisionamento(prov_id: int, db: Session = Depends(get_db)):
+async def aprovar_provisionamento(
+    prov_id: int,
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="provisionamentos")),
+    db: SessaoAssincrona = Depends(get_db)
+):
     try:
-        user_id = 1  # TODO: Obter da sessão
+        user_id = usuario.usuario_id
         
         query = text("""
             UPDATE provisionamentos 
@@ -1674,16 +1816,16 @@ async def aprovar_provisionamento(prov_id: int, db: Session = Depends(get_db)):
             WHERE id = :prov_id
         """)
         
-        db.execute(query, {"prov_id": prov_id, "user_id": user_id})
-        db.commit()
+        await db.execute(query, {"prov_id": prov_id, "user_id": user_id})
+        await db.commit()
         
         return {"success": True, "message": "Provisionamento aprovado"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.post("/api/provisionamentos/{prov_id}/gerar-conta-pagar")
-async def gerar_conta_pagar(prov_id: int, db: Session = Depends(get_db)):
+@app.post("/api/provisionamentos/{prov_id}/gerar-conta-pagar", dependencies=[Depends(exigir_permissao(menu="provisionamentos"))])
+async def gerar_conta_pagar(prov_id: int, db: SessaoAssincrona = Depends(get_db)):
     try:
         # Buscar dados do provisionamento
         query_prov = text("""
@@ -1693,7 +1835,7 @@ async def gerar_conta_pagar(prov_id: int, db: Session = Depends(get_db)):
             WHERE p.id = :prov_id AND p.status = 'APROVADO'
         """)
         
-        result = db.execute(query_prov, {"prov_id": prov_id})
+        result = await db.execute(query_prov, {"prov_id": prov_id})
         prov = result.fetchone()
         
         if not prov:
@@ -1706,7 +1848,7 @@ async def gerar_conta_pagar(prov_id: int, db: Session = Depends(get_db)):
             VALUES (:prov_id, :empresa_id, :fornecedor_id, :valor, :vencimento, 'PENDENTE')
         """)
         
-        db.execute(query_conta, {
+        await db.execute(query_conta, {
             "prov_id": prov_id,
             "empresa_id": prov[0],
             "fornecedor_id": prov[1],
@@ -1714,20 +1856,31 @@ async def gerar_conta_pagar(prov_id: int, db: Session = Depends(get_db)):
             "vencimento": prov[3]
         })
         
-        db.commit()
+        await db.commit()
+        invalidar_dashboard()
         
         return {"success": True, "message": "Conta a pagar gerada com sucesso"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"[v0 Backend] Erro ao gerar conta a pagar: {str(e)}")
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.get("/api/contas-pagar")
 async def listar_contas_pagar(
     status: str = None,
-    db: Session = Depends(get_db)
+    limite: int = PAGINA_PADRAO,
+    cursor: str = None,
+    contagem: str = CONTAGEM_NENHUMA,
+    db: SessaoAssincrona = Depends(get_db_leitura)
 ):
     try:
+        from_base = """
+            FROM contas_pagar cp
+            JOIN fornecedores f ON cp.fornecedor_id = f.id
+            JOIN provisionamentos p ON cp.provisionamento_id = p.id
+            JOIN documentos_fiscais df ON p.documento_fiscal_id = df.id
+            WHERE 1=1
+        """
         query_base = """
             SELECT 
                 cp.id,
@@ -1736,26 +1889,36 @@ async def listar_contas_pagar(
                 cp.valor_original,
                 cp.data_vencimento,
                 cp.status
-            FROM contas_pagar cp
-            JOIN fornecedores f ON cp.fornecedor_id = f.id
-            JOIN provisionamentos p ON cp.provisionamento_id = p.id
-            JOIN documentos_fiscais df ON p.documento_fiscal_id = df.id
-            WHERE 1=1
-        """
+        """ + from_base
         
+        conditions = []
         params = {}
         
         if status:
-            query_base += " AND cp.status = :status"
+            conditions.append("cp.status = :status")
             params["status"] = status
         
-        query_base += " ORDER BY cp.data_vencimento ASC"
+        total_registros, total_aproximado = await contar_registros(db, from_base, conditions, params, contagem)
         
-        result = db.execute(text(query_base), params)
-        contas = result.fetchall()
+        limite = normalizar_limite(limite)
+        ordenacao = [("cp.data_vencimento", "ASC"), ("cp.id", "ASC")]
+        if cursor:
+            aplicar_cursor(conditions, params, ordenacao, cursor)
+        
+        if conditions:
+            query_base += " AND " + " AND ".join(conditions)
+        
+        query_base += clausula_ordem(ordenacao) + clausula_limite(limite)
+        
+        result = await db.execute(text(query_base), params)
+        contas, next_cursor = fatiar_pagina(result.fetchall(), limite, [4, 0])
         
         return {
             "total": len(contas),
+            "total_registros": total_registros,
+            "total_aproximado": total_aproximado,
+            "limite": limite,
+            "next_cursor": next_cursor,
             "contas": [
                 {
                     "id": row[0],
@@ -1768,6 +1931,8 @@ async def listar_contas_pagar(
                 for row in contas
             ]
         }
+    except (CursorInvalido, ContagemInvalida) as e:
+        return JSONResponse(status_code=400, content={"erro": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
@@ -1780,44 +1945,32 @@ async def listar_remessas(
     status: str = None,
     data_inicial: str = None,
     data_final: str = None,
-    db: Session = Depends(get_db)
+    limite: int = PAGINA_PADRAO,
+    cursor: str = None,
+    contagem: str = CONTAGEM_NENHUMA,
+    db: SessaoAssincrona = Depends(get_db_leitura)
 ):
     try:
-        query_base = """
-            SELECT 
-                r.id,
-                r.numero_remessa,
-                r.data_geracao,
-                r.quantidade_registros,
-                r.valor_total,
-                r.status_remessa,
-                EXISTS(SELECT 1 FROM retornos_cnab WHERE remessa_id = r.id) as tem_retorno
-            FROM remessas_cnab r
-            WHERE 1=1
-        """
-        
-        conditions = []
         params = {}
+        limite = normalizar_limite(limite)
+        if cursor:
+            params.update(parametros_cursor(cursor, len(ORDENACAO_REMESSAS)))
         
-        if status:
-            conditions.append("r.status_remessa = :status")
-            params["status"] = status
-        
-        if data_inicial and data_final:
-            conditions.append("DATE(r.data_geracao) BETWEEN :data_inicial AND :data_final")
-            params["data_inicial"] = data_inicial
-            params["data_final"] = data_final
-        
-        if conditions:
-            query_base += " AND " + " AND ".join(conditions)
+        consulta, consulta_contagem = consulta_remessas(
+            params, status, data_inicial, data_final, com_cursor=bool(cursor)
+        )
         
-        query_base += " ORDER BY r.data_geracao DESC LIMIT 100"
+        total_registros, total_aproximado = await contar_consulta(db, consulta_contagem, params, contagem)
         
-        result = db.execute(text(query_base), params)
-        remessas = result.fetchall()
+        result = await db.execute(consulta, {**params, "limite": limite + 1})
+        remessas, next_cursor = fatiar_pagina(result.fetchall(), limite, [2, 0])
         
         return {
             "total": len(remessas),
+            "total_registros": total_registros,
+            "total_aproximado": total_aproximado,
+            "limite": limite,
+            "next_cursor": next_cursor,
             "remessas": [
                 {
                     "id": row[0],
@@ -1831,169 +1984,137 @@ async def listar_remessas(
                 for row in remessas
             ]
         }
+    except (CursorInvalido, ContagemInvalida) as e:
+        return JSONResponse(status_code=400, content={"erro": str(e)})
     except Exception as e:
         print(f"[v0 Backend] Erro ao listar remessas: {str(e)}")
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 @app.post("/api/remessas-cnab")
 async def gerar_remessa(
+    request: Request,
     conta_ids: list = [],
-    db: Session = Depends(get_db)
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="remessas_cnab")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
     try:
-        from pydantic import BaseModel
-        
-        class RemessaRequest(BaseModel):
-            conta_ids: list[int]
-        
-        # Obter próximo número de remessa
-        query_num = text("SELECT COALESCE(MAX(numero_remessa), 0) + 1 FROM remessas_cnab WHERE empresa_id = 1")
-        result = db.execute(query_num)
-        numero_remessa = result.scalar()
-        
-        # Buscar contas a pagar
-        query_contas = text("""
-            SELECT cp.id, cp.valor_original
-            FROM contas_pagar cp
-            WHERE cp.id IN :conta_ids AND cp.status = 'PENDENTE'
-        """)
-        
-        result = db.execute(query_contas, {"conta_ids": tuple(conta_ids) if conta_ids else (0,)})
-        contas = result.fetchall()
-        
-        if not contas:
-            return JSONResponse(status_code=400, content={"erro": "Nenhuma conta válida selecionada"})
-        
-        # Calcular totais
-        quantidade = len(contas)
-        valor_total = sum(float(c[1]) for c in contas)
-        
-        # Gerar nome do arquivo
-        nome_arquivo = f"remessa_{numero_remessa:06d}.rem"
-        caminho = f"/uploads/remessas/{nome_arquivo}"
-        
-        # Inserir remessa
-        query_remessa = text("""
-            INSERT INTO remessas_cnab 
-            (empresa_id, nome_arquivo, caminho_arquivo, numero_remessa, quantidade_registros, valor_total, usuario_geracao_id)
-            VALUES (1, :nome, :caminho, :numero, :qtd, :valor, 1)
-        """)
-        
-        result = db.execute(query_remessa, {
-            "nome": nome_arquivo,
-            "caminho": caminho,
-            "numero": numero_remessa,
-            "qtd": quantidade,
-            "valor": valor_total
-        })
-        
-        remessa_id = result.lastrowid
-        
-        # Atualizar contas a pagar
-        for conta_id, _ in contas:
-            query_update = text("""
-                UPDATE contas_pagar 
-                SET remessa_id = :remessa_id, status = 'AGENDADO'
-                WHERE id = :conta_id
-            """)
-            db.execute(query_update, {"remessa_id": remessa_id, "conta_id": conta_id})
-        
-        db.commit()
+        # Número da remessa, arquivo CNAB 240 e agendamento das contas em uma transação
+        remessa = await db.run_sync(gerar_remessa_cnab, conta_ids, UPLOAD_DIR, usuario.empresa_id, usuario.usuario_id)
+        remessa_id = remessa["remessa_id"]
+        numero_remessa = remessa["numero_remessa"]
+        valor_total = remessa["valor_total"]
+        
+        await db.run_sync(registrar_eventos, [evento(
+            auditoria.REMESSA_GERADA,
+            f"Remessa CNAB Nº {numero_remessa} (R$ {formatar_valor(valor_total)}) foi gerada.",
+            empresa_id=usuario.empresa_id, usuario_id=usuario.usuario_id, referencia_id=remessa_id, ip_address=ip_cliente(request)
+        )])
+        await db.commit()
+        invalidar_dashboard()
         
         return {
             "success": True,
             "remessa_id": remessa_id,
             "numero_remessa": numero_remessa,
+            "nome_arquivo": remessa["nome_arquivo"],
+            "quantidade": remessa["quantidade"],
+            "valor_total": float(valor_total),
             "message": "Remessa gerada com sucesso"
         }
+    except ErroCNAB as e:
+        await db.rollback()
+        return JSONResponse(status_code=400, content={"erro": str(e)})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"[v0 Backend] Erro ao gerar remessa: {str(e)}")
         import traceback
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
-@app.post("/api/processar-retorno-cnab")
-async def processar_retorno(
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+@app.get("/api/remessas-cnab/{remessa_id}/download")
+async def baixar_remessa(
+    remessa_id: int,
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="remessas_cnab")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
+    """
+    Baixa o arquivo CNAB 240 gerado para a remessa (uploads/remessas/<empresa>/).
+    Só remessas da empresa do usuário: o arquivo tem CNPJ e conta bancária dos fornecedores.
+    """
     try:
-        # Ler conteúdo do arquivo de retorno
-        content = await file.read()
-        content_str = content.decode('latin-1')  # Arquivos CNAB geralmente usam latin-1
-        
-        # TODO: Implementar parser de arquivo CNAB de retorno
-        # Por ora, vamos simular o processamento
-        
-        # Buscar remessas pendentes de retorno
-        query_remessa = text("""
-            SELECT id, numero_remessa 
-            FROM remessas_cnab 
-            WHERE status_remessa IN ('GERADA', 'ENVIADA')
-            ORDER BY data_geracao DESC 
-            LIMIT 1
-        """)
-        
-        result = db.execute(query_remessa)
-        remessa = result.fetchone()
+        query = text("SELECT nome_arquivo, caminho_arquivo FROM remessas_cnab WHERE id = :remessa_id AND empresa_id = :empresa_id")
+        remessa = (await db.execute(query, {"remessa_id": remessa_id, "empresa_id": usuario.empresa_id})).fetchone()
         
         if not remessa:
-            return JSONResponse(status_code=404, content={"erro": "Nenhuma remessa pendente encontrada"})
+            return JSONResponse(status_code=404, content={"erro": "Remessa não encontrada"})
         
-        remessa_id = remessa[0]
-        
-        # Salvar arquivo de retorno
-        nome_arquivo_ret = f"retorno_{remessa[1]:06d}.ret"
-        caminho_ret = f"/uploads/retornos/{nome_arquivo_ret}"
-        
-        query_retorno = text("""
-            INSERT INTO retornos_cnab 
-            (remessa_id, nome_arquivo_retorno, caminho_arquivo, processado, data_processamento, usuario_processamento_id, quantidade_registros)
-            VALUES (:remessa_id, :nome, :caminho, TRUE, NOW(), 1, 0)
-        """)
+        # caminho_arquivo é a URL pública (/uploads/...); no disco fica dentro de UPLOAD_DIR
+        caminho_completo = caminho_absoluto(UPLOAD_DIR, remessa[1].removeprefix("/uploads"))
+        if not os.path.exists(caminho_completo):
+            return JSONResponse(status_code=404, content={"erro": "Arquivo da remessa não encontrado"})
         
-        db.execute(query_retorno, {
-            "remessa_id": remessa_id,
-            "nome": nome_arquivo_ret,
-            "caminho": caminho_ret
-        })
-        
-        # Atualizar status da remessa
-        query_update_remessa = text("""
-            UPDATE remessas_cnab 
-            SET status_remessa = 'PROCESSADA'
-            WHERE id = :remessa_id
-        """)
-        db.execute(query_update_remessa, {"remessa_id": remessa_id})
+        return FileResponse(caminho_completo, filename=remessa[0], media_type="text/plain")
+    except Exception as e:
+        print(f"[v0 Backend] Erro ao baixar remessa: {str(e)}")
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
+@app.post("/api/processar-retorno-cnab")
+async def processar_retorno(
+    request: Request,
+    file: UploadFile = File(...),
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="remessas_cnab")),
+    db: SessaoAssincrona = Depends(get_db)
+):
+    """
+    Processa o arquivo de retorno do banco (CNAB 240 ou 400).
+    1. Lê o arquivo linha a linha (cnab.py), sem carregá-lo inteiro em memória.
+    2. Grava cada pagamento em retornos_cnab_itens, em lotes.
+    3. Aplica as ocorrências nas contas a pagar da remessa (pelo "seu número"):
+       pago, agendado ou rejeitado (volta a PENDENTE, fora da remessa).
+    Tudo em uma transação; devolve os contadores do processamento.
+    """
+    try:
+        # A remessa vem do "seu número" do primeiro pagamento (só lê o começo do arquivo)
+        remessa_id = await to_thread.run_sync(primeira_remessa, file.file)
+        if remessa_id is None:
+            return JSONResponse(status_code=400, content={"erro": "Nenhum pagamento do arquivo pertence a uma remessa deste sistema"})
+        
+        # Só remessas da empresa do usuário (os ids do "seu número" são sequenciais)
+        result = await db.execute(
+            text("SELECT numero_remessa FROM remessas_cnab WHERE id = :id AND empresa_id = :empresa_id"),
+            {"id": remessa_id, "empresa_id": usuario.empresa_id}
+        )
+        numero_remessa = result.scalar()
+        if numero_remessa is None:
+            return JSONResponse(status_code=404, content={"erro": f"Remessa {remessa_id} informada no arquivo não encontrada"})
         
-        # Atualizar contas a pagar para PAGO
-        query_update_contas = text("""
-            UPDATE contas_pagar 
-            SET status = 'PAGO', data_pagamento = NOW(), valor_pago = valor_original
-            WHERE remessa_id = :remessa_id
-        """)
-        result_contas = db.execute(query_update_contas, {"remessa_id": remessa_id})
-        
-        # Atualizar provisionamentos para PAGO
-        query_update_prov = text("""
-            UPDATE provisionamentos p
-            JOIN contas_pagar cp ON p.id = cp.provisionamento_id
-            SET p.status = 'PAGO'
-            WHERE cp.remessa_id = :remessa_id
-        """)
-        db.execute(query_update_prov, {"remessa_id": remessa_id})
+        resultado = await db.run_sync(
+            gravar_retorno, file.file, file.filename or f"retorno_{numero_remessa:06d}.ret", remessa_id,
+            usuario.empresa_id, usuario.usuario_id
+        )
         
-        db.commit()
+        situacoes = resultado["por_situacao"]
+        await db.run_sync(registrar_eventos, [evento(
+            auditoria.RETORNO_PROCESSADO,
+            f"Retorno CNAB da remessa Nº {numero_remessa} processado: {resultado['pagamentos']} pagamento(s), "
+            f"{situacoes.get('PAGO', 0)} pago(s), {situacoes.get('REJEITADO', 0)} rejeitado(s).",
+            empresa_id=usuario.empresa_id, usuario_id=usuario.usuario_id, referencia_id=resultado["retorno_id"], ip_address=ip_cliente(request)
+        )])
+        await db.commit()
+        invalidar_dashboard()
         
         return {
             "success": True,
             "remessa_id": remessa_id,
-            "processados": result_contas.rowcount,
+            "processados": resultado["contas_atualizadas"],
+            **resultado,
             "message": "Retorno processado com sucesso"
         }
+    except ErroCNAB as e:
+        await db.rollback()
+        return JSONResponse(status_code=400, content={"erro": str(e)})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"[v0 Backend] Erro ao processar retorno: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -2005,15 +2126,17 @@ async def processar_retorno(
 
 @app.post("/api/documentos-fiscais/{doc_id}/confirmar")
 async def confirmar_documento(
+    request: Request,
     doc_id: int,
     comentarios: str = Form(...),
-    usuario_id: int = Form(1),  # TODO: Obter da sessão
-    db: Session = Depends(get_db)
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="documentos_fiscais")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
     """
     Confirma um documento fiscal e muda status para PROVISIONADO
     Requer comentários obrigatórios
     """
+    usuario_id = usuario.usuario_id
     try:
         if not comentarios or not comentarios.strip():
             return JSONResponse(
@@ -2023,7 +2146,7 @@ async def confirmar_documento(
         
         # Buscar documento
         query_doc = text("SELECT id, status_processamento FROM documentos_fiscais WHERE id = :doc_id")
-        result = db.execute(query_doc, {"doc_id": doc_id})
+        result = await db.execute(query_doc, {"doc_id": doc_id})
         doc = result.fetchone()
         
         if not doc:
@@ -2046,11 +2169,19 @@ async def confirmar_documento(
             WHERE id = :doc_id
         """)
         
-        db.execute(update_query, {"doc_id": doc_id})
-        db.commit()
-        
-        # Registrar histórico em Firebase
-        historico_db.registrar_acao(
+        antes = await db.run_sync(estado_documentos, [doc_id])
+        await db.execute(update_query, {"doc_id": doc_id})
+        await db.run_sync(aplicar_alteracao, antes, [doc_id])
+        await db.run_sync(registrar_eventos, [evento(
+            auditoria.DOCUMENTO_CONFIRMADO,
+            f"Doc Fiscal ID {doc_id} foi confirmado ({doc[1]} -> PROVISIONADO): {comentarios.strip()}",
+            empresa_id=antes[0][0], usuario_id=usuario_id, referencia_id=doc_id, ip_address=ip_cliente(request)
+        )])
+        await db.commit()
+        invalidar_dashboard()
+        
+        # Registrar histórico (enfileirado; gravado em lote em segundo plano)
+        fila_historico.registrar_acao(
             documento_id=doc_id,
             acao="CONFIRMAR",
             usuario_id=usuario_id,
@@ -2067,22 +2198,24 @@ async def confirmar_documento(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"[v0 Backend] Erro ao confirmar documento: {str(e)}")
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 
 @app.post("/api/documentos-fiscais/{doc_id}/revisar")
 async def revisar_documento(
+    request: Request,
     doc_id: int,
     comentarios: str = Form(...),
-    usuario_id: int = Form(1),  # TODO: Obter da sessão
-    db: Session = Depends(get_db)
+    usuario: SessaoUsuario = Depends(exigir_permissao(menu="documentos_fiscais")),
+    db: SessaoAssincrona = Depends(get_db)
 ):
     """
     Marca um documento para revisão e muda status para REVISAR
     Requer comentários obrigatórios
     """
+    usuario_id = usuario.usuario_id
     try:
         if not comentarios or not comentarios.strip():
             return JSONResponse(
@@ -2092,7 +2225,7 @@ async def revisar_documento(
         
         # Buscar documento
         query_doc = text("SELECT id, status_processamento FROM documentos_fiscais WHERE id = :doc_id")
-        result = db.execute(query_doc, {"doc_id": doc_id})
+        result = await db.execute(query_doc, {"doc_id": doc_id})
         doc = result.fetchone()
         
         if not doc:
@@ -2114,11 +2247,19 @@ async def revisar_documento(
             WHERE id = :doc_id
         """)
         
-        db.execute(update_query, {"doc_id": doc_id})
-        db.commit()
-        
-        # Registrar histórico em Firebase
-        historico_db.registrar_acao(
+        antes = await db.run_sync(estado_documentos, [doc_id])
+        await db.execute(update_query, {"doc_id": doc_id})
+        await db.run_sync(aplicar_alteracao, antes, [doc_id])
+        await db.run_sync(registrar_eventos, [evento(
+            auditoria.DOCUMENTO_REVISADO,
+            f"Doc Fiscal ID {doc_id} foi marcado para revisão ({doc[1]} -> REVISAR): {comentarios.strip()}",
+            empresa_id=antes[0][0], usuario_id=usuario_id, referencia_id=doc_id, ip_address=ip_cliente(request)
+        )])
+        await db.commit()
+        invalidar_dashboard()
+        
+        # Registrar histórico (enfileirado; gravado em lote em segundo plano)
+        fila_historico.registrar_acao(
             documento_id=doc_id,
             acao="REVISAR",
             usuario_id=usuario_id,
@@ -2135,7 +2276,7 @@ async def revisar_documento(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"[v0 Backend] Erro ao revisar documento: {str(e)}")
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
@@ -2143,7 +2284,7 @@ async def revisar_documento(
 @app.get("/api/documentos-fiscais/{doc_id}/historico")
 async def obter_historico_documento(
     doc_id: int,
-    db: Session = Depends(get_db)
+    db: SessaoAssincrona = Depends(get_db)
 ):
     """
     Obtém o histórico de ações (confirmações, revisões) de um documento,
@@ -2152,14 +2293,14 @@ async def obter_historico_documento(
     try:
         # 1. Verificar se documento existe
         query_doc = text("SELECT id FROM documentos_fiscais WHERE id = :doc_id")
-        result = db.execute(query_doc, {"doc_id": doc_id})
+        result = await db.execute(query_doc, {"doc_id": doc_id})
         doc = result.fetchone()
         
         if not doc:
             return JSONResponse(status_code=404, content={"erro": "Documento não encontrado"})
         
-        # 2. Obter histórico "cru" (raw) do Firebase/local
-        historico_raw = historico_db.obter_historico(doc_id)
+        # 2. Obter histórico "cru" (raw) do Firebase/local (rede ou SQLite: fora do event loop)
+        historico_raw = await to_thread.run_sync(historico_db.obter_historico, doc_id)
         
         # 3. Se não houver histórico, retornar lista vazia
         if not historico_raw:
@@ -2178,7 +2319,7 @@ async def obter_historico_documento(
         if usuario_ids:
             # Consulta SQL para buscar IDs e Nomes da tabela 'usuarios'
             query_nomes = text("SELECT id, nome FROM usuarios WHERE id IN :ids")
-            result_nomes = db.execute(query_nomes, {"ids": tuple(usuario_ids)})
+            result_nomes = await db.execute(query_nomes, {"ids": tuple(usuario_ids)})
             
             # Criar um mapa de ID -> Nome
             nomes_usuarios = {row[0]: row[1] for row in result_nomes}
@@ -2207,147 +2348,325 @@ async def obter_historico_documento(
 # API: AUDITORIA E LOGS
 # ==============================================================================
 
-@app.get("/api/auditoria/log_atividades")
-async def get_log_atividades(db: Session = Depends(get_db)):
+# Limite de linhas do CSV exportado
+AUDITORIA_EXPORTACAO_MAX = 50000
+
+# Ordem do log: mais recentes primeiro; o id desempata eventos no mesmo segundo
+ORDENACAO_AUDITORIA = [("e.data_hora", "DESC"), ("e.id", "DESC")]
+
+def montar_filtros_auditoria(
+    data_inicial: str = None,
+    data_final: str = None,
+    usuario_id: int = None,
+    tipo_acao: str = None,
+    empresa_id: int = None
+):
     """
-    Busca um log unificado de atividades de criação de várias tabelas 
-    para a página de Auditoria.
+    Monta as condições (WHERE) e os parâmetros dos filtros do log de auditoria.
+    Cada filtro combina com um índice de eventos_auditoria terminado em data_hora.
+    """
+    conditions = []
+    params = {}
+    
+    if empresa_id:
+        conditions.append("e.empresa_id = :empresa_id")
+        params["empresa_id"] = empresa_id
+    
+    if data_inicial:
+        conditions.append("e.data_hora >= :data_inicial")
+        params["data_inicial"] = data_inicial
+    
+    if data_final:
+        # Data final inclusiva: até o fim do dia informado
+        conditions.append("e.data_hora < DATE_ADD(:data_final, INTERVAL 1 DAY)")
+        params["data_final"] = data_final
+    
+    if usuario_id:
+        conditions.append("e.usuario_id = :usuario_id")
+        params["usuario_id"] = usuario_id
+    
+    if tipo_acao:
+        conditions.append("e.acao = :acao")
+        params["acao"] = tipo_acao
+    
+    return conditions, params
+
+async def buscar_eventos(db: SessaoAssincrona, conditions: list, params: dict, limite: int):
+    """Busca uma página do log (limite + 1 linhas, para o fatiar_pagina)."""
+    query = """
+        SELECT 
+            e.data_hora, e.id, e.usuario_id, COALESCE(u.nome, 'Sistema') AS usuario_nome,
+            e.acao, e.descricao, e.referencia_id, e.ip_address, e.empresa_id
+        FROM eventos_auditoria e
+        LEFT JOIN usuarios u ON e.usuario_id = u.id
+        WHERE 1=1
+    """
+    if conditions:
+        query += " AND " + " AND ".join(conditions)
+    query += clausula_ordem(ORDENACAO_AUDITORIA) + clausula_limite(limite)
+    
+    result = await db.execute(text(query), params)
+    return result.fetchall()
+
+@app.get("/api/auditoria")
+async def listar_auditoria(
+    data_inicial: str = None,
+    data_final: str = None,
+    usuario_id: int = None,
+    tipo_acao: str = None,
+    empresa_id: int = None,
+    limite: int = PAGINA_PADRAO,
+    cursor: str = None,
+    db: SessaoAssincrona = Depends(get_db_leitura)
+):
+    """
+    Lista os eventos de auditoria (tabela eventos_auditoria), dos mais recentes
+    para os mais antigos, com filtros por período, usuário, ação e empresa.
+    Paginação por cursor em (data_hora, id): envie o 'next_cursor' da resposta
+    no parâmetro 'cursor' para buscar a próxima página.
     """
     try:
-        # Esta é a query UNION que unifica os logs
-        query_str = """
-        (
-            -- 1. Documentos Fiscais Criados
-            SELECT
-                df.created_at AS data_hora,
-                COALESCE(u.nome, 'Sistema') AS usuario,
-                'DOCUMENTO_CRIADO' AS acao,
-                CONCAT('Doc Fiscal Nº ', df.numero_documento, ' (R$ ', FORMAT(df.valor_total, 2, 'pt_BR'), ') foi criado.') AS descricao,
-                df.id AS referencia_id
-            FROM documentos_fiscais df
-            LEFT JOIN usuarios u ON df.usuario_criacao_id = u.id
-        )
-        UNION ALL
-        (
-            -- 2. Anexos Enviados
-            SELECT
-                a.created_at AS data_hora,
-                u.nome AS usuario,
-                'ANEXO_UPLOAD' AS acao,
-                CONCAT('Arquivo ', a.nome_original, ' (', a.tipo_arquivo, ') foi enviado.') AS descricao,
-                a.id AS referencia_id
-            FROM anexos a
-            JOIN usuarios u ON a.uploaded_by = u.id
-        )
-        UNION ALL
-        (
-            -- 3. Provisionamentos Criados
-            SELECT
-                p.created_at AS data_hora,
-                u.nome AS usuario,
-                'PROV_CRIADO' AS acao,
-                CONCAT('Provisionamento (R$ ', FORMAT(p.valor_provisionado, 2, 'pt_BR'), ') criado para Doc ID ', p.documento_fiscal_id) AS descricao,
-                p.id AS referencia_id
-            FROM provisionamentos p
-            JOIN usuarios u ON p.usuario_criacao_id = u.id
-        )
-        UNION ALL
-        (
-            -- 4. Remessas CNAB Geradas
-            SELECT
-                r.data_geracao AS data_hora,
-                u.nome AS usuario,
-                'REMESSA_GERADA' AS acao,
-                CONCAT('Remessa CNAB Nº ', r.numero_remessa, ' (R$ ', FORMAT(r.valor_total, 2, 'pt_BR'), ') foi gerada.') AS descricao,
-                r.id AS referencia_id
-            FROM remessas_cnab r
-            JOIN usuarios u ON r.usuario_geracao_id = u.id
-        )
-        UNION ALL
-        (
-            -- 5. Usuários Criados
-            SELECT
-                u.created_at AS data_hora,
-                'Sistema' AS usuario, -- A tabela de usuários não tem "criado_por"
-                'USUARIO_CRIADO' AS acao,
-                CONCAT('Usuário ', u.nome, ' (', u.email, ') foi criado.') AS descricao,
-                u.id AS referencia_id
-            FROM usuarios u
-        )
+        conditions, params = montar_filtros_auditoria(data_inicial, data_final, usuario_id, tipo_acao, empresa_id)
         
-        -- Ordena o log unificado e limita aos 500 eventos mais recentes
-        ORDER BY data_hora DESC
-        LIMIT 500;
-        """
+        limite = normalizar_limite(limite)
+        if cursor:
+            aplicar_cursor(conditions, params, ORDENACAO_AUDITORIA, cursor)
+        
+        linhas = await buscar_eventos(db, conditions, params, limite)
+        eventos, next_cursor = fatiar_pagina(linhas, limite, [0, 1])
         
-        result = db.execute(text(query_str))
-        logs = result.fetchall()
+        return {
+            "success": True,
+            "total": len(eventos),
+            "limite": limite,
+            "next_cursor": next_cursor,
+            "registros": [
+                {
+                    "id": row[1],
+                    "data_hora": row[0].isoformat() if row[0] else None,
+                    "usuario_id": row[2],
+                    "usuario_nome": row[3],
+                    "acao": row[4],
+                    "descricao": row[5],
+                    "referencia_id": row[6],
+                    "ip_address": row[7],
+                    "empresa_id": row[8]
+                }
+                for row in eventos
+            ]
+        }
+    except CursorInvalido as e:
+        return JSONResponse(status_code=400, content={"erro": str(e)})
+    except Exception as e:
+        print(f"[v0 Backend] Erro ao listar auditoria: {str(e)}")
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
+@app.get("/api/auditoria/exportar")
+async def exportar_auditoria(
+    data_inicial: str = None,
+    data_final: str = None,
+    usuario_id: int = None,
+    tipo_acao: str = None,
+    empresa_id: int = None,
+    db: SessaoAssincrona = Depends(get_db_leitura)
+):
+    """
+    Exporta os eventos filtrados em CSV (até AUDITORIA_EXPORTACAO_MAX linhas).
+    Busca página a página pelo cursor, sem OFFSET.
+    """
+    try:
+        conditions, params = montar_filtros_auditoria(data_inicial, data_final, usuario_id, tipo_acao, empresa_id)
+        
+        saida = io.StringIO()
+        escritor = csv.writer(saida, delimiter=';')
+        escritor.writerow(["Data/Hora", "Usuário", "Ação", "Descrição", "Referência", "IP"])
+        
+        exportados = 0
+        cursor = None
+        while exportados < AUDITORIA_EXPORTACAO_MAX:
+            conditions_pagina, params_pagina = list(conditions), dict(params)
+            if cursor:
+                aplicar_cursor(conditions_pagina, params_pagina, ORDENACAO_AUDITORIA, cursor)
+            
+            linhas = await buscar_eventos(db, conditions_pagina, params_pagina, PAGINA_MAXIMA)
+            eventos, cursor = fatiar_pagina(linhas, PAGINA_MAXIMA, [0, 1])
+            for row in eventos:
+                escritor.writerow([
+                    row[0].strftime("%d/%m/%Y %H:%M:%S") if row[0] else "",
+                    row[3], row[4], row[5], row[6] or "", row[7] or ""
+                ])
+            exportados += len(eventos)
+            if not cursor:
+                break
+        
+        # BOM para o Excel abrir os acentos corretamente
+        return Response(
+            content="\ufeff" + saida.getvalue(),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": "attachment; filename=auditoria.csv"}
+        )
+    except Exception as e:
+        print(f"[v0 Backend] Erro ao exportar auditoria: {str(e)}")
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
+@app.get("/api/auditoria/log_atividades")
+async def get_log_atividades(db: SessaoAssincrona = Depends(get_db_leitura)):
+    """
+    Busca os 500 eventos mais recentes do log de auditoria.
+    Mantida para compatibilidade; a página de Auditoria usa /api/auditoria.
+    """
+    try:
+        logs = (await buscar_eventos(db, [], {}, 500))[:500]
         
         # Formata a saída para JSON
         atividades = []
         for log in logs:
             atividades.append({
                 "data_hora": log[0].isoformat() if log[0] else None,
-                "usuario": log[1],
-                "acao": log[2],
-                "descricao": log[3],
-                "referencia_id": log[4]
+                "usuario": log[3],
+                "acao": log[4],
+                "descricao": log[5],
+                "referencia_id": log[6]
             })
             
         return {"success": True, "atividades": atividades}
         
     except Exception as e:
         print(f"[v0 Backend] Erro ao buscar log de auditoria: {str(e)}")
-        # Trata o erro de "FORMAT" que pode não existir em todos os dialetos MySQL
-        if "FUNCTION" in str(e).upper() and "FORMAT" in str(e).upper():
-             return JSONResponse(status_code=500, content={"erro": "Função 'FORMAT' não encontrada. Verifique a versão do seu MySQL."})
         return JSONResponse(status_code=500, content={"erro": str(e)})
 
 # ==============================================================================
 # API: DASHBOARD E GRÁFICOS
 # ==============================================================================
 
-@app.get("/api/dashboard/kpis")
-async def get_dashboard_kpis(db: Session = Depends(get_db)):
+async def calcular_dashboard(db: SessaoAssincrona, empresa_id: Optional[int]):
     """
-    Retorna os 4 KPIs principais para os cards do dashboard.
+    Calcula todos os números do dashboard em uma única ida ao banco.
+    Os números dos documentos vêm da tabela resumo_documentos (poucas linhas por
+    empresa/fornecedor/status/mês), mantida pelas rotas que gravam documentos.
+    Cada parte do UNION ALL é identificada pela coluna 'tipo':
+      - status: contagem e soma dos documentos por status (KPIs + gráfico de pizza)
+      - vencidas: soma das contas vencidas
+      - fornecedor: top fornecedores por valor provisionado (gráfico de barras)
     """
-    try:
-        # 1. Total Provisionado (Valor R$)
-        # Soma o valor de todos os documentos que já foram confirmados
-        q_prov = text("""
-            SELECT SUM(valor_total) 
-            FROM documentos_fiscais 
-            WHERE status_processamento = 'PROVISIONADO'
-        """)
-        total_prov = db.execute(q_prov).scalar() or 0
-
-        # 2. Contas Vencidas (Valor R$)
-        # Soma contas 'VENCIDO' ou 'PENDENTE' com data de vencimento no passado
-        q_venc = text("""
-            SELECT SUM(valor_original) 
-            FROM contas_pagar 
-            WHERE status = 'VENCIDO' OR (status = 'PENDENTE' AND data_vencimento < CURDATE())
-        """)
-        total_venc = db.execute(q_venc).scalar() or 0
+    filtro_doc = " AND r.empresa_id = :empresa_id" if empresa_id else ""
+    filtro_conta = " AND cp.empresa_id = :empresa_id" if empresa_id else ""
+
+    query = text(f"""
+        SELECT 'status' AS tipo, r.status_processamento AS chave,
+               SUM(r.quantidade) AS quantidade, SUM(r.valor_total) AS total
+        FROM resumo_documentos r
+        WHERE 1=1{filtro_doc}
+        GROUP BY r.status_processamento
+        HAVING SUM(r.quantidade) > 0
 
-        # 3. Documentos Pendentes (Contagem)
-        # Conta quantos documentos estão na fila de entrada
-        q_pend = text("SELECT COUNT(id) FROM documentos_fiscais WHERE status_processamento = 'PENDENTE'")
-        count_pend = db.execute(q_pend).scalar() or 0
+        UNION ALL
+
+        SELECT 'vencidas', NULL, COUNT(*), SUM(cp.valor_original)
+        FROM contas_pagar cp
+        WHERE (cp.status = 'VENCIDO' OR (cp.status = 'PENDENTE' AND cp.data_vencimento < CURDATE())){filtro_conta}
+
+        UNION ALL
+
+        (SELECT 'fornecedor', f.razao_social, SUM(r.quantidade), SUM(r.valor_total) AS total_fornecedor
+         FROM resumo_documentos r
+         JOIN fornecedores f ON r.fornecedor_id = f.id
+         WHERE r.status_processamento = 'PROVISIONADO'{filtro_doc}
+         GROUP BY f.razao_social
+         HAVING SUM(r.quantidade) > 0
+         ORDER BY total_fornecedor DESC
+         LIMIT {DASHBOARD_TOP_FORNECEDORES})
+    """)
+    params = {"empresa_id": empresa_id} if empresa_id else {}
+    rows = (await db.execute(query, params)).fetchall()
+
+    por_status = {}
+    contas_vencidas = 0
+    gastos_fornecedor = []
+    for tipo, chave, quantidade, total in rows:
+        if tipo == 'status':
+            por_status[chave] = (int(quantidade), float(total or 0))
+        elif tipo == 'vencidas':
+            contas_vencidas = float(total or 0)
+        else:
+            gastos_fornecedor.append({"fornecedor": chave, "total": float(total or 0)})
+
+    # O UNION não garante a ordem entre as partes; reordena o top fornecedores
+    gastos_fornecedor.sort(key=lambda g: g["total"], reverse=True)
+
+    return {
+        "total_provisionado": por_status.get('PROVISIONADO', (0, 0))[1],
+        "contas_vencidas": contas_vencidas,
+        "docs_pendentes": por_status.get('PENDENTE', (0, 0))[0],
+        "docs_revisar": por_status.get('REVISAR', (0, 0))[0],
+        "gastos_fornecedor": gastos_fornecedor,
+        "docs_por_status": [
+            {"status": status, "quantidade": quantidade}
+            for status, (quantidade, _) in por_status.items()
+        ]
+    }
+
+
+async def obter_dashboard(db: SessaoAssincrona, empresa_id: Optional[int]):
+    """Dados do dashboard vindos do cache (um por empresa) ou recalculados."""
+    return await cache_dashboard.obter_ou_calcular(
+        ("dashboard", empresa_id or "todas"),
+        lambda: calcular_dashboard(db, empresa_id)
+    )
+
+
+def invalidar_dashboard():
+    """
+    Descarta o cache do dashboard. Chamado pelas rotas que alteram documentos
+    ou contas a pagar. Limpa todas as empresas, pois o total geral ("todas") também muda.
+    Com réplica de leitura, o recálculo pode não ver uma alteração de poucos segundos
+    atrás (atraso até DB_REPLICA_MAX_LAG); esse valor dura no máximo DASHBOARD_CACHE_TTL.
+    """
+    cache_dashboard.invalidar("dashboard")
 
-        # 4. Documentos para Revisar (Contagem)
-        # Conta quantos documentos foram marcados para revisão
-        q_rev = text("SELECT COUNT(id) FROM documentos_fiscais WHERE status_processamento = 'REVISAR'")
-        count_rev = db.execute(q_rev).scalar() or 0
 
+@app.get("/api/dashboard")
+async def get_dashboard(
+    empresa_id: Optional[int] = None,
+    db: SessaoAssincrona = Depends(get_db_leitura)
+):
+    """
+    Retorna tudo o que o dashboard exibe (KPIs e os dois gráficos) em uma chamada.
+    Os dados ficam em cache por DASHBOARD_CACHE_TTL segundos ou até alguma alteração.
+    """
+    try:
+        dados = await obter_dashboard(db, empresa_id)
+        return {
+            "success": True,
+            "provisionados": dados["total_provisionado"],
+            "vencidos": dados["contas_vencidas"],
+            "pendentes": dados["docs_pendentes"],
+            "revisar": dados["docs_revisar"],
+            "gastos_fornecedor": dados["gastos_fornecedor"],
+            "docs_por_status": dados["docs_por_status"]
+        }
+    except Exception as e:
+        print(f"[v0 Backend] Erro ao buscar dashboard: {str(e)}")
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
+
+@app.get("/api/dashboard/kpis")
+async def get_dashboard_kpis(
+    empresa_id: Optional[int] = None,
+    db: SessaoAssincrona = Depends(get_db_leitura)
+):
+    """
+    Retorna os 4 KPIs principais para os cards do dashboard.
+    """
+    try:
+        dados = await obter_dashboard(db, empresa_id)
         return {
             "success": True,
             "kpis": {
-                "total_provisionado": float(total_prov),
-                "contas_vencidas": float(total_venc),
-                "docs_pendentes": int(count_pend),
-                "docs_revisar": int(count_rev)
+                "total_provisionado": dados["total_provisionado"],
+                "contas_vencidas": dados["contas_vencidas"],
+                "docs_pendentes": dados["docs_pendentes"],
+                "docs_revisar": dados["docs_revisar"]
             }
         }
     except Exception as e:
@@ -2356,27 +2675,19 @@ async def get_dashboard_kpis(db: Session = Depends(get_db)):
 
 
 @app.get("/api/dashboard/gastos_fornecedor")
-async def get_gastos_fornecedor(db: Session = Depends(get_db)):
+async def get_gastos_fornecedor(
+    empresa_id: Optional[int] = None,
+    db: SessaoAssincrona = Depends(get_db_leitura)
+):
     """
     Retorna dados para o gráfico de barras (Gastos Provisionados por Fornecedor).
     """
     try:
-        query = text("""
-            SELECT 
-                f.razao_social, 
-                SUM(df.valor_total) as total
-            FROM documentos_fiscais df
-            JOIN fornecedores f ON df.fornecedor_id = f.id
-            WHERE df.status_processamento = 'PROVISIONADO'
-            GROUP BY f.razao_social
-            ORDER BY total DESC
-            LIMIT 10;
-        """)
-        result = db.execute(query).fetchall()
+        dados = await obter_dashboard(db, empresa_id)
         
         # Formata para Chart.js
-        labels = [row[0] for row in result]
-        data = [float(row[1]) for row in result]
+        labels = [g["fornecedor"] for g in dados["gastos_fornecedor"]]
+        data = [g["total"] for g in dados["gastos_fornecedor"]]
         
         return {"success": True, "labels": labels, "data": data}
     except Exception as e:
@@ -2385,23 +2696,19 @@ async def get_gastos_fornecedor(db: Session = Depends(get_db)):
 
 
 @app.get("/api/dashboard/docs_por_status")
-async def get_docs_por_status(db: Session = Depends(get_db)):
+async def get_docs_por_status(
+    empresa_id: Optional[int] = None,
+    db: SessaoAssincrona = Depends(get_db_leitura)
+):
     """
     Retorna dados para o gráfico de pizza (Documentos por Status).
     """
     try:
-        query = text("""
-            SELECT 
-                status_processamento, 
-                COUNT(id) as contagem
-            FROM documentos_fiscais
-            GROUP BY status_processamento;
-        """)
-        result = db.execute(query).fetchall()
+        dados = await obter_dashboard(db, empresa_id)
         
         # Formata para Chart.js
-        labels = [row[0] for row in result]
-        data = [int(row[1]) for row in result]
+        labels = [s["status"] for s in dados["docs_por_status"]]
+        data = [s["quantidade"] for s in dados["docs_por_status"]]
         
         return {"success": True, "labels": labels, "data": data}
     except Exception as e:
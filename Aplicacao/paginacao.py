@@ -0,0 +1,209 @@
+# ==============================================================================
+# ARQUIVO: paginacao.py
+# DESCRIÇÃO: Paginação por cursor (keyset) para as listagens da API.
+#   - O cursor guarda os valores da última linha da página (ex: data_emissao, id)
+#   - A próxima página é buscada com WHERE (data, id) < (cursor), usando o índice,
+#     sem OFFSET (custo constante em qualquer página)
+#   - Contagem total opcional: exata (COUNT) ou aproximada (estimativa do EXPLAIN,
+#     multiplicando as linhas estimadas de cada tabela do JOIN)
+#   - Funções em duas versões: SQL em texto (aplicar_cursor/contar_registros) e
+#     SQLAlchemy Core (filtro_cursor/contar_consulta, usadas pelo consultas.py)
+# ==============================================================================
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import text, bindparam, and_, or_
+
+# Tamanho de página padrão e máximo aceito no parâmetro 'limite'
+PAGINA_PADRAO = 100
+PAGINA_MAXIMA = 500
+
+# Modos aceitos no parâmetro 'contagem'
+CONTAGEM_NENHUMA = "nenhuma"
+CONTAGEM_EXATA = "exata"
+CONTAGEM_APROXIMADA = "aproximada"
+MODOS_CONTAGEM = (CONTAGEM_NENHUMA, CONTAGEM_EXATA, CONTAGEM_APROXIMADA)
+
+
+class CursorInvalido(ValueError):
+    """Cursor recebido não foi gerado por esta API (ou foi alterado)."""
+    pass
+
+
+class ContagemInvalida(ValueError):
+    """Parâmetro 'contagem' fora de MODOS_CONTAGEM (HTTP 400)."""
+    pass
+
+
+def validar_contagem(modo) -> str:
+    """Modo de contagem pedido (vazio = nenhuma). Lança ContagemInvalida."""
+    if not modo:
+        return CONTAGEM_NENHUMA
+    if modo not in MODOS_CONTAGEM:
+        raise ContagemInvalida(f"contagem deve ser um de: {', '.join(MODOS_CONTAGEM)}")
+    return modo
+
+
+def estimativa_plano(plano: list) -> int:
+    """
+    Linhas estimadas pelo EXPLAIN para o SELECT principal: produto de
+    rows * filtered/100 das tabelas do JOIN (mesmo 'id' da 1ª linha do plano).
+    Tabelas ligadas pela chave primária (eq_ref, rows = 1) não mudam o total;
+    linhas de subconsultas (outro 'id') ficam de fora.
+    """
+    if not plano:
+        return 0
+    consulta = plano[0].get("id")
+    total = 1.0
+    for linha in plano:
+        if linha.get("id") != consulta:
+            continue
+        total *= float(linha.get("rows") or 0) * float(linha.get("filtered") or 100) / 100
+    return int(total)
+
+
+def normalizar_limite(limite) -> int:
+    """Garante que o tamanho da página fique entre 1 e PAGINA_MAXIMA."""
+    if not limite:
+        return PAGINA_PADRAO
+    return max(1, min(int(limite), PAGINA_MAXIMA))
+
+
+def _serializar(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat(sep=" ") if isinstance(valor, datetime) else valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+
+def codificar_cursor(valores) -> str:
+    """Transforma os valores da chave de ordenação em um token opaco para a URL."""
+    dados = json.dumps([_serializar(v) for v in valores], separators=(",", ":"))
+    return base64.urlsafe_b64encode(dados.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str, quantidade: int) -> list:
+    try:
+        preenchimento = "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + preenchimento).decode("utf-8"))
+    except Exception:
+        raise CursorInvalido("Cursor de paginação inválido")
+
+    if not isinstance(valores, list) or len(valores) != quantidade:
+        raise CursorInvalido("Cursor de paginação inválido")
+    return valores
+
+
+def aplicar_cursor(conditions: list, params: dict, ordenacao: list, cursor: str):
+    """
+    Adiciona a condição keyset em 'conditions'.
+    'ordenacao' é uma lista de (coluna, 'ASC'|'DESC'); a última coluna deve ser única (id).
+    Gera: (c1 < :v1) OR (c1 = :v1 AND c2 < :v2) ..., que o MySQL resolve por range no índice.
+    """
+    valores = decodificar_cursor(cursor, len(ordenacao))
+
+    partes = []
+    for i, (coluna, direcao) in enumerate(ordenacao):
+        operador = "<" if direcao.upper() == "DESC" else ">"
+        iguais = [f"{c} = :cursor_{j}" for j, (c, _) in enumerate(ordenacao[:i])]
+        partes.append("(" + " AND ".join(iguais + [f"{coluna} {operador} :cursor_{i}"]) + ")")
+        params[f"cursor_{i}"] = valores[i]
+
+    conditions.append("(" + " OR ".join(partes) + ")")
+
+
+def filtro_cursor(ordenacao: list):
+    """
+    Versão Core de aplicar_cursor: 'ordenacao' é uma lista de (coluna Core, 'ASC'|'DESC').
+    Os valores entram pelos parâmetros cursor_0, cursor_1... (ver parametros_cursor),
+    então a mesma condição serve para qualquer cursor.
+    """
+    partes = []
+    for i, (coluna, direcao) in enumerate(ordenacao):
+        iguais = [c == bindparam(f"cursor_{j}") for j, (c, _) in enumerate(ordenacao[:i])]
+        if direcao.upper() == "DESC":
+            comparacao = coluna < bindparam(f"cursor_{i}")
+        else:
+            comparacao = coluna > bindparam(f"cursor_{i}")
+        partes.append(and_(*iguais, comparacao))
+    return or_(*partes)
+
+
+def parametros_cursor(cursor: str, quantidade: int) -> dict:
+    """Valores do cursor no formato esperado por filtro_cursor()."""
+    return {f"cursor_{i}": valor for i, valor in enumerate(decodificar_cursor(cursor, quantidade))}
+
+
+def clausula_ordem(ordenacao: list) -> str:
+    return " ORDER BY " + ", ".join(f"{coluna} {direcao}" for coluna, direcao in ordenacao)
+
+
+def clausula_limite(limite: int) -> str:
+    # Busca uma linha a mais só para saber se existe próxima página
+    return f" LIMIT {int(limite) + 1}"
+
+
+def fatiar_pagina(linhas: list, limite: int, indices_chave: list):
+    """
+    Recebe as linhas buscadas com clausula_limite() e devolve (linhas_da_pagina, next_cursor).
+    'indices_chave' são as posições, na linha, das colunas usadas na ordenação.
+    """
+    if len(linhas) <= limite:
+        return linhas, None
+
+    linhas = linhas[:limite]
+    ultima = linhas[-1]
+    return linhas, codificar_cursor([ultima[i] for i in indices_chave])
+
+
+async def contar_registros(db, from_sql: str, conditions: list, params: dict, modo: str):
+    """
+    Conta os registros que atendem aos filtros (sem a condição do cursor).
+    Retorna (total, aproximado) ou (None, False) quando a contagem não foi pedida.
+    Lança ContagemInvalida para um modo desconhecido.
+    """
+    modo = validar_contagem(modo)
+    where = (" AND " + " AND ".join(conditions)) if conditions else ""
+
+    if modo == CONTAGEM_EXATA:
+        total = (await db.execute(text("SELECT COUNT(*) " + from_sql + where), params)).scalar()
+        return int(total or 0), False
+
+    if modo == CONTAGEM_APROXIMADA:
+        # Estimativa do otimizador para o JOIN inteiro
+        plano = (await db.execute(text("EXPLAIN SELECT 1 " + from_sql + where), params)).mappings().all()
+        return estimativa_plano(plano), True
+
+    return None, False
+
+
+def _explicar_consulta(sessao, consulta, params: dict):
+    # Compila a consulta Core para o dialeto do banco e roda o EXPLAIN dela
+    compilada = consulta.compile(dialect=sessao.get_bind().dialect)
+    valores = compilada.construct_params(params)
+    if compilada.positional:
+        # PyMySQL usa %s: os valores vão na ordem em que aparecem no SQL
+        valores = tuple(valores[nome] for nome in compilada.positiontup)
+    resultado = sessao.connection().exec_driver_sql("EXPLAIN " + str(compilada), valores)
+    return resultado.mappings().all()
+
+
+async def contar_consulta(db, consulta_contagem, params: dict, modo: str):
+    """
+    Versão Core de contar_registros: recebe o select(func.count()) com os filtros.
+    Retorna (total, aproximado) ou (None, False) quando a contagem não foi pedida.
+    Lança ContagemInvalida para um modo desconhecido.
+    """
+    modo = validar_contagem(modo)
+    if modo == CONTAGEM_EXATA:
+        total = (await db.execute(consulta_contagem, params)).scalar()
+        return int(total or 0), False
+
+    if modo == CONTAGEM_APROXIMADA:
+        plano = await db.run_sync(_explicar_consulta, consulta_contagem, params)
+        return estimativa_plano(plano), True
+
+    return None, False
@@ -0,0 +1,128 @@
+# ==============================================================================
+# ARQUIVO: permissoes.py
+# DESCRIÇÃO: Perfis de acesso (tabela roles) compilados em memória.
+#   - Todos os perfis ativos são lidos de uma vez; o JSON de permissoes_base
+#     vira frozensets de menus e ações, junto com o nivel_acesso
+#   - A checagem de cada requisição é uma consulta em dicionário + conjunto,
+#     sem ida ao banco e sem json.loads
+#   - O cache é limpo quando um perfil é alterado (PUT /api/roles/{id});
+#     o perfil de cada usuário vem da sessão (sessoes.py), que já é relida
+#     quando o usuário é alterado
+#   O cache é por processo: com vários workers, a alteração de um perfil leva
+#   até PERMISSOES_CACHE_TTL segundos para valer nos outros.
+# ==============================================================================
+
+import json
+import os
+from typing import NamedTuple
+from fastapi import Depends
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+from cache_memoria import CacheTTL
+from database import get_db, SessaoAssincrona
+from sessoes import SessaoUsuario, usuario_atual
+
+load_dotenv()
+
+# Validade (s) dos perfis compilados
+PERMISSOES_CACHE_TTL = float(os.getenv("PERMISSOES_CACHE_TTL", "300"))
+
+# Nível de acesso do administrador (pode alterar os perfis)
+NIVEL_ADMIN = 5
+
+# Permissões de um perfil sem permissoes_base (ou com JSON inválido)
+PERMISSOES_PADRAO = {"menus": ["dashboard"]}
+
+
+class PermissaoNegada(Exception):
+    """Usuário logado, mas o perfil dele não permite a ação (HTTP 403)."""
+    pass
+
+
+class PerfilCompilado(NamedTuple):
+    """Um perfil de roles pronto para as checagens."""
+    role_id: int
+    nome: str
+    nivel_acesso: int
+    menus: frozenset
+    acoes: frozenset
+    permissoes: dict  # JSON original (vai para o frontend no login)
+
+    def permite(self, menu: str = None, acao: str = None, nivel_minimo: int = None) -> bool:
+        return ((menu is None or menu in self.menus)
+                and (acao is None or acao in self.acoes)
+                and (nivel_minimo is None or self.nivel_acesso >= nivel_minimo))
+
+
+def ler_permissoes(valor, role: str = "") -> dict:
+    """permissoes_base (texto JSON do PyMySQL, dict ou NULL) como dict."""
+    if isinstance(valor, (bytes, str)):
+        try:
+            valor = json.loads(valor)
+        except ValueError:
+            print(f"[v0] permissoes_base inválido no perfil {role}: usando o padrão")
+            valor = None
+    return valor if isinstance(valor, dict) and valor else dict(PERMISSOES_PADRAO)
+
+
+def compilar_perfil(role_id: int, nome: str, nivel_acesso: int, permissoes_base) -> PerfilCompilado:
+    permissoes = ler_permissoes(permissoes_base, nome)
+    return PerfilCompilado(
+        role_id, nome, int(nivel_acesso or 0),
+        frozenset(permissoes.get("menus") or ()),
+        frozenset(permissoes.get("acoes") or ()),
+        permissoes
+    )
+
+
+def carregar_perfis(sessao) -> dict:
+    """Todos os perfis ativos, compilados: {role_id: PerfilCompilado}."""
+    result = sessao.execute(text("""
+        SELECT id, nome, nivel_acesso, permissoes_base
+        FROM roles
+        WHERE ativo = 1
+    """))
+    return {row[0]: compilar_perfil(*row) for row in result}
+
+
+class Perfis:
+    """Cache dos perfis compilados (uma entrada só, com todos os perfis)."""
+
+    def __init__(self):
+        self.cache = CacheTTL(PERMISSOES_CACHE_TTL)
+
+    async def todos(self, db: SessaoAssincrona) -> dict:
+        # Pedidos simultâneos com o cache vazio fazem uma consulta só
+        return await self.cache.obter_ou_calcular(("perfis",), lambda: db.run_sync(carregar_perfis))
+
+    async def perfil(self, role_id: int, db: SessaoAssincrona):
+        """PerfilCompilado do role_id, ou None se o perfil não existir/estiver inativo."""
+        return (await self.todos(db)).get(role_id)
+
+    def invalidar(self):
+        """Chamar depois do COMMIT de qualquer alteração em roles."""
+        self.cache.invalidar("perfis")
+
+
+# Instância global
+perfis = Perfis()
+
+
+def exigir_permissao(menu: str = None, acao: str = None, nivel_minimo: int = None):
+    """
+    Dependência das rotas com controle de acesso, ex:
+        usuario: SessaoUsuario = Depends(exigir_permissao(menu="usuarios"))
+    Exige login (usuario_atual) e que o perfil tenha o menu, a ação e o nível
+    pedidos. Lança PermissaoNegada (403); devolve o SessaoUsuario.
+    """
+    async def verificar(
+        usuario: SessaoUsuario = Depends(usuario_atual),
+        db: SessaoAssincrona = Depends(get_db)
+    ) -> SessaoUsuario:
+        perfil = await perfis.perfil(usuario.role_id, db)
+        if perfil is None or not perfil.permite(menu, acao, nivel_minimo):
+            raise PermissaoNegada("Seu perfil não tem permissão para esta ação.")
+        return usuario
+
+    return verificar
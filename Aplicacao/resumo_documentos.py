@@ -0,0 +1,153 @@
+# ==============================================================================
+# ARQUIVO: resumo_documentos.py
+# DESCRIÇÃO: Manutenção da tabela resumo_documentos (quantidade e valor por
+#   empresa x fornecedor x status x mês), lida pelo dashboard.
+#   - As rotas leem o estado do documento antes e depois da alteração e
+#     aplicam só a diferença, na mesma transação (atualização incremental)
+#   - Comando para reconstruir a tabela do zero ou conferir se ela bate
+#     com documentos_fiscais
+#   Tabela criada em Banco_fiscal/migracoes/002_resumo_documentos.sql
+#
+# USO (a partir da pasta Aplicacao):
+#   python resumo_documentos.py --verificar     -> só compara e lista as diferenças
+#   python resumo_documentos.py --reconstruir   -> recalcula a tabela inteira
+# ==============================================================================
+
+import argparse
+import sys
+from collections import defaultdict
+from decimal import Decimal
+from sqlalchemy import text, bindparam
+
+# Colunas que definem o grupo do resumo (o mês vem de data_emissao)
+_SELECT_ESTADO = """
+    SELECT empresa_id, fornecedor_id, status_processamento,
+           DATE_FORMAT(data_emissao, '%Y-%m-01') AS mes, valor_total
+    FROM documentos_fiscais
+"""
+
+_SQL_AGRUPADO = """
+    SELECT empresa_id, fornecedor_id, status_processamento,
+           DATE_FORMAT(data_emissao, '%Y-%m-01') AS mes, COUNT(*), SUM(valor_total)
+    FROM documentos_fiscais
+    GROUP BY empresa_id, fornecedor_id, status_processamento, DATE_FORMAT(data_emissao, '%Y-%m-01')
+"""
+
+
+def estado_documentos(sessao, ids=None, chaves=None) -> list:
+    """
+    Lê (empresa, fornecedor, status, mês, valor) dos documentos por id ou chave de acesso.
+    Usa FOR UPDATE: os documentos ficam travados até o COMMIT, então ninguém os
+    altera entre a leitura do estado "antes" e a aplicação da diferença.
+    (Um documento novo criado por outra importação no mesmo instante pode escapar;
+    o --verificar/--reconstruir corrige esse caso raro.)
+    """
+    if chaves and not ids:
+        # Primeiro acha os ids sem trava: um FOR UPDATE em chave inexistente travaria
+        # o intervalo do índice e faria importações simultâneas entrarem em deadlock
+        query_ids = text("SELECT id FROM documentos_fiscais WHERE chave_acesso IN :chaves").bindparams(
+            bindparam("chaves", expanding=True)
+        )
+        ids = [row[0] for row in sessao.execute(query_ids, {"chaves": list(chaves)}).fetchall()]
+
+    if not ids:
+        return []
+
+    query = text(_SELECT_ESTADO + " WHERE id IN :ids FOR UPDATE").bindparams(bindparam("ids", expanding=True))
+    return [tuple(row) for row in sessao.execute(query, {"ids": list(ids)}).fetchall()]
+
+
+def atualizar_resumo(sessao, antes: list, depois: list):
+    """
+    Aplica em resumo_documentos a diferença entre os estados 'antes' e 'depois'
+    (listas devolvidas por estado_documentos). Não faz COMMIT.
+    """
+    diferencas = defaultdict(lambda: [0, Decimal("0")])
+    for sinal, estados in ((-1, antes), (1, depois)):
+        for empresa_id, fornecedor_id, status, mes, valor in estados:
+            grupo = diferencas[(empresa_id, fornecedor_id, status, mes)]
+            grupo[0] += sinal
+            grupo[1] += sinal * Decimal(str(valor or 0))
+
+    linhas = [
+        {"empresa_id": e, "fornecedor_id": f, "status": s, "mes": m, "quantidade": q, "valor": v}
+        # Ordem fixa: transações simultâneas travam os grupos na mesma sequência (sem deadlock)
+        for (e, f, s, m), (q, v) in sorted(diferencas.items(), key=lambda item: str(item[0]))
+        if q or v
+    ]
+    if not linhas:
+        return
+
+    sessao.execute(text("""
+        INSERT INTO resumo_documentos (empresa_id, fornecedor_id, status_processamento, mes, quantidade, valor_total)
+        VALUES (:empresa_id, :fornecedor_id, :status, :mes, :quantidade, :valor)
+        ON DUPLICATE KEY UPDATE
+            quantidade = quantidade + VALUES(quantidade),
+            valor_total = valor_total + VALUES(valor_total)
+    """), linhas)
+
+
+def aplicar_alteracao(sessao, antes: list, ids: list):
+    """Lê o estado atual dos documentos 'ids' e aplica a diferença em relação a 'antes'."""
+    atualizar_resumo(sessao, antes, estado_documentos(sessao, ids=ids))
+
+
+def comparar_resumo(sessao) -> list:
+    """Lista os grupos em que resumo_documentos difere do cálculo direto sobre documentos_fiscais."""
+    esperado = {
+        (row[0], row[1], row[2], str(row[3])): (int(row[4]), Decimal(row[5] or 0))
+        for row in sessao.execute(text(_SQL_AGRUPADO)).fetchall()
+    }
+    gravado = {
+        (row[0], row[1], row[2], str(row[3])): (int(row[4]), Decimal(row[5] or 0))
+        for row in sessao.execute(text("""
+            SELECT empresa_id, fornecedor_id, status_processamento, mes, quantidade, valor_total
+            FROM resumo_documentos
+            WHERE quantidade <> 0 OR valor_total <> 0
+        """)).fetchall()
+    }
+
+    diferencas = []
+    for grupo in sorted(set(esperado) | set(gravado), key=str):
+        if esperado.get(grupo, (0, Decimal("0"))) != gravado.get(grupo, (0, Decimal("0"))):
+            diferencas.append((grupo, esperado.get(grupo), gravado.get(grupo)))
+    return diferencas
+
+
+def reconstruir_resumo(sessao):
+    """Recalcula a tabela inteira em uma transação. Trava documentos_fiscais contra escrita enquanto roda."""
+    sessao.execute(text("SELECT id FROM documentos_fiscais FOR SHARE")).fetchall()
+    sessao.execute(text("DELETE FROM resumo_documentos"))
+    sessao.execute(text("""
+        INSERT INTO resumo_documentos (empresa_id, fornecedor_id, status_processamento, mes, quantidade, valor_total)
+    """ + _SQL_AGRUPADO))
+    sessao.commit()
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Reconstrói ou confere a tabela resumo_documentos.")
+    grupo = parser.add_mutually_exclusive_group(required=True)
+    grupo.add_argument("--verificar", action="store_true", help="Compara o resumo com documentos_fiscais")
+    grupo.add_argument("--reconstruir", action="store_true", help="Recalcula o resumo do zero")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.reconstruir:
+            reconstruir_resumo(db)
+            print("Resumo reconstruído.")
+
+        diferencas = comparar_resumo(db)
+        for (empresa_id, fornecedor_id, status, mes), esperado, gravado in diferencas:
+            print(f"[DIFERENÇA] empresa {empresa_id}, fornecedor {fornecedor_id}, {status}, {mes}: "
+                  f"esperado {esperado}, no resumo {gravado}")
+        print(f"\n{len(diferencas)} grupo(s) com diferença" if diferencas else "\nResumo confere com documentos_fiscais.")
+        if diferencas:
+            sys.exit(1)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,61 @@
+# ==============================================================================
+# ARQUIVO: senhas.py
+# DESCRIÇÃO: Hash e verificação de senhas (bcrypt) fora do event loop.
+#   - Pool de workers dedicado (o bcrypt libera o GIL, então escala com os núcleos)
+#   - Fila limitada: quando cheia, as rotas respondem 503 em vez de enfileirar sem fim
+#   - Custo (rounds) configurável pelo .env
+# ==============================================================================
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Custo do bcrypt (cada +1 dobra o tempo de hash). Hashes antigos continuam válidos.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Quantidade de hashes calculados em paralelo (padrão: um por núcleo)
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+
+# Máximo de operações aguardando/em execução antes de recusar com 503
+HASH_FILA_MAX = int(os.getenv("HASH_FILA_MAX", str(HASH_WORKERS * 8)))
+
+# Configuração de Hash de Senhas (Bcrypt)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# Contador de operações pendentes (só é alterado dentro do event loop)
+_pendentes = 0
+
+
+class FilaSenhasCheia(Exception):
+    """Lançada quando o pool de hash já está com a fila no limite."""
+    pass
+
+
+async def _executar(funcao, *args):
+    global _pendentes
+
+    if _pendentes >= HASH_FILA_MAX:
+        raise FilaSenhasCheia("Servidor ocupado processando senhas. Tente novamente em instantes.")
+
+    _pendentes += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, funcao, *args)
+    finally:
+        _pendentes -= 1
+
+
+async def verificar_senha(senha: str, senha_hash: str) -> bool:
+    """Compara a senha com o hash bcrypt no pool dedicado."""
+    return await _executar(pwd_context.verify, senha, senha_hash)
+
+
+async def gerar_hash(senha: str) -> str:
+    """Gera o hash bcrypt da senha no pool dedicado."""
+    return await _executar(pwd_context.hash, senha)
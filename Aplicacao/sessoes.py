@@ -0,0 +1,298 @@
+# ==============================================================================
+# ARQUIVO: sessoes.py
+# DESCRIÇÃO: Sessões de login (tabela user_sessions) e usuário de cada requisição.
+#   - Token = id do usuário + id aleatório da sessão + assinatura HMAC-SHA256;
+#     token adulterado é recusado sem consultar o banco
+#   - Sessões válidas ficam em um cache em memória (LRU + TTL): a maioria das
+#     requisições autentica sem ida ao banco
+#   - last_activity não é gravado a cada requisição: os acessos são juntados
+#     em memória e gravados em lote por uma tarefa em segundo plano, que também
+#     encerra (TIMEOUT) as sessões paradas há mais de SESSAO_INATIVIDADE_MINUTOS
+#   O cache é por processo: com vários workers, um logout leva até
+#   SESSAO_CACHE_TTL segundos para valer nos outros.
+# ==============================================================================
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from typing import NamedTuple
+from fastapi import Depends, Request
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+from cache_memoria import CacheTTL
+from database import SessionLocal, executar_em_thread, get_db, SessaoAssincrona
+
+load_dotenv()
+
+# Chave das assinaturas. Precisa ser a mesma em todos os workers/servidores
+SESSAO_SEGREDO = os.getenv("SESSAO_SEGREDO", "")
+
+# Minutos sem uso até a sessão expirar
+SESSAO_INATIVIDADE_MINUTOS = int(os.getenv("SESSAO_INATIVIDADE_MINUTOS", "30"))
+
+# Cache das sessões válidas: validade (s) e quantidade máxima por processo
+SESSAO_CACHE_TTL = float(os.getenv("SESSAO_CACHE_TTL", "60"))
+SESSAO_CACHE_MAX = int(os.getenv("SESSAO_CACHE_MAX", "10000"))
+
+# Intervalo (s) entre as gravações de last_activity e entre as expirações
+SESSAO_INTERVALO_GRAVACAO = float(os.getenv("SESSAO_INTERVALO_GRAVACAO", "30"))
+SESSAO_INTERVALO_EXPIRACAO = float(os.getenv("SESSAO_INTERVALO_EXPIRACAO", "60"))
+
+if not SESSAO_SEGREDO:
+    print("[v0] SESSAO_SEGREDO não configurado: usando uma chave temporária "
+          "(os logins caem ao reiniciar e não valem entre workers)")
+    SESSAO_SEGREDO = secrets.token_urlsafe(32)
+
+LOGOUT_MANUAL = "MANUAL"
+LOGOUT_TIMEOUT = "TIMEOUT"
+LOGOUT_FORCADO = "FORCED"
+
+
+class SessaoInvalida(Exception):
+    """Requisição sem token, com token inválido ou com sessão encerrada (HTTP 401)."""
+    pass
+
+
+class SessaoUsuario(NamedTuple):
+    """Quem fez a requisição (guardado no cache de sessões)."""
+    session_id: str
+    usuario_id: int
+    empresa_id: int
+    role_id: int
+
+
+def _assinar(conteudo: str) -> str:
+    digest = hmac.new(SESSAO_SEGREDO.encode(), conteudo.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def gerar_token(usuario_id: int):
+    """(session_id, token): o id vai para user_sessions; o token, para o navegador."""
+    # token_urlsafe não gera '.', então o token se separa sem ambiguidade
+    session_id = secrets.token_urlsafe(32)
+    conteudo = f"{usuario_id}.{session_id}"
+    return session_id, f"{conteudo}.{_assinar(conteudo)}"
+
+
+def ler_token(token: str):
+    """(usuario_id, session_id) do token, ou None se a assinatura não conferir."""
+    conteudo, _, assinatura = (token or "").rpartition(".")
+    usuario_id, _, session_id = conteudo.partition(".")
+    if not usuario_id.isdigit() or not session_id or not hmac.compare_digest(assinatura, _assinar(conteudo)):
+        return None
+    return int(usuario_id), session_id
+
+
+def token_da_requisicao(request: Request):
+    """Token do cabeçalho 'Authorization: Bearer <token>'."""
+    tipo, _, token = request.headers.get("authorization", "").partition(" ")
+    return token.strip() if tipo.lower() == "bearer" else None
+
+
+# ------------------------------------------------------------------------------
+# Banco (funções síncronas, executar via db.run_sync)
+# ------------------------------------------------------------------------------
+
+def criar_sessao(sessao, usuario_id: int, empresa_id: int, role_id: int,
+                 ip_address: str = None, user_agent: str = None):
+    """Grava a sessão do login e devolve (SessaoUsuario, token). Não faz COMMIT."""
+    session_id, token = gerar_token(usuario_id)
+    sessao.execute(text("""
+        INSERT INTO user_sessions (session_id, user_id, empresa_id, ip_address, user_agent)
+        VALUES (:session_id, :user_id, :empresa_id, :ip_address, :user_agent)
+    """), {
+        "session_id": session_id,
+        "user_id": usuario_id,
+        "empresa_id": empresa_id,
+        "ip_address": ip_address,
+        "user_agent": (user_agent or "")[:1000]
+    })
+    return SessaoUsuario(session_id, usuario_id, empresa_id, role_id), token
+
+
+def carregar_sessao(sessao, usuario_id: int, session_id: str):
+    """Sessão ativa (e não parada há mais que o limite) de um usuário ativo, ou None."""
+    row = sessao.execute(text("""
+        SELECT s.user_id, s.empresa_id, u.role_id
+        FROM user_sessions s
+        JOIN usuarios u ON u.id = s.user_id
+        WHERE s.session_id = :session_id
+          AND s.user_id = :usuario_id
+          AND s.is_active = TRUE
+          AND s.last_activity >= NOW() - INTERVAL :minutos MINUTE
+          AND u.ativo = 1
+    """), {"session_id": session_id, "usuario_id": usuario_id, "minutos": SESSAO_INATIVIDADE_MINUTOS}).fetchone()
+    return SessaoUsuario(session_id, row[0], row[1], row[2]) if row else None
+
+
+def encerrar_sessao(sessao, session_id: str, tipo: str = LOGOUT_MANUAL):
+    """Marca a sessão como encerrada. Não faz COMMIT."""
+    sessao.execute(text("""
+        UPDATE user_sessions
+        SET is_active = FALSE, logout_time = NOW(), logout_type = :tipo,
+            last_activity = last_activity
+        WHERE session_id = :session_id AND is_active = TRUE
+    """), {"session_id": session_id, "tipo": tipo})
+
+
+def encerrar_sessoes_usuario(sessao, usuario_id: int, tipo: str = LOGOUT_FORCADO, exceto: str = None):
+    """
+    Encerra as sessões abertas do usuário (ex: senha trocada, usuário desativado),
+    menos a sessão 'exceto'. Não faz COMMIT.
+    """
+    sessao.execute(text("""
+        UPDATE user_sessions
+        SET is_active = FALSE, logout_time = NOW(), logout_type = :tipo,
+            last_activity = last_activity
+        WHERE user_id = :usuario_id AND is_active = TRUE AND session_id <> :exceto
+    """), {"usuario_id": usuario_id, "tipo": tipo, "exceto": exceto or ""})
+
+
+def _gravar_atividades(atividades: dict):
+    # Um UPDATE por sessão, enviados em um executemany só. O horário vem do
+    # relógio do MySQL (NOW() menos o tempo desde o acesso), como no resto da tabela;
+    # GREATEST: não volta o horário gravado por outro worker
+    agora = time.monotonic()
+    sessao = SessionLocal()
+    try:
+        sessao.execute(text("""
+            UPDATE user_sessions
+            SET last_activity = GREATEST(last_activity, NOW() - INTERVAL :segundos SECOND)
+            WHERE session_id = :session_id AND is_active = TRUE
+        """), [
+            {"session_id": sid, "segundos": int(agora - momento)} for sid, momento in atividades.items()
+        ])
+        sessao.commit()
+    except Exception:
+        sessao.rollback()
+        raise
+    finally:
+        sessao.close()
+
+
+def _expirar_inativas() -> int:
+    sessao = SessionLocal()
+    try:
+        result = sessao.execute(text("""
+            UPDATE user_sessions
+            SET is_active = FALSE, logout_time = NOW(), logout_type = :tipo,
+                last_activity = last_activity
+            WHERE is_active = TRUE AND last_activity < NOW() - INTERVAL :minutos MINUTE
+        """), {"tipo": LOGOUT_TIMEOUT, "minutos": SESSAO_INATIVIDADE_MINUTOS})
+        sessao.commit()
+        return result.rowcount
+    except Exception:
+        sessao.rollback()
+        raise
+    finally:
+        sessao.close()
+
+
+# ------------------------------------------------------------------------------
+# Cache + tarefa em segundo plano
+# ------------------------------------------------------------------------------
+
+class GerenciadorSessoes:
+    """Cache das sessões válidas e gravação em lote do último acesso."""
+
+    def __init__(self):
+        self.cache = CacheTTL(SESSAO_CACHE_TTL, max_itens=SESSAO_CACHE_MAX)
+        # session_id -> time.monotonic() do último acesso ainda não gravado
+        self._atividades = {}
+        self._tarefa = None
+
+    async def autenticar(self, token: str, db: SessaoAssincrona) -> SessaoUsuario:
+        """Sessão do token (do cache ou do banco). Lança SessaoInvalida."""
+        lido = ler_token(token)
+        if lido is None:
+            raise SessaoInvalida("Sessão inválida. Faça login novamente.")
+        usuario_id, session_id = lido
+
+        usuario = await self.cache.obter_ou_calcular(
+            ("sessao", usuario_id, session_id), lambda: db.run_sync(carregar_sessao, usuario_id, session_id)
+        )
+        if usuario is None:
+            raise SessaoInvalida("Sessão expirada. Faça login novamente.")
+
+        self._atividades[session_id] = time.monotonic()
+        return usuario
+
+    def guardar(self, usuario: SessaoUsuario):
+        """Coloca no cache a sessão recém-criada (o primeiro acesso não vai ao banco)."""
+        self.cache.guardar(("sessao", usuario.usuario_id, usuario.session_id), usuario)
+
+    def esquecer(self, usuario: SessaoUsuario):
+        """Tira a sessão do cache (logout)."""
+        self.cache.invalidar("sessao", usuario.usuario_id, usuario.session_id)
+        self._atividades.pop(usuario.session_id, None)
+
+    def esquecer_usuario(self, usuario_id: int):
+        """
+        Tira do cache as sessões do usuário (alterado, desativado, senha trocada):
+        o próximo acesso relê a sessão do banco.
+        """
+        self.cache.invalidar("sessao", usuario_id)
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida (chamado no startup/shutdown do app)
+    # ------------------------------------------------------------------
+
+    async def iniciar(self):
+        self._tarefa = asyncio.create_task(self._executar())
+
+    async def encerrar(self):
+        """Grava os últimos acessos pendentes antes de o servidor parar."""
+        if self._tarefa is None:
+            return
+        self._tarefa.cancel()
+        try:
+            await self._tarefa
+        except asyncio.CancelledError:
+            pass
+        self._tarefa = None
+        await self._gravar_atividades()
+
+    async def _executar(self):
+        ultima_expiracao = asyncio.get_running_loop().time()
+        while True:
+            await asyncio.sleep(SESSAO_INTERVALO_GRAVACAO)
+            await self._gravar_atividades()
+
+            agora = asyncio.get_running_loop().time()
+            if agora - ultima_expiracao >= SESSAO_INTERVALO_EXPIRACAO:
+                ultima_expiracao = agora
+                try:
+                    expiradas = await executar_em_thread(_expirar_inativas)
+                    if expiradas:
+                        print(f"[v0] {expiradas} sessão(ões) encerrada(s) por inatividade")
+                except Exception as e:
+                    print(f"[v0] Erro ao expirar sessões: {str(e)}")
+
+    async def _gravar_atividades(self):
+        if not self._atividades:
+            return
+        atividades, self._atividades = self._atividades, {}
+        try:
+            await executar_em_thread(_gravar_atividades, atividades)
+        except Exception as e:
+            print(f"[v0] Erro ao gravar último acesso de {len(atividades)} sessão(ões): {str(e)}")
+            # Devolve para a próxima rodada sem apagar acessos mais novos
+            for session_id, momento in atividades.items():
+                self._atividades.setdefault(session_id, momento)
+
+
+# Instância global (iniciada no startup do app)
+gerenciador_sessoes = GerenciadorSessoes()
+
+
+async def usuario_atual(request: Request, db: SessaoAssincrona = Depends(get_db)) -> SessaoUsuario:
+    """Dependência das rotas que exigem login: devolve o usuário da sessão do token."""
+    token = token_da_requisicao(request)
+    if not token:
+        raise SessaoInvalida("Login necessário.")
+    return await gerenciador_sessoes.autenticar(token, db)
@@ -17,17 +17,48 @@ if (sidebarToggler) {
   })
 }
 
+// ================================
+// Token de Sessão nas Chamadas à API
+// ================================
+
+// Toda chamada a /api/ leva o token do login (Authorization: Bearer ...).
+// Se o servidor responder 401 (sessão expirada ou encerrada), volta para o login.
+const fetchOriginal = window.fetch.bind(window)
+window.fetch = (url, opcoes = {}) => {
+  const token = localStorage.getItem("token")
+  if (token && typeof url === "string" && url.startsWith("/api/")) {
+    const headers = new Headers(opcoes.headers || {})
+    if (!headers.has("Authorization")) headers.set("Authorization", `Bearer ${token}`)
+    opcoes = { ...opcoes, headers }
+  }
+  return fetchOriginal(url, opcoes).then((response) => {
+    if (response.status === 401 && !window.location.pathname.includes("/login")) {
+      localStorage.removeItem("user")
+      localStorage.removeItem("token")
+      window.location.href = "/login"
+    }
+    return response
+  })
+}
+
 // ================================
 // Botão de Logout
 // ================================
 
 const logoutBtn = document.getElementById("logoutBtn")
 if (logoutBtn) {
-  logoutBtn.addEventListener("click", (e) => {
+  logoutBtn.addEventListener("click", async (e) => {
     e.preventDefault()
     const confirmar = confirm("Deseja realmente sair do sistema?")
     if (!confirmar) return
     
+    // Encerra a sessão no servidor (Conecta com: POST /api/logout)
+    try {
+      await fetch("/api/logout", { method: "POST" })
+    } catch (error) {
+      console.error("[v0] Erro ao encerrar sessão:", error)
+    }
+    
     // Remove dados de autenticação salvos localmente
     localStorage.removeItem("user")
     localStorage.removeItem("token")
@@ -266,7 +297,7 @@ function getAcaoBadge(acao) {
     colorClass = "aprovado"; // Verde
   } else if (acao.includes('GERADA')) {
     colorClass = "info"; // Azul
-  } else if (acao.includes('LOGIN')) {
+  } else if (acao.includes('LOGIN') || acao.includes('LOGOUT')) {
     colorClass = "cancelado"; // Cinza/Rosa
   }
 
@@ -3089,9 +3120,33 @@ async function processarGeracaoRemessa() {
 /**
  * Faz download do arquivo CNAB
  * Conecta com: GET /api/remessas-cnab/{id}/download (main.py)
+ * Usa fetch (e não window.location) para a requisição levar o token do login
  */
-function downloadRemessa(id) {
-  window.location.href = `/api/remessas-cnab/${id}/download`
+async function downloadRemessa(id) {
+  try {
+    const response = await fetch(`/api/remessas-cnab/${id}/download`)
+    if (!response.ok) {
+      const result = await response.json().catch(() => ({}))
+      alert("Erro ao baixar remessa: " + (result.erro || "Erro desconhecido"))
+      return
+    }
+
+    // Nome do arquivo vem do Content-Disposition (remessa_NNNNNN.rem)
+    const disposicao = response.headers.get("Content-Disposition") || ""
+    const nomeArquivo = disposicao.match(/filename="?([^";]+)"?/)?.[1] || `remessa_${id}.rem`
+
+    const url = URL.createObjectURL(await response.blob())
+    const link = document.createElement("a")
+    link.href = url
+    link.download = nomeArquivo
+    document.body.appendChild(link)
+    link.click()
+    link.remove()
+    URL.revokeObjectURL(url)
+  } catch (error) {
+    console.error("[v0] Erro ao baixar remessa:", error)
+    alert("Erro ao baixar remessa")
+  }
 }
 
 /**
@@ -3292,7 +3347,7 @@ async function excluirRemessa(id) {
 
 // ================================
 // PÁGINA: Dashboard com KPIs e Gráficos
-// Conecta com: GET /api/dashboard/kpis (main.py)
+// Conecta com: GET /api/dashboard (main.py)
 // ================================
 
 async function carregarDashboard() {
@@ -3369,11 +3424,11 @@ async function carregarDashboard() {
 
 /**
  * Busca os dados do dashboard e renderiza KPIs e gráficos
- * Conecta com: GET /api/dashboard/kpis (main.py)
+ * Conecta com: GET /api/dashboard (main.py) - KPIs e gráficos em uma chamada
  */
 async function carregarDadosDashboard() {
   try {
-    const response = await fetch("/api/dashboard/kpis")
+    const response = await fetch("/api/dashboard")
     const data = await response.json()
 
     console.log("[v0] Dados do dashboard:", data)
@@ -3507,6 +3562,7 @@ async function carregarAuditoriaRelatorios() {
               <option value="DOCUMENTO_CONFIRMADO">Documento Confirmado</option>
               <option value="DOCUMENTO_REVISADO">Documento Revisado</option>
               <option value="REMESSA_GERADA">Remessa Gerada</option>
+              <option value="RETORNO_PROCESSADO">Retorno CNAB Processado</option>
               <option value="LOGIN">Login</option>
               <option value="LOGOUT">Logout</option>
             </select>
@@ -0,0 +1,15 @@
+# ==============================================================================
+# ARQUIVO: tests/conftest.py
+# DESCRIÇÃO: Configuração comum dos testes (pytest, a partir da pasta Aplicacao).
+#   - Os módulos da aplicação ficam na pasta Aplicacao (não é um pacote)
+#   - O histórico local da instância global (firebase_historico) vai para uma
+#     pasta temporária, para os testes não gravarem no historico_local.db real
+# ==============================================================================
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("HISTORICO_LOCAL_DB", os.path.join(tempfile.mkdtemp(prefix="historico_testes_"), "historico_local.db"))
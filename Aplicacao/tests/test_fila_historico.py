@@ -0,0 +1,142 @@
+# ==============================================================================
+# ARQUIVO: tests/test_fila_historico.py
+# DESCRIÇÃO: Fila do histórico (fila_historico.FilaHistorico) com um backend
+#   simulado no lugar do Firebase: gravação em lote, repetição com espera,
+#   arquivo de pendentes e reenvio sem duplicar.
+# ==============================================================================
+
+import asyncio
+import json
+import os
+
+import pytest
+
+import fila_historico
+from fila_historico import FilaHistorico
+from firebase_historico import HistoricoFirebase
+from historico_local import HistoricoLocal
+
+
+class HistoricoFalso:
+    """
+    Backend no lugar do HistoricoFirebase: grava em um HistoricoLocal (chave
+    única, como o caminho .../historico/{chave} no Firebase) e falha nas
+    primeiras 'falhas' chamadas, ou na chamada de número 'falhar_na'.
+    """
+
+    montar_registro = HistoricoFirebase.montar_registro
+
+    def __init__(self, caminho, falhas=0, falhar_na=None):
+        self.local = HistoricoLocal(caminho)
+        self.falhas = falhas
+        self.falhar_na = falhar_na
+        self.chamadas = []
+
+    def registrar_lote(self, registros):
+        self.chamadas.append([r["chave"] for r in registros])
+        if self.falhas > 0 or len(self.chamadas) == self.falhar_na:
+            self.falhas -= 1
+            return False
+        self.local.registrar_varios(registros)
+        return True
+
+    def gravados(self):
+        return self.local._conexao.execute("SELECT chave FROM historico ORDER BY id").fetchall()
+
+
+@pytest.fixture(autouse=True)
+def esperas_curtas(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(fila_historico, "HISTORICO_LOTE_ESPERA", 0.05)
+    monkeypatch.setattr(fila_historico, "HISTORICO_ESPERA_RETRY", 0.001)
+    monkeypatch.setattr(fila_historico, "HISTORICO_TENTATIVAS", 3)
+
+
+async def _esperar(condicao, segundos=5):
+    limite = asyncio.get_running_loop().time() + segundos
+    while not condicao():
+        assert asyncio.get_running_loop().time() < limite, "tempo esgotado"
+        await asyncio.sleep(0.01)
+
+
+def _registrar(fila, quantidade, documento_id=1):
+    for i in range(quantidade):
+        fila.registrar_acao(documento_id, "CONFIRMAR", 1, f"comentário {i}", "PROCESSADO")
+
+
+def test_registros_enfileirados_vao_em_um_unico_lote(tmp_path):
+    historico = HistoricoFalso(str(tmp_path / "historico.db"))
+    fila = FilaHistorico(historico, str(tmp_path / "pendentes.jsonl"))
+
+    async def cenario():
+        await fila.iniciar()
+        _registrar(fila, 5)
+        assert historico.chamadas == []  # As rotas não esperam a gravação
+        await _esperar(lambda: historico.chamadas)
+        await fila.encerrar()
+
+    asyncio.run(cenario())
+    assert len(historico.chamadas) == 1
+    assert len(historico.chamadas[0]) == 5
+    assert len(historico.gravados()) == 5
+    assert not os.path.exists(tmp_path / "pendentes.jsonl")
+
+
+def test_falha_repete_e_depois_guarda_no_disco(tmp_path):
+    historico = HistoricoFalso(str(tmp_path / "historico.db"), falhas=10)
+    pendentes = tmp_path / "pendentes.jsonl"
+    fila = FilaHistorico(historico, str(pendentes))
+
+    async def cenario():
+        await fila.iniciar()
+        _registrar(fila, 2)
+        await _esperar(pendentes.exists)
+        await fila.encerrar()
+
+    asyncio.run(cenario())
+    # HISTORICO_TENTATIVAS tentativas do mesmo lote, depois o arquivo de pendentes
+    assert len(historico.chamadas) == 3
+    assert historico.chamadas[0] == historico.chamadas[1] == historico.chamadas[2]
+    linhas = [json.loads(linha) for linha in pendentes.read_text(encoding="utf-8").splitlines()]
+    assert [r["chave"] for r in linhas] == historico.chamadas[0]
+    assert historico.gravados() == []
+
+
+def test_reenvio_dos_pendentes_nao_duplica(tmp_path, monkeypatch):
+    monkeypatch.setattr(fila_historico, "HISTORICO_LOTE_MAX", 2)
+    pendentes = tmp_path / "pendentes.jsonl"
+
+    # 1ª execução: backend fora, 3 registros vão para o disco
+    fora = HistoricoFalso(str(tmp_path / "historico.db"), falhas=100)
+    fila = FilaHistorico(fora, str(pendentes))
+
+    async def guardar():
+        await fila.iniciar()
+        _registrar(fila, 3)
+        await _esperar(lambda: pendentes.exists() and len(pendentes.read_text().splitlines()) == 3)
+        await fila.encerrar()
+
+    asyncio.run(guardar())
+    chaves = [json.loads(linha)["chave"] for linha in pendentes.read_text(encoding="utf-8").splitlines()]
+
+    # 2ª execução: o 1º lote do reenvio grava, o 2º falha (o arquivo fica como .enviando)
+    historico = HistoricoFalso(str(tmp_path / "historico.db"), falhar_na=2)
+    fila = FilaHistorico(historico, str(pendentes))
+
+    async def reenviar():
+        await fila._reenviar_pendentes()
+
+    asyncio.run(reenviar())
+    assert historico.chamadas == [chaves[:2], chaves[2:]]
+    assert os.path.exists(str(pendentes) + ".enviando")
+
+    # 3ª: reenvia tudo de novo (no startup); os 2 já gravados não duplicam
+    async def reiniciar():
+        await fila.iniciar()
+        await _esperar(lambda: not os.path.exists(str(pendentes) + ".enviando"))
+        await fila.encerrar()
+
+    asyncio.run(reiniciar())
+    assert historico.chamadas[2:] == [chaves[:2], chaves[2:]]
+    assert [linha[0] for linha in historico.gravados()] == chaves
+    assert not pendentes.exists()
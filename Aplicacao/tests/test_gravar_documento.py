@@ -0,0 +1,189 @@
+# ==============================================================================
+# ARQUIVO: tests/test_gravar_documento.py
+# DESCRIÇÃO: Importação de um XML (importacao_lote.gravar_documento): idas ao
+#   banco por importação, COMMIT único e a decisão inserido/atualizado.
+#   Não precisa de MySQL: a Session é trocada por uma simulação que conta os
+#   comandos e responde como o MySQL (lastrowid do LAST_INSERT_ID e rowcount
+#   com CLIENT_FOUND_ROWS: 1 na inserção, 2 na atualização, 1 sem mudança).
+# ==============================================================================
+
+import pytest
+
+import auditoria
+from importacao_lote import gravar_documento, ACAO_INSERIDO, ACAO_ATUALIZADO
+
+
+class _Resultado:
+    def __init__(self, linhas=(), lastrowid=None, rowcount=0):
+        self.linhas = list(linhas)
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        return self.linhas
+
+
+class SessaoSimulada:
+    """Session falsa: guarda cada comando executado e simula as tabelas usadas."""
+
+    def __init__(self):
+        self.comandos = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fornecedores = {}  # cnpj -> id
+        self.documentos = {}    # id -> dict
+        self.falhar_em = None   # trecho do SQL que deve lançar erro
+        self.eventos = []       # eventos de auditoria gravados (ver a fixture)
+
+    def execute(self, query, params=None):
+        sql = " ".join(str(query).split())
+        self.comandos.append(sql)
+        if self.falhar_em and self.falhar_em in sql:
+            raise RuntimeError("falha simulada")
+
+        if sql.startswith("INSERT INTO fornecedores"):
+            id_fornecedor = self.fornecedores.setdefault(params["cnpj"], len(self.fornecedores) + 1)
+            return _Resultado(lastrowid=id_fornecedor, rowcount=1)
+
+        if sql.startswith("SELECT id FROM documentos_fiscais WHERE chave_acesso IN"):
+            return _Resultado([(i,) for i, d in self.documentos.items() if d["chave"] in params["chaves"]])
+
+        if sql.startswith("SELECT empresa_id, fornecedor_id, status_processamento"):
+            return _Resultado([
+                (d["empresa_id"], d["fornecedor_id"], d["status"], d["data_emissao"][:8] + "01", d["valor_total"])
+                for i, d in self.documentos.items() if i in params["ids"]
+            ])
+
+        if sql.startswith("INSERT INTO documentos_fiscais"):
+            for id_documento, documento in self.documentos.items():
+                if documento["chave"] == params["chave"]:
+                    novo = {**documento, "valor_total": params["valor_total"], "status": "PENDENTE"}
+                    mudou = novo != documento
+                    self.documentos[id_documento] = novo
+                    return _Resultado(lastrowid=id_documento, rowcount=2 if mudou else 1)
+            id_documento = len(self.documentos) + 100
+            self.documentos[id_documento] = {
+                "chave": params["chave"], "empresa_id": params["empresa_id"],
+                "fornecedor_id": params["fornecedor_id"], "status": "PENDENTE",
+                "data_emissao": params["data_emissao"], "valor_total": params["valor_total"]
+            }
+            return _Resultado(lastrowid=id_documento, rowcount=1)
+
+        # documentos_xml, resumo_documentos, eventos_auditoria
+        return _Resultado(rowcount=1)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def tabelas(self):
+        """Comando -> tabela/tipo, na ordem executada (ex: 'INSERT fornecedores')."""
+        resumo = []
+        for sql in self.comandos:
+            partes = sql.split()
+            if partes[0] == "INSERT":
+                resumo.append(f"INSERT {partes[2]}")
+            else:
+                resumo.append("SELECT FOR UPDATE" if sql.endswith("FOR UPDATE") else "SELECT chave")
+        return resumo
+
+
+def _dados(chave="35240112345678000195550010000012341000012345", valor=1500.0):
+    return {
+        "tipo_documento": "NF-e", "numero": "1234", "serie": "1", "chave_acesso": chave,
+        "data_emissao": "2024-01-15", "valor_total": valor, "valor_impostos": 45.3,
+        "cnpj_fornecedor": "12345678000195", "razao_fornecedor": "Distribuidora São João Ltda",
+        "xml_string": "<NFe/>", "encoding": "utf-8"
+    }
+
+
+@pytest.fixture
+def sessao(monkeypatch):
+    sessao = SessaoSimulada()
+    original = auditoria.registrar_eventos
+
+    def registrar_eventos(s, eventos):
+        sessao.eventos.extend(eventos)
+        original(s, eventos)
+
+    monkeypatch.setattr(auditoria, "registrar_eventos", registrar_eventos)
+    return sessao
+
+
+def test_fornecedor_e_documento_novos(sessao):
+    resultado = gravar_documento(sessao, _dados(), b"<NFe/>", "127.0.0.1", empresa_id=1, usuario_id=9)
+
+    assert resultado["acao"] == ACAO_INSERIDO
+    assert resultado["fornecedor_id"] == 1
+    assert resultado["documento_id"] in sessao.documentos
+    assert sessao.tabelas() == [
+        "INSERT fornecedores",        # upsert do fornecedor (id no lastrowid)
+        "SELECT chave",               # chave ainda não existe: sem FOR UPDATE
+        "INSERT documentos_fiscais",  # upsert do documento
+        "INSERT documentos_xml",
+        "SELECT FOR UPDATE",          # estado depois, para o resumo
+        "INSERT resumo_documentos",
+        "INSERT eventos_auditoria",
+    ]
+    assert (sessao.commits, sessao.rollbacks) == (1, 0)
+    assert sessao.eventos[-1]["acao"] == auditoria.DOCUMENTO_CRIADO
+
+
+def test_documento_existente_e_atualizado(sessao):
+    primeiro = gravar_documento(sessao, _dados(valor=1500.0), b"<NFe/>")
+    sessao.comandos.clear()
+
+    resultado = gravar_documento(sessao, _dados(valor=1750.0), b"<NFe/>")
+
+    assert resultado["acao"] == ACAO_ATUALIZADO
+    assert resultado["documento_id"] == primeiro["documento_id"]
+    assert resultado["fornecedor_id"] == primeiro["fornecedor_id"]
+    assert len(sessao.documentos) == 1
+    assert sessao.tabelas() == [
+        "INSERT fornecedores",
+        "SELECT chave",
+        "SELECT FOR UPDATE",          # estado antes (documento travado até o COMMIT)
+        "INSERT documentos_fiscais",
+        "INSERT documentos_xml",
+        "SELECT FOR UPDATE",
+        "INSERT resumo_documentos",
+        "INSERT eventos_auditoria",
+    ]
+    assert (sessao.commits, sessao.rollbacks) == (2, 0)
+    assert sessao.eventos[-1]["acao"] == auditoria.DOCUMENTO_EDITADO
+
+
+def test_reimportar_sem_mudanca_e_atualizado(sessao):
+    # rowcount 1 também quando nada mudou: é o 'antes' que diz que o documento já existia
+    gravar_documento(sessao, _dados(), b"<NFe/>")
+    sessao.comandos.clear()
+
+    resultado = gravar_documento(sessao, _dados(), b"<NFe/>")
+
+    assert resultado["acao"] == ACAO_ATUALIZADO
+    assert sessao.eventos[-1]["acao"] == auditoria.DOCUMENTO_EDITADO
+    # Resumo sem diferença: nenhum comando em resumo_documentos
+    assert "INSERT resumo_documentos" not in sessao.tabelas()
+    assert len(sessao.comandos) == 7
+
+
+def test_documento_sem_chave_e_inserido(sessao):
+    resultado = gravar_documento(sessao, _dados(chave=None), b"<NFe/>")
+
+    assert resultado["acao"] == ACAO_INSERIDO
+    # Sem chave não há estado anterior a buscar
+    assert "SELECT chave" not in sessao.tabelas()
+    assert len(sessao.comandos) == 6
+    assert sessao.commits == 1
+
+
+def test_erro_faz_rollback_sem_commit(sessao):
+    sessao.falhar_em = "INSERT INTO documentos_xml"
+
+    with pytest.raises(RuntimeError):
+        gravar_documento(sessao, _dados(), b"<NFe/>")
+
+    assert (sessao.commits, sessao.rollbacks) == (0, 1)
+    assert sessao.eventos == []
@@ -0,0 +1,91 @@
+# ==============================================================================
+# ARQUIVO: tests/test_historico_local.py
+# DESCRIÇÃO: Histórico local em SQLite (historico_local.HistoricoLocal):
+#   escritas simultâneas, chave única e importação dos JSON antigos.
+# ==============================================================================
+
+import json
+import shutil
+import threading
+
+from historico_local import HistoricoLocal, SUFIXO_IMPORTADO
+
+
+def _registro(documento_id, chave, acao="CONFIRMAR"):
+    return {"documento_id": documento_id, "chave": chave, "acao": acao, "usuario_id": 1}
+
+
+def _total(historico):
+    return historico._conexao.execute("SELECT COUNT(*) FROM historico").fetchone()[0]
+
+
+def test_registrar_varios_em_threads_nao_perde_registros(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    caminho = str(tmp_path / "historico.db")
+    # Duas instâncias no mesmo arquivo: lock da aplicação + lock do SQLite
+    instancias = [HistoricoLocal(caminho), HistoricoLocal(caminho)]
+    threads_total, lotes, por_lote = 8, 25, 10
+
+    def escrever(numero):
+        historico = instancias[numero % 2]
+        for lote in range(lotes):
+            historico.registrar_varios([
+                _registro(numero, f"{numero}-{lote}-{i}") for i in range(por_lote)
+            ])
+
+    threads = [threading.Thread(target=escrever, args=(n,)) for n in range(threads_total)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert _total(instancias[0]) == threads_total * lotes * por_lote
+    for numero in range(threads_total):
+        registros = instancias[1].listar(numero)
+        assert len(registros) == lotes * por_lote
+        # Cada lote é uma transação: a ordem dentro da thread é mantida
+        assert [r["chave"] for r in registros] == [
+            f"{numero}-{lote}-{i}" for lote in range(lotes) for i in range(por_lote)
+        ]
+
+
+def test_chave_repetida_e_ignorada(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    historico = HistoricoLocal(str(tmp_path / "historico.db"))
+
+    lote = [_registro(7, "a"), _registro(7, "b")]
+    historico.registrar_varios(lote)
+    # Reenvio do mesmo lote (ex: fila repetindo após falha) + um registro novo
+    historico.registrar_varios(lote + [_registro(7, "c")])
+    historico.registrar(_registro(7, "a", acao="OUTRA"))
+
+    registros = historico.listar(7)
+    assert [r["chave"] for r in registros] == ["a", "b", "c"]
+    assert registros[0]["acao"] == "CONFIRMAR"  # O primeiro gravado vale
+
+
+def test_importar_json_antigos_duas_vezes_nao_duplica(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    antigos = {
+        3: [{"documento_id": 3, "acao": "CONFIRMAR"}, {"documento_id": 3, "acao": "REVISAR"}],
+        4: [{"documento_id": 4, "acao": "CONFIRMAR"}],
+    }
+    for documento_id, registros in antigos.items():
+        (tmp_path / f"historico_local_{documento_id}.json").write_text(json.dumps(registros), encoding="utf-8")
+
+    caminho = str(tmp_path / "historico.db")
+    historico = HistoricoLocal(caminho)
+    assert historico.listar(3) == antigos[3]
+    assert historico.listar(4) == antigos[4]
+    assert not (tmp_path / "historico_local_3.json").exists()
+    assert (tmp_path / ("historico_local_3.json" + SUFIXO_IMPORTADO)).exists()
+
+    # Queda entre o COMMIT e o rename: o JSON continua com o nome original
+    shutil.copy(tmp_path / ("historico_local_3.json" + SUFIXO_IMPORTADO), tmp_path / "historico_local_3.json")
+    historico._importar_json_antigos()
+    HistoricoLocal(caminho)  # Nova execução do servidor
+
+    assert historico.listar(3) == antigos[3]
+    assert _total(historico) == 3
+    assert not (tmp_path / "historico_local_3.json").exists()
+
@@ -0,0 +1,49 @@
+# ==============================================================================
+# ARQUIVO: tests/test_leitor_xml.py
+# DESCRIÇÃO: Leitura dos campos de NF-e/NFS-e (leitor_xml): a leitura pela
+#   árvore (arquivos até XML_ITERPARSE_MB) e a com iterparse (acima disso)
+#   devolvem os mesmos campos.
+# ==============================================================================
+
+import pytest
+
+import leitor_xml
+from benchmarks.leitura_xml import gerar_nfe, gerar_nfse_sp
+
+# NF-e sem o envelope nfeProc nem o protocolo (raiz <NFe>)
+NFE_SEM_PROC = gerar_nfe(3).replace(
+    b'<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe>',
+    b'<NFe xmlns="http://www.portalfiscal.inf.br/nfe">'
+).split(b"<protNFe")[0]
+
+
+@pytest.mark.parametrize("content", [gerar_nfe(1), gerar_nfe(200), NFE_SEM_PROC, gerar_nfse_sp()])
+def test_arvore_e_iterparse_leem_os_mesmos_campos(content):
+    encoding = leitor_xml.detect_encoding(content)
+
+    arvore = leitor_xml._ler_campos_arvore(content, encoding)
+    iterparse = leitor_xml._ler_campos_iterparse(content, encoding)
+
+    assert arvore == iterparse
+
+
+def test_campos_da_nfe():
+    achou_nfe, infnfe_id, campos_nfe, _ = leitor_xml._ler_campos_arvore(gerar_nfe(2), "utf-8")
+
+    assert achou_nfe
+    assert infnfe_id == "NFe35240112345678000195550010000012341000012345"
+    assert campos_nfe == {
+        "numero": "1234", "serie": "1", "data_emissao": "2024-01-15T10:30:00-03:00",
+        "valor_total": "600.00", "valor_impostos": "90.60",
+        "cnpj_fornecedor": "12345678000195", "razao_fornecedor": "Distribuidora São João Ltda",
+    }
+
+
+def test_arquivo_grande_usa_iterparse(monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(leitor_xml, "XML_ITERPARSE_BYTES", 1024)
+    monkeypatch.setattr(leitor_xml, "_ler_campos_iterparse", lambda c, e: chamadas.append(len(c)) or (False, None, {}, {}))
+
+    leitor_xml._ler_campos(gerar_nfe(1), "utf-8")
+
+    assert chamadas == [len(gerar_nfe(1))]
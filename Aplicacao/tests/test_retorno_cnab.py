@@ -0,0 +1,51 @@
+# ==============================================================================
+# ARQUIVO: tests/test_retorno_cnab.py
+# DESCRIÇÃO: Gravação do retorno CNAB (cnab.gravar_retorno): as contas,
+#   provisionamentos e remessas alterados ficam restritos à empresa do
+#   usuário (o "seu número" tem ids sequenciais, fáceis de adivinhar).
+#   Não precisa de MySQL: a Session só guarda os comandos executados.
+# ==============================================================================
+
+from benchmarks.retorno_cnab import gerar_retorno
+from cnab import gravar_retorno
+
+
+class _Resultado:
+    lastrowid = 1
+    rowcount = 0
+
+    def scalar(self):
+        return 0
+
+
+class SessaoGravada:
+    """Session falsa: guarda (sql, parâmetros) de cada comando."""
+
+    def __init__(self):
+        self.comandos = []
+
+    def execute(self, query, params=None):
+        self.comandos.append((" ".join(str(query).split()), params))
+        return _Resultado()
+
+
+def test_contas_e_remessas_so_da_empresa(tmp_path):
+    caminho = tmp_path / "retorno.ret"
+    gerar_retorno(str(caminho), 10)
+    sessao = SessaoGravada()
+
+    with open(caminho, "rb") as arquivo:
+        gravar_retorno(sessao, arquivo, "retorno.ret", 7, empresa_id=5, usuario_id=9)
+
+    com_contas = [
+        (sql, p) for sql, p in sessao.comandos
+        if "JOIN contas_pagar cp" in sql or sql.startswith("UPDATE contas_pagar cp")
+    ]
+    # sem conta, UPDATE das contas e dos provisionamentos
+    assert len(com_contas) == 3
+    for sql, parametros in com_contas:
+        assert "cp.empresa_id = :empresa_id" in sql, sql
+        assert parametros["empresa_id"] == 5
+
+    remessas = [sql for sql, _ in sessao.comandos if sql.startswith("UPDATE remessas_cnab")]
+    assert len(remessas) == 1 and "r.empresa_id = :empresa_id" in remessas[0]
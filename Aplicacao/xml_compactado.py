@@ -0,0 +1,260 @@
+# ==============================================================================
+# ARQUIVO: xml_compactado.py
+# DESCRIÇÃO: Armazenamento compactado dos XMLs importados (tabela documentos_xml).
+#   - Guarda os bytes originais do arquivo (com a assinatura intacta),
+#     compactados com zstd (pacote 'zstandard') ou gzip (biblioteca padrão)
+#   - Leitura transparente: ler_xml()/blocos_xml() devolvem o XML já
+#     descompactado, e ainda leem o xml_content de linhas não migradas
+#   - Migração dos XMLs antigos de documentos_fiscais.xml_content e
+#     relatório de bytes economizados
+#   Tabela criada em Banco_fiscal/migracoes/004_documentos_xml.sql
+#
+# USO (a partir da pasta Aplicacao):
+#   python xml_compactado.py --migrar      -> compacta os XMLs ainda em xml_content
+#   python xml_compactado.py --relatorio   -> mostra o espaço economizado
+# ==============================================================================
+
+import argparse
+import gzip
+import os
+import zlib
+from sqlalchemy import text, bindparam
+from dotenv import load_dotenv
+
+from leitor_xml import encoding_declarado
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # Sem o pacote, os XMLs novos são gravados com gzip
+
+load_dotenv()
+
+ALGORITMO_ZSTD = "zstd"
+ALGORITMO_GZIP = "gzip"
+
+# Algoritmo dos XMLs novos (zstd compacta mais e é mais rápido; gzip não precisa de pacote extra)
+XML_COMPRESSAO = os.getenv("XML_COMPRESSAO", ALGORITMO_ZSTD).lower()
+
+# Nível de compressão (zstd: 1 a 22; gzip: 1 a 9)
+XML_NIVEL_ZSTD = int(os.getenv("XML_NIVEL_ZSTD", "9"))
+XML_NIVEL_GZIP = int(os.getenv("XML_NIVEL_GZIP", "6"))
+
+# Tamanho dos blocos entregues no download (bytes já descompactados)
+XML_BLOCO_DOWNLOAD = 64 * 1024
+
+# Documentos por transação na migração dos XMLs antigos
+MIGRACAO_LOTE = int(os.getenv("XML_MIGRACAO_LOTE", "200"))
+
+if XML_COMPRESSAO == ALGORITMO_ZSTD and zstandard is None:
+    print("[v0] Pacote 'zstandard' não instalado; XMLs serão compactados com gzip")
+    XML_COMPRESSAO = ALGORITMO_GZIP
+
+_UPSERT_XML = text("""
+    INSERT INTO documentos_xml
+    (documento_fiscal_id, algoritmo, encoding, tamanho_original, tamanho_compactado, conteudo)
+    VALUES (:documento_fiscal_id, :algoritmo, :encoding, :tamanho_original, :tamanho_compactado, :conteudo)
+    ON DUPLICATE KEY UPDATE
+     algoritmo = VALUES(algoritmo),
+     encoding = VALUES(encoding),
+     tamanho_original = VALUES(tamanho_original),
+     tamanho_compactado = VALUES(tamanho_compactado),
+     conteudo = VALUES(conteudo)
+""")
+
+
+def compactar(conteudo: bytes, algoritmo: str = None) -> bytes:
+    algoritmo = algoritmo or XML_COMPRESSAO
+    if algoritmo == ALGORITMO_ZSTD:
+        # O compressor não é thread-safe: um por chamada (custo desprezível)
+        return zstandard.ZstdCompressor(level=XML_NIVEL_ZSTD).compress(conteudo)
+    return gzip.compress(conteudo, compresslevel=XML_NIVEL_GZIP, mtime=0)
+
+
+def descompactar(algoritmo: str, dados: bytes) -> bytes:
+    if algoritmo == ALGORITMO_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(dados)
+    return gzip.decompress(dados)
+
+
+def descompactar_em_blocos(algoritmo: str, dados: bytes, tamanho: int = XML_BLOCO_DOWNLOAD):
+    """Gera o XML descompactado em blocos (o XML inteiro nunca fica em memória)."""
+    if algoritmo == ALGORITMO_ZSTD:
+        leitor = zstandard.ZstdDecompressor().stream_reader(dados)
+        while True:
+            bloco = leitor.read(tamanho)
+            if not bloco:
+                return
+            yield bloco
+
+    # 16 + MAX_WBITS: formato gzip (cabeçalho + CRC)
+    descompactador = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for inicio in range(0, len(dados), tamanho):
+        bloco = descompactador.decompress(dados[inicio:inicio + tamanho])
+        if bloco:
+            yield bloco
+    bloco = descompactador.flush()
+    if bloco:
+        yield bloco
+
+
+def preparar_xml(conteudo: bytes, encoding: str) -> dict:
+    """
+    Compacta os bytes originais do XML e devolve os parâmetros de gravar_xmls()
+    (falta só 'documento_fiscal_id'). Pode rodar nos processos da importação em lote.
+    """
+    compactado = compactar(conteudo)
+    return {
+        "algoritmo": XML_COMPRESSAO,
+        "encoding": encoding,
+        "tamanho_original": len(conteudo),
+        "tamanho_compactado": len(compactado),
+        "conteudo": compactado
+    }
+
+
+def gravar_xmls(sessao, linhas: list):
+    """
+    Grava (ou substitui) os XMLs compactados na transação atual (executar via
+    db.run_sync, antes do COMMIT). Cada linha vem de preparar_xml() com
+    'documento_fiscal_id'. Não faz COMMIT.
+    """
+    if linhas:
+        sessao.execute(_UPSERT_XML, linhas)
+
+
+def gravar_xml(sessao, documento_id: int, conteudo: bytes, encoding: str):
+    """Compacta e grava o XML de um documento. Não faz COMMIT."""
+    gravar_xmls(sessao, [{**preparar_xml(conteudo, encoding), "documento_fiscal_id": documento_id}])
+
+
+def ler_xml(sessao, documento_id: int):
+    """
+    Devolve (encoding, bytes do XML) do documento ou None se ele não tiver XML.
+    Documentos ainda não migrados são lidos de documentos_fiscais.xml_content.
+    """
+    row = sessao.execute(text("""
+        SELECT dx.algoritmo, dx.encoding, dx.conteudo, df.xml_content
+        FROM documentos_fiscais df
+        LEFT JOIN documentos_xml dx ON dx.documento_fiscal_id = df.id
+        WHERE df.id = :doc_id
+    """), {"doc_id": documento_id}).fetchone()
+
+    if not row:
+        return None
+    if row[2] is not None:
+        return row[1], descompactar(row[0], row[2])
+    if row[3] is not None:
+        encoding = encoding_declarado(row[3])
+        return encoding, row[3].encode(encoding, "xmlcharrefreplace")
+    return None
+
+
+def texto_xml(encoding: str, conteudo: bytes) -> str:
+    """Texto do XML (o mesmo que era guardado em xml_content)."""
+    return conteudo.decode(encoding, errors="replace")
+
+
+# ------------------------------------------------------------------------------
+# Migração dos XMLs antigos (documentos_fiscais.xml_content -> documentos_xml)
+# ------------------------------------------------------------------------------
+
+def migrar_existentes(sessao, lote: int = MIGRACAO_LOTE) -> int:
+    """
+    Compacta os XMLs que ainda estão em xml_content e limpa a coluna, em
+    transações de 'lote' documentos (não trava a tabela inteira). Pode ser
+    interrompido e rodado de novo. Retorna a quantidade de documentos migrados.
+    """
+    limpar = text("UPDATE documentos_fiscais SET xml_content = NULL WHERE id IN :ids").bindparams(
+        bindparam("ids", expanding=True)
+    )
+    migrados = 0
+    ultimo_id = 0
+    while True:
+        try:
+            # FOR UPDATE: uma importação simultânea do mesmo documento espera este lote
+            linhas = sessao.execute(text("""
+                SELECT id, xml_content FROM documentos_fiscais
+                WHERE id > :ultimo_id AND xml_content IS NOT NULL
+                ORDER BY id
+                LIMIT :lote
+                FOR UPDATE
+            """), {"ultimo_id": ultimo_id, "lote": lote}).fetchall()
+            if not linhas:
+                sessao.commit()
+                return migrados
+
+            gravacoes = []
+            for doc_id, xml_texto in linhas:
+                # Os bytes originais se perderam na decodificação: regrava no encoding declarado
+                encoding = encoding_declarado(xml_texto)
+                conteudo = xml_texto.encode(encoding, "xmlcharrefreplace")
+                gravacoes.append({**preparar_xml(conteudo, encoding), "documento_fiscal_id": doc_id})
+
+            gravar_xmls(sessao, gravacoes)
+            sessao.execute(limpar, {"ids": [row[0] for row in linhas]})
+            sessao.commit()
+        except Exception:
+            sessao.rollback()
+            raise
+
+        migrados += len(linhas)
+        ultimo_id = linhas[-1][0]
+        print(f"[v0] {migrados} XML(s) migrado(s) (até o documento {ultimo_id})")
+
+
+def relatorio_economia(sessao) -> dict:
+    """Espaço ocupado pelos XMLs compactados x tamanho original, por algoritmo."""
+    por_algoritmo = {}
+    for algoritmo, quantidade, original, compactado in sessao.execute(text("""
+        SELECT algoritmo, COUNT(*), COALESCE(SUM(tamanho_original), 0), COALESCE(SUM(tamanho_compactado), 0)
+        FROM documentos_xml
+        GROUP BY algoritmo
+    """)).fetchall():
+        original, compactado = int(original), int(compactado)
+        por_algoritmo[algoritmo] = {
+            "documentos": int(quantidade),
+            "bytes_originais": original,
+            "bytes_compactados": compactado,
+            "bytes_economizados": original - compactado,
+            "taxa_compressao": round(original / compactado, 2) if compactado else None
+        }
+
+    pendentes, bytes_pendentes = sessao.execute(text("""
+        SELECT COUNT(*), COALESCE(SUM(LENGTH(xml_content)), 0)
+        FROM documentos_fiscais
+        WHERE xml_content IS NOT NULL
+    """)).fetchone()
+
+    return {
+        "por_algoritmo": por_algoritmo,
+        "bytes_economizados": sum(a["bytes_economizados"] for a in por_algoritmo.values()),
+        "nao_migrados": {"documentos": int(pendentes), "bytes": int(bytes_pendentes)}
+    }
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Migra e confere o armazenamento compactado dos XMLs.")
+    grupo = parser.add_mutually_exclusive_group(required=True)
+    grupo.add_argument("--migrar", action="store_true", help="Compacta os XMLs ainda gravados em xml_content")
+    grupo.add_argument("--relatorio", action="store_true", help="Mostra o espaço economizado")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.migrar:
+            print(f"{migrar_existentes(db)} XML(s) migrado(s) para documentos_xml.")
+            print("Para devolver o espaço ao disco: OPTIMIZE TABLE documentos_fiscais;")
+
+        relatorio = relatorio_economia(db)
+        for algoritmo, dados in relatorio["por_algoritmo"].items():
+            print(f"{algoritmo}: {dados['documentos']} XML(s), {dados['bytes_originais']:,} -> "
+                  f"{dados['bytes_compactados']:,} bytes ({dados['taxa_compressao']}x)")
+        print(f"Bytes economizados: {relatorio['bytes_economizados']:,}")
+        pendentes = relatorio["nao_migrados"]
+        if pendentes["documentos"]:
+            print(f"Ainda em xml_content: {pendentes['documentos']} XML(s), {pendentes['bytes']:,} bytes")
+    finally:
+        db.close()
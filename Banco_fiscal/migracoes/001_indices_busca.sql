@@ -0,0 +1,22 @@
+-- MIGRAÇÃO 001: Índices para a pesquisa de documentos fiscais
+-- A pesquisa deixa de usar LIKE '%termo%' (que nunca usa índice) e passa a
+-- escolher o caminho por termo: FULLTEXT para nomes/descrições, prefixo para
+-- número/chave de acesso e intervalo para valores.
+
+USE sistema_fiscal;
+
+-- Nome do fornecedor: FULLTEXT com parser n-gram (acha pedaços de palavras, ex: 'limp' em 'Limpeza')
+ALTER TABLE fornecedores
+    ADD FULLTEXT INDEX ft_razao_social (razao_social) WITH PARSER ngram;
+
+-- Descrição do serviço/produto da nota
+ALTER TABLE documentos_fiscais
+    ADD FULLTEXT INDEX ft_descricao (descricao_servico_produto) WITH PARSER ngram;
+
+-- Busca por prefixo do número do documento (LIKE 'termo%')
+ALTER TABLE documentos_fiscais
+    ADD INDEX idx_numero_documento (numero_documento);
+
+-- Busca por valor (intervalo)
+ALTER TABLE documentos_fiscais
+    ADD INDEX idx_valor_total (valor_total);
@@ -0,0 +1,28 @@
+-- MIGRAÇÃO 002: Tabela de resumo dos documentos fiscais para o dashboard
+-- Guarda quantidade e valor por empresa x fornecedor x status x mês de emissão.
+-- É mantida pelas rotas que gravam documentos (resumo_documentos.py), então o
+-- dashboard lê poucas linhas em vez de somar todos os documentos a cada acesso.
+-- Para reconstruir/conferir: python resumo_documentos.py --reconstruir | --verificar
+
+USE sistema_fiscal;
+
+CREATE TABLE IF NOT EXISTS resumo_documentos (
+    empresa_id INT NOT NULL,
+    fornecedor_id INT NOT NULL,
+    status_processamento VARCHAR(20) NOT NULL,
+    mes DATE NOT NULL COMMENT 'Primeiro dia do mês de emissão',
+    quantidade INT NOT NULL DEFAULT 0,
+    valor_total DECIMAL(17,2) NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (empresa_id, fornecedor_id, status_processamento, mes),
+    INDEX idx_resumo_status (status_processamento, empresa_id)
+);
+
+-- Carga inicial a partir dos documentos existentes
+DELETE FROM resumo_documentos;
+
+INSERT INTO resumo_documentos (empresa_id, fornecedor_id, status_processamento, mes, quantidade, valor_total)
+SELECT empresa_id, fornecedor_id, status_processamento,
+       DATE_FORMAT(data_emissao, '%Y-%m-01'), COUNT(*), SUM(valor_total)
+FROM documentos_fiscais
+GROUP BY empresa_id, fornecedor_id, status_processamento, DATE_FORMAT(data_emissao, '%Y-%m-01');
@@ -0,0 +1,67 @@
+-- MIGRAÇÃO 003: Log de auditoria materializado
+-- Cada rota que cria/altera registros grava o evento aqui, na mesma transação
+-- (auditoria.py). A página de Auditoria lê só esta tabela em vez de montar um
+-- UNION de cinco tabelas a cada acesso.
+-- Para carregar eventos que faltarem depois: python auditoria.py --backfill
+
+USE sistema_fiscal;
+
+CREATE TABLE IF NOT EXISTS eventos_auditoria (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    empresa_id INT NOT NULL,
+    data_hora TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    usuario_id INT NULL COMMENT 'NULL = ação do sistema',
+    acao VARCHAR(40) NOT NULL COMMENT 'DOCUMENTO_CRIADO, ANEXO_UPLOAD, LOGIN, ...',
+    descricao VARCHAR(500) NOT NULL,
+    referencia_id INT NULL COMMENT 'ID do registro afetado (documento, anexo, remessa...)',
+    ip_address VARCHAR(45) NULL,
+
+    -- Sem chaves estrangeiras: o log deve sobreviver à exclusão do registro/usuário
+
+    -- Listagem por empresa e período (o id entra no fim do índice, serve de desempate do cursor)
+    INDEX idx_eventos_empresa_data (empresa_id, data_hora),
+    -- Listagem sem filtro de empresa
+    INDEX idx_eventos_data (data_hora),
+    -- Filtros por ação e por usuário
+    INDEX idx_eventos_acao_data (acao, data_hora),
+    INDEX idx_eventos_usuario_data (usuario_id, data_hora),
+    -- Backfill: evento já existe para este registro?
+    INDEX idx_eventos_referencia (referencia_id, acao)
+);
+
+-- Carga inicial a partir das tabelas existentes (mesmas consultas do antigo UNION)
+INSERT INTO eventos_auditoria (empresa_id, data_hora, usuario_id, acao, descricao, referencia_id)
+SELECT df.empresa_id, df.created_at, df.usuario_criacao_id, 'DOCUMENTO_CRIADO',
+       CONCAT('Doc Fiscal Nº ', df.numero_documento, ' (R$ ', FORMAT(df.valor_total, 2, 'pt_BR'), ') foi criado.'),
+       df.id
+FROM documentos_fiscais df
+WHERE NOT EXISTS (SELECT 1 FROM eventos_auditoria e WHERE e.acao = 'DOCUMENTO_CRIADO' AND e.referencia_id = df.id);
+
+INSERT INTO eventos_auditoria (empresa_id, data_hora, usuario_id, acao, descricao, referencia_id)
+SELECT u.empresa_id, a.created_at, a.uploaded_by, 'ANEXO_UPLOAD',
+       CONCAT('Arquivo ', a.nome_original, ' (', a.tipo_arquivo, ') foi enviado.'),
+       a.id
+FROM anexos a
+JOIN usuarios u ON a.uploaded_by = u.id
+WHERE NOT EXISTS (SELECT 1 FROM eventos_auditoria e WHERE e.acao = 'ANEXO_UPLOAD' AND e.referencia_id = a.id);
+
+INSERT INTO eventos_auditoria (empresa_id, data_hora, usuario_id, acao, descricao, referencia_id)
+SELECT p.empresa_id, p.created_at, p.usuario_criacao_id, 'PROV_CRIADO',
+       CONCAT('Provisionamento (R$ ', FORMAT(p.valor_provisionado, 2, 'pt_BR'), ') criado para Doc ID ', p.documento_fiscal_id),
+       p.id
+FROM provisionamentos p
+WHERE NOT EXISTS (SELECT 1 FROM eventos_auditoria e WHERE e.acao = 'PROV_CRIADO' AND e.referencia_id = p.id);
+
+INSERT INTO eventos_auditoria (empresa_id, data_hora, usuario_id, acao, descricao, referencia_id)
+SELECT r.empresa_id, r.data_geracao, r.usuario_geracao_id, 'REMESSA_GERADA',
+       CONCAT('Remessa CNAB Nº ', r.numero_remessa, ' (R$ ', FORMAT(r.valor_total, 2, 'pt_BR'), ') foi gerada.'),
+       r.id
+FROM remessas_cnab r
+WHERE NOT EXISTS (SELECT 1 FROM eventos_auditoria e WHERE e.acao = 'REMESSA_GERADA' AND e.referencia_id = r.id);
+
+INSERT INTO eventos_auditoria (empresa_id, data_hora, usuario_id, acao, descricao, referencia_id)
+SELECT u.empresa_id, u.created_at, NULL, 'USUARIO_CRIADO',
+       CONCAT('Usuário ', u.nome, ' (', u.email, ') foi criado.'),
+       u.id
+FROM usuarios u
+WHERE NOT EXISTS (SELECT 1 FROM eventos_auditoria e WHERE e.acao = 'USUARIO_CRIADO' AND e.referencia_id = u.id);
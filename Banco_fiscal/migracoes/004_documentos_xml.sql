@@ -0,0 +1,23 @@
+-- MIGRAÇÃO 004: XMLs importados guardados compactados
+-- O XML original de cada documento (bytes do arquivo, compactados com zstd ou
+-- gzip por xml_compactado.py) sai de documentos_fiscais.xml_content e passa
+-- para esta tabela. documentos_fiscais fica só com os dados lidos nas listagens.
+-- Depois de criar a tabela, mover os XMLs já gravados:
+--   python xml_compactado.py --migrar
+--   OPTIMIZE TABLE documentos_fiscais;   (devolve ao disco o espaço liberado)
+-- Espaço economizado: python xml_compactado.py --relatorio
+
+USE sistema_fiscal;
+
+CREATE TABLE IF NOT EXISTS documentos_xml (
+    documento_fiscal_id INT PRIMARY KEY,
+    algoritmo VARCHAR(10) NOT NULL COMMENT 'zstd ou gzip',
+    encoding VARCHAR(20) NOT NULL COMMENT 'Codec do XML original (utf-8, iso8859-1, ...)',
+    tamanho_original INT UNSIGNED NOT NULL COMMENT 'Bytes do XML descompactado',
+    tamanho_compactado INT UNSIGNED NOT NULL,
+    conteudo MEDIUMBLOB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (documento_fiscal_id) REFERENCES documentos_fiscais(id) ON UPDATE CASCADE ON DELETE CASCADE
+);
@@ -0,0 +1,29 @@
+-- MIGRAÇÃO 005: Pagamentos lidos de cada arquivo de retorno CNAB
+-- O processamento do retorno (cnab.py) grava aqui uma linha por pagamento
+-- (segmento A/J do CNAB 240 ou detalhe do CNAB 400) e atualiza as contas a
+-- pagar com UPDATE ... JOIN sobre esta tabela, em vez de uma conta por vez.
+-- Também serve de histórico: ocorrências devolvidas pelo banco por conta.
+
+USE sistema_fiscal;
+
+CREATE TABLE IF NOT EXISTS retornos_cnab_itens (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    retorno_id INT NOT NULL,
+    linha INT NOT NULL COMMENT 'Linha do registro no arquivo',
+    segmento CHAR(1) NOT NULL COMMENT 'A/J (CNAB 240) ou 1 (CNAB 400)',
+    remessa_id INT NULL COMMENT 'Lido do "seu número"; NULL = pagamento de outro sistema',
+    conta_id INT NULL COMMENT 'Lido do "seu número"',
+    nosso_numero VARCHAR(20) NULL COMMENT 'Número atribuído pelo banco',
+    ocorrencias VARCHAR(10) NOT NULL COMMENT 'Códigos de ocorrência devolvidos pelo banco',
+    situacao ENUM('PAGO', 'AGENDADO', 'REJEITADO') NULL COMMENT 'NULL = ocorrência só informativa',
+    valor_pago DECIMAL(15,2) NOT NULL DEFAULT 0,
+    data_pagamento DATE NULL,
+
+    -- Sem FK para contas/remessas: o retorno pode trazer referências que não existem aqui
+    FOREIGN KEY (retorno_id) REFERENCES retornos_cnab(id) ON UPDATE CASCADE ON DELETE CASCADE,
+
+    UNIQUE KEY uk_retorno_linha (retorno_id, linha),
+    -- Último registro de cada conta no arquivo (GROUP BY conta_id / MAX(linha))
+    INDEX idx_retorno_conta (retorno_id, conta_id, linha),
+    INDEX idx_conta (conta_id)
+);
@@ -0,0 +1,21 @@
+-- MIGRAÇÃO 006: Numeração das remessas CNAB por empresa
+-- O próximo número era lido com MAX(numero_remessa) + 1 sem trava: duas
+-- gerações ao mesmo tempo recebiam o mesmo número (e o banco recusa o segundo
+-- arquivo com o mesmo NSA). Agora cnab.py incrementa a linha da empresa nesta
+-- tabela dentro da transação da remessa: a trava da linha serializa as
+-- gerações da mesma empresa e um ROLLBACK devolve o número (sem buracos).
+
+USE sistema_fiscal;
+
+CREATE TABLE IF NOT EXISTS sequencias_remessa (
+    empresa_id INT PRIMARY KEY,
+    ultimo_numero INT NOT NULL DEFAULT 0 COMMENT 'Último numero_remessa usado pela empresa',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (empresa_id) REFERENCES empresas(id) ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- Continua a numeração das remessas já geradas
+INSERT INTO sequencias_remessa (empresa_id, ultimo_numero)
+SELECT empresa_id, MAX(numero_remessa) FROM remessas_cnab GROUP BY empresa_id
+ON DUPLICATE KEY UPDATE ultimo_numero = GREATEST(ultimo_numero, VALUES(ultimo_numero));
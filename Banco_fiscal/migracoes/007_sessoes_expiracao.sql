@@ -0,0 +1,8 @@
+-- MIGRAÇÃO 007: Expiração das sessões de login
+-- sessoes.py encerra periodicamente (logout_type = 'TIMEOUT') as sessões ativas
+-- sem uso há mais de SESSAO_INATIVIDADE_MINUTOS. Este índice deixa essa
+-- varredura ler só as sessões ativas mais antigas, em vez da tabela inteira.
+
+USE sistema_fiscal;
+
+CREATE INDEX idx_ativa_ultimo_acesso ON user_sessions (is_active, last_activity);